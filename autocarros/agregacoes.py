@@ -0,0 +1,216 @@
+"""
+Agregações agrupadas por autocarro.
+
+Em vez de correr vários aggregate() por autocarro (N+1), cada métrica mensal
+é obtida com um único GROUP BY autocarro_id sobre RegistoDiario e outro sobre
+DespesaCombustivel. Os dois resultados são juntados em memória.
+
+O mapa financeiro semanal segue a mesma ideia: cada tabela de origem é
+juntada à dimensão de calendário e agrupada pela coluna semanal
+(GROUP BY calendario.semana_mes), no máximo 4 linhas por tabela.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, F, Sum
+
+from .models import Autocarro, DespesaCombustivel, RegistoDiario, RelatorioSector
+from .calendario import garantir_mes
+from .periodos import filtro_periodo, intervalo_mes
+
+
+ZERO = Decimal('0')
+
+
+def _metricas_vazias():
+    return {
+        'num_registos': 0,
+        'total_km': ZERO,
+        'total_entradas': ZERO,
+        'total_saidas_registo': ZERO,
+        'total_taxi': ZERO,
+        'total_alim_outros': ZERO,
+        'total_passageiros': 0,
+        'total_viagens': 0,
+        'total_combustivel': ZERO,
+        'total_combustivel_litros': ZERO,
+        'total_combustivel_sobragem': ZERO,
+        'total_combustivel_lavagem': ZERO,
+    }
+
+
+def metricas_por_autocarro(ano, mes, sector_id=None):
+    """
+    Métricas brutas do mês por autocarro: {autocarro_id: {...}}.
+
+    Apenas duas queries, independentemente do tamanho da frota.
+    'total_saidas_registo' são as saídas do registo (com o táxi), sem o
+    combustível — cada relatório decide como compor o resto das saídas.
+    """
+    inicio, fim = intervalo_mes(ano, mes)
+
+    registos = RegistoDiario.objects.filter(data__gte=inicio, data__lt=fim)
+    combustiveis = DespesaCombustivel.objects.filter(
+        data__gte=inicio, data__lt=fim, autocarro__isnull=False
+    )
+    if sector_id:
+        registos = registos.filter(autocarro__sector_id=sector_id)
+        combustiveis = combustiveis.filter(autocarro__sector_id=sector_id)
+
+    metricas = {}
+
+    linhas_registo = (
+        registos.order_by()
+        .values('autocarro_id')
+        .annotate(
+            num_registos=Count('id'),
+            total_km=Sum('km_percorridos'),
+            total_entradas=Sum('entradas'),
+            total_saidas_registo=Sum('saidas'),
+            total_taxi=Sum('taxi'),
+            total_alim_outros=Sum(F('alimentacao') + F('outros'), output_field=DecimalField()),
+            total_passageiros=Sum('numero_passageiros'),
+            total_viagens=Sum('numero_viagens'),
+        )
+    )
+    for linha in linhas_registo:
+        m = metricas.setdefault(linha['autocarro_id'], _metricas_vazias())
+        for chave, valor in linha.items():
+            if chave != 'autocarro_id' and valor is not None:
+                m[chave] = valor
+
+    linhas_combustivel = (
+        combustiveis.order_by()
+        .values('autocarro_id')
+        .annotate(
+            total_combustivel=Sum('valor'),
+            total_combustivel_litros=Sum('valor_litros'),
+            total_combustivel_sobragem=Sum('sobragem_filtros'),
+            total_combustivel_lavagem=Sum('lavagem'),
+        )
+    )
+    for linha in linhas_combustivel:
+        m = metricas.setdefault(linha['autocarro_id'], _metricas_vazias())
+        for chave, valor in linha.items():
+            if chave != 'autocarro_id' and valor is not None:
+                m[chave] = valor
+
+    return metricas
+
+
+def estatisticas_dashboard(ano, mes, autocarros=None):
+    """
+    Lista de estatísticas por autocarro no formato usado pelo dashboard.
+
+    As saídas são as do registo (com o táxi) mais a sobragem e a lavagem;
+    o combustível é descontado à parte no saldo.
+    """
+    metricas = metricas_por_autocarro(ano, mes)
+    if autocarros is None:
+        autocarros = Autocarro.objects.all()
+
+    autocarros_stats = []
+    for autocarro in autocarros:
+        m = metricas.get(autocarro.id) or _metricas_vazias()
+        total_saidas = (
+            m['total_saidas_registo']
+            + m['total_combustivel_sobragem']
+            + m['total_combustivel_lavagem']
+        )
+        autocarros_stats.append({
+            'autocarro': autocarro,
+            'total_km': m['total_km'],
+            'total_entradas': m['total_entradas'],
+            'total_saidas': total_saidas,
+            'total_passageiros': m['total_passageiros'],
+            'total_viagens': m['total_viagens'],
+            'total_combustivel': m['total_combustivel'],
+            'total_alim_outros': m['total_alim_outros'],
+            'total_combustivel_litros': m['total_combustivel_litros'],
+            'total_combustivel_sobragem': m['total_combustivel_sobragem'],
+            'total_combustivel_lavagem': m['total_combustivel_lavagem'],
+            'resto': m['total_entradas'] - total_saidas - m['total_combustivel'],
+        })
+    return autocarros_stats
+
+
+# (chave no mapa, campo na tabela de origem)
+ENTRADAS_MAPA = (
+    ('normal', 'normal'),
+    ('alunos', 'alunos'),
+    ('luvu', 'luvu'),
+    ('frete', 'frete'),
+)
+DESPESAS_MAPA_REGISTO = (
+    ('alimentacao', 'alimentacao'),
+    ('parqueamento', 'parqueamento'),
+    ('taxa', 'taxa'),
+    ('outros', 'outros'),
+    ('taxi', 'taxi'),
+)
+DESPESAS_MAPA_COMBUSTIVEL = (
+    ('combustivel', 'valor'),
+    ('lavagem', 'lavagem'),
+    ('sopragem', 'sobragem_filtros'),
+)
+DESPESAS_MAPA_RELATORIO = (
+    ('despesa_geral', 'despesa_geral'),
+    ('alimentacao_estaleiro', 'alimentacao_estaleiro'),
+)
+
+
+def _semana_vazia():
+    return {
+        'entradas': {chave: ZERO for chave, _ in ENTRADAS_MAPA} | {'total': ZERO},
+        'despesas': {
+            chave: ZERO
+            for chave, _ in DESPESAS_MAPA_REGISTO + DESPESAS_MAPA_COMBUSTIVEL + DESPESAS_MAPA_RELATORIO
+        } | {'total': ZERO},
+        'saldo': ZERO,
+    }
+
+
+def mapa_financeiro_semanas(ano, mes, sector=None):
+    """
+    Entradas e despesas do mês divididas pelas 4 colunas semanais do mapa
+    financeiro: {1: {'entradas': {...}, 'despesas': {...}, 'saldo': ...}, ...}.
+    """
+    garantir_mes(ano, mes)
+    periodo = filtro_periodo('data', ano, mes)
+    registos = RegistoDiario.objects.filter(**periodo)
+    combustiveis = DespesaCombustivel.objects.filter(**periodo)
+    relatorios = RelatorioSector.objects.filter(**periodo)
+    if sector is not None:
+        registos = registos.filter(autocarro__sector=sector)
+        combustiveis = combustiveis.filter(sector=sector)
+        relatorios = relatorios.filter(sector=sector)
+
+    fontes = (
+        (registos, (('entradas', ENTRADAS_MAPA), ('despesas', DESPESAS_MAPA_REGISTO))),
+        (combustiveis, (('despesas', DESPESAS_MAPA_COMBUSTIVEL),)),
+        (relatorios, (('despesas', DESPESAS_MAPA_RELATORIO),)),
+    )
+
+    semanas = {i: _semana_vazia() for i in range(1, 5)}
+    for queryset, grupos in fontes:
+        somas = {
+            f'total_{chave}': Sum(campo)
+            for _, campos in grupos
+            for chave, campo in campos
+        }
+        linhas = queryset.order_by().values('calendario__semana_mes').annotate(**somas)
+        for linha in linhas:
+            semana = semanas[linha['calendario__semana_mes']]
+            for grupo, campos in grupos:
+                for chave, _ in campos:
+                    semana[grupo][chave] += linha[f'total_{chave}'] or ZERO
+
+    for semana in semanas.values():
+        semana['entradas']['total'] = sum(
+            v for k, v in semana['entradas'].items() if k != 'total'
+        )
+        semana['despesas']['total'] = sum(
+            v for k, v in semana['despesas'].items() if k != 'total'
+        )
+        semana['saldo'] = semana['entradas']['total'] - semana['despesas']['total']
+
+    return semanas
@@ -4,9 +4,15 @@ from django.apps import AppConfig
 
 # <----- Configuração da app "autocarros" -----> #
 class AutocarrosConfig(AppConfig):
-    default_auto_field = 'django.db.models.BigAutoField'
+    # default=True: há mais do que um AppConfig neste módulo. As tabelas
+    # existentes foram criadas com AutoField, por isso mantém-se esse tipo.
+    default = True
+    default_auto_field = 'django.db.models.AutoField'
     name = 'autocarros'
 
+    def ready(self):
+        from . import signals  # noqa: F401
+
 class ContabilidadeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'contabilidade'
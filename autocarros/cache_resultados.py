@@ -0,0 +1,165 @@
+"""
+Cache dos resultados dos painéis (dashboard, resumo por sector, mapa geral
+financeiro, gerência e contabilista), das mensagens de WhatsApp da
+listagem de registos e do balancete do Plano de Contas.
+
+Cada resultado é guardado com uma chave (vista, parâmetros, versão dos
+dados). A versão é a soma dos contadores VersaoDados dos meses do período
+pedido mais o contador geral; os signals incrementam esses contadores
+depois de cada escrita, por isso um resultado antigo nunca volta a ser
+lido — fica na cache só até expirar. Meses passados, que quase nunca
+mudam, são calculados uma vez.
+
+Backend: CACHES['default'] (memória local; Redis quando REDIS_URL está
+definido). Os contadores de acertos/falhas ficam no mesmo backend.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+
+from .models import VersaoDados
+
+
+PREFIXO = 'resultados'
+VISTAS = (
+    'dashboard',
+    'resumo_sector',
+    'mapa_geral_financeiro',
+    'gerencia_financas',
+    'contabilista_financas',
+    'mensagem_whatsapp',
+    'balancete',
+)
+
+
+def periodo(ano, mes):
+    """Período AAAAMM de um mês."""
+    return ano * 100 + mes
+
+
+def _periodo_da_data(data):
+    return periodo(data.year, data.month)
+
+
+# ----- Versões ----- #
+
+def incrementar_versoes(*periodos):
+    for valor in sorted(set(periodos)):
+        if VersaoDados.objects.filter(periodo=valor).update(versao=F('versao') + 1):
+            continue
+        try:
+            with transaction.atomic():
+                VersaoDados.objects.create(periodo=valor, versao=1)
+        except IntegrityError:
+            # criado entretanto por outro processo
+            VersaoDados.objects.filter(periodo=valor).update(versao=F('versao') + 1)
+
+
+def agendar_invalidacao(*periodos):
+    """
+    Incrementa as versões depois do commit. Os signals chamam isto depois
+    de agendar o recálculo dos resumos, por isso a nova versão só fica
+    visível quando os resumos já estão atualizados.
+    """
+    periodos = [p for p in periodos if p is not None]
+    if periodos:
+        transaction.on_commit(lambda: incrementar_versoes(*periodos))
+
+
+def invalidar_tudo():
+    """Para operações em massa que não disparam signals."""
+    incrementar_versoes(VersaoDados.GERAL)
+
+
+def _somar_versoes(meses):
+    total = (
+        VersaoDados.objects
+        .filter(Q(periodo=VersaoDados.GERAL) | meses)
+        .aggregate(total=Sum('versao'))['total']
+    )
+    return total or 0
+
+
+def versao_dados(inicio=None, fim=None):
+    """
+    Versão dos dados entre as datas `inicio` e `fim` (inclusive; sem
+    limite quando None): soma dos contadores desses meses e do geral.
+    Os contadores só crescem, por isso qualquer escrita no período muda
+    a soma.
+    """
+    meses = Q(periodo__gt=VersaoDados.GERAL)
+    if inicio:
+        meses &= Q(periodo__gte=_periodo_da_data(inicio))
+    if fim:
+        meses &= Q(periodo__lte=_periodo_da_data(fim))
+    return _somar_versoes(meses)
+
+
+def versao_mes(ano, mes):
+    return _somar_versoes(Q(periodo=periodo(ano, mes)))
+
+
+def versao_ano(ano):
+    return _somar_versoes(Q(periodo__gt=periodo(ano, 0), periodo__lte=periodo(ano, 12)))
+
+
+# ----- Cache ----- #
+
+def _chave(vista, versao, parametros):
+    resumo = hashlib.sha1(
+        json.dumps(parametros, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()[:16]
+    return f'{PREFIXO}:{vista}:{resumo}:v{versao}'
+
+
+def _contar(vista, tipo):
+    chave = f'{PREFIXO}:estatisticas:{vista}:{tipo}'
+    try:
+        cache.incr(chave)
+    except ValueError:
+        if not cache.add(chave, 1, timeout=None):
+            cache.incr(chave)
+
+
+def em_cache(vista, calcular, versao, **parametros):
+    """
+    Devolve o resultado de `calcular()` para (vista, parâmetros, versão),
+    calculando-o só quando não está na cache. O resultado tem de ser
+    serializável (pickle) — listas, dicts, Decimals e instâncias de modelos.
+    """
+    chave = _chave(vista, versao, parametros)
+    resultado = cache.get(chave)
+    if resultado is not None:
+        _contar(vista, 'hits')
+        return resultado
+
+    _contar(vista, 'misses')
+    resultado = calcular()
+    cache.set(chave, resultado, getattr(settings, 'RESULTADOS_CACHE_TIMEOUT', 6 * 60 * 60))
+    return resultado
+
+
+def estatisticas_cache():
+    """Acertos e falhas por vista (desde o arranque, no caso da memória local)."""
+    chaves = [
+        f'{PREFIXO}:estatisticas:{vista}:{tipo}'
+        for vista in VISTAS
+        for tipo in ('hits', 'misses')
+    ]
+    valores = cache.get_many(chaves)
+
+    estatisticas = {}
+    for vista in VISTAS:
+        hits = valores.get(f'{PREFIXO}:estatisticas:{vista}:hits', 0)
+        misses = valores.get(f'{PREFIXO}:estatisticas:{vista}:misses', 0)
+        pedidos = hits + misses
+        estatisticas[vista] = {
+            'hits': hits,
+            'misses': misses,
+            'taxa_acerto': round(100 * hits / pedidos, 1) if pedidos else None,
+        }
+    return estatisticas
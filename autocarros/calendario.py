@@ -0,0 +1,46 @@
+"""
+Dimensão de calendário (DiaCalendario).
+
+RegistoDiario, DespesaCombustivel e RelatorioSector juntam-se à tabela pelo
+campo `calendario` (um ForeignObject sobre `data`, sem coluna), por isso
+`.values('calendario__semana_mes')` agrupa por semana do mapa financeiro
+diretamente na base de dados.
+
+Os dias são criados um mês de cada vez, na primeira vez que esse mês é
+pedido; `preencher_calendario` cria-os antecipadamente.
+"""
+from datetime import timedelta
+
+from .models import DiaCalendario
+from .periodos import intervalo_mes, semana_do_mes_4colunas
+
+
+# meses já confirmados neste processo (evita a contagem em cada pedido)
+_meses_preenchidos = set()
+
+
+def dia_calendario(data):
+    ano_iso, semana_iso, _ = data.isocalendar()
+    return DiaCalendario(
+        data=data,
+        ano=data.year,
+        mes=data.month,
+        semana_mes=semana_do_mes_4colunas(data),
+        ano_iso=ano_iso,
+        semana_iso=semana_iso,
+        dia_semana=data.weekday(),
+    )
+
+
+def garantir_mes(ano, mes):
+    """Garante que todos os dias do mês existem no calendário."""
+    if (ano, mes) in _meses_preenchidos:
+        return
+    inicio, fim = intervalo_mes(ano, mes)
+    num_dias = (fim - inicio).days
+    if DiaCalendario.objects.filter(data__gte=inicio, data__lt=fim).count() < num_dias:
+        DiaCalendario.objects.bulk_create(
+            [dia_calendario(inicio + timedelta(days=i)) for i in range(num_dias)],
+            ignore_conflicts=True,
+        )
+    _meses_preenchidos.add((ano, mes))
@@ -0,0 +1,309 @@
+"""
+Documentos Word (python-docx) gerados pelas exportações.
+
+Cada gerador recebe os parâmetros já validados e devolve
+(conteúdo em bytes, nome do ficheiro), para poder correr tanto no pedido
+como num worker (ver tarefas.py).
+"""
+from datetime import datetime
+from decimal import Decimal
+from io import BytesIO
+
+from babel.numbers import format_currency
+from django.db.models import DecimalField, Sum
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from docx.shared import Inches, Pt, RGBColor
+
+from .agregacoes import metricas_por_autocarro
+from .models import Autocarro, Despesa, DespesaCombustivel, RegistoDiario
+from .periodos import filtro_periodo
+
+
+def relatorio_dashboard_docx(ano, mes):
+    """Relatório mensal do dashboard (resumo, despesas e detalhe por autocarro)."""
+    mes_param = f"{ano}-{mes:02d}"
+
+    registos = RegistoDiario.objects.filter(**filtro_periodo('data', ano, mes))
+
+    totais_registos = registos.aggregate(entradas=Sum("entradas"), saidas=Sum("saidas"))
+    total_entradas = totais_registos["entradas"] or Decimal("0")
+    total_saidas_registos = totais_registos["saidas"] or Decimal("0")
+
+    total_saidas_despesas = Despesa.objects.filter(
+        **filtro_periodo('data', ano, mes)
+    ).aggregate(total=Sum("valor", output_field=DecimalField()))["total"] or Decimal("0")
+
+    # 🔹 Corrigido: campo 'valor_litros' em vez de 'litros'
+    total_combustivel = DespesaCombustivel.objects.filter(
+        **filtro_periodo('data', ano, mes)
+    ).aggregate(
+        total_valor=Sum('valor', output_field=DecimalField()),
+        total_sobragem=Sum('sobragem_filtros', output_field=DecimalField()),
+        total_lavagem=Sum('lavagem', output_field=DecimalField()),
+        total_litros=Sum('valor_litros', output_field=DecimalField())
+    )
+
+    total_combustivel_valor = total_combustivel.get('total_valor') or Decimal('0')
+    total_combustivel_sobragem = total_combustivel.get('total_sobragem') or Decimal('0')
+    total_combustivel_lavagem = total_combustivel.get('total_lavagem') or Decimal('0')
+
+    total_saidas = (
+        total_saidas_registos
+        + total_saidas_despesas
+        + total_combustivel_valor
+        + total_combustivel_sobragem
+        + total_combustivel_lavagem
+    )
+    total_resto = total_entradas - total_saidas
+
+    # Estatísticas por autocarro (apenas autocarros com registos no mês)
+    metricas = metricas_por_autocarro(ano, mes)
+    autocarros_stats = []
+    for autocarro in Autocarro.objects.filter(id__in=metricas.keys()):
+        m = metricas[autocarro.id]
+        if not m['num_registos']:
+            continue
+
+        stats = {
+            "autocarro": autocarro,
+            "total_km": m['total_km'],
+            "total_entradas": m['total_entradas'],
+            "total_saidas": m['total_saidas_registo'],
+            "total_passageiros": m['total_passageiros'],
+            "total_viagens": m['total_viagens'],
+            "total_combustivel": m['total_combustivel'],
+            "total_combustivel_litros": m['total_combustivel_litros'],
+            "total_combustivel_sobragem": m['total_combustivel_sobragem'],
+            "total_combustivel_lavagem": m['total_combustivel_lavagem'],
+        }
+
+        # incluir combustível nas saídas por autocarro
+        stats['total_saidas'] = (
+            stats['total_saidas'] + stats['total_combustivel']
+            + stats['total_combustivel_sobragem'] + stats['total_combustivel_lavagem']
+        )
+        stats["resto"] = stats["total_entradas"] - stats['total_saidas']
+        autocarros_stats.append(stats)
+
+    # Criar documento Word
+    doc = Document()
+
+    # Configurar página para paisagem
+    section = doc.sections[0]
+    section.page_width = Inches(11.69)
+    section.page_height = Inches(8.27)
+    section.left_margin = section.right_margin = Inches(0.5)
+    section.top_margin = section.bottom_margin = Inches(0.5)
+
+    # Cabeçalho profissional
+    header_table = doc.add_table(rows=1, cols=3)
+    header_table.autofit = True
+
+    left_cell = header_table.cell(0, 0)
+    left_para = left_cell.paragraphs[0]
+    left_run = left_para.add_run("🚌")
+    left_run.font.size = Pt(28)
+    left_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    center_cell = header_table.cell(0, 1)
+    center_para = center_cell.paragraphs[0]
+    center_run = center_para.add_run(f"RELATÓRIO MENSAL - {mes_param}")
+    center_run.font.size = Pt(18)
+    center_run.font.bold = True
+    center_run.font.color.rgb = RGBColor(13, 27, 42)
+    center_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    right_cell = header_table.cell(0, 2)
+    right_para = right_cell.paragraphs[0]
+    right_run = right_para.add_run(f"{datetime.now().strftime('%d/%m/%Y')}")
+    right_run.font.size = Pt(10)
+    right_run.font.color.rgb = RGBColor(100, 100, 100)
+    right_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+
+    doc.add_paragraph().add_run().add_break()
+
+    # --- RESUMO GERAL ---
+    h = doc.add_heading("RESUMO GERAL DO MÊS", level=2)
+    try:
+        h.runs[0].font.color.rgb = RGBColor(27, 42, 73)
+    except Exception:
+        pass
+
+    tabela_resumo = doc.add_table(rows=2, cols=4)
+    tabela_resumo.style = "Table Grid"
+
+    # ajustar para mostrar centimos (2 casas decimais) usando babel
+    def fmt_money_simple(x):
+        try:
+            val = Decimal(x or 0).quantize(Decimal('0.01'))
+            return format_currency(float(val), "AOA", locale="pt_PT").replace("AOA", "Kz")
+        except Exception:
+            try:
+                return f"{Decimal(x or 0):.2f} Kz"
+            except Exception:
+                return f"{x} Kz"
+
+    entradas_val = fmt_money_simple(total_entradas)
+    despesas_val = fmt_money_simple(total_saidas)
+    resto_val = fmt_money_simple(total_resto)
+    eficiencia_val = f"{(float(total_resto) / float(total_entradas) * 100) if total_entradas > 0 else 0:.1f}%"
+
+    # label alterada para "SALDO"
+    cards_data = [
+        ("ENTRADAS TOTAIS", entradas_val, "1B4F72"),
+        ("DESPESAS TOTAIS", despesas_val, "C0392B"),
+        ("SALDO", resto_val, "27AE60"),
+        ("EFICIÊNCIA", eficiencia_val, "8E44AD")
+    ]
+
+    for i, (titulo, valor, cor) in enumerate(cards_data):
+        cell = tabela_resumo.cell(0, i)
+        cell.text = titulo
+        cell.paragraphs[0].runs[0].font.bold = True
+        cell.paragraphs[0].runs[0].font.size = Pt(10)
+        cell.paragraphs[0].runs[0].font.color.rgb = RGBColor(255, 255, 255)
+        try:
+            cell._element.get_or_add_tcPr().append(
+                parse_xml(f'<w:shd {nsdecls("w")} w:fill="{cor}"/>')
+            )
+        except Exception:
+            pass
+
+        cell_valor = tabela_resumo.cell(1, i)
+        cell_valor.text = valor
+        cell_valor.paragraphs[0].runs[0].font.bold = True
+        cell_valor.paragraphs[0].runs[0].font.size = Pt(12)
+        cell_valor.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    doc.add_paragraph().add_run().add_break()
+
+    # --- DESPESAS ESPECÍFICAS ---
+    doc.add_heading("DESPESAS OPERACIONAIS", level=2)
+
+    despesas_data = [
+        ("Combustível", total_combustivel_valor),
+        ("Sopragem de Filtros", total_combustivel_sobragem),
+        ("Lavagem", total_combustivel_lavagem),
+        ("Outras Despesas", total_saidas_despesas + total_saidas_registos),
+    ]
+
+    # +1 linha para o cabeçalho
+    tabela_despesas = doc.add_table(rows=len(despesas_data) + 1, cols=3)
+    tabela_despesas.style = "Table Grid"
+
+    # Cabeçalho
+    cabecalho_despesas = ["CATEGORIA", "VALOR", "% DO TOTAL"]
+    for i, titulo in enumerate(cabecalho_despesas):
+        cell = tabela_despesas.cell(0, i)
+        cell.text = titulo
+        run = cell.paragraphs[0].runs[0]
+        run.font.bold = True
+        run.font.color.rgb = RGBColor(255, 255, 255)
+        try:
+            cell._element.get_or_add_tcPr().append(
+                parse_xml(f'<w:shd {nsdecls("w")} w:fill="2C3E50"/>')
+            )
+        except Exception:
+            pass
+
+    # Função para formatar com separador de milhar e vírgula nos centavos
+    def fmt_money(valor):
+        try:
+            valor = Decimal(valor or 0).quantize(Decimal('0.01'))
+            return format_currency(float(valor), "AOA", locale="pt_PT").replace("AOA", "Kz")
+        except Exception:
+            try:
+                return f"{Decimal(valor or 0):.2f} Kz"
+            except Exception:
+                return f"{valor} Kz"
+
+    # Preenchimento das linhas da tabela
+    for i, (categoria, valor) in enumerate(despesas_data, start=1):
+        cell_cat = tabela_despesas.cell(i, 0)
+        cell_cat.text = categoria
+
+        cell_val = tabela_despesas.cell(i, 1)
+        cell_val.text = fmt_money(valor)
+        cell_val.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
+
+        try:
+            pct = (float(valor) / float(total_saidas) * 100) if total_saidas > 0 else 0
+        except Exception:
+            pct = 0
+        cell_pct = tabela_despesas.cell(i, 2)
+        cell_pct.text = f"{pct:.1f}%"
+        cell_pct.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
+
+        # Zebra shading (linhas alternadas)
+        if i % 2 == 0:
+            for c in (cell_cat, cell_val, cell_pct):
+                try:
+                    c._element.get_or_add_tcPr().append(
+                        parse_xml(f'<w:shd {nsdecls("w")} w:fill="F8F9F9"/>')
+                    )
+                except Exception:
+                    pass
+
+    doc.add_paragraph().add_run().add_break()
+
+    # --- DETALHE POR AUTOCARRO ---
+    doc.add_heading("DETALHE POR AUTOCARRO", level=2)
+
+    if autocarros_stats:
+        cols = ["AUTOCARRO", "KM", "ENTRADAS", "SAÍDAS", "COMBUSTÍVEL", "LITROS", "RESTO"]
+        tabela_autos = doc.add_table(rows=len(autocarros_stats) + 1, cols=len(cols))
+        tabela_autos.style = "Table Grid"
+
+        # Cabeçalho
+        for j, titulo in enumerate(cols):
+            cell = tabela_autos.cell(0, j)
+            cell.text = titulo
+            cell.paragraphs[0].runs[0].font.bold = True
+            try:
+                cell._element.get_or_add_tcPr().append(
+                    parse_xml(f'<w:shd {nsdecls("w")} w:fill="2C3E50"/>')
+                )
+            except Exception:
+                pass
+
+        # Linhas
+        # table.cell(i, j) reconstrói a lista de todas as células a cada
+        # chamada (O(n²) numa frota grande): ler as células linha a linha.
+        for row, s in zip(tabela_autos.rows[1:], autocarros_stats):
+            cells = row.cells
+            cells[0].text = str(s["autocarro"].numero)
+            cells[1].text = str(int(s.get("total_km", 0) or 0))
+            cells[2].text = fmt_money(s.get("total_entradas", Decimal('0')))
+            cells[3].text = fmt_money(s.get("total_saidas", Decimal('0')))
+            cells[4].text = fmt_money(s.get("total_combustivel", Decimal('0')))
+            # litros podem ser None
+            litros = s.get("total_combustivel_litros", Decimal('0')) or Decimal('0')
+            cells[5].text = f"{float(litros):,.2f}"
+            cells[6].text = fmt_money(s.get("resto", Decimal('0')))
+
+            # right align numeric cols
+            for cell in cells[1:]:
+                try:
+                    cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
+                except Exception:
+                    pass
+    else:
+        doc.add_paragraph("Nenhum registo por autocarro encontrado para o período.")
+
+    doc.add_paragraph().add_run().add_break()
+
+    # --- ASSINATURA --- (nome fixo e "cravado" no documento)
+    assinatura_para = doc.add_paragraph()
+    run = assinatura_para.add_run("Assinatura: ")
+    run.bold = True
+    nome_run = assinatura_para.add_run("KIANGEBENI KALEBA MATIAS")
+    nome_run.bold = True
+
+    doc.add_paragraph().add_run().add_break()
+
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue(), f"Relatorio_Mensal_{mes_param}.docx"
@@ -0,0 +1,230 @@
+"""
+Livro de estoque das peças (Movimentacao → EstoqueMensalPeca).
+
+O estoque de uma peça é a soma das entradas menos a soma das saídas das
+suas Movimentações. EstoqueMensalPeca guarda, por peça e por mês com
+movimentações, a quantidade de abertura e as entradas e saídas do mês, e
+Peca.quantidade_estoque guarda o estoque atual (o fecho do último mês).
+
+O estoque numa data é o fecho do último mês guardado antes do mês da data
+mais as movimentações desse mês até à data: uma linha da tabela e um
+intervalo curto de movimentações por peça, resolvidos numa só consulta
+para a lista inteira (com_estoque), o que deixa filtrar o estoque baixo e
+somar o valor do estoque na base de dados.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import (
+    BooleanField, Case, DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear
+from django.utils import timezone
+
+from .models import EstoqueMensalPeca, Movimentacao, Peca
+
+
+ZERO = Decimal('0')
+TAMANHO_LOTE = 1000
+OBSERVACAO_ACERTO = 'Acerto de estoque (quantidade que estava registada na peça)'
+
+
+def _periodo(data):
+    return data.year * 100 + data.month
+
+
+def _decimal(expressao):
+    return Coalesce(expressao, Value(ZERO), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def _totais():
+    return dict(
+        entradas=Sum('quantidade', filter=Q(tipo='entrada')),
+        saidas=Sum('quantidade', filter=Q(tipo='saida')),
+    )
+
+
+def _quantidade_com_sinal():
+    """Entrada positiva, saída negativa."""
+    return Case(
+        When(tipo='entrada', then=F('quantidade')),
+        default=-F('quantidade'),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+
+
+def _meses(movimentacoes):
+    """[(periodo, entradas, saídas)] por ordem cronológica, num só GROUP BY."""
+    linhas = (
+        movimentacoes.order_by()
+        .annotate(_ano=ExtractYear('data'), _mes=ExtractMonth('data'))
+        .values('_ano', '_mes')
+        .annotate(**_totais())
+        .order_by('_ano', '_mes')
+    )
+    return [
+        (linha['_ano'] * 100 + linha['_mes'], linha['entradas'] or ZERO, linha['saidas'] or ZERO)
+        for linha in linhas
+    ]
+
+
+def _linhas_encadeadas(peca_id, meses, abertura=ZERO):
+    """EstoqueMensalPeca de cada mês, com a abertura = fecho do mês anterior."""
+    linhas = []
+    for periodo, entradas, saidas in meses:
+        linhas.append(EstoqueMensalPeca(
+            peca_id=peca_id, periodo=periodo,
+            quantidade_abertura=abertura, entradas=entradas, saidas=saidas,
+        ))
+        abertura = abertura + entradas - saidas
+    return linhas
+
+
+# ----- Manutenção ----- #
+
+def recalcular_estoque_peca(peca_id, desde=None):
+    """
+    Recalcula o estoque mensal de uma peça a partir do mês da data `desde`
+    (ou de sempre) e grava o estoque atual em Peca.quantidade_estoque.
+    """
+    movimentacoes = Movimentacao.objects.filter(peca_id=peca_id)
+    estoques = EstoqueMensalPeca.objects.filter(peca_id=peca_id)
+    abertura = ZERO
+    if desde is not None:
+        movimentacoes = movimentacoes.filter(data__gte=desde.replace(day=1))
+        estoques = estoques.filter(periodo__gte=_periodo(desde))
+        anterior = (
+            EstoqueMensalPeca.objects
+            .filter(peca_id=peca_id, periodo__lt=_periodo(desde))
+            .order_by('-periodo')
+            .first()
+        )
+        if anterior is not None:
+            abertura = anterior.quantidade_fecho
+
+    linhas = _linhas_encadeadas(peca_id, _meses(movimentacoes), abertura)
+    atual = linhas[-1].quantidade_fecho if linhas else abertura
+    with transaction.atomic():
+        estoques.delete()
+        EstoqueMensalPeca.objects.bulk_create(linhas)
+        Peca.objects.filter(pk=peca_id).update(quantidade_estoque=atual)
+
+
+def agendar_recalculo_estoque(*chaves):
+    """Recalcula as peças das chaves (peca_id, data) depois do commit."""
+    desde = {}
+    for chave in chaves:
+        if not chave or not all(chave):
+            continue
+        peca_id, data = chave
+        desde[peca_id] = min(data, desde.get(peca_id, data))
+    if not desde:
+        return
+
+    def _executar():
+        for peca_id, data in desde.items():
+            recalcular_estoque_peca(peca_id, data)
+
+    transaction.on_commit(_executar)
+
+
+def acertar_estoque(data=None):
+    """
+    Regista uma movimentação de acerto (com a data `data`, por omissão
+    hoje) para cada peça cuja quantidade_estoque não bate certo com as
+    suas movimentações — o estoque que era ajustado à mão antes do livro
+    de estoque passa a constar do histórico. Devolve o número de acertos.
+    """
+    data = data or timezone.localdate()
+    pecas = (
+        Peca.objects
+        .annotate(_livro=_decimal(Sum(
+            Case(
+                When(movimentacoes__tipo='entrada', then=F('movimentacoes__quantidade')),
+                default=-F('movimentacoes__quantidade'),
+            ),
+        )))
+        .exclude(quantidade_estoque=F('_livro'))
+        .values_list('pk', 'quantidade_estoque', '_livro')
+    )
+    acertos = [
+        Movimentacao(
+            peca_id=peca_id,
+            tipo='entrada' if registado > livro else 'saida',
+            quantidade=abs(registado - livro),
+            data=data,
+            observacao=OBSERVACAO_ACERTO,
+        )
+        for peca_id, registado, livro in pecas
+    ]
+    Movimentacao.objects.bulk_create(acertos, batch_size=TAMANHO_LOTE)
+    return len(acertos)
+
+
+def reconstruir_estoque():
+    """
+    Recria EstoqueMensalPeca de raiz (um GROUP BY (peça, mês) e
+    bulk_create) e volta a gravar o estoque atual de todas as peças.
+    """
+    por_peca = {}
+    linhas = (
+        Movimentacao.objects.order_by()
+        .annotate(_ano=ExtractYear('data'), _mes=ExtractMonth('data'))
+        .values('peca_id', '_ano', '_mes')
+        .annotate(**_totais())
+        .order_by('peca_id', '_ano', '_mes')
+    )
+    for linha in linhas:
+        por_peca.setdefault(linha['peca_id'], []).append(
+            (linha['_ano'] * 100 + linha['_mes'], linha['entradas'] or ZERO, linha['saidas'] or ZERO)
+        )
+
+    novas = []
+    atuais = []
+    for peca_id in Peca.objects.order_by('pk').values_list('pk', flat=True):
+        encadeadas = _linhas_encadeadas(peca_id, por_peca.get(peca_id, []))
+        novas.extend(encadeadas)
+        atual = encadeadas[-1].quantidade_fecho if encadeadas else ZERO
+        atuais.append(Peca(pk=peca_id, quantidade_estoque=atual))
+
+    with transaction.atomic():
+        EstoqueMensalPeca.objects.all().delete()
+        EstoqueMensalPeca.objects.bulk_create(novas, batch_size=TAMANHO_LOTE)
+        Peca.objects.bulk_update(atuais, ['quantidade_estoque'], batch_size=TAMANHO_LOTE)
+    return len(novas)
+
+
+# ----- Consulta ----- #
+
+def com_estoque(pecas, data=None):
+    """
+    Anota em cada peça de `pecas` a `quantidade` em estoque (atual, ou no
+    fim do dia `data`), o `valor` (quantidade × preço unitário) e `em_baixo`
+    (quantidade ≤ estoque mínimo da peça).
+    """
+    if data is None:
+        quantidade = F('quantidade_estoque')
+    else:
+        fecho_anterior = (
+            EstoqueMensalPeca.objects
+            .filter(peca=OuterRef('pk'), periodo__lt=_periodo(data))
+            .order_by('-periodo')
+            .annotate(_fecho=F('quantidade_abertura') + F('entradas') - F('saidas'))
+            .values('_fecho')[:1]
+        )
+        do_mes = (
+            Movimentacao.objects
+            .filter(peca=OuterRef('pk'), data__gte=data.replace(day=1), data__lte=data)
+            .order_by()
+            .values('peca')
+            .annotate(_total=Sum(_quantidade_com_sinal()))
+            .values('_total')
+        )
+        quantidade = _decimal(Subquery(fecho_anterior)) + _decimal(Subquery(do_mes))
+
+    return pecas.annotate(quantidade=quantidade).annotate(
+        valor=ExpressionWrapper(
+            F('quantidade') * F('preco_unitario'), output_field=DecimalField(max_digits=16, decimal_places=2),
+        ),
+        em_baixo=ExpressionWrapper(Q(quantidade__lte=F('estoque_minimo')), output_field=BooleanField()),
+    )
@@ -0,0 +1,81 @@
+"""
+Exportações CSV em streaming.
+
+As linhas são geradas à medida que o cliente as lê (StreamingHttpResponse):
+o primeiro byte sai logo e a memória do worker não cresce com o período
+exportado, porque as querysets são percorridas com .iterator() em blocos.
+"""
+import csv
+from itertools import islice
+
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+
+from .models import DespesaCombustivel
+
+
+TAMANHO_BLOCO = 2000
+
+
+class _Eco:
+    """Pseudo-ficheiro para o csv.writer: devolve a linha em vez de a guardar."""
+
+    def write(self, valor):
+        return valor
+
+
+def resposta_csv(linhas, nome_ficheiro):
+    """
+    StreamingHttpResponse com as `linhas` (iterável de listas) em CSV ';'.
+    Começa pelo BOM para o Excel reconhecer UTF-8.
+    """
+    writer = csv.writer(_Eco(), delimiter=';')
+
+    def _gerar():
+        yield '\ufeff'
+        for linha in linhas:
+            yield writer.writerow(linha)
+
+    response = StreamingHttpResponse(_gerar(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nome_ficheiro}"'
+    return response
+
+
+def em_blocos(queryset, tamanho=TAMANHO_BLOCO):
+    """Percorre a queryset com .iterator() e devolve listas de `tamanho` linhas."""
+    iterador = queryset.iterator(chunk_size=tamanho)
+    while True:
+        bloco = list(islice(iterador, tamanho))
+        if not bloco:
+            return
+        yield bloco
+
+
+def combustivel_por_chave(chaves):
+    """
+    Totais de combustível por (autocarro_id, data), só para as chaves dadas
+    (um bloco da exportação). Uma query por bloco.
+    """
+    if not chaves:
+        return {}
+    datas = [data for _, data in chaves]
+    linhas = (
+        DespesaCombustivel.objects
+        .filter(
+            autocarro_id__in={autocarro_id for autocarro_id, _ in chaves},
+            data__gte=min(datas),
+            data__lte=max(datas),
+        )
+        .order_by()
+        .values('autocarro_id', 'data')
+        .annotate(
+            total_valor=Sum('valor'),
+            total_sobragem=Sum('sobragem_filtros'),
+            total_lavagem=Sum('lavagem'),
+        )
+    )
+    return {
+        (linha['autocarro_id'], linha['data']): linha
+        for linha in linhas
+        if (linha['autocarro_id'], linha['data']) in chaves
+    }
@@ -121,7 +121,6 @@ class RegistoDiarioForm(forms.ModelForm):
             'taxa': forms.NumberInput(attrs={'class': 'form-control'}),
             'outros': forms.NumberInput(attrs={'class': 'form-control'}),
             'taxi': forms.NumberInput(attrs={'class': 'form-control'}),
-            'numero_passageiros': forms.NumberInput(attrs={'class': 'form-control'}),
             'numero_viagens': forms.NumberInput(attrs={'class': 'form-control'}),
             'km_percorridos': forms.NumberInput(attrs={'class': 'form-control'}),
             'motorista': forms.TextInput(attrs={'class': 'form-control'}),
@@ -149,6 +148,18 @@ class RegistoDiarioForm(forms.ModelForm):
         return cleaned_data
 
 
+class RegistoSectorForm(RegistoDiarioForm):
+    """Um autocarro na folha do relatório do sector: só os campos que a folha mostra."""
+    class Meta(RegistoDiarioForm.Meta):
+        exclude = None
+        fields = [
+            'concluido', 'validado', 'motorista', 'cobrador_principal', 'cobrador_auxiliar',
+            'normal', 'alunos', 'luvu', 'frete',
+            'alimentacao', 'parqueamento', 'taxa', 'outros', 'taxi',
+            'numero_viagens', 'km_percorridos',
+        ]
+
+
 # ---- Autocarro ---- #
 class AutocarroForm(forms.ModelForm):
     class Meta:
@@ -421,7 +432,7 @@ class PecaForm(forms.ModelForm):
         model = Peca
         fields = [
             'nome', 'referencia', 'categoria', 'fornecedor',
-            'unidade_medida', 'preco_unitario', 'quantidade_estoque', 'observacao',
+            'unidade_medida', 'preco_unitario', 'quantidade_estoque', 'estoque_minimo', 'observacao',
         ]
         widgets = {
             'nome': forms.TextInput(attrs={'placeholder': 'Nome da peça'}),
@@ -431,6 +442,13 @@ class PecaForm(forms.ModelForm):
             'observacao': forms.Textarea(attrs={'rows': 3, 'placeholder': 'Notas adicionais (opcional)'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            # depois de criada, o estoque só muda com movimentações
+            self.fields['quantidade_estoque'].disabled = True
+            self.fields['quantidade_estoque'].help_text = 'Para corrigir, registe uma movimentação de entrada ou saída.'
+
 
 class AutocarroChoiceField(forms.ModelChoiceField):
     def label_from_instance(self, obj):
@@ -0,0 +1,225 @@
+"""
+Verificação e correção da integridade dos registos diários.
+
+Três problemas, cada um encontrado com uma única consulta:
+- registos mal arquivados: o mesmo autocarro aparece mais de uma vez no
+  mesmo relatório — como (autocarro, data) é único, são registos de dias
+  diferentes, e os que não são do dia do relatório são religados ao
+  relatório do sector do autocarro no seu próprio dia (nunca apagados);
+- registos órfãos: RegistoDiario sem RelatorioSector, ligados ao relatório
+  do sector do autocarro nessa data;
+- relatórios vazios: RelatorioSector sem registos, que recebem um registo
+  em branco por cada autocarro do sector.
+
+Os relatórios em falta são criados. As correções são gravadas com
+bulk_create / bulk_update por lotes, cada lote na sua transação, com os
+signals dos resumos em pausa; no fim os resumos diários e mensais tocados,
+os odómetros e a cache são refeitos de uma vez. Em simulação tudo corre
+dentro de uma transação que é desfeita no fim, por isso os números são
+exatamente os de uma correção real.
+"""
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from .cache_resultados import invalidar_tudo
+from .models import Autocarro, RegistoDiario, RelatorioSector
+from .odometro import recalcular_odometros
+from .resumos import reconstruir_resumos, recalcular_resumo_mensal
+from .signals import resumos_em_pausa
+
+
+TAMANHO_LOTE = 1000
+PROBLEMAS = ('mal_arquivados', 'orfaos', 'vazios')
+DESCRICAO_AUTOMATICA = 'Relatório criado automaticamente na verificação de integridade'
+
+DESCRICOES = {
+    'mal_arquivados_ligados': 'registo(s) de outro dia religado(s) ao relatório do seu dia',
+    'relatorios_criados': 'relatório(s) criado(s) para registos órfãos ou mal arquivados',
+    'orfaos_ligados': 'registo(s) órfão(s) ligado(s) ao relatório do sector',
+    'registos_criados': 'registo(s) em branco criado(s) em relatórios vazios',
+    'vazios_sem_autocarros': 'relatório(s) vazio(s) de sectores sem autocarros (não corrigidos)',
+}
+
+
+def _lotes(itens):
+    for i in range(0, len(itens), TAMANHO_LOTE):
+        yield itens[i:i + TAMANHO_LOTE]
+
+
+def _mal_arquivados():
+    """
+    Registos de um autocarro que aparece mais de uma vez no mesmo relatório
+    e que não são do dia desse relatório.
+    """
+    # com uma Window o Django filtraria a data antes de contar (a condição
+    # vai para dentro da subconsulta), e o registo do dia deixava de contar
+    outro_no_relatorio = (
+        RegistoDiario.objects
+        .filter(relatorio_id=OuterRef('relatorio_id'), autocarro_id=OuterRef('autocarro_id'))
+        .exclude(pk=OuterRef('pk'))
+    )
+    return (
+        RegistoDiario.objects
+        .filter(relatorio__isnull=False)
+        .exclude(data=F('relatorio__data'))
+        .filter(Exists(outro_no_relatorio))
+    )
+
+
+def verificar():
+    """Contagens dos problemas encontrados (sem corrigir nada)."""
+    return {
+        'mal_arquivados': _mal_arquivados().count(),
+        'orfaos': RegistoDiario.objects.filter(relatorio__isnull=True).count(),
+        'relatorios_vazios': RelatorioSector.objects.filter(registos__isnull=True).count(),
+    }
+
+
+def _ligar_ao_relatorio_do_dia(registos, chave_resultado, resultado, meses, progresso):
+    """Liga os `registos` ao relatório do sector do autocarro na sua data (criado se faltar)."""
+    # lidos de uma vez, antes de gravar o primeiro lote
+    linhas = list(registos.values_list('pk', 'autocarro__sector_id', 'data'))
+    if not linhas:
+        return
+
+    chaves = {(sector_id, data) for _, sector_id, data in linhas}
+    datas = [data for _, data in chaves]
+
+    def _relatorios():
+        return {
+            (sector_id, data): pk
+            for pk, sector_id, data in (
+                RelatorioSector.objects
+                .filter(
+                    sector_id__in={sector_id for sector_id, _ in chaves},
+                    data__gte=min(datas), data__lte=max(datas),
+                )
+                .values_list('pk', 'sector_id', 'data')
+            )
+        }
+
+    relatorios = _relatorios()
+    em_falta = [chave for chave in chaves if chave not in relatorios]
+    for lote in _lotes(em_falta):
+        with transaction.atomic():
+            RelatorioSector.objects.bulk_create([
+                RelatorioSector(sector_id=sector_id, data=data, descricao=DESCRICAO_AUTOMATICA)
+                for sector_id, data in lote
+            ])
+        meses.update((data.year, data.month, sector_id) for sector_id, data in lote)
+        resultado['relatorios_criados'] += len(lote)
+        if progresso:
+            progresso('relatorios_criados', resultado['relatorios_criados'])
+    if em_falta:
+        # nem todas as bases devolvem os ids no bulk_create
+        relatorios = _relatorios()
+
+    for lote in _lotes(linhas):
+        with transaction.atomic():
+            RegistoDiario.objects.bulk_update(
+                [
+                    RegistoDiario(pk=pk, relatorio_id=relatorios[(sector_id, data)])
+                    for pk, sector_id, data in lote
+                ],
+                ['relatorio'],
+            )
+        resultado[chave_resultado] += len(lote)
+        if progresso:
+            progresso(chave_resultado, resultado[chave_resultado])
+
+
+def _preencher_vazios(resultado, tocados, progresso):
+    vazios = list(
+        RelatorioSector.objects
+        .filter(registos__isnull=True)
+        .values_list('pk', 'sector_id', 'data')
+    )
+    if not vazios:
+        return
+
+    datas = [data for _, _, data in vazios]
+    sectores = {sector_id for _, sector_id, _ in vazios}
+    autocarros = {}
+    for pk, sector_id in Autocarro.objects.filter(sector_id__in=sectores).values_list('pk', 'sector_id'):
+        autocarros.setdefault(sector_id, []).append(pk)
+    # um autocarro só pode ter um registo por dia (pode estar noutro relatório)
+    ocupados = set(
+        RegistoDiario.objects
+        .filter(autocarro__sector_id__in=sectores, data__gte=min(datas), data__lte=max(datas))
+        .values_list('autocarro_id', 'data')
+    )
+
+    novos = []
+    for relatorio_id, sector_id, data in vazios:
+        if not autocarros.get(sector_id):
+            resultado['vazios_sem_autocarros'] += 1
+            continue
+        for autocarro_id in autocarros[sector_id]:
+            if (autocarro_id, data) not in ocupados:
+                novos.append(RegistoDiario(relatorio_id=relatorio_id, autocarro_id=autocarro_id, data=data))
+
+    for lote in _lotes(novos):
+        with transaction.atomic():
+            RegistoDiario.objects.bulk_create(lote)
+        tocados.update((registo.autocarro_id, registo.data) for registo in lote)
+        resultado['registos_criados'] += len(lote)
+        if progresso:
+            progresso('registos_criados', resultado['registos_criados'])
+
+
+def _atualizar_resumos(tocados, meses):
+    """Refaz, de uma vez, o que os signals em pausa teriam refeito linha a linha."""
+    if tocados:
+        datas = [data for _, data in tocados]
+        reconstruir_resumos(min(datas), max(datas))
+        recalcular_odometros({autocarro_id for autocarro_id, _ in tocados})
+        sector_de = dict(
+            Autocarro.objects
+            .filter(pk__in={autocarro_id for autocarro_id, _ in tocados})
+            .values_list('pk', 'sector_id')
+        )
+        meses.update((data.year, data.month, sector_de.get(autocarro_id)) for autocarro_id, data in tocados)
+    for ano, mes, sector_id in meses:
+        recalcular_resumo_mensal(ano, mes, sector_id)
+    if tocados or meses:
+        invalidar_tudo()
+
+
+def corrigir(problemas=PROBLEMAS, simular=False, progresso=None):
+    """
+    Corrige os `problemas` pedidos (mal arquivados, órfãos e relatórios
+    vazios), sempre por esta ordem: os relatórios que recebem registos
+    religados deixam de contar como vazios. `progresso(chave, total)` é chamado
+    depois de cada lote. Devolve {chave de DESCRICOES: quantidade}.
+    """
+    resultado = dict.fromkeys(DESCRICOES, 0)
+    tocados = set()   # (autocarro_id, data) com registos criados
+    meses = set()     # (ano, mes, sector_id) com relatórios criados
+
+    def _executar():
+        with resumos_em_pausa():
+            if 'mal_arquivados' in problemas:
+                _ligar_ao_relatorio_do_dia(
+                    _mal_arquivados(), 'mal_arquivados_ligados', resultado, meses, progresso,
+                )
+            if 'orfaos' in problemas:
+                _ligar_ao_relatorio_do_dia(
+                    RegistoDiario.objects.filter(relatorio__isnull=True),
+                    'orfaos_ligados', resultado, meses, progresso,
+                )
+            if 'vazios' in problemas:
+                _preencher_vazios(resultado, tocados, progresso)
+
+    if simular:
+        # uma transação à volta de tudo (os lotes passam a savepoints), desfeita no fim
+        with transaction.atomic():
+            _executar()
+            transaction.set_rollback(True)
+        return resultado
+
+    try:
+        _executar()
+    finally:
+        # se um lote falhar, os que já foram gravados ficam nos resumos
+        _atualizar_resumos(tocados, meses)
+    return resultado
@@ -0,0 +1,209 @@
+import json
+import platform
+import time
+import tracemalloc
+from datetime import date
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from autocarros import views
+from autocarros.documentos import relatorio_dashboard_docx
+from autocarros.models import (
+    CobradorViagem, CustomUser, DespesaCombustivel, RegistoDiario, Sector,
+)
+
+
+UTILIZADOR = "benchmark"
+
+
+def _percentil(valores, p):
+    """Percentil por interpolação linear (valores já ordenados)."""
+    if not valores:
+        return None
+    k = (len(valores) - 1) * p / 100
+    inferior = int(k)
+    superior = min(inferior + 1, len(valores) - 1)
+    return valores[inferior] + (valores[superior] - valores[inferior]) * (k - inferior)
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede as vistas mais pesadas (dashboard, listagens, mapa financeiro, "
+        "gerência, exportações CSV/Word): número de consultas, latência "
+        "p50/p95 e pico de memória. Escreve o resultado num ficheiro JSON "
+        "para comparar execuções (--comparar). Usar com gerar_dados_sinteticos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeticoes", type=int, default=5)
+        parser.add_argument("--mes", default=None, help="Mês a medir (AAAA-MM). Por omissão, o atual.")
+        parser.add_argument("--sector", type=int, default=None, help="Sector para o mapa financeiro.")
+        parser.add_argument("--saida", default="benchmark.json")
+        parser.add_argument(
+            "--sem-cache", action="store_true",
+            help="Limpa a cache antes de cada pedido (mede o cálculo completo).",
+        )
+        parser.add_argument("--comparar", default=None, help="JSON de uma execução anterior.")
+        parser.add_argument("--apenas", nargs="*", default=None, help="Nomes dos casos a medir.")
+
+    # ------------------------------------------------------------------ #
+
+    def _casos(self, ano, mes, sector_id):
+        mes_param = f"{ano}-{mes:02d}"
+        filtro_mapa = f"mes={mes}&ano={ano}" + (f"&sector={sector_id}" if sector_id else "")
+        fabrica = RequestFactory()
+
+        def paginado():
+            # sem rota própria: chama a vista diretamente
+            request = fabrica.get("/relatorio-autocarros/", {"mes": mes, "ano": ano})
+            request.user = self.utilizador
+            return views.relatorio_autocarros_paginado(request)
+
+        return {
+            "dashboard": f"/dashboard/?mes={mes_param}",
+            "listar_registros": "/registros/",
+            "mapa_geral_financeiro": f"/mapas/mensal-financeiro/?{filtro_mapa}",
+            "relatorio_autocarros": f"/relatorio-autocarros/?mes={mes}&ano={ano}",
+            "relatorio_autocarros_paginado": paginado,
+            "gerencia_financas": "/gerencia-financas/",
+            "gerencia_financas_docx": f"/gerencia-financas/?mes={mes_param}&download=1",
+            "exportar_relatorio_autocarros_csv": f"/relatorio-autocarros/exportar-csv/?mes={mes}&ano={ano}",
+            "exportar_mapa_financeiro_csv": f"/mapas/mensal-financeiro/exportar-csv/?{filtro_mapa}",
+            # a vista só enfileira o job; mede-se a geração do documento
+            "relatorio_dashboard_docx": lambda: relatorio_dashboard_docx(ano, mes),
+        }
+
+    def _executar(self, alvo):
+        """Corre um caso e devolve (status, bytes). Consome respostas em streaming."""
+        if callable(alvo):
+            resposta = alvo()
+        else:
+            resposta = self.cliente.get(alvo)
+        if isinstance(resposta, tuple):  # gerador de documento: (bytes, nome)
+            return 200, len(resposta[0])
+        if getattr(resposta, "streaming", False):
+            return resposta.status_code, sum(len(bloco) for bloco in resposta.streaming_content)
+        return resposta.status_code, len(resposta.content)
+
+    def _medir(self, alvo, repeticoes, sem_cache):
+        tempos, consultas = [], []
+        status = tamanho = None
+        for _ in range(repeticoes):
+            if sem_cache:
+                cache.clear()
+            with CaptureQueriesContext(connection) as capturadas:
+                inicio = time.perf_counter()
+                status, tamanho = self._executar(alvo)
+                tempos.append((time.perf_counter() - inicio) * 1000)
+            consultas.append(len(capturadas))
+
+        # memória numa execução à parte: o tracemalloc atrasa muito o pedido
+        if sem_cache:
+            cache.clear()
+        tracemalloc.start()
+        self._executar(alvo)
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        tempos.sort()
+        return {
+            "status": status,
+            "bytes": tamanho,
+            "consultas": max(consultas),
+            "consultas_min": min(consultas),
+            "p50_ms": round(_percentil(tempos, 50), 2),
+            "p95_ms": round(_percentil(tempos, 95), 2),
+            "min_ms": round(tempos[0], 2),
+            "max_ms": round(tempos[-1], 2),
+            "memoria_pico_kb": round(pico / 1024, 1),
+        }
+
+    # ------------------------------------------------------------------ #
+
+    def handle(self, *args, **options):
+        hoje = timezone.now().date()
+        ano, mes = hoje.year, hoje.month
+        if options["mes"]:
+            try:
+                ano, mes = map(int, options["mes"].split("-"))
+                date(ano, mes, 1)
+            except ValueError:
+                raise CommandError(f"Mês inválido em --mes: {options['mes']}")
+
+        self.utilizador, criado = CustomUser.objects.get_or_create(
+            username=UTILIZADOR, defaults={"nivel_acesso": "admin"}
+        )
+        if criado:
+            self.utilizador.set_unusable_password()
+            self.utilizador.save()
+        self.cliente = Client(SERVER_NAME="localhost")
+        self.cliente.force_login(self.utilizador)
+
+        casos = self._casos(ano, mes, options["sector"])
+        if options["apenas"]:
+            desconhecidos = set(options["apenas"]) - set(casos)
+            if desconhecidos:
+                raise CommandError(f"Casos desconhecidos: {', '.join(sorted(desconhecidos))}")
+            casos = {nome: alvo for nome, alvo in casos.items() if nome in options["apenas"]}
+
+        resultados = {}
+        for nome, alvo in casos.items():
+            # um pedido de aquecimento (imports, templates, cache de resultados)
+            self._executar(alvo)
+            resultados[nome] = self._medir(alvo, options["repeticoes"], options["sem_cache"])
+            r = resultados[nome]
+            self.stdout.write(
+                f"{nome:<36} {r['status']:>3}  consultas={r['consultas']:<4} "
+                f"p50={r['p50_ms']:>8.1f}ms  p95={r['p95_ms']:>8.1f}ms  "
+                f"mem={r['memoria_pico_kb']:>9.1f}KB"
+            )
+
+        relatorio = {
+            "gerado_em": timezone.now().isoformat(),
+            "parametros": {
+                "mes": f"{ano}-{mes:02d}",
+                "sector": options["sector"],
+                "repeticoes": options["repeticoes"],
+                "sem_cache": options["sem_cache"],
+            },
+            "ambiente": {
+                "python": platform.python_version(),
+                "base_dados": connection.vendor,
+            },
+            "volume": {
+                "sectores": Sector.objects.count(),
+                "registos_diarios": RegistoDiario.objects.count(),
+                "despesas_combustivel": DespesaCombustivel.objects.count(),
+                "viagens_cobrador": CobradorViagem.objects.count(),
+            },
+            "resultados": resultados,
+        }
+        with open(options["saida"], "w", encoding="utf-8") as ficheiro:
+            json.dump(relatorio, ficheiro, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f"Resultados gravados em {options['saida']}."))
+
+        if options["comparar"]:
+            self._comparar(options["comparar"], resultados)
+
+    def _comparar(self, caminho, resultados):
+        with open(caminho, encoding="utf-8") as ficheiro:
+            anteriores = json.load(ficheiro).get("resultados", {})
+
+        self.stdout.write(f"\nComparação com {caminho}:")
+        for nome, atual in resultados.items():
+            antes = anteriores.get(nome)
+            if not antes:
+                continue
+            variacao = (
+                (atual["p50_ms"] - antes["p50_ms"]) / antes["p50_ms"] * 100
+                if antes["p50_ms"] else 0
+            )
+            self.stdout.write(
+                f"{nome:<36} consultas {antes['consultas']:>4} -> {atual['consultas']:<4} "
+                f"p50 {antes['p50_ms']:>8.1f} -> {atual['p50_ms']:>8.1f}ms ({variacao:+.0f}%)"
+            )
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.utils import timezone
+
+from autocarros.models import (
+    Deposito, Despesa, Despesa2, DespesaCombustivel, RegistoDiario, RelatorioSector, Sector,
+)
+from autocarros.periodos import filtro_periodo
+
+
+# Marcas de uso de índice no plano (SQLite / PostgreSQL / MySQL)
+MARCAS_INDICE = ("USING INDEX", "USING COVERING INDEX", "Index Scan", "Index Only Scan", "Bitmap Index Scan", "key:")
+
+
+def usa_indice(plano):
+    return any(marca in plano for marca in MARCAS_INDICE)
+
+
+def consultas_mensais(ano, mes, sector_id, dia=1):
+    """{nome: queryset} das consultas por período (mês ou um dia do mês) mais usadas nos relatórios."""
+    periodo = filtro_periodo("data", ano, mes)
+    do_dia = filtro_periodo("data", ano, mes, dia)
+    return {
+        "RegistoDiario por mês": RegistoDiario.objects.filter(**periodo).values("autocarro_id").annotate(t=Sum("normal")),
+        "RegistoDiario num dia": RegistoDiario.objects.filter(**do_dia),
+        "DespesaCombustivel por mês": DespesaCombustivel.objects.filter(**periodo).values("autocarro_id").annotate(t=Sum("valor")),
+        "DespesaCombustivel num dia": DespesaCombustivel.objects.filter(**do_dia),
+        "DespesaCombustivel por sector e mês": DespesaCombustivel.objects.filter(sector_id=sector_id, **periodo),
+        "RelatorioSector por mês": RelatorioSector.objects.filter(**periodo),
+        "Despesa por mês": Despesa.objects.filter(**periodo),
+        "Despesa2 por mês": Despesa2.objects.filter(**periodo),
+        "Deposito por sector e mês": Deposito.objects.filter(
+            sector_id=sector_id, **filtro_periodo("data_deposito", ano, mes)
+        ),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Mostra o EXPLAIN das consultas mensais mais usadas nos relatórios e "
+        "indica se cada uma usa índice. Útil depois de popular a base de dados "
+        "(em tabelas pequenas o PostgreSQL pode preferir um seq scan)."
+    )
+
+    def add_arguments(self, parser):
+        hoje = timezone.localdate()
+        parser.add_argument("--ano", type=int, default=hoje.year)
+        parser.add_argument("--mes", type=int, default=hoje.month)
+        parser.add_argument(
+            "--estrito",
+            action="store_true",
+            help="Falhar se alguma consulta não usar índice.",
+        )
+
+    def handle(self, *args, **options):
+        ano, mes = options["ano"], options["mes"]
+        sector_id = Sector.objects.values_list("pk", flat=True).first() or 0
+        consultas = consultas_mensais(ano, mes, sector_id)
+
+        sem_indice = []
+        for nome, queryset in consultas.items():
+            plano = queryset.explain()
+            com_indice = usa_indice(plano)
+            estilo = self.style.SUCCESS if com_indice else self.style.WARNING
+            self.stdout.write(estilo(f"== {nome}: {'índice' if com_indice else 'SEM índice'}"))
+            self.stdout.write(plano)
+            self.stdout.write("")
+            if not com_indice:
+                sem_indice.append(nome)
+
+        if sem_indice and options["estrito"]:
+            raise CommandError("Consultas sem índice: " + ", ".join(sem_indice))
@@ -0,0 +1,292 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from autocarros.cache_resultados import invalidar_tudo
+from autocarros.models import (
+    Autocarro, Bateria, CategoriaDespesa, CobradorViagem, Deposito, Despesa, Despesa2,
+    DespesaCombustivel, DespesaFixa, Manutencao, Pneu, RegistoDiario, RegistroKM,
+    RegistroKMItem, RelatorioSector, Sector, SubCategoriaDespesa, Troca, TrocaBateria,
+)
+from autocarros.odometro import recalcular_odometros
+from autocarros.resumos import reconstruir_resumos, reconstruir_resumos_mensais
+from autocarros.signals import resumos_em_pausa
+
+
+PREFIXO_SECTOR = "Sintético"
+MARCA = "[sintético]"
+LOTE = 1000
+
+
+def _kz(rng, minimo, maximo):
+    return Decimal(rng.randint(minimo, maximo))
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera um conjunto de dados sintético e reprodutível (sectores × "
+        "autocarros × dias) com registos diários, combustível, despesas, "
+        "depósitos, manutenções, trocas de pneus/baterias e viagens de "
+        "cobrador. Serve para medir o desempenho (ver benchmark_vistas). "
+        "Os dados ficam em sectores 'Sintético NN' e são apagados com --limpar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sectores", type=int, default=3)
+        parser.add_argument("--autocarros", type=int, default=8, help="Autocarros por sector.")
+        parser.add_argument("--dias", type=int, default=90)
+        parser.add_argument(
+            "--ate", default=None,
+            help="Último dia dos dados (AAAA-MM-DD). Por omissão, hoje.",
+        )
+        parser.add_argument("--semente", type=int, default=42)
+        parser.add_argument(
+            "--limpar", action="store_true",
+            help="Apaga os dados sintéticos anteriores antes de gerar.",
+        )
+        parser.add_argument(
+            "--so-limpar", action="store_true",
+            help="Apenas apaga os dados sintéticos anteriores.",
+        )
+
+    def handle(self, *args, **options):
+        inicio_execucao = time.monotonic()
+
+        fim = date.today()
+        if options["ate"]:
+            fim = parse_date(options["ate"])
+            if fim is None:
+                raise CommandError(f"Data inválida em --ate: {options['ate']}")
+        dias = [fim - timedelta(days=n) for n in range(options["dias"] - 1, -1, -1)]
+
+        existentes = Sector.objects.filter(nome__startswith=PREFIXO_SECTOR)
+        if options["limpar"] or options["so_limpar"]:
+            self._limpar()
+        elif existentes.exists():
+            raise CommandError("Já existem dados sintéticos. Use --limpar para os substituir.")
+
+        if not options["so_limpar"]:
+            rng = random.Random(options["semente"])
+            with resumos_em_pausa(), transaction.atomic():
+                totais = self._gerar(rng, options["sectores"], options["autocarros"], dias)
+            for modelo, quantidade in totais.items():
+                self.stdout.write(f"  {modelo}: {quantidade}")
+
+        # bulk_create e os deletes em massa não passam pelos signals
+        self.stdout.write("A reconstruir os resumos...")
+        reconstruir_resumos()
+        reconstruir_resumos_mensais()
+        recalcular_odometros()
+        invalidar_tudo()
+
+        duracao = time.monotonic() - inicio_execucao
+        self.stdout.write(self.style.SUCCESS(f"Concluído em {duracao:.1f}s."))
+
+    # ------------------------------------------------------------------ #
+
+    def _limpar(self):
+        sectores = Sector.objects.filter(nome__startswith=PREFIXO_SECTOR)
+        with resumos_em_pausa(), transaction.atomic():
+            # Despesa fica com sector NULL se o sector for apagado
+            Despesa.objects.filter(sector__in=sectores).delete()
+            Despesa2.objects.filter(descricao__startswith=MARCA).delete()
+            apagados, _ = sectores.delete()
+            Pneu.objects.filter(fornecedor=PREFIXO_SECTOR).delete()
+            Bateria.objects.filter(fornecedor=PREFIXO_SECTOR).delete()
+        self.stdout.write(f"Dados sintéticos anteriores apagados ({apagados} linha(s)).")
+
+    def _gerar(self, rng, n_sectores, n_autocarros, dias):
+        totais = {}
+
+        def gravar(modelo, objetos):
+            modelo.objects.bulk_create(objetos, batch_size=LOTE)
+            totais[modelo.__name__] = totais.get(modelo.__name__, 0) + len(objetos)
+            return objetos
+
+        sectores = gravar(Sector, [
+            Sector(nome=f"{PREFIXO_SECTOR} {i:02d}", slug=f"sintetico-{i:02d}")
+            for i in range(1, n_sectores + 1)
+        ])
+        autocarros = gravar(Autocarro, [
+            Autocarro(
+                numero=f"S{i:02d}-{j:03d}",
+                modelo=rng.choice(["Yutong ZK6122", "King Long XMQ6127", "Higer KLQ6129"]),
+                placa=f"LD-{rng.randint(10, 99)}-{rng.randint(10, 99)}-SN",
+                sector=sector,
+            )
+            for i, sector in enumerate(sectores, start=1)
+            for j in range(1, n_autocarros + 1)
+        ])
+        por_sector = {}
+        for autocarro in autocarros:
+            por_sector.setdefault(autocarro.sector_id, []).append(autocarro)
+
+        # ----- por sector e dia ----- #
+        relatorios = gravar(RelatorioSector, [
+            RelatorioSector(
+                sector=sector, data=dia,
+                despesa_geral=_kz(rng, 0, 15000),
+                alimentacao_estaleiro=_kz(rng, 0, 8000),
+            )
+            for sector in sectores
+            for dia in dias
+        ])
+        relatorio_de = {(r.sector_id, r.data): r for r in relatorios}
+
+        gravar(Deposito, [
+            Deposito(sector=sector, data_deposito=dia, valor=_kz(rng, 50000, 400000))
+            for sector in sectores
+            for dia in dias
+            if rng.random() < 0.8
+        ])
+        gravar(Despesa, [
+            Despesa(
+                sector=sector, data=dia, valor=_kz(rng, 2000, 60000),
+                descricao=f"{MARCA} {rng.choice(['Peças', 'Pneus', 'Oficina', 'Limpeza'])}",
+            )
+            for sector in sectores
+            for dia in dias
+            if rng.random() < 0.3
+        ])
+        gravar(DespesaFixa, [
+            DespesaFixa(
+                sector=sector, categoria=categoria, descricao=MARCA,
+                valor=_kz(rng, 100000, 900000), periodicidade="mensal",
+                data_inicio=dias[0].replace(day=1),
+            )
+            for sector in sectores
+            for categoria in ("salario", "internet_tv", "seguro")
+        ])
+
+        categoria, _ = CategoriaDespesa.objects.get_or_create(nome="VARIAVEL")
+        subcategoria, _ = SubCategoriaDespesa.objects.get_or_create(
+            categoria=categoria, nome="Diversos (sintético)"
+        )
+        gravar(Despesa2, [
+            Despesa2(
+                categoria=categoria, subcategoria=subcategoria, data=dia,
+                valor=_kz(rng, 5000, 120000), descricao=MARCA,
+            )
+            for dia in dias
+            if dia.weekday() in (0, 3)
+        ])
+
+        # ----- por autocarro e dia ----- #
+        km = {a.pk: Decimal(rng.randint(80000, 300000)) for a in autocarros}
+        registos, combustiveis, viagens = [], [], []
+        for autocarro in autocarros:
+            for dia in dias:
+                if rng.random() < 0.1:
+                    continue  # dia parado
+                normal, alunos = _kz(rng, 20000, 90000), _kz(rng, 0, 15000)
+                luvu, frete = _kz(rng, 0, 8000), _kz(rng, 0, 20000)
+                km_dia = Decimal(rng.randint(80, 320))
+                km[autocarro.pk] += km_dia
+                registos.append(RegistoDiario(
+                    autocarro=autocarro,
+                    relatorio=relatorio_de[(autocarro.sector_id, dia)],
+                    data=dia,
+                    normal=normal, alunos=alunos, luvu=luvu, frete=frete,
+                    alimentacao=_kz(rng, 1000, 6000),
+                    parqueamento=_kz(rng, 0, 2000),
+                    taxa=_kz(rng, 0, 3000),
+                    taxi=_kz(rng, 0, 2500),
+                    outros=_kz(rng, 0, 4000),
+                    numero_viagens=rng.randint(2, 8),
+                    km_percorridos=km_dia,
+                    validado=rng.random() < 0.7,
+                    concluido=True,
+                ))
+                if rng.random() < 0.45:
+                    litros = Decimal(rng.randint(40, 160))
+                    combustiveis.append(DespesaCombustivel(
+                        sector_id=autocarro.sector_id, autocarro=autocarro, data=dia,
+                        valor=litros * Decimal("300"), valor_litros=litros,
+                        sobragem_filtros=_kz(rng, 0, 3000) if rng.random() < 0.2 else None,
+                        lavagem=_kz(rng, 0, 2500) if rng.random() < 0.3 else None,
+                    ))
+                for _ in range(rng.randint(2, 6)):
+                    viagens.append(CobradorViagem(
+                        autocarro=autocarro, data=dia,
+                        valor=_kz(rng, 2000, 20000), passageiros=rng.randint(5, 70),
+                        status=rng.choice(["pending", "approved", "approved", "rejected"]),
+                    ))
+        gravar(RegistoDiario, registos)
+        gravar(DespesaCombustivel, combustiveis)
+        gravar(CobradorViagem, viagens)
+
+        # ----- leituras de km semanais ----- #
+        leituras = {}
+        for sector in sectores:
+            for dia in dias[::7]:
+                leituras[(sector.pk, dia)] = RegistroKM(sector=sector, data_registo=dia)
+        gravar(RegistroKM, list(leituras.values()))
+        km_ate = {}
+        acumulado = {a.pk: km[a.pk] for a in autocarros}
+        for registo in reversed(registos):
+            km_ate[(registo.autocarro_id, registo.data)] = acumulado[registo.autocarro_id]
+            acumulado[registo.autocarro_id] -= registo.km_percorridos
+        itens = []
+        for (sector_id, dia), leitura in leituras.items():
+            for autocarro in por_sector[sector_id]:
+                valor = km_ate.get((autocarro.pk, dia))
+                if valor is not None:
+                    itens.append(RegistroKMItem(registro=leitura, autocarro=autocarro, km_atual=int(valor)))
+        gravar(RegistroKMItem, itens)
+
+        # ----- manutenções e trocas ----- #
+        manutencoes = []
+        for autocarro in autocarros:
+            for dia in dias[rng.randint(0, 29)::30]:
+                km_ultima = km_ate.get((autocarro.pk, dia), km[autocarro.pk])
+                manutencoes.append(Manutencao(
+                    sector_id=autocarro.sector_id, autocarro=autocarro, data_ultima=dia,
+                    km_ultima=km_ultima, km_proxima=km_ultima + Decimal("4500.00"),
+                    km_prox_oleo_motor=km_ultima + Decimal("7000.00"),
+                    km_prox_oleo_diferencial=km_ultima + Decimal("5000.00"),
+                    km_prox_oleo_cambio=km_ultima + Decimal("10000.00"),
+                    km_prox_filtro_combustivel=km_ultima + Decimal("7000.00"),
+                    km_prox_filtro_oleo=km_ultima + Decimal("7000.00"),
+                    km_prox_filtro_ar=km_ultima + Decimal("7000.00"),
+                    oleo_motor=True, filtro_oleo=True, filtro_ar=rng.random() < 0.5,
+                    custo_total=_kz(rng, 30000, 250000), status="concluida",
+                ))
+        gravar(Manutencao, manutencoes)
+
+        pneus = gravar(Pneu, [
+            Pneu(
+                fornecedor=PREFIXO_SECTOR, marca=rng.choice(["Michelin", "Bridgestone", "Firestone"]),
+                referencia=f"295/80R22.5-{n:05d}", data_compra=dias[0],
+            )
+            for n in range(len(autocarros) * len(Troca.LOCAL_CHOICES))
+        ])
+        baterias = gravar(Bateria, [
+            Bateria(
+                fornecedor=PREFIXO_SECTOR, marca=rng.choice(["Bosch", "Varta"]),
+                referencia=f"12V-180Ah-{n:05d}", data_compra=dias[0],
+            )
+            for n in range(len(autocarros))
+        ])
+        trocas, trocas_bateria = [], []
+        pneus_livres, baterias_livres = iter(pneus), iter(baterias)
+        for autocarro in autocarros:
+            for local, _ in Troca.LOCAL_CHOICES:
+                dia = rng.choice(dias)
+                trocas.append(Troca(
+                    pneu=next(pneus_livres), autocarro=autocarro, local=local, data_troca=dia,
+                    km_troca=km_ate.get((autocarro.pk, dia)),
+                ))
+            dia = rng.choice(dias)
+            trocas_bateria.append(TrocaBateria(
+                bateria=next(baterias_livres), autocarro=autocarro, local="principal",
+                data_troca=dia, km_troca=km_ate.get((autocarro.pk, dia)),
+            ))
+        gravar(Troca, trocas)
+        gravar(TrocaBateria, trocas_bateria)
+
+        return totais
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from autocarros.models import ExportacaoJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Apaga os jobs de exportação (e os ficheiros gerados) com mais de "
+        "--dias dias. Pensado para correr diariamente (cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dias", type=int, default=7)
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(days=options["dias"])
+        antigos = ExportacaoJob.objects.filter(criado_em__lt=limite)
+
+        ficheiros = 0
+        for job in antigos.exclude(ficheiro="").iterator():
+            job.ficheiro.delete(save=False)
+            ficheiros += 1
+
+        apagados, _ = antigos.delete()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Concluído: {apagados} job(s) e {ficheiros} ficheiro(s) apagados."
+            )
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from autocarros.calendario import garantir_mes
+
+
+class Command(BaseCommand):
+    help = (
+        "Cria antecipadamente os dias da dimensão de calendário (DiaCalendario) "
+        "entre --de e --ate (anos, inclusive). Os meses em falta são também "
+        "criados a pedido, por isso correr isto é opcional."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--de", type=int, default=2020)
+        parser.add_argument("--ate", type=int, default=2035)
+
+    def handle(self, *args, **options):
+        if options["de"] > options["ate"]:
+            raise CommandError("--de tem de ser menor ou igual a --ate.")
+
+        for ano in range(options["de"], options["ate"] + 1):
+            for mes in range(1, 13):
+                garantir_mes(ano, mes)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Calendário preenchido de {options['de']} a {options['ate']}."
+            )
+        )
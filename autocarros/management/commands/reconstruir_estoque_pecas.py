@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from autocarros.estoque import acertar_estoque, reconstruir_estoque
+from autocarros.models import EstoqueMensalPeca
+
+
+class Command(BaseCommand):
+    help = (
+        "Recria a tabela EstoqueMensalPeca (quantidade de abertura, entradas "
+        "e saídas por peça e por mês) e o estoque atual de cada peça a partir "
+        "das movimentações. Antes, regista um acerto para cada peça cujo "
+        "estoque registado não bate certo com as movimentações (o estoque que "
+        "era ajustado à mão). O deploy (render.yaml) corre-o com --se-vazia "
+        "depois do migrate; correr após importações/alterações em massa que "
+        "não disparam signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sem-acertos",
+            action="store_true",
+            help="Não regista acertos: o estoque das peças passa a ser só o das movimentações.",
+        )
+        parser.add_argument(
+            "--se-vazia",
+            action="store_true",
+            help=(
+                "Só corre se EstoqueMensalPeca estiver vazia (primeiro deploy): os "
+                "acertos têm de ser registados antes da primeira movimentação."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options["se_vazia"] and EstoqueMensalPeca.objects.exists():
+            self.stdout.write("Estoque mensal das peças já preenchido; nada a fazer.")
+            return
+
+        inicio = time.monotonic()
+
+        with transaction.atomic():
+            if not options["sem_acertos"]:
+                acertos = acertar_estoque()
+                self.stdout.write(f"{acertos} acerto(s) de estoque registado(s).")
+
+            self.stdout.write("A reconstruir o estoque mensal das peças...")
+            criados = reconstruir_estoque()
+
+        duracao = time.monotonic() - inicio
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Concluído: {criados} linha(s) de estoque criada(s) em {duracao:.1f}s."
+            )
+        )
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from autocarros.models import OdometroAutocarro
+from autocarros.odometro import JANELA_DIAS, recalcular_odometros
+
+
+class Command(BaseCommand):
+    help = (
+        "Recria a tabela OdometroAutocarro (última leitura de km, km diários "
+        "desde essa leitura e média de km por dia) e a lista de vencimentos "
+        "de manutenção de todos os autocarros. O deploy (render.yaml) corre-o "
+        "com --se-vazia depois do migrate; correr após importações em massa "
+        "que não disparam signals e "
+        f"uma vez por dia (cron no render.yaml), para a média dos últimos "
+        f"{JANELA_DIAS} dias e os prazos por data acompanharem o calendário."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--se-vazia",
+            action="store_true",
+            help="Só reconstrói se OdometroAutocarro estiver vazia (primeiro deploy).",
+        )
+
+    def handle(self, *args, **options):
+        if options["se_vazia"] and OdometroAutocarro.objects.exists():
+            self.stdout.write("Odómetros já preenchidos; nada a fazer.")
+            return
+
+        inicio = time.monotonic()
+
+        self.stdout.write("A reconstruir os odómetros e os vencimentos dos autocarros...")
+        total = recalcular_odometros()
+
+        duracao = time.monotonic() - inicio
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Concluído: {total} odómetro(s) recalculado(s) em {duracao:.1f}s."
+            )
+        )
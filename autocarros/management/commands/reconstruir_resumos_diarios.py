@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from autocarros.cache_resultados import invalidar_tudo
+from autocarros.models import ResumoDiarioAutocarro
+from autocarros.resumos import reconstruir_resumos
+
+
+class Command(BaseCommand):
+    help = (
+        "Recria a tabela ResumoDiarioAutocarro (registo diário + combustível "
+        "por autocarro e data). O deploy (render.yaml) corre-o com --se-vazia "
+        "depois do migrate; correr após importações/alterações em massa que "
+        "não disparam signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--data-inicio",
+            default=None,
+            help="Reconstruir apenas a partir desta data (AAAA-MM-DD).",
+        )
+        parser.add_argument(
+            "--data-fim",
+            default=None,
+            help="Reconstruir apenas até esta data (AAAA-MM-DD), inclusive.",
+        )
+        parser.add_argument(
+            "--se-vazia",
+            action="store_true",
+            help="Só reconstrói se ResumoDiarioAutocarro estiver vazia (primeiro deploy).",
+        )
+
+    def handle(self, *args, **options):
+        if options["se_vazia"] and ResumoDiarioAutocarro.objects.exists():
+            self.stdout.write("Resumo diário por autocarro já preenchido; nada a fazer.")
+            return
+
+        inicio = time.monotonic()
+
+        datas = {}
+        for opcao in ("data_inicio", "data_fim"):
+            valor = options[opcao]
+            if valor:
+                datas[opcao] = parse_date(valor)
+                if datas[opcao] is None:
+                    raise CommandError(f"Data inválida em --{opcao.replace('_', '-')}: {valor}")
+
+        self.stdout.write("A reconstruir o resumo diário por autocarro...")
+
+        def progresso(criados):
+            self.stdout.write(f"  ... {criados} linha(s) gravada(s)")
+
+        criados = reconstruir_resumos(progresso=progresso, **datas)
+        # a reconstrução não passa pelos signals: resultados em cache caducam
+        invalidar_tudo()
+
+        duracao = time.monotonic() - inicio
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Concluído: {criados} linha(s) de resumo criada(s) em {duracao:.1f}s."
+            )
+        )
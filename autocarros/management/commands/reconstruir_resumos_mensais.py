@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from autocarros.cache_resultados import invalidar_tudo
+from autocarros.models import ResumoMensalSector
+from autocarros.resumos import reconstruir_resumos_mensais
+
+
+class Command(BaseCommand):
+    help = (
+        "Recria a tabela ResumoMensalSector (totais por ano, mês e sector) "
+        "usada pelos painéis financeiros. O deploy (render.yaml) corre-o com "
+        "--se-vazia depois do migrate; correr após importações/alterações em "
+        "massa que não disparam signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--se-vazia",
+            action="store_true",
+            help="Só reconstrói se ResumoMensalSector estiver vazia (primeiro deploy).",
+        )
+
+    def handle(self, *args, **options):
+        if options["se_vazia"] and ResumoMensalSector.objects.exists():
+            self.stdout.write("Resumo mensal por sector já preenchido; nada a fazer.")
+            return
+
+        inicio = time.monotonic()
+
+        self.stdout.write("A reconstruir o resumo mensal por sector...")
+
+        def progresso(origem, celulas):
+            self.stdout.write(f"  ... {origem}: {celulas} célula(s) até agora")
+
+        criados = reconstruir_resumos_mensais(progresso=progresso)
+        # a reconstrução não passa pelos signals: resultados em cache caducam
+        invalidar_tudo()
+
+        duracao = time.monotonic() - inicio
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Concluído: {criados} linha(s) de resumo criada(s) em {duracao:.1f}s."
+            )
+        )
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from autocarros.cache_resultados import invalidar_tudo
+from autocarros.models import SaldoMensalConta
+from autocarros.saldos import reconstruir_saldos
+
+
+class Command(BaseCommand):
+    help = (
+        "Recria a tabela SaldoMensalConta (saldo de abertura, débitos e "
+        "créditos por conta do Plano de Contas e por mês) a partir dos "
+        "movimentos bancários. O deploy (render.yaml) corre-o com --se-vazia "
+        "depois do migrate; correr após importações/alterações em massa que "
+        "não disparam signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--se-vazia",
+            action="store_true",
+            help="Só reconstrói se SaldoMensalConta estiver vazia (primeiro deploy).",
+        )
+
+    def handle(self, *args, **options):
+        if options["se_vazia"] and SaldoMensalConta.objects.exists():
+            self.stdout.write("Saldos mensais das contas já preenchidos; nada a fazer.")
+            return
+
+        inicio = time.monotonic()
+
+        self.stdout.write("A reconstruir os saldos mensais das contas...")
+        criados = reconstruir_saldos()
+        invalidar_tudo()
+
+        duracao = time.monotonic() - inicio
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Concluído: {criados} linha(s) de saldo criada(s) em {duracao:.1f}s."
+            )
+        )
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from autocarros.integridade import DESCRICOES, PROBLEMAS, corrigir, verificar
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifica a integridade dos registos diários: registos arquivados no "
+        "relatório de outro dia, registos sem relatório (órfãos) e relatórios "
+        "sem registos. Com --corrigir liga os mal arquivados e os órfãos ao "
+        "relatório do sector no seu dia (criando-o se faltar) e preenche os "
+        "relatórios vazios, em lotes, refazendo no fim os resumos afetados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--corrigir",
+            action="store_true",
+            help="Aplica as correções (por omissão só mostra os problemas).",
+        )
+        parser.add_argument(
+            "--simular",
+            action="store_true",
+            help="Corre as correções numa transação desfeita no fim: mostra o que seria feito.",
+        )
+        parser.add_argument(
+            "--apenas",
+            choices=PROBLEMAS,
+            action="append",
+            help="Corrige só este problema (pode repetir-se). Por omissão, todos.",
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+
+        self.stdout.write("A verificar a integridade dos registos...")
+        encontrados = verificar()
+        self.stdout.write(f"  registos no relatório de outro dia: {encontrados['mal_arquivados']}")
+        self.stdout.write(f"  registos sem relatório: {encontrados['orfaos']}")
+        self.stdout.write(f"  relatórios sem registos: {encontrados['relatorios_vazios']}")
+
+        if options["corrigir"] or options["simular"]:
+            simular = options["simular"]
+            self.stdout.write("A simular as correções..." if simular else "A corrigir...")
+
+            def progresso(chave, total):
+                self.stdout.write(f"  ... {total} {DESCRICOES[chave]}")
+
+            resultado = corrigir(options["apenas"] or PROBLEMAS, simular=simular, progresso=progresso)
+            for chave, total in resultado.items():
+                if total:
+                    self.stdout.write(f"  {total} {DESCRICOES[chave]}")
+            if simular:
+                self.stdout.write("Simulação: nada foi gravado.")
+
+        duracao = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(f"Concluído em {duracao:.1f}s."))
@@ -1,3 +1,13 @@
+import logging
+import re
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
 class PermissionMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -15,3 +25,149 @@ class PermissionMiddleware:
                 'can_edit': request.user.can_edit(),
                 'can_view_only': request.user.can_view_only(),
             }
+
+
+# ===================== Instrumentação de consultas SQL ===================== #
+logger = logging.getLogger('autocarros.consultas')
+
+_LISTA_IN = re.compile(r'\bIN \((?:%s, )*%s\)')
+_ESPACOS = re.compile(r'\s+')
+
+# vista -> totais acumulados desde o arranque do processo
+_estatisticas = {}
+_estatisticas_lock = threading.Lock()
+
+
+def impressao_digital(sql):
+    """SQL sem diferenças irrelevantes: espaços e tamanho das listas IN (...)."""
+    return _LISTA_IN.sub('IN (...)', _ESPACOS.sub(' ', sql).strip())
+
+
+class _MetricasPedido:
+    """Execute wrapper que mede cada consulta feita durante um pedido."""
+
+    def __init__(self):
+        self.consultas = []  # (duração em ms, sql)
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas.append(((time.perf_counter() - inicio) * 1000, sql))
+
+    @property
+    def total(self):
+        return len(self.consultas)
+
+    @property
+    def tempo_ms(self):
+        return sum(duracao for duracao, _ in self.consultas)
+
+    def mais_lentas(self, n=3):
+        return sorted(self.consultas, key=lambda c: c[0], reverse=True)[:n]
+
+    def repetidas(self):
+        """{impressão digital: vezes} das consultas feitas mais de uma vez (N+1)."""
+        contagem = {}
+        for _, sql in self.consultas:
+            chave = impressao_digital(sql)
+            contagem[chave] = contagem.get(chave, 0) + 1
+        return {sql: vezes for sql, vezes in contagem.items() if vezes > 1}
+
+
+def _nome_vista(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        return match.view_name or match._func_path
+    return request.path
+
+
+def _e_admin(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return False
+    return user.is_superuser or getattr(user, 'nivel_acesso', None) == 'admin'
+
+
+def estatisticas_consultas():
+    """Totais por vista (neste processo) para o endpoint de diagnóstico."""
+    with _estatisticas_lock:
+        return {vista: dict(valores) for vista, valores in sorted(_estatisticas.items())}
+
+
+class MetricasConsultasMiddleware:
+    """
+    Mede as consultas SQL de cada pedido: quantidade, tempo total, as mais
+    lentas e as repetidas (mesma impressão digital — sinal de N+1).
+
+    - Avisa no log `autocarros.consultas` quando a vista passa o orçamento
+      (CONSULTAS_ORCAMENTO[nome da URL] ou CONSULTAS_ORCAMENTO_PADRAO);
+    - regista como lentas as consultas acima de CONSULTAS_LENTA_MS;
+    - com SERVER_TIMING ativo, junta o cabeçalho Server-Timing às
+      respostas dos administradores (visível nas DevTools do browser).
+
+    Respostas em streaming: só conta o que é feito antes do primeiro byte.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'CONSULTAS_METRICAS', True):
+            return self.get_response(request)
+
+        metricas = _MetricasPedido()
+        inicio = time.perf_counter()
+        with ExitStack() as pilha:
+            for conexao in connections.all():
+                pilha.enter_context(conexao.execute_wrapper(metricas))
+            response = self.get_response(request)
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+
+        vista = _nome_vista(request)
+        self._registar(vista, metricas, request)
+
+        if getattr(settings, 'SERVER_TIMING', False) and _e_admin(request):
+            response['Server-Timing'] = (
+                f'db;dur={metricas.tempo_ms:.1f};desc="{metricas.total} consultas", '
+                f'total;dur={duracao_ms:.1f}'
+            )
+        return response
+
+    def _registar(self, vista, metricas, request):
+        orcamento = getattr(settings, 'CONSULTAS_ORCAMENTO', {}).get(
+            vista, getattr(settings, 'CONSULTAS_ORCAMENTO_PADRAO', 50)
+        )
+        acima = metricas.total > orcamento
+
+        with _estatisticas_lock:
+            totais = _estatisticas.setdefault(vista, {
+                'pedidos': 0,
+                'consultas': 0,
+                'tempo_sql_ms': 0.0,
+                'max_consultas': 0,
+                'acima_orcamento': 0,
+            })
+            totais['pedidos'] += 1
+            totais['consultas'] += metricas.total
+            totais['tempo_sql_ms'] = round(totais['tempo_sql_ms'] + metricas.tempo_ms, 1)
+            totais['max_consultas'] = max(totais['max_consultas'], metricas.total)
+            totais['acima_orcamento'] += acima
+
+        if acima:
+            repetidas = sorted(metricas.repetidas().items(), key=lambda r: r[1], reverse=True)
+            logger.warning(
+                "%s %s: %d consultas (orçamento %d), %.1f ms em SQL. Repetidas: %s",
+                request.method,
+                vista,
+                metricas.total,
+                orcamento,
+                metricas.tempo_ms,
+                '; '.join(f'{vezes}x {sql[:200]}' for sql, vezes in repetidas[:3]) or '-',
+            )
+
+        limite_ms = getattr(settings, 'CONSULTAS_LENTA_MS', 200)
+        for duracao, sql in metricas.mais_lentas():
+            if duracao >= limite_ms:
+                logger.warning("%s: consulta lenta (%.1f ms): %s", vista, duracao, sql[:500])
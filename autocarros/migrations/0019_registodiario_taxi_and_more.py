@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0018_registodiario_taxi_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoDiarioAutocarro',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('entradas', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('saidas_registo', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('combustivel', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('combustivel_litros', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('sobragem', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('lavagem', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('saidas', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('saldo', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('autocarro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos_diarios', to='autocarros.autocarro')),
+                ('registo', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='resumo_diario', to='autocarros.registodiario')),
+            ],
+            options={
+                'verbose_name': 'Resumo Diário por Autocarro',
+                'verbose_name_plural': 'Resumos Diários por Autocarro',
+                'ordering': ['-data'],
+                'indexes': [models.Index(fields=['data', 'autocarro'], name='autocarros__data_ec8890_idx')],
+                'unique_together': {('autocarro', 'data')},
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0019_registodiario_taxi_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoMensalSector',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ano', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('num_registos', models.PositiveIntegerField(default=0)),
+                ('normal', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('alunos', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('luvu', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('frete', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('alimentacao', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('parqueamento', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('taxa', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('outros', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('taxi', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('despesa_geral', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('alimentacao_estaleiro', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('combustivel', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('sobragem', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('lavagem', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('despesas_variaveis', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('despesa2', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fixa_salario', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fixa_fundo_maneio', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fixa_subsidio_alimentacao', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fixa_cameras', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fixa_gps', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fixa_internet_tv', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fixa_agua_luz', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fixa_prestacao', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fixa_seguro', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fixa_outro', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('sector', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='resumos_mensais', to='autocarros.sector')),
+            ],
+            options={
+                'verbose_name': 'Resumo Mensal por Sector',
+                'verbose_name_plural': 'Resumos Mensais por Sector',
+                'ordering': ['ano', 'mes'],
+                'unique_together': {('ano', 'mes', 'sector')},
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0020_registodiario_taxi_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deposito',
+            index=models.Index(fields=['sector', 'data_deposito'], name='autocarros__sector__a799fa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deposito',
+            index=models.Index(fields=['data_deposito'], name='autocarros__data_de_56cb13_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='despesa',
+            index=models.Index(fields=['data'], name='autocarros__data_bf187d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='despesa',
+            index=models.Index(fields=['sector', 'data'], name='autocarros__sector__60b312_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='despesa2',
+            index=models.Index(fields=['data'], name='autocarros__data_ef2f17_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='despesacombustivel',
+            index=models.Index(fields=['autocarro', 'data'], name='autocarros__autocar_b34708_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='despesacombustivel',
+            index=models.Index(fields=['sector', 'data'], name='autocarros__sector__e2d0a2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='despesacombustivel',
+            index=models.Index(fields=['data'], name='autocarros__data_f1c3ef_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registodiario',
+            index=models.Index(fields=['data'], name='autocarros__data_781b57_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='relatoriosector',
+            index=models.Index(fields=['data'], name='autocarros__data_4c4330_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0023_versaodados_registodiario_taxi_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiaCalendario',
+            fields=[
+                ('data', models.DateField(primary_key=True, serialize=False)),
+                ('ano', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('semana_mes', models.PositiveSmallIntegerField()),
+                ('ano_iso', models.PositiveSmallIntegerField()),
+                ('semana_iso', models.PositiveSmallIntegerField()),
+                ('dia_semana', models.PositiveSmallIntegerField(help_text='0 = segunda-feira')),
+            ],
+            options={
+                'verbose_name': 'Dia do Calendário',
+                'verbose_name_plural': 'Dias do Calendário',
+                'ordering': ['data'],
+            },
+        ),
+        migrations.AddField(
+            model_name='despesacombustivel',
+            name='calendario',
+            field=models.ForeignObject(blank=True, editable=False, from_fields=['data'], null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', serialize=False, to='autocarros.diacalendario', to_fields=['data']),
+        ),
+        migrations.AddField(
+            model_name='registodiario',
+            name='calendario',
+            field=models.ForeignObject(blank=True, editable=False, from_fields=['data'], null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', serialize=False, to='autocarros.diacalendario', to_fields=['data']),
+        ),
+        migrations.AddField(
+            model_name='relatoriosector',
+            name='calendario',
+            field=models.ForeignObject(blank=True, editable=False, from_fields=['data'], null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', serialize=False, to='autocarros.diacalendario', to_fields=['data']),
+        ),
+    ]
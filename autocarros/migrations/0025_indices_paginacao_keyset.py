@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0024_diacalendario'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='despesa2',
+            index=models.Index(fields=['data', 'criado_em', 'id'], name='autocarros__data_175a19_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacao',
+            index=models.Index(fields=['data', 'criado_em', 'id'], name='autocarros__data_d2103c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentobancario',
+            index=models.Index(fields=['data', 'criado_em', 'id'], name='autocarros__data_076a1f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pneu',
+            index=models.Index(fields=['data_compra', 'criado_em', 'id'], name='autocarros__data_co_d73417_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='troca',
+            index=models.Index(fields=['data_troca', 'criado_em', 'id'], name='autocarros__data_tr_5ff8ef_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trocabateria',
+            index=models.Index(fields=['data_troca', 'criado_em', 'id'], name='autocarros__data_tr_25f28e_idx'),
+        ),
+    ]
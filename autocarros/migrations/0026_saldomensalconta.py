@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0025_indices_paginacao_keyset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoMensalConta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.PositiveIntegerField(help_text='AAAAMM')),
+                ('saldo_abertura', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('debitos', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('creditos', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+            options={
+                'verbose_name': 'Saldo Mensal de Conta',
+                'verbose_name_plural': 'Saldos Mensais de Contas',
+                'ordering': ['conta', 'periodo'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='movimentobancario',
+            index=models.Index(fields=['pgc', 'data'], name='autocarros__pgc_id_d6c987_idx'),
+        ),
+        migrations.AddField(
+            model_name='saldomensalconta',
+            name='conta',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_mensais', to='autocarros.planocontas'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='saldomensalconta',
+            unique_together={('conta', 'periodo')},
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0026_saldomensalconta'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='manutencao',
+            index=models.Index(fields=['autocarro', 'data_ultima'], name='autocarros__autocar_6b32b3_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0027_indice_manutencao_autocarro_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OdometroAutocarro',
+            fields=[
+                ('autocarro', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='odometro', serialize=False, to='autocarros.autocarro')),
+                ('km_leitura', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('data_leitura', models.DateField(blank=True, null=True)),
+                ('origem', models.CharField(blank=True, choices=[('registo_km', 'Registo de km'), ('manutencao', 'Manutenção'), ('troca_pneu', 'Troca de pneu'), ('troca_bateria', 'Troca de bateria')], max_length=20)),
+                ('km_desde_leitura', models.DecimalField(decimal_places=2, default=0, help_text='Soma dos km_percorridos dos registos diários depois da leitura', max_digits=14)),
+                ('media_km_dia', models.DecimalField(decimal_places=2, default=0, help_text='Média de km por dia na janela móvel (ver odometro.JANELA_DIAS)', max_digits=10)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Odómetro de Autocarro',
+                'verbose_name_plural': 'Odómetros dos Autocarros',
+            },
+        ),
+    ]
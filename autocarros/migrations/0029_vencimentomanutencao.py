@@ -0,0 +1,56 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0028_odometroautocarro'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VencimentoManutencao',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('componente', models.CharField(choices=[('revisao', 'Revisão geral'), ('oleo_motor', 'Óleo do motor'), ('oleo_diferencial', 'Óleo do diferencial'), ('oleo_cambio', 'Óleo do câmbio'), ('filtro_combustivel', 'Filtro de combustível'), ('filtro_oleo', 'Filtro de óleo'), ('filtro_ar', 'Filtro de ar'), ('pneu', 'Pneu'), ('bateria', 'Bateria')], max_length=20)),
+                ('posicao', models.CharField(blank=True, help_text='Posição do pneu ou da bateria', max_length=20)),
+                ('km_previsto', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('km_em_falta', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('data_prevista', models.DateField(blank=True, help_text='Prazo por data (pneus e baterias)', null=True)),
+                ('data_estimada', models.DateField(blank=True, help_text='Data em que chega ao km previsto, pela média diária', null=True)),
+                ('data_limite', models.DateField(blank=True, help_text='A mais próxima das duas datas', null=True)),
+                ('estado', models.CharField(choices=[('atrasado', 'Atrasado'), ('proximo', 'Próximo'), ('em_dia', 'Em dia'), ('sem_dados', 'Sem dados')], max_length=10)),
+                ('prioridade', models.PositiveSmallIntegerField(default=0, help_text='0 = atrasado … 3 = sem dados')),
+                ('calculado_em', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Vencimento de Manutenção',
+                'verbose_name_plural': 'Vencimentos de Manutenção',
+                'ordering': ['prioridade', 'data_limite', 'km_em_falta'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='troca',
+            index=models.Index(fields=['autocarro', 'local', 'data_troca'], name='autocarros__autocar_d6a860_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trocabateria',
+            index=models.Index(fields=['autocarro', 'local', 'data_troca'], name='autocarros__autocar_77462b_idx'),
+        ),
+        migrations.AddField(
+            model_name='vencimentomanutencao',
+            name='autocarro',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vencimentos', to='autocarros.autocarro'),
+        ),
+        migrations.AddIndex(
+            model_name='vencimentomanutencao',
+            index=models.Index(fields=['prioridade', 'data_limite'], name='autocarros__priorid_d02a00_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='vencimentomanutencao',
+            unique_together={('autocarro', 'componente', 'posicao')},
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:20
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0029_vencimentomanutencao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstoqueMensalPeca',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.PositiveIntegerField(help_text='AAAAMM')),
+                ('quantidade_abertura', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('entradas', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('saidas', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Estoque Mensal de Peça',
+                'verbose_name_plural': 'Estoques Mensais de Peças',
+                'ordering': ['peca', 'periodo'],
+            },
+        ),
+        migrations.AddField(
+            model_name='peca',
+            name='estoque_minimo',
+            field=models.DecimalField(decimal_places=2, default=Decimal('5.00'), help_text='Ponto de encomenda: com esta quantidade ou menos a peça aparece como estoque baixo', max_digits=12),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacao',
+            index=models.Index(fields=['peca', 'data'], name='autocarros__peca_id_2ca59d_idx'),
+        ),
+        migrations.AddField(
+            model_name='estoquemensalpeca',
+            name='peca',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estoque_mensal', to='autocarros.peca'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='estoquemensalpeca',
+            unique_together={('peca', 'periodo')},
+        ),
+    ]
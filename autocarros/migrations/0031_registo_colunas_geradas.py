@@ -0,0 +1,81 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:30
+
+import django.db.models.expressions
+import django.db.models.functions.comparison
+import django.db.models.functions.math
+from django.db import migrations, models
+
+
+# Colunas que existem nas bases em produção mas nunca entraram nas migrações
+COLUNAS_FORA_DAS_MIGRACOES = [
+    ('registodiario', 'taxi'),
+    ('relatoriosector', 'alimentacao_estaleiro'),
+]
+
+
+def criar_colunas_em_falta(apps, schema_editor):
+    """Numa base criada de raiz estas colunas não existem: são criadas aqui."""
+    conexao = schema_editor.connection
+    for nome_modelo, nome_campo in COLUNAS_FORA_DAS_MIGRACOES:
+        modelo = apps.get_model('autocarros', nome_modelo)
+        campo = modelo._meta.get_field(nome_campo)
+        with conexao.cursor() as cursor:
+            colunas = {
+                coluna.name
+                for coluna in conexao.introspection.get_table_description(cursor, modelo._meta.db_table)
+            }
+        if campo.column not in colunas:
+            schema_editor.add_field(modelo, campo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0030_livro_estoque_pecas'),
+    ]
+
+    operations = [
+        # taxi e alimentacao_estaleiro entram no estado das migrações (a
+        # expressão de saidas precisa de taxi) e a coluna só é criada na base
+        # se ainda não existir
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='registodiario',
+                    name='taxi',
+                    field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                migrations.AddField(
+                    model_name='relatoriosector',
+                    name='alimentacao_estaleiro',
+                    field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Despesa com alimentação do estaleiro'),
+                ),
+            ],
+        ),
+        migrations.RunPython(criar_colunas_em_falta, migrations.RunPython.noop),
+        # um campo normal não pode passar a gerado: sai e volta a entrar
+        migrations.RemoveField(
+            model_name='registodiario',
+            name='numero_passageiros',
+        ),
+        migrations.AddField(
+            model_name='registodiario',
+            name='entradas',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('normal'), '+', models.F('alunos')), '+', models.F('luvu')), '+', models.F('frete')), output_field=models.DecimalField(decimal_places=2, max_digits=12)),
+        ),
+        migrations.AddField(
+            model_name='registodiario',
+            name='saidas',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('alimentacao'), '+', models.F('parqueamento')), '+', models.F('taxa')), '+', models.F('outros')), '+', models.F('taxi')), output_field=models.DecimalField(decimal_places=2, max_digits=12)),
+        ),
+        migrations.AddField(
+            model_name='registodiario',
+            name='saldo',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('normal'), '+', models.F('alunos')), '+', models.F('luvu')), '+', models.F('frete')), '-', django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('alimentacao'), '+', models.F('parqueamento')), '+', models.F('taxa')), '+', models.F('outros')), '+', models.F('taxi'))), output_field=models.DecimalField(decimal_places=2, max_digits=13)),
+        ),
+        migrations.AddField(
+            model_name='registodiario',
+            name='numero_passageiros',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.comparison.Cast(django.db.models.functions.math.Floor(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.Value(5), '*', django.db.models.expressions.CombinedExpression(models.F('normal'), '+', models.F('alunos'))), '+', models.F('luvu')), '+', models.F('frete')), '/', models.Value(1000))), models.IntegerField()), output_field=models.IntegerField()),
+        ),
+    ]
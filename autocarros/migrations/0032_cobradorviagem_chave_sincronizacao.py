@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autocarros', '0031_registo_colunas_geradas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cobradorviagem',
+            name='chave_sincronizacao',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='cobradorviagem',
+            unique_together={('cobrador', 'chave_sincronizacao')},
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
 from django.core.exceptions import ValidationError
+from django.db.models import F, Value
+from django.db.models.functions import Cast, Floor
 from django.utils import timezone
 from django.utils.text import slugify
 from decimal import Decimal
@@ -148,9 +150,18 @@ class RelatorioSector(models.Model):
         verbose_name="Despesa com alimentação do estaleiro"
     )
 
+    # junção com a dimensão de calendário pela data (sem coluna própria)
+    calendario = models.ForeignObject(
+        'DiaCalendario', on_delete=models.DO_NOTHING, from_fields=['data'], to_fields=['data'],
+        related_name='+', null=True, blank=True, editable=False, serialize=False,
+    )
+
     class Meta:
         unique_together = ['sector', 'data']  # 🔹 IMPEDE MÚLTIPLOS RELATÓRIOS POR DIA
         ordering = ['-data']
+        indexes = [
+            models.Index(fields=['data']),
+        ]
 
     def clean(self):
         """Validação para evitar relatórios duplicados"""
@@ -179,20 +190,25 @@ class ComprovativoRelatorio(models.Model):
 
 
 # <----- Modelo de registo diário de viagens por autocarro -----> #
-class RegistoDiario(models.Model):
-    def save(self, *args, **kwargs):
-        try:
-            normal = Decimal(self.normal or 0)
-            alunos = Decimal(self.alunos or 0)
-            luvu = Decimal(self.luvu or 0)
-            frete = Decimal(self.frete or 0)
-            passageiros = ( (normal + alunos) / Decimal('200') ) + ( (luvu + frete) / Decimal('1000') )
-            # usar int() (truncar) para manter comportamento semelhante ao Math.floor
-            self.numero_passageiros = int(passageiros)
-        except Exception:
-            self.numero_passageiros = 0
-        super().save(*args, **kwargs)
+# Definições únicas das colunas calculadas de RegistoDiario (o PostgreSQL
+# não deixa uma coluna gerada usar outra, por isso o saldo repete as somas).
+def _entradas_registo():
+    return F('normal') + F('alunos') + F('luvu') + F('frete')
+
+
+def _saidas_registo():
+    return F('alimentacao') + F('parqueamento') + F('taxa') + F('outros') + F('taxi')
 
+
+def _passageiros_registo():
+    # bilhete normal/alunos a 200 Kz, luvu/frete a 1000 Kz: (5 × (normal + alunos) + luvu + frete) / 1000, truncado
+    return Cast(
+        Floor((Value(5) * (F('normal') + F('alunos')) + F('luvu') + F('frete')) / Value(1000)),
+        models.IntegerField(),
+    )
+
+
+class RegistoDiario(models.Model):
     autocarro = models.ForeignKey('Autocarro', on_delete=models.CASCADE, related_name='registos_diarios')
     relatorio = models.ForeignKey('RelatorioSector', on_delete=models.CASCADE, related_name='registos', null=True, blank=True)
     data = models.DateField(default=timezone.now, verbose_name="Data")
@@ -216,7 +232,27 @@ class RegistoDiario(models.Model):
     outros = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
 
-    numero_passageiros = models.PositiveIntegerField(default=0)
+    # colunas geradas pela base de dados (guardadas): somar sempre estas
+    entradas = models.GeneratedField(
+        expression=_entradas_registo(),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        db_persist=True,
+    )
+    saidas = models.GeneratedField(
+        expression=_saidas_registo(),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        db_persist=True,
+    )
+    saldo = models.GeneratedField(
+        expression=_entradas_registo() - _saidas_registo(),
+        output_field=models.DecimalField(max_digits=13, decimal_places=2),
+        db_persist=True,
+    )
+    numero_passageiros = models.GeneratedField(
+        expression=_passageiros_registo(),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
     numero_viagens = models.PositiveIntegerField(default=0)
     km_percorridos = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     
@@ -224,10 +260,22 @@ class RegistoDiario(models.Model):
     cobrador_principal = models.CharField(max_length=100, blank=True, default="N/A")
     cobrador_auxiliar = models.CharField(max_length=100, blank=True, default="N/A")
 
+    # junção com a dimensão de calendário pela data (sem coluna própria)
+    calendario = models.ForeignObject(
+        'DiaCalendario', on_delete=models.DO_NOTHING, from_fields=['data'], to_fields=['data'],
+        related_name='+', null=True, blank=True, editable=False, serialize=False,
+    )
+
     class Meta:
         unique_together = ['autocarro', 'data']
         verbose_name_plural = "Registos Diários"
+        indexes = [
+            # filtros só por período (todos os autocarros)
+            models.Index(fields=['data']),
+        ]
 
+    # Os métodos abaixo dão o mesmo que as colunas geradas, mas a partir dos
+    # valores em memória (as colunas só são atualizadas ao ler da base de dados).
     def entradas_total(self):
         return self.normal + self.alunos + self.luvu + self.frete
 
@@ -272,6 +320,12 @@ class Despesa(models.Model):
     numero_transacao = models.CharField(max_length=50, blank=True, null=True)
     numero_requisicao = models.CharField(max_length=50, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['data']),
+            models.Index(fields=['sector', 'data']),
+        ]
+
     def __str__(self):
         return f"{self.descricao} - {self.valor}"
 
@@ -288,6 +342,19 @@ class DespesaCombustivel(models.Model):
     sobragem_filtros = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     lavagem = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
+    # junção com a dimensão de calendário pela data (sem coluna própria)
+    calendario = models.ForeignObject(
+        'DiaCalendario', on_delete=models.DO_NOTHING, from_fields=['data'], to_fields=['data'],
+        related_name='+', null=True, blank=True, editable=False, serialize=False,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['autocarro', 'data']),
+            models.Index(fields=['sector', 'data']),
+            models.Index(fields=['data']),
+        ]
+
     @property
     def litros(self):
         if self.valor_litros and self.valor_litros > 0:
@@ -298,6 +365,165 @@ class DespesaCombustivel(models.Model):
         return f"Combustível {self.autocarro.numero} - {self.valor}Kz"
 
 
+# <----- Resumo diário por autocarro (registo + combustível) -----> #
+class ResumoDiarioAutocarro(models.Model):
+    """
+    Tabela desnormalizada com uma linha por (autocarro, data), que junta o
+    RegistoDiario e as DespesaCombustivel desse dia. É mantida pelos signals
+    (ver signals.py) e pode ser recriada com
+    `python manage.py reconstruir_resumos_diarios`.
+    """
+    autocarro = models.ForeignKey(Autocarro, on_delete=models.CASCADE, related_name='resumos_diarios')
+    data = models.DateField()
+    registo = models.OneToOneField(
+        RegistoDiario, on_delete=models.SET_NULL, null=True, blank=True, related_name='resumo_diario'
+    )
+
+    entradas = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # saídas do próprio registo (alimentação, parqueamento, taxa, outros, táxi)
+    saidas_registo = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    combustivel = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    combustivel_litros = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    sobragem = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    lavagem = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # saídas do registo + combustível + sobragem + lavagem
+    saidas = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    saldo = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['autocarro', 'data']
+        ordering = ['-data']
+        indexes = [
+            models.Index(fields=['data', 'autocarro']),
+        ]
+        verbose_name = "Resumo Diário por Autocarro"
+        verbose_name_plural = "Resumos Diários por Autocarro"
+
+    def __str__(self):
+        return f"{self.autocarro.numero} - {self.data}"
+
+    @property
+    def preco_litro(self):
+        if self.combustivel_litros:
+            return self.combustivel / self.combustivel_litros
+        return None
+
+
+# <----- Resumo mensal por sector (cubo ano/mês/sector) -----> #
+class ResumoMensalSector(models.Model):
+    """
+    Totais de cada categoria de receita e despesa por (ano, mês, sector),
+    usados pelos painéis financeiros. Sector vazio = despesas sem sector
+    (ex.: Despesa2). Mantido pelos signals e recriável com
+    `python manage.py reconstruir_resumos_mensais`.
+    """
+    ano = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    sector = models.ForeignKey(Sector, on_delete=models.CASCADE, null=True, blank=True, related_name='resumos_mensais')
+
+    num_registos = models.PositiveIntegerField(default=0)
+
+    # Entradas (RegistoDiario)
+    normal = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    alunos = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    luvu = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    frete = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    # Saídas (RegistoDiario)
+    alimentacao = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    parqueamento = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    taxa = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    outros = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    taxi = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    # RelatorioSector
+    despesa_geral = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    alimentacao_estaleiro = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    # DespesaCombustivel
+    combustivel = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sobragem = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    lavagem = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    # Despesa e Despesa2
+    despesas_variaveis = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    despesa2 = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    # DespesaFixa ativas, pelo mês de data_inicio (uma coluna por categoria)
+    fixa_salario = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fixa_fundo_maneio = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fixa_subsidio_alimentacao = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fixa_cameras = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fixa_gps = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fixa_internet_tv = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fixa_agua_luz = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fixa_prestacao = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fixa_seguro = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fixa_outro = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['ano', 'mes', 'sector']
+        ordering = ['ano', 'mes']
+        verbose_name = "Resumo Mensal por Sector"
+        verbose_name_plural = "Resumos Mensais por Sector"
+
+    def __str__(self):
+        sector = self.sector.nome if self.sector_id else "Geral"
+        return f"{self.mes:02d}/{self.ano} - {sector}"
+
+
+# <----- Versões dos dados por período (invalidação da cache de resultados) -----> #
+class VersaoDados(models.Model):
+    """
+    Contador por mês (periodo = AAAAMM) incrementado sempre que dados desse
+    mês mudam; periodo 0 é o contador geral (despesas fixas, autocarros,
+    sectores e reconstruções em massa). As chaves da cache de resultados
+    incluem a soma dos contadores do período pedido.
+    """
+    GERAL = 0
+
+    periodo = models.PositiveIntegerField(unique=True)
+    versao = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Versão dos Dados"
+        verbose_name_plural = "Versões dos Dados"
+
+    def __str__(self):
+        if self.periodo == self.GERAL:
+            return f"Geral - v{self.versao}"
+        return f"{self.periodo % 100:02d}/{self.periodo // 100} - v{self.versao}"
+
+
+# <----- Dimensão de calendário (um dia por linha) -----> #
+class DiaCalendario(models.Model):
+    """
+    Atributos de calendário de cada dia, para agrupar por semana no SQL.
+    `semana_mes` é a coluna (1 a 4) do mapa financeiro, com a regra da
+    primeira semana curta de periodos.semana_do_mes_4colunas. As linhas
+    são criadas a pedido por calendario.garantir_mes().
+    """
+    data = models.DateField(primary_key=True)
+    ano = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    semana_mes = models.PositiveSmallIntegerField()
+    ano_iso = models.PositiveSmallIntegerField()
+    semana_iso = models.PositiveSmallIntegerField()
+    dia_semana = models.PositiveSmallIntegerField(help_text="0 = segunda-feira")
+
+    class Meta:
+        ordering = ['data']
+        verbose_name = "Dia do Calendário"
+        verbose_name_plural = "Dias do Calendário"
+
+    def __str__(self):
+        return f"{self.data:%d/%m/%Y} - semana {self.semana_mes}"
+
+
 class DespesaFixa(models.Model):
     CATEGORIAS = [
         ('salario', 'Salários'),
@@ -356,6 +582,10 @@ class Deposito(models.Model):
 
     class Meta:
         ordering = ['-data_deposito', '-criado_em']
+        indexes = [
+            models.Index(fields=['sector', 'data_deposito']),
+            models.Index(fields=['data_deposito']),
+        ]
 
     def __str__(self):
         return f"Depósito {self.sector.nome} {self.data_deposito} — {self.valor}"
@@ -377,6 +607,8 @@ class CobradorViagem(models.Model):
     passageiros = models.PositiveIntegerField(default=0)
     observacao = models.TextField(blank=True)
     criado_em = models.DateTimeField(auto_now_add=True)
+    # chave gerada no telemóvel do cobrador: reenviar a mesma viagem não a duplica
+    chave_sincronizacao = models.CharField(max_length=64, null=True, blank=True, editable=False)
 
     # Validação / auditoria
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -387,6 +619,7 @@ class CobradorViagem(models.Model):
 
     class Meta:
         ordering = ['-data', '-hora', '-criado_em']
+        unique_together = ['cobrador', 'chave_sincronizacao']
 
     def __str__(self):
         return f"Viagem {self.autocarro} {self.data} {self.hora} — {self.valor}"
@@ -480,6 +713,10 @@ class Manutencao(models.Model):
 
     class Meta:
         ordering = ['-data_ultima', '-criado_em']
+        indexes = [
+            # manutenção mais recente por autocarro (registo de km)
+            models.Index(fields=['autocarro', 'data_ultima']),
+        ]
 
     def __str__(self):
         return f"Manut. {self.autocarro.numero} {self.data_ultima} — {self.get_status_display()}"
@@ -519,6 +756,10 @@ class Pneu(models.Model):
 
     class Meta:
         ordering = ['-data_compra', '-criado_em']
+        indexes = [
+            # paginação por chave (paginacao.py)
+            models.Index(fields=['data_compra', 'criado_em', 'id']),
+        ]
         verbose_name = 'Pneu'
         verbose_name_plural = 'Pneus'
 
@@ -528,10 +769,42 @@ class Pneu(models.Model):
 from decimal import Decimal
 
 from dateutil.relativedelta import relativedelta
-from django.db import models
+from django.db import connections, models
+from django.db.models import Window
+from django.db.models.functions import RowNumber
 from django.utils import timezone
 
 
+class TrocaQuerySet(models.QuerySet):
+    """Consultas comuns a Troca (pneus) e TrocaBateria."""
+
+    ORDEM_RECENTE = ('-data_troca', '-criado_em', '-pk')
+
+    def instaladas(self):
+        """
+        A troca mais recente de cada (autocarro, local) — o pneu ou a
+        bateria que está montado agora em cada posição. Em PostgreSQL usa
+        DISTINCT ON; nas outras bases numera as trocas de cada posição com
+        ROW_NUMBER() e fica com a primeira. Os filtros aplicados antes
+        escolhem as trocas candidatas; os aplicados depois filtram o
+        resultado (ex.: a referência do que está instalado).
+        """
+        if connections[self.db].vendor == 'postgresql':
+            ultimas = (
+                self.order_by('autocarro_id', 'local', *self.ORDEM_RECENTE)
+                .distinct('autocarro_id', 'local')
+            )
+        else:
+            ultimas = self.annotate(
+                _ordem_local=Window(
+                    RowNumber(),
+                    partition_by=[F('autocarro_id'), F('local')],
+                    order_by=[F(campo[1:]).desc() for campo in self.ORDEM_RECENTE],
+                )
+            ).filter(_ordem_local=1)
+        return self.model._default_manager.filter(pk__in=ultimas.values('pk'))
+
+
 class Troca(models.Model):
     LOCAL_CHOICES = [
         ('dianteira_e', 'Dianteira-E'),
@@ -566,11 +839,19 @@ class Troca(models.Model):
     criado_em = models.DateTimeField(auto_now_add=True)
     atualizado_em = models.DateTimeField(auto_now=True)
 
+    objects = TrocaQuerySet.as_manager()
+
     KM_PREVISAO = Decimal('60000.00')
     MESES_PREVISAO = 10
 
     class Meta:
         ordering = ['-data_troca', '-criado_em']
+        indexes = [
+            # paginação por chave (paginacao.py)
+            models.Index(fields=['data_troca', 'criado_em', 'id']),
+            # última troca de cada posição de cada autocarro
+            models.Index(fields=['autocarro', 'local', 'data_troca']),
+        ]
         verbose_name = 'Troca de Pneu'
         verbose_name_plural = 'Trocas de Pneus'
 
@@ -584,6 +865,15 @@ class Troca(models.Model):
             return None
         return self.km_troca + self.KM_PREVISAO
 
+    @property
+    def km_em_falta(self):
+        """Km até à próxima troca pelo odómetro atual do autocarro (negativo se já passou)."""
+        previsto = self.km_previsto_proxima_troca
+        odometro = getattr(self.autocarro, 'odometro', None)
+        if previsto is None or odometro is None or odometro.km_atual is None:
+            return None
+        return previsto - odometro.km_atual
+
     @property
     def data_prevista_proxima_troca(self):
         """Data prevista para a próxima troca (data_troca + 10 meses)."""
@@ -623,17 +913,19 @@ class Peca(models.Model):
     unidade_medida = models.CharField(max_length=5, choices=UNIDADE_CHOICES, default='un')
     preco_unitario = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
 
-    # Estoque MANUAL: quem edita a peça ajusta esse valor diretamente.
-    # As Movimentações abaixo servem como registo/histórico, não recalculam este campo sozinhas.
+    # Estoque atual = entradas − saídas das Movimentações. Mantido pelos
+    # signals (ver estoque.py); só é escrito à mão como estoque inicial da peça.
     quantidade_estoque = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    estoque_minimo = models.DecimalField(
+        max_digits=12, decimal_places=2, default=Decimal('5.00'),
+        help_text='Ponto de encomenda: com esta quantidade ou menos a peça aparece como estoque baixo'
+    )
 
     observacao = models.TextField(blank=True, null=True)
 
     criado_em = models.DateTimeField(auto_now_add=True)
     atualizado_em = models.DateTimeField(auto_now=True)
 
-    LIMITE_ESTOQUE_BAIXO = Decimal('5.00')
-
     class Meta:
         ordering = ['nome']
         verbose_name = 'Peça'
@@ -644,7 +936,13 @@ class Peca(models.Model):
 
     @property
     def estoque_baixo(self):
-        return self.quantidade_estoque <= self.LIMITE_ESTOQUE_BAIXO
+        return self.quantidade_estoque <= self.estoque_minimo
+
+    @property
+    def valor_estoque(self):
+        if self.preco_unitario is None:
+            return None
+        return self.quantidade_estoque * self.preco_unitario
 
 
 class Movimentacao(models.Model):
@@ -679,12 +977,46 @@ class Movimentacao(models.Model):
 
     class Meta:
         ordering = ['-data', '-criado_em']
+        indexes = [
+            # paginação por chave (paginacao.py)
+            models.Index(fields=['data', 'criado_em', 'id']),
+            # livro de estoque de cada peça (estoque.py)
+            models.Index(fields=['peca', 'data']),
+        ]
         verbose_name = 'Movimentação de Peça'
         verbose_name_plural = 'Movimentações de Peças'
 
     def __str__(self):
         return f'{self.get_tipo_display()} — {self.peca.nome} ({self.quantidade})'
 
+
+class EstoqueMensalPeca(models.Model):
+    """
+    Estoque de uma peça num mês com movimentações: quantidade de abertura
+    (tudo o que entrou menos tudo o que saiu antes do mês) e as entradas e
+    saídas do mês. O estoque numa data é o fecho do mês anterior mais as
+    movimentações do mês até essa data. Mantido pelos signals (ver
+    estoque.py) e recriável com `python manage.py reconstruir_estoque_pecas`.
+    """
+    peca = models.ForeignKey(Peca, on_delete=models.CASCADE, related_name='estoque_mensal')
+    periodo = models.PositiveIntegerField(help_text="AAAAMM")
+    quantidade_abertura = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    entradas = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    saidas = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ['peca', 'periodo']
+        ordering = ['peca', 'periodo']
+        verbose_name = 'Estoque Mensal de Peça'
+        verbose_name_plural = 'Estoques Mensais de Peças'
+
+    @property
+    def quantidade_fecho(self):
+        return self.quantidade_abertura + self.entradas - self.saidas
+
+    def __str__(self):
+        return f'{self.peca.nome} — {self.periodo % 100:02d}/{self.periodo // 100}'
+
 # _______________________ BATERIAS __________________________
 from decimal import Decimal
 
@@ -740,12 +1072,20 @@ class TrocaBateria(models.Model):
     criado_em = models.DateTimeField(auto_now_add=True)
     atualizado_em = models.DateTimeField(auto_now=True)
 
+    objects = TrocaQuerySet.as_manager()
+
     # Mesmos critérios usados nos pneus — ajuste aqui se a periodicidade de bateria for diferente.
     KM_PREVISAO = Decimal('60000.00')
     MESES_PREVISAO = 10
 
     class Meta:
         ordering = ['-data_troca', '-criado_em']
+        indexes = [
+            # paginação por chave (paginacao.py)
+            models.Index(fields=['data_troca', 'criado_em', 'id']),
+            # última troca de cada posição de cada autocarro
+            models.Index(fields=['autocarro', 'local', 'data_troca']),
+        ]
         verbose_name = 'Troca de Bateria'
         verbose_name_plural = 'Trocas de Baterias'
 
@@ -758,6 +1098,15 @@ class TrocaBateria(models.Model):
             return None
         return self.km_troca + self.KM_PREVISAO
 
+    @property
+    def km_em_falta(self):
+        """Km até à próxima troca pelo odómetro atual do autocarro (negativo se já passou)."""
+        previsto = self.km_previsto_proxima_troca
+        odometro = getattr(self.autocarro, 'odometro', None)
+        if previsto is None or odometro is None or odometro.km_atual is None:
+            return None
+        return previsto - odometro.km_atual
+
     @property
     def data_prevista_proxima_troca(self):
         if not self.data_troca:
@@ -772,6 +1121,122 @@ class TrocaBateria(models.Model):
         return timezone.now().date() >= prevista
 
 
+# <----- Odómetro atual de cada autocarro -----> #
+class OdometroAutocarro(models.Model):
+    """
+    Km atual de cada autocarro num só sítio: a leitura absoluta mais recente
+    (registo de km, manutenção, troca de pneu ou de bateria), mais os km
+    diários registados depois dela, e a média de km por dia nos últimos
+    dias. Mantido pelos signals (ver odometro.py) e recriável com
+    `python manage.py reconstruir_odometros`.
+    """
+    ORIGEM_CHOICES = [
+        ('registo_km', 'Registo de km'),
+        ('manutencao', 'Manutenção'),
+        ('troca_pneu', 'Troca de pneu'),
+        ('troca_bateria', 'Troca de bateria'),
+    ]
+
+    autocarro = models.OneToOneField(
+        'Autocarro', on_delete=models.CASCADE, primary_key=True, related_name='odometro'
+    )
+    km_leitura = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    data_leitura = models.DateField(null=True, blank=True)
+    origem = models.CharField(max_length=20, choices=ORIGEM_CHOICES, blank=True)
+    km_desde_leitura = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0,
+        help_text='Soma dos km_percorridos dos registos diários depois da leitura'
+    )
+    media_km_dia = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0,
+        help_text='Média de km por dia na janela móvel (ver odometro.JANELA_DIAS)'
+    )
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Odómetro de Autocarro'
+        verbose_name_plural = 'Odómetros dos Autocarros'
+
+    def __str__(self):
+        return f'{self.autocarro_id} — {self.km_atual} km'
+
+    @property
+    def km_atual(self):
+        """Km estimado hoje; None se o autocarro ainda não tem nenhuma leitura."""
+        if self.km_leitura is None:
+            return None
+        return self.km_leitura + self.km_desde_leitura
+
+    def dias_ate_km(self, km):
+        """Dias previstos até o autocarro chegar a `km`, pela média diária (None se não der)."""
+        atual = self.km_atual
+        if atual is None or km is None or not self.media_km_dia:
+            return None
+        return max(0, int((Decimal(km) - atual) / self.media_km_dia))
+
+
+class VencimentoManutencao(models.Model):
+    """
+    Lista de vencimentos da frota: para cada autocarro, cada componente
+    (revisão, óleos e filtros da última manutenção, pneu e bateria de cada
+    posição) com o km e a data em que vence, já projetados pela média de
+    km por dia do odómetro. Recalculada em bloco por vencimentos.py sempre
+    que o odómetro muda e pelo comando `reconstruir_odometros` (cron diário
+    no render.yaml). `estado` é o do dia do recálculo; a lista usa o do dia
+    (vencimentos.com_estado_do_dia).
+    """
+    ATRASADO = 'atrasado'
+    PROXIMO = 'proximo'
+    EM_DIA = 'em_dia'
+    SEM_DADOS = 'sem_dados'
+    ESTADO_CHOICES = [
+        (ATRASADO, 'Atrasado'),
+        (PROXIMO, 'Próximo'),
+        (EM_DIA, 'Em dia'),
+        (SEM_DADOS, 'Sem dados'),
+    ]
+
+    COMPONENTE_CHOICES = [
+        ('revisao', 'Revisão geral'),
+        ('oleo_motor', 'Óleo do motor'),
+        ('oleo_diferencial', 'Óleo do diferencial'),
+        ('oleo_cambio', 'Óleo do câmbio'),
+        ('filtro_combustivel', 'Filtro de combustível'),
+        ('filtro_oleo', 'Filtro de óleo'),
+        ('filtro_ar', 'Filtro de ar'),
+        ('pneu', 'Pneu'),
+        ('bateria', 'Bateria'),
+    ]
+
+    autocarro = models.ForeignKey('Autocarro', on_delete=models.CASCADE, related_name='vencimentos')
+    componente = models.CharField(max_length=20, choices=COMPONENTE_CHOICES)
+    posicao = models.CharField(max_length=20, blank=True, help_text='Posição do pneu ou da bateria')
+    km_previsto = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    km_em_falta = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    data_prevista = models.DateField(null=True, blank=True, help_text='Prazo por data (pneus e baterias)')
+    data_estimada = models.DateField(null=True, blank=True, help_text='Data em que chega ao km previsto, pela média diária')
+    data_limite = models.DateField(null=True, blank=True, help_text='A mais próxima das duas datas')
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES)
+    prioridade = models.PositiveSmallIntegerField(default=0, help_text='0 = atrasado … 3 = sem dados')
+    calculado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['autocarro', 'componente', 'posicao']
+        ordering = ['prioridade', 'data_limite', 'km_em_falta']
+        indexes = [
+            models.Index(fields=['prioridade', 'data_limite']),
+        ]
+        verbose_name = 'Vencimento de Manutenção'
+        verbose_name_plural = 'Vencimentos de Manutenção'
+
+    def __str__(self):
+        return f'{self.autocarro_id} — {self.get_componente_display()} {self.posicao} ({self.get_estado_display()})'
+
+    def get_posicao_display(self):
+        posicoes = dict(Troca.LOCAL_CHOICES + TrocaBateria.LOCAL_CHOICES)
+        return posicoes.get(self.posicao, self.posicao)
+
+
 # ____________________________ Modelo para Categoria de Despesa ________________________________ #
 from django.db import models
 
@@ -841,6 +1306,10 @@ class Despesa2(models.Model):
         verbose_name = "Despesa"
         verbose_name_plural = "Despesas"
         ordering = ['-data']
+        indexes = [
+            models.Index(fields=['data']),
+            models.Index(fields=['data', 'criado_em', 'id']),
+        ]
 
     from django.core.exceptions import ValidationError
 
@@ -1009,8 +1478,98 @@ class MovimentoBancario(models.Model):
 
     class Meta:
         ordering = ['-data', '-criado_em']
+        indexes = [
+            # paginação por chave (paginacao.py)
+            models.Index(fields=['data', 'criado_em', 'id']),
+            # extrato por conta (saldos.py)
+            models.Index(fields=['pgc', 'data']),
+        ]
         verbose_name = 'Movimento Bancário'
         verbose_name_plural = 'Movimentos Bancários'
 
     def __str__(self):
-        return f'{self.get_tipo_display()} — {self.pgc.codigo} — {self.valor}'
\ No newline at end of file
+        return f'{self.get_tipo_display()} — {self.pgc.codigo} — {self.valor}'
+
+
+class SaldoMensalConta(models.Model):
+    """
+    Saldo de uma conta do Plano de Contas num mês com movimentos bancários:
+    saldo de abertura (tudo o que foi lançado antes do mês) e débitos e
+    créditos do mês. Valores em bruto (créditos − débitos); o sinal da
+    natureza da conta só é aplicado na apresentação. Mantido pelos signals
+    (ver saldos.py) e recriável com `python manage.py reconstruir_saldos_contas`.
+    """
+    conta = models.ForeignKey(PlanoContas, on_delete=models.CASCADE, related_name='saldos_mensais')
+    periodo = models.PositiveIntegerField(help_text="AAAAMM")
+    saldo_abertura = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    debitos = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    creditos = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ['conta', 'periodo']
+        ordering = ['conta', 'periodo']
+        verbose_name = 'Saldo Mensal de Conta'
+        verbose_name_plural = 'Saldos Mensais de Contas'
+
+    @property
+    def saldo_fecho(self):
+        return self.saldo_abertura + self.creditos - self.debitos
+
+    def __str__(self):
+        return f'{self.conta.codigo} — {self.periodo % 100:02d}/{self.periodo // 100}'
+
+
+# <----- Exportações em segundo plano -----> #
+import uuid
+
+
+class ExportacaoJob(models.Model):
+    """
+    Pedido de exportação (Word/CSV) gerado fora do pedido HTTP.
+
+    `chave` identifica o pedido (tipo + parâmetros + versão dos dados): um
+    pedido igual, com os mesmos dados, reaproveita o ficheiro já gerado.
+    """
+    PENDENTE = 'pendente'
+    EM_CURSO = 'em_curso'
+    CONCLUIDO = 'concluido'
+    ERRO = 'erro'
+    ESTADO_CHOICES = [
+        (PENDENTE, 'Pendente'),
+        (EM_CURSO, 'Em curso'),
+        (CONCLUIDO, 'Concluído'),
+        (ERRO, 'Erro'),
+    ]
+
+    TIPO_CHOICES = [
+        ('relatorio_dashboard', 'Relatório mensal do dashboard (Word)'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    tipo = models.CharField(max_length=50, choices=TIPO_CHOICES)
+    parametros = models.JSONField(default=dict, blank=True)
+    chave = models.CharField(max_length=64, db_index=True)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default=PENDENTE)
+
+    ficheiro = models.FileField(upload_to='exportacoes/%Y/%m/', null=True, blank=True)
+    nome_ficheiro = models.CharField(max_length=255, blank=True)
+    erro = models.TextField(blank=True)
+
+    criado_por = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='exportacoes'
+    )
+    criado_em = models.DateTimeField(auto_now_add=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-criado_em']
+        verbose_name = 'Exportação'
+        verbose_name_plural = 'Exportações'
+
+    def __str__(self):
+        return f'{self.get_tipo_display()} — {self.get_estado_display()}'
+
+    @property
+    def terminado(self):
+        return self.estado in (self.CONCLUIDO, self.ERRO)
\ No newline at end of file
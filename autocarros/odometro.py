@@ -0,0 +1,167 @@
+"""
+Manutenção do odómetro atual de cada autocarro (OdometroAutocarro).
+
+O km de um autocarro aparece em vários sítios: leituras absolutas
+(RegistroKMItem.km_atual, Manutencao.km_ultima, Troca.km_troca,
+TrocaBateria.km_troca) e os km diários de RegistoDiario.km_percorridos.
+A tabela guarda, por autocarro, a leitura absoluta mais recente (com a
+data e a origem), a soma dos km diários registados depois dela e a média
+de km por dia nos últimos JANELA_DIAS dias, para as previsões por km não
+terem de voltar a juntar tudo. Cada recálculo refaz também a lista de
+vencimentos desses autocarros (vencimentos.py).
+
+A leitura mais recente de cada fonte sai de subconsultas correlacionadas
+sobre Autocarro (uma consulta para todas as fontes); numa data com
+leituras de várias fontes ganha a que vem primeiro em FONTES.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from .models import (
+    Autocarro, Manutencao, OdometroAutocarro, RegistoDiario, RegistroKMItem, Troca, TrocaBateria,
+)
+from .vencimentos import recalcular_vencimentos
+
+
+ZERO = Decimal('0')
+CENTIMOS = Decimal('0.01')
+JANELA_DIAS = 30
+TAMANHO_LOTE = 200
+CAMPOS_ODOMETRO = ['km_leitura', 'data_leitura', 'origem', 'km_desde_leitura', 'media_km_dia', 'atualizado_em']
+
+# (origem, modelo, campo do km, campo da data), por ordem de preferência
+FONTES = (
+    ('registo_km', RegistroKMItem, 'km_atual', 'registro__data_registo'),
+    ('manutencao', Manutencao, 'km_ultima', 'data_ultima'),
+    ('troca_pneu', Troca, 'km_troca', 'data_troca'),
+    ('troca_bateria', TrocaBateria, 'km_troca', 'data_troca'),
+)
+
+
+def _leituras(autocarro_ids):
+    """{autocarro_id: (km, data, origem)} da leitura absoluta mais recente."""
+    anotacoes = {}
+    for origem, modelo, campo_km, campo_data in FONTES:
+        ultima = (
+            modelo.objects
+            .filter(autocarro=OuterRef('pk'), **{f'{campo_km}__isnull': False})
+            .order_by(f'-{campo_data}', '-criado_em', '-pk')
+        )
+        anotacoes[f'{origem}_km'] = Subquery(ultima.values(campo_km)[:1])
+        anotacoes[f'{origem}_data'] = Subquery(ultima.values(campo_data)[:1])
+
+    leituras = {}
+    for linha in Autocarro.objects.filter(pk__in=autocarro_ids).annotate(**anotacoes).values('pk', *anotacoes):
+        melhor = None
+        for origem, *_ in FONTES:
+            data = linha[f'{origem}_data']
+            if data is not None and (melhor is None or data > melhor[1]):
+                melhor = (Decimal(linha[f'{origem}_km']), data, origem)
+        leituras[linha['pk']] = melhor
+    return leituras
+
+
+def _km_desde(leituras):
+    """{autocarro_id: soma dos km_percorridos depois da data da leitura}."""
+    condicao = Q()
+    for autocarro_id, leitura in leituras.items():
+        if leitura is not None:
+            condicao |= Q(autocarro_id=autocarro_id, data__gt=leitura[1])
+    if not condicao:
+        return {}
+    return dict(
+        RegistoDiario.objects
+        .filter(condicao)
+        .order_by()
+        .values('autocarro_id')
+        .annotate(km=Sum('km_percorridos'))
+        .values_list('autocarro_id', 'km')
+    )
+
+
+def _medias(autocarro_ids, hoje):
+    """{autocarro_id: km por dia nos últimos JANELA_DIAS dias até hoje}."""
+    inicio = hoje - timedelta(days=JANELA_DIAS - 1)
+    somas = (
+        RegistoDiario.objects
+        .filter(autocarro_id__in=autocarro_ids, data__gte=inicio, data__lte=hoje)
+        .order_by()
+        .values('autocarro_id')
+        .annotate(km=Sum('km_percorridos'))
+        .values_list('autocarro_id', 'km')
+    )
+    return {
+        autocarro_id: (Decimal(km) / JANELA_DIAS).quantize(CENTIMOS)
+        for autocarro_id, km in somas if km
+    }
+
+
+def _recalcular_lote(autocarro_ids, hoje):
+    leituras = _leituras(autocarro_ids)
+    km_desde = _km_desde(leituras)
+    medias = _medias(autocarro_ids, hoje)
+
+    novos = []
+    for autocarro_id, leitura in leituras.items():
+        km, data, origem = leitura or (None, None, '')
+        novos.append(OdometroAutocarro(
+            autocarro_id=autocarro_id,
+            km_leitura=km,
+            data_leitura=data,
+            origem=origem,
+            km_desde_leitura=(km_desde.get(autocarro_id) or ZERO) if leitura else ZERO,
+            media_km_dia=medias.get(autocarro_id, ZERO),
+        ))
+
+    # upsert: dois recálculos do mesmo autocarro ao mesmo tempo não colidem na chave
+    OdometroAutocarro.objects.bulk_create(
+        novos,
+        update_conflicts=True,
+        unique_fields=['autocarro'],
+        update_fields=CAMPOS_ODOMETRO,
+    )
+    return len(novos)
+
+
+def recalcular_odometros(autocarro_ids=None):
+    """
+    Recalcula o odómetro dos autocarros indicados (ou de todos), em lotes
+    de TAMANHO_LOTE: três consultas de leitura e uma escrita por lote. No
+    fim recalcula os vencimentos dos mesmos autocarros.
+    """
+    todos = autocarro_ids is None
+    if todos:
+        autocarro_ids = Autocarro.objects.order_by('pk').values_list('pk', flat=True)
+    autocarro_ids = sorted(set(autocarro_ids))
+    hoje = timezone.localdate()
+    total = 0
+    for i in range(0, len(autocarro_ids), TAMANHO_LOTE):
+        total += _recalcular_lote(autocarro_ids[i:i + TAMANHO_LOTE], hoje)
+    recalcular_vencimentos(None if todos else autocarro_ids)
+    return total
+
+
+def agendar_recalculo_odometro(*autocarro_ids):
+    """
+    Recalcula o odómetro destes autocarros depois do commit. Os autocarros
+    de todas as chamadas na mesma transação (ex.: um formset, um signal
+    por linha) juntam-se num só recálculo: o primeiro callback a correr
+    leva os pendentes todos e os seguintes não têm nada a fazer.
+    """
+    ids = {pk for pk in autocarro_ids if pk}
+    if not ids:
+        return
+    pendentes = transaction.get_connection().__dict__.setdefault('odometros_pendentes', set())
+    pendentes.update(ids)
+
+    def _executar():
+        a_recalcular = set(pendentes)
+        pendentes.clear()
+        if a_recalcular:
+            recalcular_odometros(a_recalcular)
+
+    transaction.on_commit(_executar)
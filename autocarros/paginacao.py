@@ -0,0 +1,145 @@
+"""
+Paginação por chave (keyset / seek) para as listagens longas.
+
+Em vez de OFFSET, cada página continua a partir dos valores da última
+linha da página anterior:
+
+    WHERE (data, criado_em, id) < (...) ORDER BY data DESC, ... LIMIT n
+
+Com um índice nas colunas da ordenação, o custo de uma página não depende
+de quantas linhas ficam para trás. A ordenação tem de terminar numa
+coluna única (o id) e as colunas não podem ser nulas.
+
+O cursor vai na querystring (?cursor=...) com os valores da linha de
+fronteira e a direção; os outros filtros mantêm-se com {% querystring %}
+(ver templates/_paginacao_keyset.html).
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+POR_PAGINA = 50
+
+SEGUINTE = 's'
+ANTERIOR = 'a'
+
+
+class PaginaKeyset:
+    """Uma página de resultados; itera como a lista de objetos."""
+
+    def __init__(self, itens, cursor_seguinte=None, cursor_anterior=None, cursor_ultima=None):
+        self.itens = itens
+        self.cursor_seguinte = cursor_seguinte
+        self.cursor_anterior = cursor_anterior
+        self.cursor_ultima = cursor_ultima
+
+    @property
+    def tem_seguinte(self):
+        return self.cursor_seguinte is not None
+
+    @property
+    def tem_anterior(self):
+        return self.cursor_anterior is not None
+
+    def __iter__(self):
+        return iter(self.itens)
+
+    def __len__(self):
+        return len(self.itens)
+
+    def __getitem__(self, indice):
+        return self.itens[indice]
+
+
+def _nome(campo):
+    return campo.lstrip('-')
+
+
+def _inverter(campo):
+    return _nome(campo) if campo.startswith('-') else f'-{campo}'
+
+
+def _codificar(direcao, valores):
+    valores = [v.isoformat() if hasattr(v, 'isoformat') else v for v in valores] if valores else None
+    dados = json.dumps([direcao, valores], separators=(',', ':'))
+    return base64.urlsafe_b64encode(dados.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _descodificar(cursor, ordenacao, modelo):
+    """(direção, valores) do cursor, ou None se faltar ou for inválido."""
+    if not cursor:
+        return None
+    try:
+        dados = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direcao, valores = json.loads(dados)
+        if direcao not in (SEGUINTE, ANTERIOR):
+            return None
+        if valores is None:
+            return direcao, None
+        if len(valores) != len(ordenacao):
+            return None
+        valores = [
+            modelo._meta.get_field(_nome(campo)).to_python(valor)
+            for campo, valor in zip(ordenacao, valores)
+        ]
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, ValidationError):
+        return None
+    return direcao, valores
+
+
+def _depois_de(ordenacao, valores):
+    """Q das linhas que vêm depois de `valores` na ordem `ordenacao`."""
+    condicao = Q()
+    iguais = {}
+    for campo, valor in zip(ordenacao, valores):
+        operador = 'lt' if campo.startswith('-') else 'gt'
+        condicao |= Q(**iguais, **{f'{_nome(campo)}__{operador}': valor})
+        iguais[_nome(campo)] = valor
+    return condicao
+
+
+def _valores(obj, ordenacao):
+    return [getattr(obj, _nome(campo)) for campo in ordenacao]
+
+
+def paginar_keyset(request, queryset, ordenacao, por_pagina=POR_PAGINA, parametro='cursor'):
+    """
+    Devolve a PaginaKeyset pedida em request.GET[parametro].
+
+    `ordenacao` é a lista de order_by, p. ex. ('-data', '-criado_em', '-id').
+    Lê por_pagina + 1 linhas para saber se há mais páginas; os totais da
+    listagem devem vir de um aggregate() à parte.
+    """
+    ordenacao = tuple(ordenacao)
+    cursor = _descodificar(request.GET.get(parametro), ordenacao, queryset.model)
+    direcao, valores = cursor or (SEGUINTE, None)
+
+    if direcao == ANTERIOR:
+        # anda para trás com a ordem invertida e volta a pôr a página na ordem certa
+        invertida = tuple(_inverter(campo) for campo in ordenacao)
+        qs = queryset.order_by(*invertida)
+        if valores is not None:
+            qs = qs.filter(_depois_de(invertida, valores))
+        linhas = list(qs[:por_pagina + 1])
+        ha_anteriores = len(linhas) > por_pagina
+        itens = linhas[:por_pagina][::-1]
+        ha_seguintes = valores is not None
+    else:
+        qs = queryset.order_by(*ordenacao)
+        if valores is not None:
+            qs = qs.filter(_depois_de(ordenacao, valores))
+        linhas = list(qs[:por_pagina + 1])
+        ha_seguintes = len(linhas) > por_pagina
+        itens = linhas[:por_pagina]
+        ha_anteriores = valores is not None
+
+    return PaginaKeyset(
+        itens,
+        cursor_seguinte=_codificar(SEGUINTE, _valores(itens[-1], ordenacao)) if itens and ha_seguintes else None,
+        cursor_anterior=_codificar(ANTERIOR, _valores(itens[0], ordenacao)) if itens and ha_anteriores else None,
+        cursor_ultima=_codificar(ANTERIOR, None) if ha_seguintes else None,
+    )
@@ -0,0 +1,81 @@
+"""
+Filtros de período sargáveis.
+
+`data__year=ano, data__month=mes` compila para EXTRACT(...)/strftime(...)
+sobre a coluna, o que impede a base de dados de usar os índices em `data`.
+Estes helpers devolvem intervalos semi-abertos [início, fim) que o planner
+resolve com um range scan no índice.
+"""
+from datetime import date, timedelta
+
+
+def intervalo_mes(ano, mes):
+    """Devolve (primeiro dia do mês, primeiro dia do mês seguinte)."""
+    inicio = date(ano, mes, 1)
+    if mes == 12:
+        fim = date(ano + 1, 1, 1)
+    else:
+        fim = date(ano, mes + 1, 1)
+    return inicio, fim
+
+
+def intervalo_ano(ano):
+    """Devolve (1 de janeiro do ano, 1 de janeiro do ano seguinte)."""
+    return date(ano, 1, 1), date(ano + 1, 1, 1)
+
+
+def filtro_periodo(campo='data', ano=None, mes=None, dia=None):
+    """
+    kwargs para `.filter()` com o mês (ano e mês), o ano inteiro (só ano)
+    ou nada (sem ano). Aceita ano/mês/dia como int ou string.
+
+    Com ano, mês e dia é a própria data (igualdade, também resolvida pelo
+    índice). Um mês sem ano (o mesmo mês em todos os anos) ou um dia sem
+    ano e mês não são intervalos contínuos, por isso nesses casos continua
+    a usar `__month` / `__day`.
+    """
+    if ano and mes and dia:
+        try:
+            return {campo: date(int(ano), int(mes), int(dia))}
+        except ValueError:
+            # dia que não existe nesse mês (ex.: 31 de fevereiro): nenhum registo
+            return {f'{campo}__in': []}
+
+    if ano and mes:
+        inicio, fim = intervalo_mes(int(ano), int(mes))
+        filtro = {f'{campo}__gte': inicio, f'{campo}__lt': fim}
+    elif ano:
+        inicio, fim = intervalo_ano(int(ano))
+        filtro = {f'{campo}__gte': inicio, f'{campo}__lt': fim}
+    elif mes:
+        filtro = {f'{campo}__month': int(mes)}
+    else:
+        filtro = {}
+    if dia:
+        filtro[f'{campo}__day'] = int(dia)
+    return filtro
+
+
+def semana_do_mes_4colunas(data):
+    """
+    Coluna (1 a 4) do mapa financeiro em que cai a data.
+
+    A primeira semana natural do mês (até domingo) junta-se à seguinte se
+    tiver 4 dias ou menos; tudo o que passe da 4.ª semana fica na 4.ª.
+    """
+    primeiro_dia = data.replace(day=1)
+
+    dias_ate_domingo = (6 - primeiro_dia.weekday()) % 7
+    fim_primeira_semana = primeiro_dia + timedelta(days=dias_ate_domingo)
+
+    total_dias_primeira_semana = (fim_primeira_semana - primeiro_dia).days + 1
+    if total_dias_primeira_semana <= 4:
+        fim_primeira_semana = fim_primeira_semana + timedelta(days=7)
+
+    if data <= fim_primeira_semana:
+        return 1
+
+    dias_apos = (data - fim_primeira_semana).days
+    semana = 2 + ((dias_apos - 1) // 7)
+
+    return min(semana, 4)
@@ -0,0 +1,152 @@
+"""
+Importação em massa do plano de contas base (fixtures/plano_base.json).
+
+Gravar conta a conta com PlanoContas.objects.create() faz, por cada linha,
+o full_clean() (com a leitura da mãe) e a renumeração MPTT das contas
+seguintes. Aqui o ficheiro é validado todo em memória contra as mesmas
+regras de PlanoContas.clean(), as contas são inseridas com bulk_create
+(um lote por nível da árvore, para as filhas já terem o id da mãe) com as
+atualizações MPTT desligadas, e a árvore é reconstruída uma única vez.
+
+Os códigos que já existem são mantidos tal como estão, por isso a mesma
+função serve para carregar o plano de raiz e para juntar contas novas a um
+plano já em uso.
+"""
+import json
+import os
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .cache_resultados import invalidar_tudo
+from .models import PlanoContas
+
+
+CAMINHO_PLANO_BASE = os.path.join(os.path.dirname(__file__), 'fixtures', 'plano_base.json')
+TAMANHO_LOTE = 500
+
+
+def ler_plano(caminho=None):
+    with open(caminho or CAMINHO_PLANO_BASE, encoding='utf-8') as ficheiro:
+        return json.load(ficheiro)
+
+
+def _validar(dados, existentes):
+    """
+    Erros do ficheiro contra ele próprio e contra as contas `existentes`
+    ({codigo: (tipo, id)}). Devolve a lista de mensagens (vazia se válido).
+    """
+    erros = []
+    tipos_validos = {valor for valor, _ in PlanoContas.TIPO_CHOICES}
+    naturezas_validas = {valor for valor, _ in PlanoContas.NATUREZA_CHOICES}
+    max_codigo = PlanoContas._meta.get_field('codigo').max_length
+    max_nome = PlanoContas._meta.get_field('nome').max_length
+
+    no_ficheiro = {}
+    for n, item in enumerate(dados, start=1):
+        codigo = item.get('codigo')
+        if not codigo or not item.get('nome'):
+            erros.append(f'Linha {n}: falta o código ou a designação.')
+            continue
+        if codigo in no_ficheiro:
+            erros.append(f'Código "{codigo}" repetido no ficheiro.')
+            continue
+        no_ficheiro[codigo] = item
+        if len(codigo) > max_codigo or len(item['nome']) > max_nome:
+            erros.append(f'Código "{codigo}": código ou designação demasiado longos.')
+        if item.get('tipo') not in tipos_validos:
+            erros.append(f'Código "{codigo}": tipo inválido ({item.get("tipo")!r}).')
+        if item.get('natureza') not in naturezas_validas:
+            erros.append(f'Código "{codigo}": natureza inválida ({item.get("natureza")!r}).')
+
+    for codigo, item in no_ficheiro.items():
+        if codigo in existentes:
+            continue
+        mae = item.get('parent_codigo')
+        if not mae:
+            continue
+        if mae in existentes:
+            # a conta gravada prevalece sobre a linha do ficheiro
+            tipo_mae = existentes[mae][0]
+        elif mae in no_ficheiro:
+            tipo_mae = no_ficheiro[mae].get('tipo')
+        else:
+            erros.append(f'Código "{codigo}": a conta-mãe "{mae}" não existe.')
+            continue
+        if codigo == mae:
+            erros.append(f'Código "{codigo}": a conta não pode ser mãe de si própria.')
+            continue
+        # mesmas regras de PlanoContas.clean()
+        if not codigo.startswith(mae):
+            erros.append(f'O código "{codigo}" deve começar por "{mae}" (código da conta-mãe).')
+        if tipo_mae != 'S':
+            erros.append(f'Código "{codigo}": a conta-mãe "{mae}" é Analítica, não pode ter subcontas.')
+    return erros
+
+
+def _por_nivel(novas, existentes):
+    """As contas novas agrupadas por profundidade (as mães antes das filhas)."""
+    profundidade = {}
+
+    def _nivel(codigo):
+        if codigo not in profundidade:
+            mae = novas[codigo].get('parent_codigo')
+            # o prefixo obriga a mãe a ter um código mais curto: não há ciclos
+            profundidade[codigo] = 0 if not mae or mae in existentes else _nivel(mae) + 1
+        return profundidade[codigo]
+
+    niveis = {}
+    for codigo in novas:
+        niveis.setdefault(_nivel(codigo), []).append(novas[codigo])
+    return [niveis[nivel] for nivel in sorted(niveis)]
+
+
+def importar_plano(dados):
+    """
+    Cria as contas de `dados` cujo código ainda não existe.
+    Devolve (criadas, ja_existiam). Levanta ValidationError com todas as
+    mensagens se o ficheiro não respeitar as regras do Plano de Contas.
+    """
+    existentes = {
+        codigo: (tipo, pk)
+        for codigo, tipo, pk in PlanoContas.objects.values_list('codigo', 'tipo', 'pk')
+    }
+    erros = _validar(dados, existentes)
+    if erros:
+        raise ValidationError(erros)
+
+    novas = {item['codigo']: item for item in dados if item['codigo'] not in existentes}
+    if not novas:
+        return 0, len(dados)
+
+    ids = {codigo: pk for codigo, (_, pk) in existentes.items()}
+    with transaction.atomic():
+        with PlanoContas.objects.disable_mptt_updates():
+            for nivel in _por_nivel(novas, existentes):
+                PlanoContas.objects.bulk_create(
+                    [
+                        PlanoContas(
+                            codigo=item['codigo'],
+                            nome=item['nome'],
+                            tipo=item['tipo'],
+                            natureza=item['natureza'],
+                            permite_lancamento=item['tipo'] != 'S',
+                            parent_id=ids.get(item.get('parent_codigo')),
+                            # provisórios: o rebuild() abaixo numera a árvore
+                            tree_id=0, lft=0, rght=0, level=0,
+                        )
+                        for item in nivel
+                    ],
+                    batch_size=TAMANHO_LOTE,
+                )
+                # nem todas as bases devolvem os ids no bulk_create
+                ids.update(
+                    PlanoContas.objects
+                    .filter(codigo__in=[item['codigo'] for item in nivel])
+                    .values_list('codigo', 'pk')
+                )
+        PlanoContas.objects.rebuild()
+        # bulk_create não dispara signals: o balancete em cache caduca aqui
+        invalidar_tudo()
+
+    return len(novas), len(dados) - len(novas)
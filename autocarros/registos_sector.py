@@ -0,0 +1,90 @@
+"""
+Registos diários de um sector numa data (a folha do relatório do sector).
+
+Abrir o relatório de um sector num dia garante que cada autocarro do sector
+tem o seu RegistoDiario nessa data: os autocarros em falta saem de uma
+consulta, os registos em branco entram num único bulk_create (com
+ignore_conflicts, por isso dois gestores a abrir o mesmo dia não falham na
+unicidade (autocarro, data)) e a folha completa vem numa só leitura — o
+número de consultas não depende do número de autocarros.
+
+Ao gravar a folha só as linhas que mudaram são escritas, todas num
+bulk_update dentro de uma transação curta (entradas, saídas, saldo e
+passageiros são colunas geradas pela base de dados).
+
+bulk_create e bulk_update não disparam signals: depois do commit são
+refeitas só as linhas do resumo diário dos autocarros criados ou
+alterados (um upsert, sem tocar nas dos outros sectores), a célula do
+resumo mensal do sector e a versão da cache do mês (e o odómetro dos
+autocarros alterados).
+"""
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .cache_resultados import agendar_invalidacao, periodo
+from .models import Autocarro, RegistoDiario
+from .odometro import agendar_recalculo_odometro
+from .resumos import agendar_recalculo_mensal, agendar_resumos_dia
+
+
+def _agendar_resumos(sector_id, data, autocarro_ids):
+    agendar_resumos_dia(data, autocarro_ids)
+    agendar_recalculo_mensal((data.year, data.month, sector_id))
+    agendar_invalidacao(periodo(data.year, data.month))
+
+
+def preparar_registos(sector, data, relatorio=None):
+    """
+    Cria os registos em branco dos autocarros do `sector` que ainda não têm
+    registo na `data` (ligados ao `relatorio`, se indicado) e devolve
+    (registos do sector nessa data com o autocarro, número de criados).
+    """
+    em_falta = list(
+        Autocarro.objects
+        .filter(sector=sector)
+        .exclude(Exists(RegistoDiario.objects.filter(autocarro=OuterRef('pk'), data=data)))
+        .values_list('pk', flat=True)
+    )
+    if em_falta:
+        RegistoDiario.objects.bulk_create(
+            [RegistoDiario(autocarro_id=pk, data=data, relatorio=relatorio) for pk in em_falta],
+            ignore_conflicts=True,
+        )
+        _agendar_resumos(sector.pk, data, em_falta)
+
+    registos = list(
+        RegistoDiario.objects
+        .filter(autocarro__sector=sector, data=data)
+        .select_related('autocarro')
+        .order_by('autocarro__numero')
+    )
+    return registos, len(em_falta)
+
+
+def aplicar_alteracoes(registo, dados, campos):
+    """
+    Copia para o `registo` os valores de `dados` (cleaned_data da folha)
+    que diferem dos carregados; devolve True se algum dos `campos` mudou.
+    """
+    alterado = False
+    for campo in campos:
+        if getattr(registo, campo) != dados[campo]:
+            setattr(registo, campo, dados[campo])
+            alterado = True
+    return alterado
+
+
+def gravar_alterados(sector, data, alterados, campos):
+    """
+    Grava os registos `alterados` da folha do `sector` na `data` (só os
+    `campos` da folha) com um único bulk_update. Devolve o
+    número de registos gravados.
+    """
+    if not alterados:
+        return 0
+    with transaction.atomic():
+        RegistoDiario.objects.bulk_update(alterados, campos)
+        autocarro_ids = {registo.autocarro_id for registo in alterados}
+        _agendar_resumos(sector.pk, data, autocarro_ids)
+        agendar_recalculo_odometro(*autocarro_ids)
+    return len(alterados)
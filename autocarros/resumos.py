@@ -0,0 +1,461 @@
+"""
+Manutenção das tabelas de resumo.
+
+- ResumoDiarioAutocarro: junta o RegistoDiario de um autocarro numa data com
+  as despesas de combustível (valor, litros, sobragem, lavagem) do mesmo dia,
+  para que os relatórios não tenham de montar o 'combustivel_map' em Python.
+- ResumoMensalSector: totais por (ano, mês, sector) de cada categoria de
+  receita e despesa, para os painéis financeiros.
+"""
+from datetime import date
+from decimal import Decimal
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Q, Sum, Value
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .models import (
+    Autocarro, Despesa, Despesa2, DespesaCombustivel, DespesaFixa, RegistoDiario,
+    RelatorioSector, ResumoDiarioAutocarro, ResumoMensalSector,
+)
+from .periodos import filtro_periodo
+
+
+ZERO = Decimal('0')
+TAMANHO_LOTE = 1000
+
+
+def _valores_resumo(registo, combustivel):
+    """Calcula os campos do resumo a partir de um registo (ou None) e dos totais de combustível."""
+    entradas = ZERO
+    saidas_registo = ZERO
+    if registo is not None:
+        entradas = registo.entradas_total()
+        saidas_registo = registo.saidas_total()
+
+    comb = combustivel.get('combustivel') or ZERO
+    litros = combustivel.get('combustivel_litros') or ZERO
+    sobragem = combustivel.get('sobragem') or ZERO
+    lavagem = combustivel.get('lavagem') or ZERO
+
+    saidas = saidas_registo + comb + sobragem + lavagem
+    return {
+        'registo': registo,
+        'entradas': entradas,
+        'saidas_registo': saidas_registo,
+        'combustivel': comb,
+        'combustivel_litros': litros,
+        'sobragem': sobragem,
+        'lavagem': lavagem,
+        'saidas': saidas,
+        'saldo': entradas - saidas,
+    }
+
+
+def _totais_combustivel():
+    return dict(
+        combustivel=Sum('valor'),
+        combustivel_litros=Sum('valor_litros'),
+        sobragem=Sum('sobragem_filtros'),
+        lavagem=Sum('lavagem'),
+    )
+
+
+def recalcular_resumo_diario(autocarro_id, data):
+    """Recalcula (ou apaga) a linha do resumo de um autocarro numa data."""
+    if not autocarro_id or not data:
+        return None
+
+    registo = RegistoDiario.objects.filter(autocarro_id=autocarro_id, data=data).first()
+    combustiveis = DespesaCombustivel.objects.filter(autocarro_id=autocarro_id, data=data)
+    combustivel = combustiveis.aggregate(**_totais_combustivel())
+
+    if registo is None and not combustiveis.exists():
+        ResumoDiarioAutocarro.objects.filter(autocarro_id=autocarro_id, data=data).delete()
+        return None
+
+    if registo is not None:
+        # Se o registo mudou de data/autocarro, a linha antiga ainda aponta
+        # para ele (OneToOne) até ser recalculada — soltá-la primeiro.
+        ResumoDiarioAutocarro.objects.filter(registo=registo).exclude(
+            autocarro_id=autocarro_id, data=data
+        ).update(registo=None)
+
+    resumo, _ = ResumoDiarioAutocarro.objects.update_or_create(
+        autocarro_id=autocarro_id,
+        data=data,
+        defaults=_valores_resumo(registo, combustivel),
+    )
+    return resumo
+
+
+def agendar_recalculo(*chaves):
+    """
+    Recalcula as chaves (autocarro_id, data) depois do commit da transação.
+
+    Assim, apagar um autocarro (cascade de registos e combustíveis) não tenta
+    recriar linhas de um autocarro que já não existe.
+    """
+    pendentes = {chave for chave in chaves if chave and all(chave)}
+    if not pendentes:
+        return
+
+    def _executar():
+        for autocarro_id, data in pendentes:
+            recalcular_resumo_diario(autocarro_id, data)
+
+    transaction.on_commit(_executar)
+
+
+def recalcular_resumos_dia(data, autocarro_ids):
+    """
+    Recalcula de uma vez as linhas do resumo dos `autocarro_ids` na `data`:
+    uma leitura dos registos, um GROUP BY do combustível e um upsert sobre
+    (autocarro, data). As linhas dos outros autocarros nessa data não são
+    tocadas, por isso duas folhas do mesmo dia gravadas ao mesmo tempo não
+    colidem na unicidade.
+    """
+    autocarro_ids = set(autocarro_ids)
+    if not data or not autocarro_ids:
+        return 0
+
+    registos = {
+        registo.autocarro_id: registo
+        for registo in RegistoDiario.objects.filter(autocarro_id__in=autocarro_ids, data=data)
+    }
+    combustivel_map = {
+        linha.pop('autocarro_id'): linha
+        for linha in (
+            DespesaCombustivel.objects
+            .filter(autocarro_id__in=autocarro_ids, data=data)
+            .order_by()
+            .values('autocarro_id')
+            .annotate(**_totais_combustivel())
+        )
+    }
+    sem_dados = autocarro_ids - registos.keys() - combustivel_map.keys()
+    linhas = [
+        ResumoDiarioAutocarro(
+            autocarro_id=autocarro_id,
+            data=data,
+            **_valores_resumo(registos.get(autocarro_id), combustivel_map.get(autocarro_id, {})),
+        )
+        for autocarro_id in autocarro_ids - sem_dados
+    ]
+
+    with transaction.atomic():
+        if sem_dados:
+            ResumoDiarioAutocarro.objects.filter(autocarro_id__in=sem_dados, data=data).delete()
+        if registos:
+            # registos que mudaram de data/autocarro: soltar a linha antiga (OneToOne)
+            ResumoDiarioAutocarro.objects.filter(registo__in=registos.values()).exclude(
+                autocarro_id=F('registo__autocarro_id'), data=F('registo__data')
+            ).update(registo=None)
+        ResumoDiarioAutocarro.objects.bulk_create(
+            linhas,
+            update_conflicts=True,
+            unique_fields=['autocarro', 'data'],
+            update_fields=[campo for campo in _valores_resumo(None, {})] + ['atualizado_em'],
+        )
+    return len(linhas)
+
+
+def agendar_resumos_dia(data, autocarro_ids):
+    """recalcular_resumos_dia depois do commit da transação."""
+    autocarro_ids = set(autocarro_ids)
+    if data and autocarro_ids:
+        transaction.on_commit(lambda: recalcular_resumos_dia(data, autocarro_ids))
+
+
+def reconstruir_resumos(data_inicio=None, data_fim=None, progresso=None):
+    """
+    Recria o resumo diário de raiz (ou apenas no intervalo indicado).
+
+    Usa um GROUP BY sobre DespesaCombustivel e bulk_create em lotes;
+    devolve o número de linhas criadas.
+    """
+    registos = RegistoDiario.objects.all()
+    combustiveis = DespesaCombustivel.objects.all()
+    resumos = ResumoDiarioAutocarro.objects.all()
+    if data_inicio:
+        registos = registos.filter(data__gte=data_inicio)
+        combustiveis = combustiveis.filter(data__gte=data_inicio)
+        resumos = resumos.filter(data__gte=data_inicio)
+    if data_fim:
+        registos = registos.filter(data__lte=data_fim)
+        combustiveis = combustiveis.filter(data__lte=data_fim)
+        resumos = resumos.filter(data__lte=data_fim)
+
+    combustivel_map = {
+        (linha['autocarro_id'], linha['data']): linha
+        for linha in (
+            combustiveis.order_by()
+            .values('autocarro_id', 'data')
+            .annotate(**_totais_combustivel())
+        )
+    }
+
+    with transaction.atomic():
+        resumos.delete()
+
+        lote = []
+        criados = 0
+
+        def _gravar():
+            nonlocal criados, lote
+            ResumoDiarioAutocarro.objects.bulk_create(lote)
+            criados += len(lote)
+            lote = []
+            if progresso:
+                progresso(criados)
+
+        for registo in registos.order_by('data', 'autocarro_id').iterator(chunk_size=TAMANHO_LOTE):
+            chave = (registo.autocarro_id, registo.data)
+            combustivel = combustivel_map.pop(chave, {})
+            lote.append(ResumoDiarioAutocarro(
+                autocarro_id=registo.autocarro_id,
+                data=registo.data,
+                **_valores_resumo(registo, combustivel),
+            ))
+            if len(lote) >= TAMANHO_LOTE:
+                _gravar()
+
+        # Dias com combustível mas sem registo diário
+        for (autocarro_id, data), combustivel in combustivel_map.items():
+            lote.append(ResumoDiarioAutocarro(
+                autocarro_id=autocarro_id,
+                data=data,
+                **_valores_resumo(None, combustivel),
+            ))
+            if len(lote) >= TAMANHO_LOTE:
+                _gravar()
+
+        if lote:
+            _gravar()
+
+    return criados
+
+
+def anexar_resumo(registo):
+    """
+    Anexa ao registo os atributos de combustível usados pelos templates
+    (combustivel_total, saidas_total_incl_combustivel, ...), lidos do resumo.
+
+    Para evitar uma query por registo, o queryset deve usar
+    select_related('resumo_diario').
+    """
+    try:
+        resumo = registo.resumo_diario
+    except ObjectDoesNotExist:
+        resumo = None
+
+    if resumo is None:
+        # linha ainda por criar (ex.: recálculo depois do commit por correr):
+        # o combustível vem das despesas, para não aparecer a zero
+        combustivel = DespesaCombustivel.objects.filter(
+            autocarro_id=registo.autocarro_id, data=registo.data,
+        ).aggregate(**_totais_combustivel())
+        resumo = ResumoDiarioAutocarro(**_valores_resumo(registo, combustivel))
+
+    registo.combustivel_total = resumo.combustivel
+    registo.combustivel_valor_litros = resumo.combustivel_litros
+    registo.combustivel_sobragem = resumo.sobragem
+    registo.combustivel_lavagem = resumo.lavagem
+    registo.saidas_total_incl_combustivel = resumo.saidas
+    registo.saldo_liquido_incl_combustivel = resumo.saldo
+    registo.preco_litro = resumo.preco_litro
+    return registo
+
+
+# ═══════════════════════════════════════════════════════════
+# RESUMO MENSAL POR SECTOR (ano, mês, sector)
+# ═══════════════════════════════════════════════════════════
+
+def _fontes_mensais():
+    """
+    Para cada modelo de origem: (queryset base, campo de data, campo do sector
+    ou None, agregados por coluna do ResumoMensalSector).
+    """
+    agregados_fixas = {
+        f'fixa_{categoria}': Sum('valor', filter=Q(categoria=categoria))
+        for categoria, _ in DespesaFixa.CATEGORIAS
+    }
+    return {
+        RegistoDiario: (
+            RegistoDiario.objects.all(), 'data', 'autocarro__sector_id', {
+                'num_registos': Count('id'),
+                'normal': Sum('normal'),
+                'alunos': Sum('alunos'),
+                'luvu': Sum('luvu'),
+                'frete': Sum('frete'),
+                'alimentacao': Sum('alimentacao'),
+                'parqueamento': Sum('parqueamento'),
+                'taxa': Sum('taxa'),
+                'outros': Sum('outros'),
+                'taxi': Sum('taxi'),
+            },
+        ),
+        RelatorioSector: (
+            RelatorioSector.objects.all(), 'data', 'sector_id', {
+                'despesa_geral': Sum('despesa_geral'),
+                'alimentacao_estaleiro': Sum('alimentacao_estaleiro'),
+            },
+        ),
+        DespesaCombustivel: (
+            DespesaCombustivel.objects.all(), 'data', 'sector_id', {
+                'combustivel': Sum('valor'),
+                'sobragem': Sum('sobragem_filtros'),
+                'lavagem': Sum('lavagem'),
+            },
+        ),
+        Despesa: (
+            Despesa.objects.all(), 'data', 'sector_id', {
+                'despesas_variaveis': Sum('valor'),
+            },
+        ),
+        Despesa2: (
+            Despesa2.objects.all(), 'data', None, {
+                'despesa2': Sum('valor'),
+            },
+        ),
+        DespesaFixa: (
+            DespesaFixa.objects.filter(ativo=True), 'data_inicio', 'sector_id', agregados_fixas,
+        ),
+    }
+
+
+MODELOS_RESUMO_MENSAL = (RegistoDiario, RelatorioSector, DespesaCombustivel, Despesa, Despesa2, DespesaFixa)
+
+
+def chave_mensal(instance):
+    """(ano, mes, sector_id) da célula do resumo mensal afetada por uma instância."""
+    if isinstance(instance, DespesaFixa):
+        data = instance.data_inicio
+    else:
+        data = getattr(instance, 'data', None)
+    if not data:
+        return None
+
+    if isinstance(instance, RegistoDiario):
+        sector_id = (
+            Autocarro.objects.filter(pk=instance.autocarro_id)
+            .values_list('sector_id', flat=True).first()
+        )
+    elif isinstance(instance, Despesa2):
+        sector_id = None
+    else:
+        sector_id = instance.sector_id
+    return (data.year, data.month, sector_id)
+
+
+def _agrupar_por_mes(queryset, campo_data, campo_sector, agregados):
+    """Agrupa um queryset por (ano, mês, sector): {(ano, mes, sector_id): {coluna: valor}}."""
+    agrupamento = {
+        '_ano': ExtractYear(campo_data),
+        '_mes': ExtractMonth(campo_data),
+        '_sector': F(campo_sector) if campo_sector else Value(None, output_field=IntegerField()),
+    }
+    linhas = (
+        queryset.filter(**{f'{campo_data}__isnull': False})
+        .order_by()
+        .annotate(**agrupamento)
+        .values('_ano', '_mes', '_sector')
+        .annotate(**agregados)
+    )
+    resultado = {}
+    for linha in linhas:
+        chave = (linha.pop('_ano'), linha.pop('_mes'), linha.pop('_sector'))
+        resultado[chave] = {k: v for k, v in linha.items() if v is not None}
+    return resultado
+
+
+def recalcular_resumo_mensal(ano, mes, sector_id):
+    """Recalcula (ou apaga) uma célula (ano, mês, sector) a partir das tabelas de origem."""
+    valores = {}
+    for queryset, campo_data, campo_sector, agregados in _fontes_mensais().values():
+        queryset = queryset.filter(**filtro_periodo(campo_data, ano, mes))
+        if campo_sector:
+            queryset = queryset.filter(**{campo_sector: sector_id})
+        elif sector_id is not None:
+            continue
+        for linha in _agrupar_por_mes(queryset, campo_data, campo_sector, agregados).values():
+            valores.update(linha)
+
+    existentes = ResumoMensalSector.objects.filter(ano=ano, mes=mes, sector_id=sector_id)
+    if not valores:
+        existentes.delete()
+        return None
+
+    valores = {campo.name: valores.get(campo.name, campo.default) for campo in _campos_valor()}
+    # update_or_create volta a ler a célula se outra transação a criar entretanto
+    resumo, _ = ResumoMensalSector.objects.update_or_create(
+        ano=ano, mes=mes, sector_id=sector_id, defaults=valores,
+    )
+    return resumo
+
+
+def _campos_valor():
+    return [
+        campo for campo in ResumoMensalSector._meta.concrete_fields
+        if campo.name not in ('id', 'ano', 'mes', 'sector', 'atualizado_em')
+    ]
+
+
+def agendar_recalculo_mensal(*chaves):
+    """Recalcula as células (ano, mes, sector_id) depois do commit da transação."""
+    pendentes = {chave for chave in chaves if chave}
+    if not pendentes:
+        return
+
+    def _executar():
+        for ano, mes, sector_id in pendentes:
+            recalcular_resumo_mensal(ano, mes, sector_id)
+
+    transaction.on_commit(_executar)
+
+
+def reconstruir_resumos_mensais(progresso=None):
+    """Recria o resumo mensal de raiz: um GROUP BY por tabela de origem e bulk_create."""
+    celulas = {}
+    for modelo, (queryset, campo_data, campo_sector, agregados) in _fontes_mensais().items():
+        for chave, linha in _agrupar_por_mes(queryset, campo_data, campo_sector, agregados).items():
+            celulas.setdefault(chave, {}).update(linha)
+        if progresso:
+            progresso(modelo._meta.verbose_name_plural, len(celulas))
+
+    with transaction.atomic():
+        ResumoMensalSector.objects.all().delete()
+        ResumoMensalSector.objects.bulk_create(
+            [
+                ResumoMensalSector(ano=ano, mes=mes, sector_id=sector_id, **valores)
+                for (ano, mes, sector_id), valores in celulas.items()
+            ],
+            batch_size=TAMANHO_LOTE,
+        )
+    return len(celulas)
+
+
+def totais_mensais(ano=None, mes=None, apenas_com_registos=False):
+    """
+    Totais por mês (somando todos os sectores), numa só query ao resumo.
+    Cada linha traz 'mes' (date do dia 1) e uma chave por coluna do resumo.
+    """
+    resumos = ResumoMensalSector.objects.all()
+    if ano:
+        resumos = resumos.filter(ano=ano)
+    if mes:
+        resumos = resumos.filter(mes=mes)
+
+    somas = {f'total_{campo.name}': Sum(campo.name) for campo in _campos_valor()}
+    linhas = resumos.order_by().values('ano', 'mes').annotate(**somas).order_by('ano', 'mes')
+    if apenas_com_registos:
+        linhas = linhas.filter(total_num_registos__gt=0)
+
+    resultado = []
+    for linha in linhas:
+        item = {'mes': date(linha['ano'], linha['mes'], 1)}
+        for campo in _campos_valor():
+            item[campo.name] = linha[f'total_{campo.name}'] or campo.default
+        resultado.append(item)
+    return resultado
@@ -0,0 +1,330 @@
+"""
+Saldos das contas do Plano de Contas (movimentos bancários).
+
+SaldoMensalConta guarda, por conta e por mês com movimentos, o saldo de
+abertura e os débitos e créditos do mês. O saldo antes de qualquer data
+lê uma linha dessa tabela (mais, se a data não for dia 1, os movimentos
+desde o início do mês), por isso um extrato lê só o intervalo pedido; o
+saldo corrido de cada movimento é uma soma em janela
+(SUM(...) OVER (ORDER BY data, criado_em, id)).
+
+Os saldos são guardados em bruto (créditos − débitos). Nas contas de
+natureza devedora são apresentados com o sinal trocado (débitos − créditos).
+
+O balancete soma os movimentos uma vez por conta e sobe os totais pela
+árvore MPTT numa só passagem (ordem de `lft` invertida: as filhas vêm
+sempre antes das mães), sem consultas recursivas.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When, Window
+from django.db.models.expressions import RowRange
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .cache_resultados import em_cache, versao_dados
+from .models import MovimentoBancario, PlanoContas, SaldoMensalConta
+
+
+ZERO = Decimal('0')
+CENTIMOS = Decimal('0.01')
+TAMANHO_LOTE = 1000
+
+
+def sinal_natureza(natureza):
+    """+1 para contas credoras, -1 para devedoras."""
+    return -1 if natureza == 'D' else 1
+
+
+def com_sinal(valor, natureza):
+    """Valor em bruto apresentado com o sinal da natureza, em cêntimos (sem -0.00)."""
+    if sinal_natureza(natureza) < 0:
+        valor = ZERO - valor
+    return valor.quantize(CENTIMOS)
+
+
+def _periodo(data):
+    return data.year * 100 + data.month
+
+
+def _totais():
+    return dict(
+        debitos=Sum('valor', filter=Q(tipo='debito')),
+        creditos=Sum('valor', filter=Q(tipo='credito')),
+    )
+
+
+def _valor_com_sinal():
+    """Crédito positivo, débito negativo."""
+    return Case(
+        When(tipo='credito', then=F('valor')),
+        default=-F('valor'),
+        output_field=DecimalField(max_digits=16, decimal_places=2),
+    )
+
+
+def _meses(movimentos):
+    """[(periodo, débitos, créditos)] por ordem cronológica, num só GROUP BY."""
+    linhas = (
+        movimentos.order_by()
+        .annotate(_ano=ExtractYear('data'), _mes=ExtractMonth('data'))
+        .values('_ano', '_mes')
+        .annotate(**_totais())
+        .order_by('_ano', '_mes')
+    )
+    return [
+        (linha['_ano'] * 100 + linha['_mes'], linha['debitos'] or ZERO, linha['creditos'] or ZERO)
+        for linha in linhas
+    ]
+
+
+def _linhas_encadeadas(conta_id, meses, abertura=ZERO):
+    """SaldoMensalConta de cada mês, com a abertura = fecho do mês anterior."""
+    linhas = []
+    for periodo, debitos, creditos in meses:
+        linhas.append(SaldoMensalConta(
+            conta_id=conta_id, periodo=periodo,
+            saldo_abertura=abertura, debitos=debitos, creditos=creditos,
+        ))
+        abertura = abertura + creditos - debitos
+    return linhas
+
+
+# ----- Manutenção ----- #
+
+def recalcular_saldos_conta(conta_id, desde=None):
+    """
+    Recalcula os saldos mensais de uma conta a partir do mês da data
+    `desde` (ou de sempre): um movimento muda a abertura de todos os
+    meses seguintes.
+    """
+    movimentos = MovimentoBancario.objects.filter(pgc_id=conta_id)
+    saldos = SaldoMensalConta.objects.filter(conta_id=conta_id)
+    abertura = ZERO
+    if desde is not None:
+        movimentos = movimentos.filter(data__gte=desde.replace(day=1))
+        saldos = saldos.filter(periodo__gte=_periodo(desde))
+        anterior = (
+            SaldoMensalConta.objects
+            .filter(conta_id=conta_id, periodo__lt=_periodo(desde))
+            .order_by('-periodo')
+            .first()
+        )
+        if anterior is not None:
+            abertura = anterior.saldo_fecho
+
+    with transaction.atomic():
+        saldos.delete()
+        SaldoMensalConta.objects.bulk_create(
+            _linhas_encadeadas(conta_id, _meses(movimentos), abertura)
+        )
+
+
+def agendar_recalculo_saldos(*chaves):
+    """Recalcula as contas das chaves (conta_id, data) depois do commit."""
+    desde = {}
+    for chave in chaves:
+        if not chave or not all(chave):
+            continue
+        conta_id, data = chave
+        desde[conta_id] = min(data, desde.get(conta_id, data))
+    if not desde:
+        return
+
+    def _executar():
+        for conta_id, data in desde.items():
+            recalcular_saldos_conta(conta_id, data)
+
+    transaction.on_commit(_executar)
+
+
+def reconstruir_saldos():
+    """Recria SaldoMensalConta de raiz: um GROUP BY (conta, mês) e bulk_create."""
+    por_conta = {}
+    linhas = (
+        MovimentoBancario.objects.order_by()
+        .annotate(_ano=ExtractYear('data'), _mes=ExtractMonth('data'))
+        .values('pgc_id', '_ano', '_mes')
+        .annotate(**_totais())
+        .order_by('pgc_id', '_ano', '_mes')
+    )
+    for linha in linhas:
+        por_conta.setdefault(linha['pgc_id'], []).append(
+            (linha['_ano'] * 100 + linha['_mes'], linha['debitos'] or ZERO, linha['creditos'] or ZERO)
+        )
+
+    novas = []
+    for conta_id, meses in por_conta.items():
+        novas.extend(_linhas_encadeadas(conta_id, meses))
+
+    with transaction.atomic():
+        SaldoMensalConta.objects.all().delete()
+        SaldoMensalConta.objects.bulk_create(novas, batch_size=TAMANHO_LOTE)
+    return len(novas)
+
+
+# ----- Consulta ----- #
+
+def saldo_antes_de(conta_id, data):
+    """Saldo em bruto da conta no início do dia `data`."""
+    periodo = _periodo(data)
+    linha = (
+        SaldoMensalConta.objects
+        .filter(conta_id=conta_id, periodo__lte=periodo)
+        .order_by('-periodo')
+        .first()
+    )
+    if linha is None:
+        return ZERO
+    if linha.periodo < periodo:
+        # sem movimentos entre o fim desse mês e a data
+        return linha.saldo_fecho
+
+    saldo = linha.saldo_abertura
+    if data.day > 1:
+        parcial = (
+            MovimentoBancario.objects
+            .filter(pgc_id=conta_id, data__gte=data.replace(day=1), data__lt=data)
+            .aggregate(**_totais())
+        )
+        saldo += (parcial['creditos'] or ZERO) - (parcial['debitos'] or ZERO)
+    return saldo
+
+
+def extrato_conta(conta, data_inicio, data_fim):
+    """
+    Movimentos da conta entre as datas (inclusive) com o saldo corrido
+    (`m.saldo`), mais a abertura, os totais e o fecho do intervalo, já com
+    o sinal da natureza da conta.
+    """
+    abertura = saldo_antes_de(conta.pk, data_inicio)
+
+    movimentos = (
+        MovimentoBancario.objects
+        .filter(pgc=conta, data__gte=data_inicio, data__lte=data_fim)
+        .select_related('sector', 'autocarro')
+        .annotate(
+            saldo_corrido=Window(
+                Sum(_valor_com_sinal()),
+                order_by=[F('data').asc(), F('criado_em').asc(), F('id').asc()],
+                frame=RowRange(start=None, end=0),
+            ) + Value(abertura, output_field=DecimalField(max_digits=16, decimal_places=2)),
+        )
+        .order_by('data', 'criado_em', 'id')
+    )
+    movimentos = list(movimentos)
+    for movimento in movimentos:
+        movimento.saldo = com_sinal(movimento.saldo_corrido, conta.natureza)
+
+    totais = (
+        MovimentoBancario.objects
+        .filter(pgc=conta, data__gte=data_inicio, data__lte=data_fim)
+        .aggregate(**_totais())
+    )
+    debitos = totais['debitos'] or ZERO
+    creditos = totais['creditos'] or ZERO
+    return {
+        'movimentos': movimentos,
+        'saldo_abertura': com_sinal(abertura, conta.natureza),
+        'total_debitos': debitos.quantize(CENTIMOS),
+        'total_creditos': creditos.quantize(CENTIMOS),
+        'saldo_fecho': com_sinal(abertura + creditos - debitos, conta.natureza),
+    }
+
+
+# ----- Balancete ----- #
+
+def _aberturas(data):
+    """Saldo em bruto de todas as contas no início do dia `data`: {conta_id: valor}."""
+    aberturas = dict(
+        SaldoMensalConta.objects
+        .filter(periodo__lt=_periodo(data))
+        .order_by()
+        .values('conta_id')
+        .annotate(saldo=Sum(F('creditos') - F('debitos')))
+        .values_list('conta_id', 'saldo')
+    )
+    if data.day > 1:
+        parciais = (
+            MovimentoBancario.objects
+            .filter(data__gte=data.replace(day=1), data__lt=data)
+            .order_by()
+            .values('pgc_id')
+            .annotate(**_totais())
+        )
+        for linha in parciais:
+            aberturas[linha['pgc_id']] = (
+                (aberturas.get(linha['pgc_id']) or ZERO)
+                + (linha['creditos'] or ZERO) - (linha['debitos'] or ZERO)
+            )
+    return aberturas
+
+
+def balancete(data_inicio, data_fim):
+    """
+    Lista das contas pela ordem da árvore, cada uma com saldo inicial,
+    débitos, créditos e saldo final do período (as Sintéticas com a soma
+    das filhas), já com o sinal da natureza.
+    """
+    contas = list(
+        PlanoContas.objects
+        .order_by('tree_id', 'lft')
+        .values('id', 'codigo', 'nome', 'tipo', 'natureza', 'ativo', 'parent_id', 'level')
+    )
+    aberturas = _aberturas(data_inicio)
+    movimentos = {
+        linha['pgc_id']: linha
+        for linha in (
+            MovimentoBancario.objects
+            .filter(data__gte=data_inicio, data__lte=data_fim)
+            .order_by()
+            .values('pgc_id')
+            .annotate(**_totais())
+        )
+    }
+
+    por_id = {}
+    for conta in contas:
+        linha = movimentos.get(conta['id'], {})
+        conta['abertura'] = aberturas.get(conta['id']) or ZERO
+        conta['debitos'] = linha.get('debitos') or ZERO
+        conta['creditos'] = linha.get('creditos') or ZERO
+        por_id[conta['id']] = conta
+
+    for conta in reversed(contas):
+        mae = por_id.get(conta['parent_id'])
+        if mae is not None:
+            mae['abertura'] += conta['abertura']
+            mae['debitos'] += conta['debitos']
+            mae['creditos'] += conta['creditos']
+
+    for conta in contas:
+        abertura = conta.pop('abertura')
+        conta['saldo_inicial'] = com_sinal(abertura, conta['natureza'])
+        conta['saldo_final'] = com_sinal(abertura + conta['creditos'] - conta['debitos'], conta['natureza'])
+        conta['debitos'] = conta['debitos'].quantize(CENTIMOS)
+        conta['creditos'] = conta['creditos'].quantize(CENTIMOS)
+    return contas
+
+
+def balancete_em_cache(data_inicio, data_fim):
+    """balancete() guardado em cache_resultados até mudar um movimento até data_fim."""
+    return em_cache(
+        'balancete',
+        lambda: balancete(data_inicio, data_fim),
+        versao_dados(None, data_fim),
+        inicio=data_inicio.isoformat(),
+        fim=data_fim.isoformat(),
+    )
+
+
+def arvore_balancete(contas):
+    """Raízes do balancete, cada conta com a lista das `filhas`."""
+    raizes = []
+    por_id = {}
+    for conta in contas:
+        no = dict(conta, filhas=[])
+        por_id[conta['id']] = no
+        mae = por_id.get(conta['parent_id'])
+        (mae['filhas'] if mae is not None else raizes).append(no)
+    return raizes
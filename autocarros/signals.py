@@ -0,0 +1,223 @@
+"""
+Signals da app autocarros.
+
+Mantêm as tabelas de resumo atualizadas sempre que uma linha de origem é
+gravada ou apagada:
+- ResumoDiarioAutocarro: RegistoDiario e DespesaCombustivel;
+- ResumoMensalSector: RegistoDiario, RelatorioSector, DespesaCombustivel,
+  Despesa, Despesa2 e DespesaFixa (e mudança de sector de um Autocarro);
+- SaldoMensalConta: MovimentoBancario;
+- EstoqueMensalPeca (e Peca.quantidade_estoque): Movimentacao;
+- OdometroAutocarro: RegistroKMItem, Manutencao, Troca, TrocaBateria e
+  RegistoDiario.
+
+Depois de cada escrita incrementam também a versão dos dados do mês (ou a
+geral, para despesas fixas, autocarros, sectores e contas do Plano de
+Contas), o que invalida os resultados guardados em cache_resultados.
+
+Operações em massa (update(), bulk_create()) não disparam signals — nesses
+casos usar `reconstruir_resumos_diarios` / `reconstruir_resumos_mensais`
+(e `reconstruir_saldos_contas` para movimentos bancários,
+`reconstruir_odometros` para leituras de km, `reconstruir_estoque_pecas`
+para movimentações de peças).
+Para apagar ou gravar muitas linhas de uma vez, `resumos_em_pausa()` desliga
+estes signals (o Django volta a poder apagar em massa) e quem o usa
+reconstrói os resumos no fim.
+"""
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache_resultados import agendar_invalidacao, periodo
+from .models import (
+    Autocarro, DespesaCombustivel, DespesaFixa, Manutencao, Movimentacao, MovimentoBancario, PlanoContas,
+    RegistoDiario, RegistroKMItem, Sector, Troca, TrocaBateria, VersaoDados,
+)
+from .resumos import (
+    MODELOS_RESUMO_MENSAL, agendar_recalculo, agendar_recalculo_mensal, chave_mensal,
+)
+from .estoque import agendar_recalculo_estoque
+from .odometro import agendar_recalculo_odometro
+from .saldos import agendar_recalculo_saldos
+
+
+MODELOS_RESUMO_DIARIO = (RegistoDiario, DespesaCombustivel)
+MODELOS_ODOMETRO = (RegistroKMItem, Manutencao, Troca, TrocaBateria, RegistoDiario)
+
+
+def _chave_diaria(instance):
+    return (instance.autocarro_id, instance.data)
+
+
+def _periodos(sender, *chaves):
+    """Versões a incrementar para as chaves (ano, mes, sector) de uma escrita."""
+    if sender is DespesaFixa:
+        # as mensais contam em todos os meses a partir de data_inicio
+        return [VersaoDados.GERAL]
+    return [periodo(chave[0], chave[1]) for chave in chaves if chave]
+
+
+def guardar_estado_anterior(sender, instance, **kwargs):
+    """Guarda as chaves antigas para recalcular também o dia/mês de origem."""
+    instance._chave_diaria_anterior = None
+    instance._chave_mensal_anterior = None
+    if not instance.pk:
+        return
+    anterior = sender.objects.filter(pk=instance.pk).first()
+    if anterior is None:
+        return
+    if sender in MODELOS_RESUMO_DIARIO:
+        instance._chave_diaria_anterior = _chave_diaria(anterior)
+    instance._chave_mensal_anterior = chave_mensal(anterior)
+
+
+def atualizar_resumos(sender, instance, **kwargs):
+    if sender in MODELOS_RESUMO_DIARIO:
+        agendar_recalculo(_chave_diaria(instance), getattr(instance, '_chave_diaria_anterior', None))
+    chaves = (chave_mensal(instance), getattr(instance, '_chave_mensal_anterior', None))
+    agendar_recalculo_mensal(*chaves)
+    agendar_invalidacao(*_periodos(sender, *chaves))
+
+
+def remover_dos_resumos(sender, instance, **kwargs):
+    if sender in MODELOS_RESUMO_DIARIO:
+        agendar_recalculo(_chave_diaria(instance))
+    chave = chave_mensal(instance)
+    agendar_recalculo_mensal(chave)
+    agendar_invalidacao(*_periodos(sender, chave))
+
+
+def _ligacoes_resumos():
+    for modelo in MODELOS_RESUMO_MENSAL:
+        yield pre_save, guardar_estado_anterior, modelo, f'resumos_pre_save_{modelo.__name__}'
+        yield post_save, atualizar_resumos, modelo, f'resumos_post_save_{modelo.__name__}'
+        yield post_delete, remover_dos_resumos, modelo, f'resumos_post_delete_{modelo.__name__}'
+
+
+for _signal, _receiver, _modelo, _uid in _ligacoes_resumos():
+    _signal.connect(_receiver, sender=_modelo, dispatch_uid=_uid)
+
+
+@receiver(pre_save, sender=Autocarro)
+def guardar_sector_anterior(sender, instance, **kwargs):
+    instance._sector_anterior_id = None
+    if instance.pk:
+        instance._sector_anterior_id = (
+            Autocarro.objects.filter(pk=instance.pk).values_list('sector_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Autocarro)
+def mover_registos_de_sector(sender, instance, created, **kwargs):
+    """Se o autocarro mudou de sector, os meses dos seus registos mudam de célula."""
+    anterior = getattr(instance, '_sector_anterior_id', None)
+    if created or anterior == instance.sector_id:
+        return
+    meses = {
+        (d.year, d.month)
+        for d in RegistoDiario.objects.filter(autocarro=instance).dates('data', 'month')
+    }
+    chaves = []
+    for ano, mes in meses:
+        chaves.append((ano, mes, anterior))
+        chaves.append((ano, mes, instance.sector_id))
+    agendar_recalculo_mensal(*chaves)
+
+
+def invalidar_cadastros(sender, **kwargs):
+    """Nomes, números, sectores e contas aparecem nos painéis: invalida tudo."""
+    agendar_invalidacao(VersaoDados.GERAL)
+
+
+for _modelo in (Autocarro, Sector, PlanoContas):
+    post_save.connect(invalidar_cadastros, sender=_modelo, dispatch_uid=f'cache_post_save_{_modelo.__name__}')
+    post_delete.connect(invalidar_cadastros, sender=_modelo, dispatch_uid=f'cache_post_delete_{_modelo.__name__}')
+
+
+def _periodo_movimento(data):
+    return periodo(data.year, data.month) if data else None
+
+
+@receiver(pre_save, sender=MovimentoBancario)
+def guardar_conta_anterior(sender, instance, **kwargs):
+    instance._chave_saldo_anterior = None
+    if instance.pk:
+        instance._chave_saldo_anterior = (
+            MovimentoBancario.objects.filter(pk=instance.pk).values_list('pgc_id', 'data').first()
+        )
+
+
+@receiver(post_save, sender=MovimentoBancario)
+def atualizar_saldos(sender, instance, **kwargs):
+    """Um movimento muda o saldo do seu mês e a abertura dos meses seguintes."""
+    anterior = getattr(instance, '_chave_saldo_anterior', None)
+    agendar_recalculo_saldos((instance.pgc_id, instance.data), anterior)
+    agendar_invalidacao(_periodo_movimento(instance.data), anterior and _periodo_movimento(anterior[1]))
+
+
+@receiver(post_delete, sender=MovimentoBancario)
+def remover_dos_saldos(sender, instance, **kwargs):
+    agendar_recalculo_saldos((instance.pgc_id, instance.data))
+    agendar_invalidacao(_periodo_movimento(instance.data))
+
+
+@receiver(pre_save, sender=Movimentacao)
+def guardar_peca_anterior(sender, instance, **kwargs):
+    instance._chave_estoque_anterior = None
+    if instance.pk:
+        instance._chave_estoque_anterior = (
+            Movimentacao.objects.filter(pk=instance.pk).values_list('peca_id', 'data').first()
+        )
+
+
+@receiver(post_save, sender=Movimentacao)
+def atualizar_estoque(sender, instance, **kwargs):
+    """Uma movimentação muda o estoque do seu mês e a abertura dos meses seguintes."""
+    agendar_recalculo_estoque((instance.peca_id, instance.data), getattr(instance, '_chave_estoque_anterior', None))
+
+
+@receiver(post_delete, sender=Movimentacao)
+def remover_do_estoque(sender, instance, **kwargs):
+    agendar_recalculo_estoque((instance.peca_id, instance.data))
+
+
+def guardar_autocarro_anterior(sender, instance, **kwargs):
+    instance._autocarro_anterior_id = None
+    if instance.pk:
+        instance._autocarro_anterior_id = (
+            sender.objects.filter(pk=instance.pk).values_list('autocarro_id', flat=True).first()
+        )
+
+
+def atualizar_odometro(sender, instance, **kwargs):
+    """Uma leitura de km ou um registo diário muda o km atual do autocarro."""
+    agendar_recalculo_odometro(instance.autocarro_id, getattr(instance, '_autocarro_anterior_id', None))
+
+
+def remover_do_odometro(sender, instance, **kwargs):
+    agendar_recalculo_odometro(instance.autocarro_id)
+
+
+def _ligacoes_odometro():
+    for modelo in MODELOS_ODOMETRO:
+        yield pre_save, guardar_autocarro_anterior, modelo, f'odometro_pre_save_{modelo.__name__}'
+        yield post_save, atualizar_odometro, modelo, f'odometro_post_save_{modelo.__name__}'
+        yield post_delete, remover_do_odometro, modelo, f'odometro_post_delete_{modelo.__name__}'
+
+
+for _signal, _receiver, _modelo, _uid in _ligacoes_odometro():
+    _signal.connect(_receiver, sender=_modelo, dispatch_uid=_uid)
+
+
+@contextmanager
+def resumos_em_pausa():
+    """Desliga os signals dos resumos e do odómetro durante uma operação em massa."""
+    ligacoes = list(_ligacoes_resumos()) + list(_ligacoes_odometro())
+    for signal, _, modelo, uid in ligacoes:
+        signal.disconnect(sender=modelo, dispatch_uid=uid)
+    try:
+        yield
+    finally:
+        for signal, funcao, modelo, uid in ligacoes:
+            signal.connect(funcao, sender=modelo, dispatch_uid=uid)
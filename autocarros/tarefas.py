@@ -0,0 +1,114 @@
+"""
+Exportações em segundo plano.
+
+enfileirar_exportacao() cria (ou reaproveita) um ExportacaoJob e entrega-o:
+- modo eager (EXPORTACOES_EAGER, por omissão quando não há broker): corre no
+  próprio processo logo após o commit — chega para desenvolvimento;
+- caso contrário: task Celery `autocarros.tasks.executar_exportacao_task`,
+  executada pelo worker que o render.yaml arranca ao lado do gunicorn.
+
+Pedidos com o mesmo tipo, os mesmos parâmetros e a mesma versão dos dados
+têm a mesma chave e reaproveitam o ficheiro já gerado (ou o job em curso).
+"""
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from .cache_resultados import versao_mes
+from .documentos import relatorio_dashboard_docx
+from .models import ExportacaoJob
+
+
+logger = logging.getLogger(__name__)
+
+# tipo -> (gerador(**parametros) -> (bytes, nome), versão dos dados(**parametros))
+GERADORES = {
+    'relatorio_dashboard': (relatorio_dashboard_docx, versao_mes),
+}
+
+
+def chave_exportacao(tipo, parametros):
+    """sha256 de tipo + parâmetros + versão atual dos dados."""
+    _, versao = GERADORES[tipo]
+    base = json.dumps(
+        {'tipo': tipo, 'parametros': parametros, 'versao': versao(**parametros)},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(base.encode('utf-8')).hexdigest()
+
+
+def _reaproveitavel(job):
+    if job.estado == ExportacaoJob.CONCLUIDO:
+        return bool(job.ficheiro) and job.ficheiro.storage.exists(job.ficheiro.name)
+    # pendente / em curso: só enquanto não passar do tempo limite (worker parado)
+    limite = timedelta(seconds=getattr(settings, 'EXPORTACOES_TEMPO_LIMITE', 15 * 60))
+    return job.criado_em >= timezone.now() - limite
+
+
+def enfileirar_exportacao(tipo, parametros, utilizador=None):
+    """Devolve o ExportacaoJob para estes parâmetros, criando-o se preciso."""
+    if tipo not in GERADORES:
+        raise ValueError(f"Tipo de exportação desconhecido: {tipo}")
+
+    chave = chave_exportacao(tipo, parametros)
+    existente = (
+        ExportacaoJob.objects
+        .filter(chave=chave)
+        .exclude(estado=ExportacaoJob.ERRO)
+        .order_by('-criado_em')
+        .first()
+    )
+    if existente is not None and _reaproveitavel(existente):
+        return existente
+
+    job = ExportacaoJob.objects.create(
+        tipo=tipo,
+        parametros=parametros,
+        chave=chave,
+        criado_por=utilizador,
+    )
+    transaction.on_commit(lambda: _despachar(job.pk))
+    return job
+
+
+def _despachar(job_id):
+    if getattr(settings, 'EXPORTACOES_EAGER', True):
+        executar_exportacao(job_id)
+        return
+    from .tasks import executar_exportacao_task
+    executar_exportacao_task.delay(str(job_id))
+
+
+def executar_exportacao(job_id):
+    """Gera o ficheiro do job. Corre no worker (ou no processo, em modo eager)."""
+    # Só quem passa o job de pendente para em curso o executa.
+    if not ExportacaoJob.objects.filter(pk=job_id, estado=ExportacaoJob.PENDENTE).update(
+        estado=ExportacaoJob.EM_CURSO
+    ):
+        return None
+
+    job = ExportacaoJob.objects.get(pk=job_id)
+    gerador, _ = GERADORES[job.tipo]
+    try:
+        conteudo, nome = gerador(**job.parametros)
+    except Exception as exc:
+        logger.exception("Falha na exportação %s (%s)", job.pk, job.tipo)
+        job.estado = ExportacaoJob.ERRO
+        job.erro = str(exc)
+        job.concluido_em = timezone.now()
+        job.save(update_fields=['estado', 'erro', 'concluido_em'])
+        return job
+
+    job.nome_ficheiro = nome
+    job.ficheiro.save(nome, ContentFile(conteudo), save=False)
+    job.estado = ExportacaoJob.CONCLUIDO
+    job.concluido_em = timezone.now()
+    job.save(update_fields=['nome_ficheiro', 'ficheiro', 'estado', 'concluido_em'])
+    return job
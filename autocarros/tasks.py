@@ -0,0 +1,13 @@
+"""
+Tasks Celery da app (descobertas pelo worker com autodiscover_tasks).
+
+Arrancar o worker com:  celery -A gestao_autocarros worker -l info
+"""
+from celery import shared_task
+
+from .tarefas import executar_exportacao
+
+
+@shared_task(name='autocarros.executar_exportacao')
+def executar_exportacao_task(job_id):
+    executar_exportacao(job_id)
@@ -1,3 +1,491 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from autocarros import integridade
+from autocarros.management.commands.explicar_consultas import consultas_mensais, usa_indice
+from autocarros.models import (
+    Autocarro, CobradorViagem, CustomUser, Despesa, Despesa2, DespesaCombustivel, DespesaFixa, ExportacaoJob,
+    RegistoDiario, RelatorioSector, ResumoDiarioAutocarro, ResumoMensalSector, Sector,
+)
+from autocarros.periodos import filtro_periodo
+from autocarros.resumos import agendar_resumos_dia, reconstruir_resumos, reconstruir_resumos_mensais
+from autocarros.signals import resumos_em_pausa
+
+
+def _linhas(modelo, *chave):
+    """{chave: valores} de todas as linhas de uma tabela de resumo, sem id nem atualizado_em."""
+    campos = [campo.attname for campo in modelo._meta.concrete_fields if campo.name not in ("id", "atualizado_em")]
+    return {tuple(linha[c] for c in chave): linha for linha in modelo.objects.values(*campos)}
+
+
+class ConsultasPorPeriodoTests(TestCase):
+    """
+    As consultas por período dos relatórios têm de ser resolvidas pelos
+    índices (filtros sargáveis de periodos.py). A base é populada com o
+    gerador de dados sintéticos.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "gerar_dados_sinteticos", sectores=2, autocarros=5, dias=60, ate="2026-03-31", stdout=StringIO(),
+        )
+        cls.sector_id = Sector.objects.values_list("pk", flat=True).first()
+
+    def setUp(self):
+        if connection.vendor == "postgresql":
+            # em tabelas pequenas o planner prefere um seq scan mesmo com índice
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+
+    def test_consultas_do_periodo_usam_indice(self):
+        for nome, queryset in consultas_mensais(2026, 3, self.sector_id, dia=15).items():
+            with self.subTest(nome):
+                plano = queryset.explain()
+                self.assertTrue(usa_indice(plano), f"{nome} sem índice:\n{plano}")
+
+    def test_consultas_do_periodo_nao_extraem_partes_da_data(self):
+        # EXTRACT / django_date_extract sobre a coluna: o índice só serve
+        # para o intervalo e o dia é filtrado linha a linha
+        for nome, queryset in consultas_mensais(2026, 3, self.sector_id, dia=15).items():
+            with self.subTest(nome):
+                self.assertNotIn("extract", str(queryset.query).lower())
+
+    def test_dia_do_mes_e_a_propria_data(self):
+        self.assertEqual(filtro_periodo("data", "2026", "3", "15"), {"data": date(2026, 3, 15)})
+        for modelo in (RegistoDiario, DespesaCombustivel):
+            with self.subTest(modelo.__name__):
+                do_dia = modelo.objects.filter(**filtro_periodo("data", 2026, 3, 15))
+                extraido = modelo.objects.filter(data__year=2026, data__month=3, data__day=15)
+                self.assertGreater(do_dia.count(), 0)
+                self.assertEqual(set(do_dia.values_list("pk", flat=True)), set(extraido.values_list("pk", flat=True)))
+
+    def test_dia_inexistente_nao_devolve_registos(self):
+        self.assertFalse(RegistoDiario.objects.filter(**filtro_periodo("data", 2026, 2, 31)).exists())
+
+    def test_dia_sem_mes_continua_a_filtrar_pelo_dia(self):
+        filtro = filtro_periodo("data", 2026, None, 15)
+        self.assertEqual(filtro["data__day"], 15)
+        self.assertEqual(
+            RegistoDiario.objects.filter(**filtro).count(),
+            RegistoDiario.objects.filter(data__year=2026, data__day=15).count(),
+        )
+
+
+class SincronizacaoViagensTests(TestCase):
+    """Contrato de cobrador_viagens_sync: um resultado por viagem, sem duplicar reenvios."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cobrador = CustomUser.objects.create_user("cobrador", password="x")
+        sector = Sector.objects.create(nome="Sector A")
+        cls.autocarro = Autocarro.objects.create(numero="A-01", modelo="Yutong", placa="LD-01", sector=sector)
+
+    def setUp(self):
+        self.client.force_login(self.cobrador)
+
+    def enviar(self, *viagens):
+        resposta = self.client.post(
+            reverse("cobrador_viagens_sync"), json.dumps({"viagens": list(viagens)}), content_type="application/json",
+        )
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json()["resultados"]
+
+    def viagem(self, chave, **campos):
+        return {"chave": chave, "autocarro_numero": "A-01", "data": "2026-03-02", "valor": "1500.00", **campos}
+
+    def test_reenvio_devolve_existente_com_o_mesmo_id(self):
+        [primeiro] = self.enviar(self.viagem("k1"))
+        self.assertEqual(primeiro["estado"], "criada")
+
+        [reenvio] = self.enviar(self.viagem("k1"))
+        self.assertEqual(reenvio, {"chave": "k1", "estado": "existente", "viagem_id": primeiro["viagem_id"]})
+        self.assertEqual(CobradorViagem.objects.filter(cobrador=self.cobrador).count(), 1)
+
+    def test_erros_ficam_na_propria_viagem(self):
+        resultados = self.enviar(
+            self.viagem("k1"),
+            self.viagem("k1", valor="20.00"),
+            self.viagem("k2", autocarro_numero="NAO-EXISTE"),
+            self.viagem("k3", data="02/03/2026"),
+            self.viagem("k4"),
+        )
+        self.assertEqual([r["estado"] for r in resultados], ["criada", "erro", "erro", "erro", "criada"])
+        self.assertEqual(resultados[1]["erro"], "chave repetida no envio")
+        self.assertEqual(resultados[2]["erro"], "Autocarro não encontrado")
+        self.assertIn("data inválida", resultados[3]["erro"])
+        self.assertEqual(
+            set(CobradorViagem.objects.values_list("chave_sincronizacao", flat=True)), {"k1", "k4"},
+        )
+
+    def test_valor_fora_da_coluna_nao_perde_o_lote(self):
+        # DecimalField(max_digits=12, decimal_places=2)
+        resultados = self.enviar(
+            self.viagem("grande", valor="12345678901.00"),
+            self.viagem("casas", valor="10.005"),
+            self.viagem("nan", valor="NaN"),
+            self.viagem("ok", valor="9999999999.99"),
+        )
+        self.assertEqual([r["estado"] for r in resultados], ["erro", "erro", "erro", "criada"])
+        self.assertEqual(resultados[0]["erro"], "valor inválido")
+        self.assertEqual(CobradorViagem.objects.get(chave_sincronizacao="ok").valor, Decimal("9999999999.99"))
+
+
+@override_settings(EXPORTACOES_EAGER=True)
+class ExportacoesTests(TestCase):
+    """Pedido -> estado -> download do relatório do dashboard, em modo eager."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user("admin", password="x", nivel_acesso="admin")
+        cls.sector = Sector.objects.create(nome="Sector A")
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.client.force_login(self.admin)
+
+    def pedir(self, mes="2026-03"):
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.get(reverse("exportar_relatorio_dashboard"), {"mes": mes})
+        self.assertEqual(resposta.status_code, 302)
+        return ExportacaoJob.objects.get(pk=resposta.url.rstrip("/").rsplit("/", 1)[-1])
+
+    def test_pedido_estado_e_download(self):
+        job = self.pedir()
+        estado = self.client.get(reverse("exportacao_estado", args=[job.pk]), {"formato": "json"}).json()
+        self.assertEqual(estado["estado"], ExportacaoJob.CONCLUIDO)
+        self.assertEqual(estado["download_url"], reverse("exportacao_download", args=[job.pk]))
+
+        download = self.client.get(estado["download_url"])
+        self.assertEqual(download.status_code, 200)
+        self.assertIn(job.nome_ficheiro, download["Content-Disposition"])
+        self.assertTrue(b"".join(download.streaming_content).startswith(b"PK"))  # .docx é um zip
+
+    def test_pedido_igual_reaproveita_o_job(self):
+        primeiro = self.pedir()
+        self.assertEqual(self.pedir(), primeiro)
+        self.assertEqual(ExportacaoJob.objects.count(), 1)
+
+        # outro mês, ou os mesmos parâmetros com dados novos, geram outro ficheiro
+        self.assertNotEqual(self.pedir("2026-02"), primeiro)
+        with self.captureOnCommitCallbacks(execute=True):
+            Despesa.objects.create(sector=self.sector, data=date(2026, 3, 5), valor=Decimal("100"), descricao="Oficina")
+        self.assertNotEqual(self.pedir(), primeiro)
+        self.assertEqual(ExportacaoJob.objects.filter(estado=ExportacaoJob.CONCLUIDO).count(), 3)
+
+
+class ResumoDiarioTests(TestCase):
+    """
+    ResumoDiarioAutocarro mantido pelos signals (depois do commit) tem de
+    ficar igual ao que reconstruir_resumos_diarios refaz de raiz.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "gerar_dados_sinteticos", sectores=2, autocarros=3, dias=30, ate="2026-03-31", stdout=StringIO(),
+        )
+
+    def gravar(self):
+        # os signals recalculam no on_commit, que o TestCase nunca chega a fazer
+        return self.captureOnCommitCallbacks(execute=True)
+
+    def resumo(self, autocarro_id, data):
+        return ResumoDiarioAutocarro.objects.filter(autocarro_id=autocarro_id, data=data).first()
+
+    def combustivel(self, autocarro_id, data):
+        return DespesaCombustivel.objects.filter(autocarro_id=autocarro_id, data=data).aggregate(
+            total=Sum("valor"),
+        )["total"] or Decimal("0")
+
+    def registo(self, com_combustivel):
+        dias_com_combustivel = set(DespesaCombustivel.objects.values_list("autocarro_id", "data"))
+        for registo in RegistoDiario.objects.order_by("pk"):
+            if ((registo.autocarro_id, registo.data) in dias_com_combustivel) == com_combustivel:
+                return registo
+        self.fail("dados sintéticos sem o caso pedido")
+
+    def assertIgualAReconstrucao(self):
+        mantido = _linhas(ResumoDiarioAutocarro, "autocarro_id", "data")
+        reconstruir_resumos()
+        self.assertEqual(mantido, _linhas(ResumoDiarioAutocarro, "autocarro_id", "data"))
+
+    def test_registo_gravado_e_apagado(self):
+        registo = self.registo(com_combustivel=True)
+        antes = self.resumo(registo.autocarro_id, registo.data)
+        with self.gravar():
+            registo.normal += 1000
+            registo.save()
+        depois = self.resumo(registo.autocarro_id, registo.data)
+        self.assertEqual(depois.entradas, antes.entradas + 1000)
+        self.assertEqual(depois.saldo, antes.saldo + 1000)
+
+        # o combustível desse dia continua no resumo, já sem registo
+        with self.gravar():
+            registo.delete()
+        depois = self.resumo(registo.autocarro_id, registo.data)
+        self.assertIsNone(depois.registo_id)
+        self.assertEqual(depois.entradas, 0)
+        self.assertEqual(depois.combustivel, antes.combustivel)
+
+        registo = self.registo(com_combustivel=False)
+        with self.gravar():
+            registo.delete()
+        self.assertIsNone(self.resumo(registo.autocarro_id, registo.data))
+        self.assertIgualAReconstrucao()
+
+    def test_combustivel_gravado_e_apagado(self):
+        registo = self.registo(com_combustivel=False)
+        antes = self.resumo(registo.autocarro_id, registo.data)
+        with self.gravar():
+            despesa = DespesaCombustivel.objects.create(
+                sector_id=registo.autocarro.sector_id, autocarro_id=registo.autocarro_id, data=registo.data,
+                valor=Decimal("30000"), valor_litros=Decimal("100"), lavagem=Decimal("500"),
+            )
+        depois = self.resumo(registo.autocarro_id, registo.data)
+        self.assertEqual(depois.combustivel, Decimal("30000"))
+        self.assertEqual(depois.combustivel_litros, Decimal("100"))
+        self.assertEqual(depois.saidas, antes.saidas + Decimal("30500"))
+
+        with self.gravar():
+            despesa.delete()
+        self.assertEqual(self.resumo(registo.autocarro_id, registo.data).saidas, antes.saidas)
+
+        # combustível num dia sem registo: a linha existe só enquanto houver despesa
+        dia_sem_registo = date(2026, 4, 10)
+        with self.gravar():
+            despesa = DespesaCombustivel.objects.create(
+                sector_id=registo.autocarro.sector_id, autocarro_id=registo.autocarro_id,
+                data=dia_sem_registo, valor=Decimal("12000"),
+            )
+        self.assertEqual(self.resumo(registo.autocarro_id, dia_sem_registo).combustivel, Decimal("12000"))
+        with self.gravar():
+            despesa.delete()
+        self.assertIsNone(self.resumo(registo.autocarro_id, dia_sem_registo))
+        self.assertIgualAReconstrucao()
+
+    def test_combustivel_mudado_de_dia_e_autocarro(self):
+        despesa = DespesaCombustivel.objects.order_by("pk").first()
+        origem = (despesa.autocarro_id, despesa.data)
+        outro = Autocarro.objects.exclude(pk=despesa.autocarro_id).order_by("pk").first()
+        destino = (outro.pk, despesa.data - timedelta(days=1))
+
+        with self.gravar():
+            despesa.autocarro = outro
+            despesa.sector_id = outro.sector_id
+            despesa.data = destino[1]
+            despesa.save()
+
+        for chave in (origem, destino):
+            with self.subTest(chave=chave):
+                resumo = self.resumo(*chave)
+                self.assertEqual(resumo.combustivel if resumo else Decimal("0"), self.combustivel(*chave))
+        self.assertIgualAReconstrucao()
+
+    def test_escritas_em_massa_com_recalculo_agendado(self):
+        registos = list(RegistoDiario.objects.filter(data=date(2026, 3, 20)))
+        for registo in registos:
+            registo.frete += 700
+        with self.gravar(), resumos_em_pausa():
+            RegistoDiario.objects.bulk_update(registos, ["frete"])
+            self.assertEqual(
+                self.resumo(registos[0].autocarro_id, registos[0].data).entradas,
+                registos[0].entradas_total() - 700,
+            )
+            agendar_resumos_dia(date(2026, 3, 20), {registo.autocarro_id for registo in registos})
+        self.assertEqual(
+            self.resumo(registos[0].autocarro_id, registos[0].data).entradas, registos[0].entradas_total(),
+        )
+        self.assertIgualAReconstrucao()
+
+
+class ResumoMensalTests(TestCase):
+    """
+    Depois de cada escrita, ResumoMensalSector tem de ser igual ao GROUP BY
+    das tabelas de origem (reconstruir_resumos_mensais).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "gerar_dados_sinteticos", sectores=2, autocarros=3, dias=45, ate="2026-03-31", stdout=StringIO(),
+        )
+        cls.sectores = list(Sector.objects.order_by("pk"))
+
+    def assertIgualAoGroupBy(self):
+        mantido = _linhas(ResumoMensalSector, "ano", "mes", "sector_id")
+        reconstruir_resumos_mensais()
+        self.assertEqual(mantido, _linhas(ResumoMensalSector, "ano", "mes", "sector_id"))
+
+    def gravar(self):
+        return self.captureOnCommitCallbacks(execute=True)
+
+    def test_registo_diario_editado_e_mudado_de_mes(self):
+        registo = RegistoDiario.objects.filter(data__month=3).order_by("pk").first()
+        with self.gravar():
+            registo.normal += 2500
+            registo.taxi += 300
+            registo.save()
+        self.assertIgualAoGroupBy()
+
+        outro_dia = date(2026, 2, 27)
+        with self.gravar():
+            RegistoDiario.objects.filter(autocarro=registo.autocarro, data=outro_dia).delete()
+            registo.data = outro_dia
+            registo.save()
+        self.assertIgualAoGroupBy()
+
+    def test_relatorio_sector_editado(self):
+        relatorio = RelatorioSector.objects.order_by("pk").first()
+        with self.gravar():
+            relatorio.despesa_geral += 4000
+            relatorio.alimentacao_estaleiro = 0
+            relatorio.save()
+        self.assertIgualAoGroupBy()
+
+    def test_despesas_editadas(self):
+        despesa = Despesa.objects.order_by("pk").first()
+        with self.gravar():
+            despesa.valor += 1500
+            despesa.sector = next(s for s in self.sectores if s.pk != despesa.sector_id)
+            despesa.save()
+        self.assertIgualAoGroupBy()
+
+        despesa2 = Despesa2.objects.order_by("pk").first()
+        with self.gravar():
+            despesa2.valor += 800
+            despesa2.data = date(2026, 1, 15)
+            despesa2.save()
+        self.assertIgualAoGroupBy()
+
+        with self.gravar():
+            despesa2.delete()
+        self.assertIgualAoGroupBy()
+
+    def test_despesa_fixa_editada(self):
+        fixa = DespesaFixa.objects.order_by("pk").first()
+        with self.gravar():
+            fixa.valor += 10000
+            fixa.data_inicio = date(2026, 3, 1)
+            fixa.save()
+        self.assertIgualAoGroupBy()
+
+        with self.gravar():
+            fixa.ativo = False
+            fixa.save()
+        self.assertIgualAoGroupBy()
+
+    def test_autocarro_mudado_de_sector(self):
+        autocarro = Autocarro.objects.order_by("pk").first()
+        with self.gravar():
+            autocarro.sector = next(s for s in self.sectores if s.pk != autocarro.sector_id)
+            autocarro.save()
+        self.assertIgualAoGroupBy()
+
+
+class IntegridadeTests(TestCase):
+    """Correção dos registos mal arquivados, órfãos e relatórios vazios (integridade.corrigir)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sector = Sector.objects.create(nome="Sector A")
+        cls.a1, cls.a2 = (
+            Autocarro.objects.create(numero=numero, modelo="Yutong", placa=numero, sector=cls.sector)
+            for numero in ("A-01", "A-02")
+        )
+        cls.dia1, cls.dia2, cls.dia3, cls.dia4 = (date(2026, 3, dia) for dia in (1, 2, 3, 4))
+
+        # o relatório do dia 1 tem também o registo do dia 2 do mesmo autocarro
+        cls.relatorio1 = RelatorioSector.objects.create(sector=cls.sector, data=cls.dia1)
+        cls.certo = RegistoDiario.objects.create(
+            autocarro=cls.a1, relatorio=cls.relatorio1, data=cls.dia1, normal=Decimal("1000"),
+        )
+        cls.mal_arquivado = RegistoDiario.objects.create(
+            autocarro=cls.a1, relatorio=cls.relatorio1, data=cls.dia2, normal=Decimal("2000"),
+        )
+        # órfão de um dia sem relatório
+        cls.orfao = RegistoDiario.objects.create(autocarro=cls.a2, data=cls.dia3, normal=Decimal("3000"))
+        cls.vazio = RelatorioSector.objects.create(sector=cls.sector, data=cls.dia4)
+
+    def estado(self):
+        return (
+            sorted(RegistoDiario.objects.values_list("pk", "autocarro_id", "data", "relatorio_id", "normal")),
+            sorted(RelatorioSector.objects.values_list("pk", "sector_id", "data")),
+            ResumoDiarioAutocarro.objects.count(),
+        )
+
+    def test_verificar_conta_os_problemas(self):
+        self.assertEqual(
+            integridade.verificar(), {"mal_arquivados": 1, "orfaos": 1, "relatorios_vazios": 1},
+        )
+
+    def test_simulacao_nao_altera_a_base(self):
+        antes = self.estado()
+        resultado = integridade.corrigir(simular=True)
+        self.assertEqual(self.estado(), antes)
+        self.assertEqual(resultado, integridade.corrigir())
+
+    def test_mal_arquivado_religado_sem_apagar(self):
+        resultado = integridade.corrigir(problemas=("mal_arquivados",))
+        self.assertEqual(resultado["mal_arquivados_ligados"], 1)
+        self.assertEqual(resultado["relatorios_criados"], 1)
+
+        self.mal_arquivado.refresh_from_db()
+        self.assertEqual(self.mal_arquivado.relatorio.data, self.dia2)
+        self.assertEqual(self.mal_arquivado.relatorio.sector, self.sector)
+        self.assertEqual(self.mal_arquivado.normal, Decimal("2000"))
+        self.certo.refresh_from_db()
+        self.assertEqual(self.certo.relatorio, self.relatorio1)
+        self.assertEqual(RegistoDiario.objects.count(), 3)
+
+    def test_repetidos_de_outros_dias_religados_os_dois(self):
+        outros = [
+            RegistoDiario.objects.create(autocarro=self.a2, relatorio=self.relatorio1, data=date(2026, 3, dia))
+            for dia in (5, 6)
+        ]
+        self.assertEqual(integridade.verificar()["mal_arquivados"], 3)
+        integridade.corrigir(problemas=("mal_arquivados",))
+        for registo in outros:
+            registo.refresh_from_db()
+            self.assertEqual(registo.relatorio.data, registo.data)
+
+    def test_orfao_ligado_ao_relatorio_do_sector(self):
+        existente = RelatorioSector.objects.create(sector=self.sector, data=self.dia3)
+        resultado = integridade.corrigir(problemas=("orfaos",))
+        self.assertEqual(resultado["orfaos_ligados"], 1)
+        self.assertEqual(resultado["relatorios_criados"], 0)
+        self.orfao.refresh_from_db()
+        self.assertEqual(self.orfao.relatorio, existente)
+
+    def test_relatorio_vazio_recebe_registos_em_branco(self):
+        resultado = integridade.corrigir(problemas=("vazios",))
+        self.assertEqual(resultado["registos_criados"], 2)
+        registos = RegistoDiario.objects.filter(relatorio=self.vazio)
+        self.assertEqual({r.autocarro_id for r in registos}, {self.a1.pk, self.a2.pk})
+        self.assertTrue(all(r.entradas == 0 for r in registos))
+        # os resumos em pausa durante a correção são refeitos no fim
+        self.assertEqual(ResumoDiarioAutocarro.objects.filter(data=self.dia4).count(), 2)
+
+    def test_correcao_completa(self):
+        resultado = integridade.corrigir()
+        self.assertEqual(resultado, {
+            "mal_arquivados_ligados": 1,
+            "relatorios_criados": 2,
+            "orfaos_ligados": 1,
+            "registos_criados": 2,
+            "vazios_sem_autocarros": 0,
+        })
+        self.assertEqual(integridade.verificar(), {"mal_arquivados": 0, "orfaos": 0, "relatorios_vazios": 0})
+        self.assertEqual(integridade.corrigir(), dict.fromkeys(integridade.DESCRICOES, 0))
@@ -53,6 +53,8 @@ urlpatterns = [
 
     # Painel de Controle
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/cache/', views.cache_estatisticas, name='cache_estatisticas'),
+    path('dashboard/consultas/', views.consultas_estatisticas, name='consultas_estatisticas'),
     path('autocarro/<int:autocarro_id>/', views.detalhe_autocarro, name='detalhe_autocarro'),
 
     # Relatórios Diários por Sector
@@ -70,6 +72,7 @@ urlpatterns = [
     path('relatorios-validados/', views.relatorios_validados, name='relatorios_validados'),
     path('registros/<int:pk>/deletar/', views.deletar_registro, name='deletar_registro'),
     path('registros/deletar-grupo/<int:sector_id>/<str:data>/', views.deletar_registros_sector_data, name='deletar_registros_sector_data'),
+    path('registros/whatsapp/<int:sector_id>/<str:data>/', views.whatsapp_registos_sector_data, name='whatsapp_registos_sector_data'),
 
     # Autocarros
     path('autocarros/', views.listar_autocarros, name='listar_autocarros'),
@@ -131,10 +134,13 @@ urlpatterns = [
 
     #exportar relatório mensal
     path("exportar-relatorio-dashboard/", views.exportar_relatorio_dashboard, name="exportar_relatorio_dashboard"),
+    path("exportacoes/<uuid:job_id>/", views.exportacao_estado, name="exportacao_estado"),
+    path("exportacoes/<uuid:job_id>/download/", views.exportacao_download, name="exportacao_download"),
 
     # Cobrador
     path('cobrador/viagens/', views.cobrador_viagens, name='cobrador_viagens'),
     path('cobrador/viagens/save/', views.cobrador_viagens_save, name='cobrador_viagens_save'),
+    path('cobrador/viagens/sync/', views.cobrador_viagens_sync, name='cobrador_viagens_sync'),
     path('cobrador/viagens/list/', views.cobrador_viagens_list, name='cobrador_viagens_list'),
     path('cobrador/viagens/validate/list/', views.cobrador_viagens_validate_list, name='cobrador_viagens_validate_list'),
     path('cobrador/viagens/validate/action/', views.cobrador_viagens_validate_action, name='cobrador_viagens_validate_action'),
@@ -145,6 +151,7 @@ urlpatterns = [
     path('manutencoes/', views.manutencao_list, name='manutencao_list'),
     path('manutencoes/<int:pk>/edit/', views.manutencao_edit, name='manutencao_edit'),
     path('manutencoes/<int:pk>/delete/', views.manutencao_delete, name='manutencao_delete'),
+    path('manutencoes/vencimentos/', views.vencimentos_list, name='vencimentos_list'),
     path('api/autocarros_por_sector/', views.api_autocarros_por_sector, name='api_autocarros_por_sector'),
     path('registros/km/', views.registro_km_view, name='registro_km'),
     path('registros/km/save/', views.registro_km_save, name='registro_km_save'),
@@ -158,6 +165,7 @@ urlpatterns = [
     path('trocas/<int:pk>/editar/', views.troca_edit, name='troca_edit'),
     path('trocas/<int:pk>/eliminar/', views.troca_delete, name='troca_delete'),
     path('inspecao/', views.inspecao_list, name='inspecao_list'),
+    path('pneus/historico/', views.historico_pneu_list, name='historico_pneu_list'),
 
     # Baterias
     path('baterias/', views.bateria_list, name='bateria_list'),
@@ -219,6 +227,7 @@ urlpatterns = [
         
     #Mapas
     path('mapas/mensal-financeiro/', views.mapa_geral_financeiro, name='mapa_geral_financeiro'),
+    path('mapas/mensal-financeiro/exportar-csv/', views.exportar_mapa_financeiro_csv, name='exportar_mapa_financeiro_csv'),
 
 
     #Inclua isto no urls.py do projeto, por exemplo:
@@ -227,6 +236,8 @@ urlpatterns = [
     path('plano-de-contas/nova/', views.plano_contas_create, name='plano_contas_create'),
     path('plano-de-contas/<int:pk>/editar/', views.plano_contas_edit, name='plano_contas_edit'),
     path('plano-de-contas/<int:pk>/eliminar/', views.plano_contas_delete, name='plano_contas_delete'),
+    path('plano-de-contas/<int:pk>/extrato/', views.conta_extrato, name='conta_extrato'),
+    path('plano-de-contas/balancete/exportar-csv/', views.exportar_balancete_csv, name='exportar_balancete_csv'),
     path('plano-de-contas/sugerir-codigo/', views.sugerir_codigo_ajax, name='sugerir_codigo_ajax'),
     path('plano-de-contas/carregar-padrao/', views.carregar_plano_padrao, name='carregar_plano_padrao'),
 
@@ -0,0 +1,203 @@
+"""
+Motor da lista de vencimentos de manutenção (VencimentoManutencao).
+
+Numa só passagem pela frota junta, por autocarro:
+- a última Manutencao (revisão geral e os km_prox_* de óleos e filtros);
+- a última Troca de pneu de cada posição e a última TrocaBateria de cada
+  posição (km e data previstos da próxima troca);
+- o odómetro atual (OdometroAutocarro), para saber os km em falta e
+  projetar a data em que cada componente vence pela média de km por dia.
+
+As "últimas" de cada chave saem de subconsultas correlacionadas por
+autocarro (e posição), por isso o custo depende do tamanho da frota e não
+dos anos de histórico. O
+resultado é gravado de uma vez: um upsert sobre (autocarro, componente,
+posição) e o delete das linhas que deixaram de existir.
+"""
+import math
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, CharField, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.utils import timezone
+
+from .models import (
+    Autocarro, Manutencao, OdometroAutocarro, Troca, TrocaBateria, VencimentoManutencao,
+)
+
+
+KM_PROXIMO = Decimal('1000')   # mesmo limiar do registo de km
+DIAS_PROXIMO = 30
+TAMANHO_LOTE = 1000
+CAMPOS_VENCIMENTO = [
+    'km_previsto', 'km_em_falta', 'data_prevista', 'data_estimada', 'data_limite',
+    'estado', 'prioridade', 'calculado_em',
+]
+
+# componente -> campo da Manutencao com o km em que vence
+CAMPOS_MANUTENCAO = (
+    ('revisao', 'km_proxima'),
+    ('oleo_motor', 'km_prox_oleo_motor'),
+    ('oleo_diferencial', 'km_prox_oleo_diferencial'),
+    ('oleo_cambio', 'km_prox_oleo_cambio'),
+    ('filtro_combustivel', 'km_prox_filtro_combustivel'),
+    ('filtro_oleo', 'km_prox_filtro_oleo'),
+    ('filtro_ar', 'km_prox_filtro_ar'),
+)
+
+PRIORIDADES = {
+    VencimentoManutencao.ATRASADO: 0,
+    VencimentoManutencao.PROXIMO: 1,
+    VencimentoManutencao.EM_DIA: 2,
+    VencimentoManutencao.SEM_DADOS: 3,
+}
+
+
+def _ultimas(modelo, ordem, autocarro_ids, posicoes=(None,)):
+    """
+    A linha mais recente de `modelo` por autocarro (e por posição, se
+    `posicoes` for dado): uma subconsulta por posição sobre Autocarro, cada
+    uma resolvida pelo índice (autocarro, [local,] data).
+    """
+    anotacoes = {}
+    for n, posicao in enumerate(posicoes):
+        filtro = {'autocarro': OuterRef('pk')}
+        if posicao is not None:
+            filtro['local'] = posicao
+        anotacoes[f'ultima_{n}'] = Subquery(
+            modelo.objects.filter(**filtro).order_by(*ordem).values('pk')[:1]
+        )
+
+    autocarros = Autocarro.objects.all()
+    if autocarro_ids is not None:
+        autocarros = autocarros.filter(pk__in=autocarro_ids)
+    pks = [
+        pk
+        for linha in autocarros.annotate(**anotacoes).values_list(*anotacoes)
+        for pk in linha if pk is not None
+    ]
+    return modelo.objects.filter(pk__in=pks)
+
+
+def _estado(km_em_falta, data_limite, hoje):
+    if km_em_falta is None and data_limite is None:
+        return VencimentoManutencao.SEM_DADOS
+    if (km_em_falta is not None and km_em_falta <= 0) or (data_limite is not None and data_limite <= hoje):
+        return VencimentoManutencao.ATRASADO
+    if (km_em_falta is not None and km_em_falta <= KM_PROXIMO) or (
+        data_limite is not None and data_limite <= hoje + timedelta(days=DIAS_PROXIMO)
+    ):
+        return VencimentoManutencao.PROXIMO
+    return VencimentoManutencao.EM_DIA
+
+
+def com_estado_do_dia(vencimentos, hoje=None):
+    """
+    Anota `estado_hoje` e `prioridade_hoje`, com as regras de _estado
+    aplicadas na consulta a km_em_falta e data_limite. O estado gravado é
+    o do dia do recálculo, e um prazo por data passa a próximo e depois a
+    atrasado sem haver dados novos.
+    """
+    hoje = hoje or timezone.localdate()
+    regras = [
+        (Q(km_em_falta__isnull=True, data_limite__isnull=True), VencimentoManutencao.SEM_DADOS),
+        (Q(km_em_falta__lte=0) | Q(data_limite__lte=hoje), VencimentoManutencao.ATRASADO),
+        (
+            Q(km_em_falta__lte=KM_PROXIMO) | Q(data_limite__lte=hoje + timedelta(days=DIAS_PROXIMO)),
+            VencimentoManutencao.PROXIMO,
+        ),
+    ]
+    return vencimentos.annotate(
+        estado_hoje=Case(
+            *[When(condicao, then=Value(estado)) for condicao, estado in regras],
+            default=Value(VencimentoManutencao.EM_DIA),
+            output_field=CharField(),
+        ),
+        prioridade_hoje=Case(
+            *[When(condicao, then=Value(PRIORIDADES[estado])) for condicao, estado in regras],
+            default=Value(PRIORIDADES[VencimentoManutencao.EM_DIA]),
+            output_field=IntegerField(),
+        ),
+    )
+
+
+def _vencimento(autocarro_id, componente, odometro, hoje, km_previsto=None, data_prevista=None, posicao=''):
+    km_atual = odometro.km_atual if odometro else None
+    km_em_falta = None
+    data_estimada = None
+    if km_previsto is not None and km_atual is not None:
+        km_em_falta = km_previsto - km_atual
+        if odometro.media_km_dia:
+            dias = max(0, math.ceil(km_em_falta / odometro.media_km_dia))
+            data_estimada = hoje + timedelta(days=dias)
+
+    datas = [d for d in (data_prevista, data_estimada) if d is not None]
+    data_limite = min(datas) if datas else None
+    estado = _estado(km_em_falta, data_limite, hoje)
+    return VencimentoManutencao(
+        autocarro_id=autocarro_id,
+        componente=componente,
+        posicao=posicao,
+        km_previsto=km_previsto,
+        km_em_falta=km_em_falta,
+        data_prevista=data_prevista,
+        data_estimada=data_estimada,
+        data_limite=data_limite,
+        estado=estado,
+        prioridade=PRIORIDADES[estado],
+    )
+
+
+def recalcular_vencimentos(autocarro_ids=None):
+    """
+    Recalcula a lista de vencimentos dos autocarros indicados (ou de toda
+    a frota): sete leituras e uma escrita, qualquer que seja o histórico.
+    """
+    if autocarro_ids is not None:
+        autocarro_ids = sorted(set(autocarro_ids))
+    hoje = timezone.localdate()
+
+    odometros = OdometroAutocarro.objects.all()
+    if autocarro_ids is not None:
+        odometros = odometros.filter(autocarro_id__in=autocarro_ids)
+    odometros = {o.autocarro_id: o for o in odometros}
+
+    novos = []
+    for manut in _ultimas(Manutencao, ('-data_ultima', '-criado_em', '-pk'), autocarro_ids):
+        odometro = odometros.get(manut.autocarro_id)
+        for componente, campo in CAMPOS_MANUTENCAO:
+            km_previsto = getattr(manut, campo)
+            if km_previsto is not None:
+                novos.append(_vencimento(manut.autocarro_id, componente, odometro, hoje, km_previsto=km_previsto))
+
+    for modelo, componente in ((Troca, 'pneu'), (TrocaBateria, 'bateria')):
+        posicoes = [local for local, _ in modelo.LOCAL_CHOICES]
+        for troca in _ultimas(modelo, ('-data_troca', '-criado_em', '-pk'), autocarro_ids, posicoes):
+            novos.append(_vencimento(
+                troca.autocarro_id, componente, odometros.get(troca.autocarro_id), hoje,
+                km_previsto=troca.km_previsto_proxima_troca,
+                data_prevista=troca.data_prevista_proxima_troca,
+                posicao=troca.local,
+            ))
+
+    antigos = VencimentoManutencao.objects.all()
+    if autocarro_ids is not None:
+        antigos = antigos.filter(autocarro_id__in=autocarro_ids)
+    chaves = {(v.autocarro_id, v.componente, v.posicao) for v in novos}
+    obsoletos = [
+        pk for pk, *chave in antigos.values_list('pk', 'autocarro_id', 'componente', 'posicao')
+        if tuple(chave) not in chaves
+    ]
+
+    # upsert: dois recálculos do mesmo autocarro ao mesmo tempo não colidem na chave
+    with transaction.atomic():
+        VencimentoManutencao.objects.bulk_create(
+            novos,
+            update_conflicts=True,
+            unique_fields=['autocarro', 'componente', 'posicao'],
+            update_fields=CAMPOS_VENCIMENTO,
+            batch_size=TAMANHO_LOTE,
+        )
+        VencimentoManutencao.objects.filter(pk__in=obsoletos).delete()
+    return len(novos)
@@ -0,0 +1,164 @@
+"""
+Sincronização em lote das viagens registadas pelos cobradores.
+
+No terreno a rede móvel falha: o telemóvel do cobrador guarda as viagens
+numa fila e envia-as todas de uma vez, cada uma com uma chave gerada no
+telemóvel (CobradorViagem.chave_sincronizacao, única por cobrador). Voltar
+a enviar a fila — porque a resposta não chegou — não duplica viagens: as
+chaves que já estão gravadas voltam como 'existente', com o id da viagem.
+
+Os autocarros do lote inteiro são resolvidos numa consulta (pelo número e,
+como em cobrador_viagens_save, pelo id), as chaves já gravadas noutra, e as
+viagens novas entram num único bulk_create.
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_time
+
+from .models import Autocarro, CobradorViagem
+
+
+MAX_VIAGENS = 1000
+TAMANHO_CHAVE = CobradorViagem._meta.get_field('chave_sincronizacao').max_length
+CAMPO_VALOR = CobradorViagem._meta.get_field('valor')
+
+CRIADA = 'criada'
+EXISTENTE = 'existente'
+ERRO = 'erro'
+
+
+def _referencia(item):
+    referencia = item.get('autocarro_numero') or item.get('autocarro_id')
+    return str(referencia).strip() if referencia not in (None, '') else ''
+
+
+def _validar(item):
+    """(campos da viagem sem o autocarro, erro) de um item do lote."""
+    if not isinstance(item, dict):
+        return None, 'viagem inválida'
+    if not _referencia(item):
+        return None, 'autocarro_numero obrigatório'
+
+    try:
+        data = parse_date(str(item.get('data') or ''))
+    except ValueError:
+        data = None
+    if data is None:
+        return None, 'data inválida (AAAA-MM-DD)'
+
+    hora = None
+    if item.get('hora'):
+        try:
+            hora = parse_time(str(item['hora']))
+        except ValueError:
+            hora = None
+        if hora is None:
+            return None, 'hora inválida (HH:MM)'
+
+    # as regras da coluna (12 dígitos, 2 casas decimais): um valor fora delas
+    # faria falhar o bulk_create do lote inteiro em vez de só esta viagem
+    try:
+        valor = CAMPO_VALOR.clean(str(item.get('valor') or '0'), None)
+    except ValidationError:
+        return None, 'valor inválido'
+    if valor < 0:
+        return None, 'valor inválido'
+
+    try:
+        passageiros = int(item.get('passageiros') or 0)
+    except (TypeError, ValueError):
+        return None, 'passageiros inválido'
+    if passageiros < 0:
+        return None, 'passageiros inválido'
+
+    return {
+        'data': data,
+        'hora': hora,
+        'valor': valor,
+        'passageiros': passageiros,
+        'observacao': str(item.get('observacao') or ''),
+    }, None
+
+
+def _autocarros(referencias):
+    """{referência: autocarro_id} numa consulta: primeiro pelo número, depois pelo id."""
+    ids = {int(ref) for ref in referencias if ref.isdigit()}
+    por_numero = {}
+    por_id = set()
+    for pk, numero in Autocarro.objects.filter(Q(numero__in=referencias) | Q(pk__in=ids)).values_list('pk', 'numero'):
+        por_numero[numero] = pk
+        por_id.add(pk)
+
+    resolvidos = {}
+    for ref in referencias:
+        if ref in por_numero:
+            resolvidos[ref] = por_numero[ref]
+        elif ref.isdigit() and int(ref) in por_id:
+            resolvidos[ref] = int(ref)
+    return resolvidos
+
+
+def sincronizar_viagens(cobrador, itens):
+    """
+    Grava as viagens de `itens` (dicts com chave, autocarro_numero |
+    autocarro_id, data, hora, valor, passageiros, observacao) em nome do
+    `cobrador`, saltando as chaves já gravadas. Devolve um resultado por
+    item, pela mesma ordem: {'chave', 'estado': criada | existente | erro,
+    'viagem_id'} ou, em erro, {'chave', 'estado', 'erro'}.
+    """
+    resultados = [None] * len(itens)
+    validos = {}      # chave -> (índice, autocarro, campos)
+    vistas = set()
+
+    for indice, item in enumerate(itens):
+        chave = str(item.get('chave') or '').strip() if isinstance(item, dict) else ''
+        if not chave or len(chave) > TAMANHO_CHAVE:
+            resultados[indice] = {
+                'chave': chave, 'estado': ERRO,
+                'erro': f'chave obrigatória (até {TAMANHO_CHAVE} caracteres)',
+            }
+            continue
+        if chave in vistas:
+            # a mesma chave duas vezes no envio: só a primeira é considerada
+            resultados[indice] = {'chave': chave, 'estado': ERRO, 'erro': 'chave repetida no envio'}
+            continue
+        vistas.add(chave)
+        campos, erro = _validar(item)
+        if erro:
+            resultados[indice] = {'chave': chave, 'estado': ERRO, 'erro': erro}
+            continue
+        validos[chave] = (indice, _referencia(item), campos)
+
+    autocarros = _autocarros({referencia for _, referencia, _ in validos.values()})
+    existentes = dict(
+        CobradorViagem.objects
+        .filter(cobrador=cobrador, chave_sincronizacao__in=list(validos))
+        .values_list('chave_sincronizacao', 'pk')
+    )
+
+    novas = []
+    for chave, (indice, referencia, campos) in validos.items():
+        if chave in existentes:
+            resultados[indice] = {'chave': chave, 'estado': EXISTENTE, 'viagem_id': existentes[chave]}
+        elif referencia not in autocarros:
+            resultados[indice] = {'chave': chave, 'estado': ERRO, 'erro': 'Autocarro não encontrado'}
+        else:
+            novas.append(CobradorViagem(
+                autocarro_id=autocarros[referencia], cobrador=cobrador, chave_sincronizacao=chave, **campos,
+            ))
+
+    if novas:
+        with transaction.atomic():
+            # outro envio da mesma fila pode ter gravado alguma chave entretanto
+            CobradorViagem.objects.bulk_create(novas, ignore_conflicts=True)
+        # com ignore_conflicts os ids não são devolvidos
+        criadas = dict(
+            CobradorViagem.objects
+            .filter(cobrador=cobrador, chave_sincronizacao__in=[viagem.chave_sincronizacao for viagem in novas])
+            .values_list('chave_sincronizacao', 'pk')
+        )
+        for viagem in novas:
+            chave = viagem.chave_sincronizacao
+            resultados[validos[chave][0]] = {'chave': chave, 'estado': CRIADA, 'viagem_id': criadas.get(chave)}
+    return resultados
@@ -3,7 +3,9 @@ from datetime import date, datetime
 from decimal import Decimal
 import json
 from django.contrib import messages
-from django.db.models import Sum, F, DecimalField, Q
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Count, Sum, F, DecimalField, OuterRef, Q, Subquery
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils import timezone
 from urllib.parse import quote_plus
@@ -11,8 +13,22 @@ from django.utils.dateparse import parse_date
 from django.forms import modelformset_factory
 from django.db.models.functions import TruncMonth
 from autocarros.decorators import acesso_restrito
-from .models import Autocarro, CobradorViagem, Comprovativo, ComprovativoRelatorio, Deposito, Despesa2, DespesaCombustivel, DespesaFixa, Manutencao, RegistoDiario, Despesa, RegistroKM, RegistroKMItem, RelatorioSector, Sector, Motorista, SubCategoriaDespesa
-from .forms import DespesaCombustivelForm, DespesaFixaForm, DespesaForm2, EstadoAutocarroForm, AutocarroForm, DespesaForm, ComprovativoFormSet, ManutencaoForm, MultiFileForm,RegistoDiarioFormSet, RelatorioSectorForm, SectorForm, SectorGestorForm, SelecionarSectorCombustivelForm, RegistoDiarioForm, SubCategoriaDespesaForm
+from autocarros.middleware import estatisticas_consultas
+from .agregacoes import estatisticas_dashboard, mapa_financeiro_semanas
+from .cache_resultados import em_cache, estatisticas_cache, versao_ano, versao_dados, versao_mes
+from .estoque import com_estoque
+from .exportacoes import combustivel_por_chave, em_blocos, resposta_csv
+from . import integridade
+from .odometro import agendar_recalculo_odometro
+from .paginacao import paginar_keyset
+from .periodos import filtro_periodo
+from .registos_sector import aplicar_alteracoes, gravar_alterados, preparar_registos
+from .resumos import anexar_resumo, totais_mensais
+from .saldos import arvore_balancete, balancete_em_cache, extrato_conta
+from .vencimentos import com_estado_do_dia
+from .viagens_cobrador import MAX_VIAGENS, sincronizar_viagens
+from .models import Autocarro, CobradorViagem, Comprovativo, ComprovativoRelatorio, Deposito, Despesa2, DespesaCombustivel, DespesaFixa, Manutencao, RegistoDiario, Despesa, RegistroKM, RegistroKMItem, RelatorioSector, ResumoDiarioAutocarro, ResumoMensalSector, Sector, Motorista, SubCategoriaDespesa, VencimentoManutencao
+from .forms import DespesaCombustivelForm, DespesaFixaForm, DespesaForm2, EstadoAutocarroForm, AutocarroForm, DespesaForm, ComprovativoFormSet, ManutencaoForm, MultiFileForm,RegistoDiarioFormSet, RelatorioSectorForm, SectorForm, SectorGestorForm, SelecionarSectorCombustivelForm, RegistoDiarioForm, RegistoSectorForm, SubCategoriaDespesaForm
 from autocarros import models
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
@@ -196,57 +212,36 @@ def acesso_negado(request):
 @login_required
 @acesso_restrito(['admin'])
 def verificar_integridade(request):
-    """View para verificar e corrigir problemas de integridade"""
+    """View para verificar e corrigir problemas de integridade (ver integridade.py)"""
     if not request.user.is_superuser:
         messages.error(request, "❌ Apenas administradores podem acessar esta função.")
         return redirect('listar_registros')
-    
-    problemas = []
-    
-    # 🔹 VERIFICAR REGISTROS SEM RELATÓRIO
-    registros_sem_relatorio = RegistoDiario.objects.filter(relatorio__isnull=True)
-    if registros_sem_relatorio.exists():
-        problemas.append(f"❌ {registros_sem_relatorio.count()} registros sem relatório associado")
-    
-    # 🔹 VERIFICAR RELATÓRIOS SEM REGISTROS
-    relatorios_sem_registros = RelatorioSector.objects.filter(registos__isnull=True)
-    if relatorios_sem_registros.exists():
-        problemas.append(f"❌ {relatorios_sem_registros.count()} relatórios sem registros")
-    
-    # 🔹 VERIFICAR DUPLICAÇÕES
-    from django.db.models import Count
-    duplicatas = RegistoDiario.objects.values('relatorio', 'autocarro').annotate(
-        count=Count('id')
-    ).filter(count__gt=1)
-    
-    if duplicatas.exists():
-        problemas.append(f"❌ {duplicatas.count()} duplicatas encontradas")
-    
-    if request.method == "POST" and "corrigir" in request.POST:
-        # 🔹 CORRIGIR REGISTROS SEM RELATÓRIO
-        for registro in registros_sem_relatorio:
-            relatorio_compativel = RelatorioSector.objects.filter(
-                sector=registro.autocarro.sector,
-                data=registro.data
-            ).first()
-            
-            if relatorio_compativel:
-                registro.relatorio = relatorio_compativel
-                registro.save()
-        
-        # 🔹 CRIAR REGISTROS PARA RELATÓRIOS VAZIOS
-        for relatorio in relatorios_sem_registros:
-            autocarros = Autocarro.objects.filter(sector=relatorio.sector)
-            for autocarro in autocarros:
-                RegistoDiario.objects.get_or_create(
-                    relatorio=relatorio,
-                    autocarro=autocarro,
-                    defaults={'data': relatorio.data}
-                )
-        
-        messages.success(request, "✅ Problemas de integridade corrigidos!")
+
+    if request.method == "POST" and ("corrigir" in request.POST or "simular" in request.POST):
+        simular = "simular" in request.POST
+        resultado = integridade.corrigir(simular=simular)
+        feito = "; ".join(f"{total} {integridade.DESCRICOES[chave]}" for chave, total in resultado.items() if total)
+        if simular:
+            messages.info(request, f"🔎 Simulação (nada foi gravado): {feito or 'nada a corrigir'}.")
+        else:
+            messages.success(request, f"✅ Problemas de integridade corrigidos: {feito or 'nada a corrigir'}.")
         return redirect('verificar_integridade')
-    
+
+    encontrados = integridade.verificar()
+    problemas = []
+
+    # 🔹 REGISTROS SEM RELATÓRIO
+    if encontrados['orfaos']:
+        problemas.append(f"❌ {encontrados['orfaos']} registros sem relatório associado")
+
+    # 🔹 RELATÓRIOS SEM REGISTROS
+    if encontrados['relatorios_vazios']:
+        problemas.append(f"❌ {encontrados['relatorios_vazios']} relatórios sem registros")
+
+    # 🔹 AUTOCARRO REPETIDO NO MESMO RELATÓRIO (registos de outros dias)
+    if encontrados['mal_arquivados']:
+        problemas.append(f"❌ {encontrados['mal_arquivados']} registros de outro dia arquivados no relatório errado")
+
     context = {
         'problemas': problemas,
         'total_problemas': len(problemas),
@@ -317,88 +312,33 @@ def apagar_sector(request, pk):
 
 
 # === Dashboard View === #
-@login_required
-@acesso_restrito(['admin'])
-def dashboard(request):
-    hoje = timezone.now().date()
-
-    # 🔹 Capturar "YYYY-MM" vindo do input type="month"
-    mes_param = request.GET.get("mes", hoje.strftime("%Y-%m"))
-    try:
-        ano, mes = map(int, mes_param.split("-"))
-    except ValueError:
-        ano, mes = hoje.year, hoje.month
-
-    # 🔹 anos disponíveis
-    anos_disponiveis = [
-        int(d.year) for d in RegistoDiario.objects.dates("data", "year", order="DESC")
-    ]
-    if hoje.year not in anos_disponiveis:
-        anos_disponiveis.insert(0, hoje.year)
-
+def _dados_dashboard(ano, mes):
+    """Totais e estatísticas do dashboard para um mês (guardados em cache)."""
     # 🔹 registos filtrados
     registos = RegistoDiario.objects.filter(
-        data__year=ano,
-        data__month=mes
+        **filtro_periodo('data', ano, mes)
     ).select_related("autocarro")
 
-    # 🔹 Combustível por autocarro/data
-    combustivel_map_dashboard = {}
-    if registos.exists():
-        autocarro_ids = set(registos.values_list('autocarro_id', flat=True))
-        datas = set(registos.values_list('data', flat=True))
-
-        combustiveis_dash = DespesaCombustivel.objects.filter(
-            autocarro_id__in=autocarro_ids,
-            data__in=datas
-        )
-
-        agg_dash = defaultdict(lambda: {
-            'total_valor': Decimal('0'),
-            'total_valor_litros': Decimal('0'),
-            'total_sobragem': Decimal('0'),
-            'total_lavagem': Decimal('0')
-        })
-
-        for c in combustiveis_dash:
-            key = f"{c.autocarro_id}_{c.data.isoformat()}"
-            agg_dash[key]['total_valor'] += c.valor or Decimal('0')
-            agg_dash[key]['total_valor_litros'] += c.valor_litros or Decimal('0')
-            agg_dash[key]['total_sobragem'] += c.sobragem_filtros or Decimal('0')
-            agg_dash[key]['total_lavagem'] += c.lavagem or Decimal('0')
-
-        combustivel_map_dashboard.update(agg_dash)
-
-    # 🔹 Totais gerais
-    total_entradas = registos.aggregate(
-        total=Sum(F("normal") + F("alunos") + F("luvu") + F("frete"), output_field=DecimalField())
-    )["total"] or Decimal("0")
-
-    total_saidas_registos = registos.aggregate(
-        total=Sum(
-            F("alimentacao") + F("parqueamento") + F("taxi") + F("taxa") + F("outros"),
-            output_field=DecimalField()
-        )
-    )["total"] or Decimal("0")
+    # 🔹 Totais gerais (colunas geradas do registo)
+    totais_registos = registos.aggregate(entradas=Sum("entradas"), saidas=Sum("saidas"))
+    total_entradas = totais_registos["entradas"] or Decimal("0")
+    total_saidas_registos = totais_registos["saidas"] or Decimal("0")
 
     total_saidas_despesas = Despesa.objects.filter(
-        data__year=ano,
-        data__month=mes
+        **filtro_periodo('data', ano, mes)
     ).aggregate(
         total=Sum("valor", output_field=DecimalField())
     )["total"] or Decimal("0")
 
     # 🔹 Despesa geral dos setores (NOVO)
     total_despesa_geral = RelatorioSector.objects.filter(
-        data__year=ano,
-        data__month=mes
+        **filtro_periodo('data', ano, mes)
     ).aggregate(
         total=Sum('despesa_geral', output_field=DecimalField())
     )['total'] or Decimal('0')
 
     total_alimentacao_estaleiro = RelatorioSector.objects.filter(
-        data__year=ano,
-        data__month=mes
+        **filtro_periodo('data', ano, mes)
     ).aggregate(
         total=Sum('alimentacao_estaleiro', output_field=DecimalField())
     )['total'] or Decimal('0')
@@ -414,15 +354,13 @@ def dashboard(request):
     # Anuais: contam apenas se data_inicio for no mesmo mês/ano
     anuais_qs = qs_fixas.filter(
         periodicidade__iexact='anual',
-        data_inicio__year=ano,
-        data_inicio__month=mes
+        **filtro_periodo('data_inicio', ano, mes)
     )
 
     # Únicas: contam apenas no mês/ano específico
     unicas_qs = qs_fixas.filter(
         periodicidade__iexact='único',
-        data_inicio__year=ano,
-        data_inicio__month=mes
+        **filtro_periodo('data_inicio', ano, mes)
     )
 
     total_despesas_fixas = (
@@ -434,8 +372,7 @@ def dashboard(request):
     )
 
     total_combustivel = DespesaCombustivel.objects.filter(
-        data__year=ano,
-        data__month=mes
+        **filtro_periodo('data', ano, mes)
     ).aggregate(
         total_valor=Sum('valor', output_field=DecimalField()),
         total_litros=Sum('valor_litros', output_field=DecimalField()),
@@ -449,8 +386,7 @@ def dashboard(request):
 
     # 🔹 Total Despesa2 (variáveis do mês)
     total_despesa2 = Despesa2.objects.filter(
-        data__year=ano,
-        data__month=mes
+        **filtro_periodo('data', ano, mes)
     ).aggregate(
         total=Sum("valor", output_field=DecimalField())
     )["total"] or Decimal("0")
@@ -468,87 +404,25 @@ def dashboard(request):
     total_despesa2_1 = total_despesa2 + total_despesas_fixas + total_saidas_despesas
     total_lucro = total_resto - total_despesa2_1
 
-    # 🔹 Estatísticas por autocarro
-    autocarros_stats = []
-    for autocarro in Autocarro.objects.all():
-        registos_auto = registos.filter(autocarro=autocarro)
-        stats = {
-            "autocarro": autocarro,
-            "total_km": registos_auto.aggregate(Sum("km_percorridos"))["km_percorridos__sum"] or 0,
-            "total_entradas": registos_auto.aggregate(
-                total=Sum(F("normal") + F("alunos") + F("luvu") + F("frete"), output_field=DecimalField())
-            )["total"] or Decimal('0'),
-            "total_saidas": registos_auto.aggregate(
-                total=Sum(F("alimentacao") + F("parqueamento") + F("taxi") + F("taxa") + F("outros"), output_field=DecimalField())
-            )["total"] or Decimal('0'),
-            "total_passageiros": registos_auto.aggregate(Sum("numero_passageiros"))["numero_passageiros__sum"] or 0,
-            "total_viagens": registos_auto.aggregate(Sum("numero_viagens"))["numero_viagens__sum"] or 0,
-        }
-
-        comb_auto = DespesaCombustivel.objects.filter(
-            autocarro=autocarro,
-            data__year=ano,
-            data__month=mes
-        ).aggregate(
-            total_valor=Sum('valor', output_field=DecimalField()),
-            total_litros=Sum('valor_litros', output_field=DecimalField()),
-            total_sobragem=Sum('sobragem_filtros', output_field=DecimalField()),
-            total_lavagem=Sum('lavagem', output_field=DecimalField()),
-        )
-
-        comb_val = comb_auto.get('total_valor') or Decimal('0')
-        stats['total_combustivel'] = comb_val
-
-        # em vez de 'litros' o ficheiro pede 'alimentacao + outros' por autocarro
-        alim_outros_auto = registos_auto.aggregate(
-            total=Sum(F("alimentacao") + F("outros"), output_field=DecimalField())
-        )["total"] or Decimal('0')
-
-        stats['total_alim_outros'] = alim_outros_auto
-
-        stats['total_combustivel_litros'] = comb_auto.get('total_litros') or Decimal('0')
-        stats['total_combustivel_sobragem'] = comb_auto.get('total_sobragem') or Decimal('0')
-
-        stats['total_combustivel_lavagem'] = comb_auto.get('total_lavagem') or Decimal('0')
-
-        comb_sobr = stats['total_combustivel_sobragem']
-
-        comb_lav = stats['total_combustivel_lavagem']
-
-        # incluir combustível e respetivas taxas nas saídas por autocarro
-        stats['total_saidas'] += comb_sobr + comb_lav
-        # OBS: 'total_alim_outros' já faz parte de 'total_saidas' (porque veio de registos_auto agregados),
-        # mas mantemos o campo separado para exibição no lugar de "litros".
-        stats["resto"] = stats["total_entradas"] - stats["total_saidas"] - stats['total_combustivel']
-
-        autocarros_stats.append(stats)
+    # 🔹 Estatísticas por autocarro (um GROUP BY em vez de queries por autocarro)
+    autocarros_stats = estatisticas_dashboard(ano, mes)
 
     # 🔹 Calcular o maior saldo (mais lucrativo)
     max_saldo = max((a["resto"] for a in autocarros_stats), default=Decimal('0'))
 
-    # 🔹 Registos recentes
-    registos_recentes_qs = registos.order_by("-data")[:10]
+    # 🔹 Registos recentes (combustível vem do resumo diário)
+    registos_recentes_qs = registos.select_related("resumo_diario").order_by("-data")[:10]
     registos_recentes = []
     for reg in registos_recentes_qs:
-        key = f"{reg.autocarro_id}_{reg.data.isoformat()}"
-        comb = combustivel_map_dashboard.get(key, {})
-        reg.combustivel_total = comb.get('total_valor', Decimal('0'))
+        anexar_resumo(reg)
         # em vez de litros, mostramos alimentacao + outros do próprio registo
         reg.alim_outros = (getattr(reg, 'alimentacao', Decimal('0')) or Decimal('0')) + (getattr(reg, 'outros', Decimal('0')) or Decimal('0'))
-        reg.combustivel_valor_litros = comb.get('total_valor_litros', Decimal('0'))
-        reg.combustivel_sobragem = comb.get('total_sobragem', Decimal('0'))
-        reg.combustivel_lavagem = comb.get('total_lavagem', Decimal('0'))
-        reg.saidas_total_incl_combustivel = (
-            reg.saidas_total() + reg.combustivel_total + reg.combustivel_sobragem + reg.combustivel_lavagem
-        )
-        reg.saldo_liquido_incl_combustivel = reg.entradas_total() - reg.saidas_total_incl_combustivel
         registos_recentes.append(reg)
 
 
     context = {
         "ano": ano,
         "mes": f"{ano}-{mes:02d}",
-        "anos_disponiveis": anos_disponiveis,
         "total_entradas": total_entradas,
         "total_saidas": total_saidas,
         "total_saidas_registos": total_saidas_registos,
@@ -562,22 +436,59 @@ def dashboard(request):
         "registos_recentes": registos_recentes,
         "max_saldo": max_saldo,
     }
+    return context
+
+
+@login_required
+@acesso_restrito(['admin'])
+def dashboard(request):
+    hoje = timezone.now().date()
+
+    # 🔹 Capturar "YYYY-MM" vindo do input type="month"
+    mes_param = request.GET.get("mes", hoje.strftime("%Y-%m"))
+    try:
+        ano, mes = map(int, mes_param.split("-"))
+    except ValueError:
+        ano, mes = hoje.year, hoje.month
+
+    # 🔹 anos disponíveis
+    anos_disponiveis = [
+        int(d.year) for d in RegistoDiario.objects.dates("data", "year", order="DESC")
+    ]
+    if hoje.year not in anos_disponiveis:
+        anos_disponiveis.insert(0, hoje.year)
+
+    context = em_cache(
+        'dashboard', lambda: _dados_dashboard(ano, mes), versao_mes(ano, mes), ano=ano, mes=mes
+    )
+    context["anos_disponiveis"] = anos_disponiveis
     return render(request, "autocarros/dashboard.html", context)
 
 
+@login_required
+@acesso_restrito(['admin'])
+def cache_estatisticas(request):
+    """Acertos/falhas da cache de resultados dos painéis, por vista."""
+    return JsonResponse(estatisticas_cache())
+
+
+@login_required
+@acesso_restrito(['admin'])
+def consultas_estatisticas(request):
+    """Consultas SQL por vista (MetricasConsultasMiddleware), neste processo."""
+    return JsonResponse(estatisticas_consultas())
+
+
 #================================== Arquivo World ========================================== #
-from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.urls import reverse
 from django.utils import timezone
 from django.db.models import Sum, F, DecimalField
 from django.contrib.humanize.templatetags.humanize import intcomma
 from decimal import Decimal
-from docx import Document
-from docx.shared import Pt, RGBColor, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml import parse_xml
-from docx.oxml.ns import nsdecls
 from datetime import datetime
-from .models import RegistoDiario, Despesa, DespesaCombustivel, Autocarro
+from .models import RegistoDiario, Despesa, DespesaCombustivel, Autocarro, ExportacaoJob
+from .tarefas import enfileirar_exportacao
 from .decorators import acesso_restrito
 from django.contrib.auth.decorators import login_required
 
@@ -593,328 +504,40 @@ def exportar_relatorio_dashboard(request):
     except ValueError:
         ano, mes = hoje.year, hoje.month
 
-    registos = RegistoDiario.objects.filter(data__year=ano, data__month=mes)
-
-    total_entradas = registos.aggregate(
-        total=Sum(F("normal") + F("alunos") + F("luvu") + F("frete"), output_field=DecimalField())
-    )["total"] or Decimal("0")
-
-    total_saidas_registos = registos.aggregate(
-        total=Sum(F("alimentacao") + F("parqueamento") + F("taxa") + F("outros"), output_field=DecimalField())
-    )["total"] or Decimal("0")
-
-    total_saidas_despesas = Despesa.objects.filter(
-        data__year=ano, data__month=mes
-    ).aggregate(total=Sum("valor", output_field=DecimalField()))["total"] or Decimal("0")
-
-    # 🔹 Corrigido: campo 'valor_litros' em vez de 'litros'
-    total_combustivel = DespesaCombustivel.objects.filter(
-        data__year=ano, data__month=mes
-    ).aggregate(
-        total_valor=Sum('valor', output_field=DecimalField()),
-        total_sobragem=Sum('sobragem_filtros', output_field=DecimalField()),
-        total_lavagem=Sum('lavagem', output_field=DecimalField()),
-        total_litros=Sum('valor_litros', output_field=DecimalField())
+    # O documento é gerado fora do pedido (ver tarefas.py); um pedido igual
+    # com os mesmos dados reaproveita o ficheiro já gerado.
+    job = enfileirar_exportacao(
+        'relatorio_dashboard', {'ano': ano, 'mes': mes}, utilizador=request.user
     )
+    return redirect('exportacao_estado', job_id=job.pk)
 
-    total_combustivel_valor = total_combustivel.get('total_valor') or Decimal('0')
-    total_combustivel_sobragem = total_combustivel.get('total_sobragem') or Decimal('0')
-    total_combustivel_lavagem = total_combustivel.get('total_lavagem') or Decimal('0')
-
-    total_saidas = (
-        total_saidas_registos
-        + total_saidas_despesas
-        + total_combustivel_valor
-        + total_combustivel_sobragem
-        + total_combustivel_lavagem
-    )
-    total_resto = total_entradas - total_saidas
-
-    # Estatísticas por autocarro
-    autocarros_stats = []
-    for autocarro in Autocarro.objects.all():
-        registos_auto = registos.filter(autocarro=autocarro)
-        if not registos_auto.exists():
-            continue
-
-        total_km = registos_auto.aggregate(Sum("km_percorridos"))["km_percorridos__sum"] or 0
-        total_entr_auto = registos_auto.aggregate(
-            total=Sum(F("normal") + F("alunos") + F("luvu") + F("frete"), output_field=DecimalField())
-        )["total"] or Decimal("0")
-        total_saida_auto = registos_auto.aggregate(
-            total=Sum(F("alimentacao") + F("parqueamento") + F("taxa") + F("outros"), output_field=DecimalField())
-        )["total"] or Decimal("0")
-        total_passageiros = registos_auto.aggregate(Sum("numero_passageiros"))["numero_passageiros__sum"] or 0
-        total_viagens = registos_auto.aggregate(Sum("numero_viagens"))["numero_viagens__sum"] or 0
-
-        # 🔹 Corrigido aqui também
-        comb_auto = DespesaCombustivel.objects.filter(
-            autocarro=autocarro, data__year=ano, data__month=mes
-        ).aggregate(
-            total_valor=Sum('valor', output_field=DecimalField()),
-            total_sobragem=Sum('sobragem_filtros', output_field=DecimalField()),
-            total_lavagem=Sum('lavagem', output_field=DecimalField()),
-            total_litros=Sum('valor_litros', output_field=DecimalField())
-        )
-
-        comb_val = comb_auto.get('total_valor') or Decimal('0')
-        comb_sobr = comb_auto.get('total_sobragem') or Decimal('0')
-        comb_lav = comb_auto.get('total_lavagem') or Decimal('0')
-        comb_litros = comb_auto.get('total_litros') or Decimal('0')
-
-        stats = {
-            "autocarro": autocarro,
-            "total_km": total_km,
-            "total_entradas": total_entr_auto,
-            "total_saidas": total_saida_auto,
-            "total_passageiros": total_passageiros,
-            "total_viagens": total_viagens,
-            "total_combustivel": comb_val,
-            "total_combustivel_litros": comb_litros,
-            "total_combustivel_sobragem": comb_sobr,
-            "total_combustivel_lavagem": comb_lav,
-        }
-
-        # incluir combustível nas saídas por autocarro
-        stats['total_saidas'] = stats['total_saidas'] + stats.get('total_combustivel', Decimal('0')) + comb_sobr + comb_lav
-        stats["resto"] = stats["total_entradas"] - stats['total_saidas']
-        autocarros_stats.append(stats)
-
-    # Criar documento Word
-    doc = Document()
-
-    # Configurar página para paisagem
-    section = doc.sections[0]
-    section.page_width = Inches(11.69)
-    section.page_height = Inches(8.27)
-    section.left_margin = section.right_margin = Inches(0.5)
-    section.top_margin = section.bottom_margin = Inches(0.5)
-
-    # Cabeçalho profissional
-    header_table = doc.add_table(rows=1, cols=3)
-    header_table.autofit = True
-
-    left_cell = header_table.cell(0, 0)
-    left_para = left_cell.paragraphs[0]
-    left_run = left_para.add_run("🚌")
-    left_run.font.size = Pt(28)
-    left_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-    center_cell = header_table.cell(0, 1)
-    center_para = center_cell.paragraphs[0]
-    center_run = center_para.add_run(f"RELATÓRIO MENSAL - {mes_param}")
-    center_run.font.size = Pt(18)
-    center_run.font.bold = True
-    center_run.font.color.rgb = RGBColor(13, 27, 42)
-    center_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-    right_cell = header_table.cell(0, 2)
-    right_para = right_cell.paragraphs[0]
-    right_run = right_para.add_run(f"{datetime.now().strftime('%d/%m/%Y')}")
-    right_run.font.size = Pt(10)
-    right_run.font.color.rgb = RGBColor(100, 100, 100)
-    right_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-
-    doc.add_paragraph().add_run().add_break()
-
-    # --- RESUMO GERAL ---
-    h = doc.add_heading("RESUMO GERAL DO MÊS", level=2)
-    try:
-        h.runs[0].font.color.rgb = RGBColor(27, 42, 73)
-    except Exception:
-        pass
-
-    tabela_resumo = doc.add_table(rows=2, cols=4)
-    tabela_resumo.style = "Table Grid"
-
-    # ajustar para mostrar centimos (2 casas decimais) usando babel
-    from babel.numbers import format_currency
-
-    def fmt_money_simple(x):
-        try:
-            val = Decimal(x or 0).quantize(Decimal('0.01'))
-            return format_currency(float(val), "AOA", locale="pt_PT").replace("AOA", "Kz")
-        except Exception:
-            try:
-                return f"{Decimal(x or 0):.2f} Kz"
-            except Exception:
-                return f"{x} Kz"
-
-    entradas_val = fmt_money_simple(total_entradas)
-    despesas_val = fmt_money_simple(total_saidas)
-    resto_val = fmt_money_simple(total_resto)
-    eficiencia_val = f"{(float(total_resto) / float(total_entradas) * 100) if total_entradas > 0 else 0:.1f}%"
-
-    # label alterada para "SALDO"
-    cards_data = [
-        ("ENTRADAS TOTAIS", entradas_val, "1B4F72"),
-        ("DESPESAS TOTAIS", despesas_val, "C0392B"),
-        ("SALDO", resto_val, "27AE60"),
-        ("EFICIÊNCIA", eficiencia_val, "8E44AD")
-    ]
-
-    for i, (titulo, valor, cor) in enumerate(cards_data):
-        cell = tabela_resumo.cell(0, i)
-        cell.text = titulo
-        cell.paragraphs[0].runs[0].font.bold = True
-        cell.paragraphs[0].runs[0].font.size = Pt(10)
-        cell.paragraphs[0].runs[0].font.color.rgb = RGBColor(255, 255, 255)
-        try:
-            cell._element.get_or_add_tcPr().append(
-                parse_xml(f'<w:shd {nsdecls("w")} w:fill="{cor}"/>')
-            )
-        except Exception:
-            pass
-
-        cell_valor = tabela_resumo.cell(1, i)
-        cell_valor.text = valor
-        cell_valor.paragraphs[0].runs[0].font.bold = True
-        cell_valor.paragraphs[0].runs[0].font.size = Pt(12)
-        cell_valor.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-    doc.add_paragraph().add_run().add_break()
-
-    # --- DESPESAS ESPECÍFICAS ---
-    doc.add_heading("DESPESAS OPERACIONAIS", level=2)
-
-    despesas_data = [
-        ("Combustível", total_combustivel_valor),
-        ("Sopragem de Filtros", total_combustivel_sobragem),
-        ("Lavagem", total_combustivel_lavagem),
-        ("Outras Despesas", total_saidas_despesas + total_saidas_registos),
-    ]
-
-    # +1 linha para o cabeçalho
-    tabela_despesas = doc.add_table(rows=len(despesas_data) + 1, cols=3)
-    tabela_despesas.style = "Table Grid"
-
-    # Cabeçalho
-    cabecalho_despesas = ["CATEGORIA", "VALOR", "% DO TOTAL"]
-    for i, titulo in enumerate(cabecalho_despesas):
-        cell = tabela_despesas.cell(0, i)
-        cell.text = titulo
-        run = cell.paragraphs[0].runs[0]
-        run.font.bold = True
-        run.font.color.rgb = RGBColor(255, 255, 255)
-        try:
-            cell._element.get_or_add_tcPr().append(
-                parse_xml(f'<w:shd {nsdecls("w")} w:fill="2C3E50"/>')
-            )
-        except Exception:
-            pass
-
-    # Função para formatar com separador de milhar e vírgula nos centavos
-    def fmt_money(valor):
-        try:
-            valor = Decimal(valor or 0).quantize(Decimal('0.01'))
-            return format_currency(float(valor), "AOA", locale="pt_PT").replace("AOA", "Kz")
-        except Exception:
-            try:
-                return f"{Decimal(valor or 0):.2f} Kz"
-            except Exception:
-                return f"{valor} Kz"
-
-    # Preenchimento das linhas da tabela
-    for i, (categoria, valor) in enumerate(despesas_data, start=1):
-        cell_cat = tabela_despesas.cell(i, 0)
-        cell_cat.text = categoria
-
-        cell_val = tabela_despesas.cell(i, 1)
-        cell_val.text = fmt_money(valor)
-        cell_val.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-
-        try:
-            pct = (float(valor) / float(total_saidas) * 100) if total_saidas > 0 else 0
-        except Exception:
-            pct = 0
-        cell_pct = tabela_despesas.cell(i, 2)
-        cell_pct.text = f"{pct:.1f}%"
-        cell_pct.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-
-        # Zebra shading (linhas alternadas)
-        if i % 2 == 0:
-            for c in (cell_cat, cell_val, cell_pct):
-                try:
-                    c._element.get_or_add_tcPr().append(
-                        parse_xml(f'<w:shd {nsdecls("w")} w:fill="F8F9F9"/>')
-                    )
-                except Exception:
-                    pass
-
-    doc.add_paragraph().add_run().add_break()
-
-    # --- DETALHE POR AUTOCARRO ---
-    doc.add_heading("DETALHE POR AUTOCARRO", level=2)
-
-    if autocarros_stats:
-        cols = ["AUTOCARRO", "KM", "ENTRADAS", "SAÍDAS", "COMBUSTÍVEL", "LITROS", "RESTO"]
-        tabela_autos = doc.add_table(rows=len(autocarros_stats) + 1, cols=len(cols))
-        tabela_autos.style = "Table Grid"
-
-        # Cabeçalho
-        for j, titulo in enumerate(cols):
-            cell = tabela_autos.cell(0, j)
-            cell.text = titulo
-            cell.paragraphs[0].runs[0].font.bold = True
-            try:
-                cell._element.get_or_add_tcPr().append(
-                    parse_xml(f'<w:shd {nsdecls("w")} w:fill="2C3E50"/>')
-                )
-            except Exception:
-                pass
-
-        # Linhas
-        for i, s in enumerate(autocarros_stats, start=1):
-            tabela_autos.cell(i, 0).text = str(s["autocarro"].numero)
-            tabela_autos.cell(i, 1).text = str(int(s.get("total_km", 0) or 0))
-            tabela_autos.cell(i, 2).text = fmt_money(s.get("total_entradas", Decimal('0')))
-            tabela_autos.cell(i, 3).text = fmt_money(s.get("total_saidas", Decimal('0')))
-            tabela_autos.cell(i, 4).text = fmt_money(s.get("total_combustivel", Decimal('0')))
-            # litros podem ser None
-            litros = s.get("total_combustivel_litros", Decimal('0')) or Decimal('0')
-            tabela_autos.cell(i, 5).text = f"{float(litros):,.2f}"
-            tabela_autos.cell(i, 6).text = fmt_money(s.get("resto", Decimal('0')))
-
-            # right align numeric cols
-            for col_idx in range(1, len(cols)):
-                try:
-                    tabela_autos.cell(i, col_idx).paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-                except Exception:
-                    pass
-    else:
-        doc.add_paragraph("Nenhum registo por autocarro encontrado para o período.")
-
-    doc.add_paragraph().add_run().add_break()
-
-    # --- ASSINATURA --- (nome fixo e "cravado" no documento)
-    assinatura_para = doc.add_paragraph()
-    run = assinatura_para.add_run("Assinatura: ")
-    run.bold = True
-    nome_run = assinatura_para.add_run("KIANGEBENI KALEBA MATIAS")
-    nome_run.bold = True
-
-    doc.add_paragraph().add_run().add_break()
 
-    # --- FINALIZAÇÃO E DOWNLOAD DO RELATÓRIO ---
-    from io import BytesIO
-    from django.http import HttpResponse
+@login_required
+@acesso_restrito(['admin'])
+def exportacao_estado(request, job_id):
+    job = get_object_or_404(ExportacaoJob, pk=job_id)
 
-    buffer = BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({
+            'estado': job.estado,
+            'terminado': job.terminado,
+            'erro': job.erro,
+            'download_url': (
+                reverse('exportacao_download', args=[job.pk])
+                if job.estado == ExportacaoJob.CONCLUIDO else None
+            ),
+        })
 
-    filename = f"Relatorio_Mensal_{mes_param}.docx"
-    response = HttpResponse(
-        buffer.getvalue(),
-        content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-    )
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return render(request, 'exportacoes/estado.html', {'job': job})
 
-    referer = request.META.get('HTTP_REFERER', '/')
-    response['X-Redirect-After-Download'] = referer
-    response['X-File-Generated'] = filename
 
-    return response
+@login_required
+@acesso_restrito(['admin'])
+def exportacao_download(request, job_id):
+    job = get_object_or_404(ExportacaoJob, pk=job_id, estado=ExportacaoJob.CONCLUIDO)
+    if not job.ficheiro or not job.ficheiro.storage.exists(job.ficheiro.name):
+        raise Http404("Ficheiro da exportação já não existe.")
+    return FileResponse(job.ficheiro.open('rb'), as_attachment=True, filename=job.nome_ficheiro)
 
 
 
@@ -926,23 +549,8 @@ from decimal import Decimal
 from datetime import datetime
 from urllib.parse import quote_plus
 
-@login_required
-@acesso_restrito(['admin', 'gestor'])
-def resumo_sector(request, slug):
-
-    sector_obj = get_object_or_404(Sector, slug=slug)
-    nivel = request.user.nivel_acesso.lower()
-
-    if nivel == 'gestor' and sector_obj.gestor_id != request.user.id:
-        return redirect('acesso_negado')
-    elif nivel == 'associado' and not sector_obj.associados.filter(pk=request.user.pk).exists():
-        return redirect('acesso_negado')
-    elif nivel not in ['admin', 'gestor', 'associado']:
-        return redirect('acesso_negado')
-
-    data_inicio = request.GET.get("data_inicio")
-    data_fim = request.GET.get("data_fim")
-
+def _dados_resumo_sector(sector_obj, data_inicio, data_fim):
+    """Totais do sector entre as datas dadas (guardados em cache)."""
     # 🔹 Registos
     registos = RegistoDiario.objects.filter(
         autocarro__sector=sector_obj
@@ -953,38 +561,32 @@ def resumo_sector(request, slug):
     if data_fim:
         registos = registos.filter(data__lte=parse_date(data_fim))
 
-    # 🔹 Entradas
-    total_entradas = registos.aggregate(
-        total=Sum(F("normal") + F("alunos") + F("luvu") + F("frete"), output_field=DecimalField())
-    )["total"] or Decimal("0")
-
-    # 🔹 Saídas separadas
-    saidas = registos.aggregate(
+    # 🔹 Entradas, saídas (total e por categoria) e estatísticas numa só consulta
+    totais = registos.aggregate(
+        total_entradas=Sum("entradas"),
+        total_saidas=Sum("saidas"),
         total_alimentacao=Sum("alimentacao", output_field=DecimalField()),
         total_parqueamento=Sum("parqueamento", output_field=DecimalField()),
         total_outros=Sum("outros", output_field=DecimalField()),
         total_taxas=Sum("taxa", output_field=DecimalField()),
         total_taxis=Sum("taxi", output_field=DecimalField()),
+        total_km=Sum("km_percorridos"),
+        total_passageiros=Sum("numero_passageiros"),
+        total_viagens=Sum("numero_viagens"),
     )
 
-    total_alimentacao = saidas["total_alimentacao"] or Decimal("0")
-    total_parqueamento = saidas["total_parqueamento"] or Decimal("0")
-    total_outros = saidas["total_outros"] or Decimal("0")
-    total_taxas = saidas["total_taxas"] or Decimal("0")
-    total_taxis = saidas["total_taxis"] or Decimal("0")
-
-    total_saidas_registos = (
-        total_alimentacao +
-        total_parqueamento +
-        total_outros +
-        total_taxas +
-        total_taxis
-    )
+    total_entradas = totais["total_entradas"] or Decimal("0")
+    total_saidas_registos = totais["total_saidas"] or Decimal("0")
+    total_alimentacao = totais["total_alimentacao"] or Decimal("0")
+    total_parqueamento = totais["total_parqueamento"] or Decimal("0")
+    total_outros = totais["total_outros"] or Decimal("0")
+    total_taxas = totais["total_taxas"] or Decimal("0")
+    total_taxis = totais["total_taxis"] or Decimal("0")
 
     # 🔹 Estatísticas gerais
-    total_km = registos.aggregate(Sum("km_percorridos"))["km_percorridos__sum"] or 0
-    total_passageiros = registos.aggregate(Sum("numero_passageiros"))["numero_passageiros__sum"] or 0
-    total_viagens = registos.aggregate(Sum("numero_viagens"))["numero_viagens__sum"] or 0
+    total_km = totais["total_km"] or 0
+    total_passageiros = totais["total_passageiros"] or 0
+    total_viagens = totais["total_viagens"] or 0
 
     # 🔹 Combustível
     combustivel_qs = DespesaCombustivel.objects.filter(autocarro__sector=sector_obj)
@@ -1070,13 +672,9 @@ def resumo_sector(request, slug):
 
         registos_auto = registos.filter(autocarro=autocarro)
 
-        entradas_auto = registos_auto.aggregate(
-            total=Sum(F("normal") + F("alunos") + F("luvu") + F("frete"), output_field=DecimalField())
-        )["total"] or Decimal("0")
-
-        saidas_auto = registos_auto.aggregate(
-            total=Sum(F("alimentacao") + F("parqueamento") + F("taxi") + F("taxa") + F("outros"), output_field=DecimalField())
-        )["total"] or Decimal("0")
+        totais_auto = registos_auto.aggregate(entradas=Sum("entradas"), saidas=Sum("saidas"))
+        entradas_auto = totais_auto["entradas"] or Decimal("0")
+        saidas_auto = totais_auto["saidas"] or Decimal("0")
 
         comb_auto = combustivel_qs.filter(autocarro=autocarro).aggregate(
             total_valor=Sum("valor", output_field=DecimalField()),
@@ -1158,6 +756,38 @@ def resumo_sector(request, slug):
         "whatsapp_message": whatsapp_text,
         "whatsapp_link": whatsapp_link,
     }
+    return context
+
+
+@login_required
+@acesso_restrito(['admin', 'gestor'])
+def resumo_sector(request, slug):
+
+    sector_obj = get_object_or_404(Sector, slug=slug)
+    nivel = request.user.nivel_acesso.lower()
+
+    if nivel == 'gestor' and sector_obj.gestor_id != request.user.id:
+        return redirect('acesso_negado')
+    elif nivel == 'associado' and not sector_obj.associados.filter(pk=request.user.pk).exists():
+        return redirect('acesso_negado')
+    elif nivel not in ['admin', 'gestor', 'associado']:
+        return redirect('acesso_negado')
+
+    data_inicio = request.GET.get("data_inicio")
+    data_fim = request.GET.get("data_fim")
+
+    versao = versao_dados(
+        parse_date(data_inicio) if data_inicio else None,
+        parse_date(data_fim) if data_fim else None,
+    )
+    context = em_cache(
+        'resumo_sector',
+        lambda: _dados_resumo_sector(sector_obj, data_inicio, data_fim),
+        versao,
+        sector=sector_obj.pk,
+        data_inicio=data_inicio,
+        data_fim=data_fim,
+    )
 
     return render(request, "autocarros/resumo_sector.html", context)
 
@@ -1168,66 +798,37 @@ def detalhe_autocarro(request, autocarro_id):
     autocarro = get_object_or_404(Autocarro, id=autocarro_id)
     registos_local = RegistoDiario.objects.filter(autocarro=autocarro)
 
-    entradas = registos_local.aggregate(
-        total=Sum(F("normal") + F("alunos") + F("luvu") + F("frete"), output_field=DecimalField())
-    )["total"] or 0
-
-    saidas = registos_local.aggregate(
-        total=Sum(F("alimentacao") + F("parqueamento") + F("taxa") + F("outros"), output_field=DecimalField())
-    )["total"] or 0
-
-    km = registos_local.aggregate(Sum('km_percorridos'))['km_percorridos__sum'] or 0
-    passageiros = registos_local.aggregate(Sum('numero_passageiros'))['numero_passageiros__sum'] or 0
-    viagens = registos_local.aggregate(Sum('numero_viagens'))['numero_viagens__sum'] or 0
-    # Agregar despesas de combustível por autocarro e por data
-    combustiveis_qs = DespesaCombustivel.objects.filter(autocarro=autocarro, data__in=registos_local.values_list('data', flat=True))
-    from collections import defaultdict
-    comb_map = defaultdict(lambda: {
-        'total_valor': Decimal('0'),
-        'total_valor_litros': Decimal('0'),
-        'total_sobragem': Decimal('0'),
-        'total_lavagem': Decimal('0'),
-    })
-    total_combustivel_valor = Decimal('0')
-    total_combustivel_litros = Decimal('0')
-    total_combustivel_sobragem = Decimal('0')
-    total_combustivel_lavagem = Decimal('0')
-
-    for c in combustiveis_qs:
-        key = c.data.isoformat()
-        comb_map[key]['total_valor'] += c.valor or Decimal('0')
-        comb_map[key]['total_valor_litros'] += c.valor_litros or Decimal('0')
-        comb_map[key]['total_sobragem'] += c.sobragem_filtros or Decimal('0')
-        comb_map[key]['total_lavagem'] += c.lavagem or Decimal('0')
-        total_combustivel_valor += c.valor or Decimal('0')
-        total_combustivel_litros += c.valor_litros or Decimal('0')
-        total_combustivel_sobragem += c.sobragem_filtros or Decimal('0')
-        total_combustivel_lavagem += c.lavagem or Decimal('0')
-
-    # Anexar valores agregados a cada registo
-    for r in registos_local:
-        key = r.data.isoformat()
-        agg = comb_map.get(key, {})
-        r.combustivel_total = agg.get('total_valor', Decimal('0'))
-        r.combustivel_valor_litros = agg.get('total_valor_litros', Decimal('0'))
-        r.combustivel_sobragem = agg.get('total_sobragem', Decimal('0'))
-        r.combustivel_lavagem = agg.get('total_lavagem', Decimal('0'))
-        # saídas e saldo que incluem combustível
-        try:
-            r.saidas_total_incl_combustivel = r.saidas_total() + r.combustivel_total
-        except Exception:
-            r.saidas_total_incl_combustivel = r.saidas_total()
-        try:
-            r.saldo_liquido_incl_combustivel = r.entradas_total() - r.saidas_total_incl_combustivel
-        except Exception:
-            r.saldo_liquido_incl_combustivel = r.saldo_liquido()
-        try:
-            if r.combustivel_valor_litros and r.combustivel_valor_litros != Decimal('0'):
-                r.preco_litro = r.combustivel_total / r.combustivel_valor_litros
-            else:
-                r.preco_litro = None
-        except Exception:
-            r.preco_litro = None
+    totais_registo = registos_local.aggregate(
+        km=Sum('km_percorridos'),
+        passageiros=Sum('numero_passageiros'),
+        viagens=Sum('numero_viagens'),
+    )
+    km = totais_registo['km'] or 0
+    passageiros = totais_registo['passageiros'] or 0
+    viagens = totais_registo['viagens'] or 0
+
+    # Entradas, saídas e combustível lidos do resumo diário (dias com registo)
+    totais_resumo = ResumoDiarioAutocarro.objects.filter(
+        autocarro=autocarro, registo__isnull=False
+    ).aggregate(
+        entradas=Sum('entradas'),
+        saidas=Sum('saidas_registo'),
+        combustivel=Sum('combustivel'),
+        litros=Sum('combustivel_litros'),
+        sobragem=Sum('sobragem'),
+        lavagem=Sum('lavagem'),
+    )
+    entradas = totais_resumo['entradas'] or Decimal('0')
+    saidas = totais_resumo['saidas'] or Decimal('0')
+    total_combustivel_valor = totais_resumo['combustivel'] or Decimal('0')
+    total_combustivel_litros = totais_resumo['litros'] or Decimal('0')
+    total_combustivel_sobragem = totais_resumo['sobragem'] or Decimal('0')
+    total_combustivel_lavagem = totais_resumo['lavagem'] or Decimal('0')
+
+    registos_recentes = [
+        anexar_resumo(r)
+        for r in registos_local.select_related('resumo_diario').order_by('-data')[:10]
+    ]
 
     resto = entradas - (saidas + total_combustivel_valor)
 
@@ -1245,7 +846,7 @@ def detalhe_autocarro(request, autocarro_id):
         'total_combustivel_litros': total_combustivel_litros,
         'total_combustivel_sobragem': total_combustivel_sobragem,
         'total_combustivel_lavagem': total_combustivel_lavagem,
-        'registos': registos_local.order_by('-data')[:10],
+        'registos': registos_recentes,
     }
     return render(request, 'autocarros/detalhe_autocarro.html', contexto)
 
@@ -1311,41 +912,22 @@ def listar_registros(request):
     if data_fim:
         registros = registros.filter(data__lte=data_fim)
 
-    # 🔹 Agregar despesas de combustível
-    combustivel_map = {}
-    if registros.exists():
-        autocarro_ids = set(registros.values_list('autocarro_id', flat=True))
-        datas = set(registros.values_list('data', flat=True))
-        combustiveis = DespesaCombustivel.objects.filter(
-            autocarro_id__in=autocarro_ids,
-            data__in=datas
-        )
-
-        from collections import defaultdict
-        agg = defaultdict(lambda: {
-            'total_valor': Decimal('0'),
-            'total_valor_litros': Decimal('0'),
-            'total_sobragem_filtros': Decimal('0'),
-            'total_lavagem': Decimal('0'),
-            'comprovativos': []
-        })
-
-        for c in combustiveis:
-            key = f"{c.autocarro_id}_{c.data.isoformat()}"
-            agg[key]['total_valor'] += c.valor or Decimal('0')
-            agg[key]['total_valor_litros'] += c.valor_litros or Decimal('0')
-            agg[key]['total_sobragem_filtros'] += c.sobragem_filtros or Decimal('0')
-            agg[key]['total_lavagem'] += c.lavagem or Decimal('0')
-            if c.comprovativo:
-                url = c.comprovativo.url if hasattr(c.comprovativo, 'url') else str(c.comprovativo)
-                agg[key]['comprovativos'].append(url)
-
-        combustivel_map = dict(agg)
-
-    # 🔹 Ordenar e agrupar
-    registros = registros.order_by('-data', 'autocarro__sector__nome', 'autocarro__numero')
+    # 🔹 Ordenar e agrupar (combustível vem do resumo diário)
+    registros = registros.select_related('resumo_diario').order_by('-data', 'autocarro__sector__nome', 'autocarro__numero')
     registros_agrupados = {}
 
+    # 🔹 Relatórios do sector numa só consulta, por (sector, data)
+    relatorios = RelatorioSector.objects.only('sector_id', 'data', 'despesa_geral', 'alimentacao_estaleiro')
+    if sector_obj:
+        relatorios = relatorios.filter(sector=sector_obj)
+    else:
+        relatorios = relatorios.filter(sector__in=sectores_permitidos)
+    if data_inicio:
+        relatorios = relatorios.filter(data__gte=data_inicio)
+    if data_fim:
+        relatorios = relatorios.filter(data__lte=data_fim)
+    relatorios_sector = {(r.sector_id, r.data): r for r in relatorios}
+
     for registro in registros:
         chave = f"{registro.data.isoformat()}_{registro.autocarro.sector.id}"
         
@@ -1361,61 +943,14 @@ def listar_registros(request):
                 'alimentacao_estaleiro': Decimal('0'),
             }
 
-            # 🔹 Buscar o relatório apenas uma vez por grupo (otimizado)
-            relatorio_sector = (
-                RelatorioSector.objects
-                .filter(sector=registro.autocarro.sector, data=registro.data)
-                .only('despesa_geral', 'alimentacao_estaleiro')  # otimiza a query
-                .first()
-            )
-            if relatorio_sector:
-                registros_agrupados[chave]['despesa_geral'] = relatorio_sector.despesa_geral or Decimal('0')
-                registros_agrupados[chave]['alimentacao_estaleiro'] = relatorio_sector.alimentacao_estaleiro or Decimal('0')
-        # 🔹 Processamento do registro (combustível, entradas, saídas, etc)
-        key = f"{registro.autocarro_id}_{registro.data.isoformat()}"
-        comb = combustivel_map.get(key)
-
-        # Combustível agregado
-        if comb:
-            registro.combustivel_total = comb.get('total_valor', Decimal('0'))
-            registro.combustivel_valor_litros = comb.get('total_valor_litros', Decimal('0'))
-            registro.combustivel_sobragem = comb.get('total_sobragem_filtros', Decimal('0'))
-            registro.combustivel_lavagem = comb.get('total_lavagem', Decimal('0'))
-            registro.comprovativos_combustivel = comb.get('comprovativos', [])
-        else:
-            registro.combustivel_total = Decimal('0')
-            registro.combustivel_valor_litros = Decimal('0')
-            registro.combustivel_sobragem = Decimal('0')
-            registro.combustivel_lavagem = Decimal('0')
-            registro.comprovativos_combustivel = []
-
-        # Totais com combustível
-        try:
-            registro.saidas_total_incl_combustivel = (
-                registro.saidas_total()
-                + registro.combustivel_total
-                + registro.combustivel_sobragem
-                + registro.combustivel_lavagem
-            )
-        except Exception:
-            registro.saidas_total_incl_combustivel = registro.saidas_total()
-
-        try:
-            registro.saldo_liquido_incl_combustivel = (
-                registro.entradas_total() - registro.saidas_total_incl_combustivel
-            )
-        except Exception:
-            registro.saldo_liquido_incl_combustivel = registro.saldo_liquido()
-
-        # Preço por litro
-        try:
-            if registro.combustivel_valor_litros and registro.combustivel_valor_litros != Decimal('0'):
-                registro.preco_litro = registro.combustivel_total / registro.combustivel_valor_litros
-            else:
-                registro.preco_litro = None
-        except Exception:
-            registro.preco_litro = None
-
+            # 🔹 Relatório do grupo (já carregado em bloco)
+            relatorio_sector = relatorios_sector.get((registro.autocarro.sector.id, registro.data))
+            if relatorio_sector:
+                registros_agrupados[chave]['despesa_geral'] = relatorio_sector.despesa_geral or Decimal('0')
+                registros_agrupados[chave]['alimentacao_estaleiro'] = relatorio_sector.alimentacao_estaleiro or Decimal('0')
+        # 🔹 Combustível, saídas e saldo do registo (do resumo diário)
+        anexar_resumo(registro)
+
         registros_agrupados[chave]['registos'].append(registro)
         registros_agrupados[chave]['total_entradas'] += registro.entradas_total()
         registros_agrupados[chave]['total_saidas'] += registro.saidas_total_incl_combustivel
@@ -1435,7 +970,9 @@ def listar_registros(request):
     total_entradas = sum(g['total_entradas'] for g in registros_agrupados.values())
     total_saidas = sum(g['total_saidas'] for g in registros_agrupados.values())
     total_saldo = sum(g['total_saldo'] for g in registros_agrupados.values())
-    total_combustivel = sum(v.get('total_valor', Decimal('0')) for v in combustivel_map.values())
+    total_combustivel = sum(
+        reg.combustivel_total for g in registros_agrupados.values() for reg in g['registos']
+    )
     total_despesas_gerais = sum(g.get('despesa_geral', Decimal('0')) for g in registros_agrupados.values())
 
     totais = {
@@ -1448,82 +985,6 @@ def listar_registros(request):
     }
 
 
-    # 🔹 Gerar mensagens de WhatsApp
-    def fmt_money(valor):
-        try:
-            d = Decimal(valor)
-        except Exception:
-            return "0,00"
-        sign = '-' if d < 0 else ''
-        d = abs(d).quantize(Decimal('0.01'))
-        s = f"{d:.2f}"
-        integer, frac = s.split('.')
-        integer = '{:,}'.format(int(integer)).replace(',', '.')
-        return f"{sign}{integer},{frac}"
-
-    for g in registros_agrupados.values():
-        data_str = g['data'].strftime('%d/%m/%Y')
-        sector_name = g['sector'].nome if g.get('sector') else 'Geral'
-        descricao = getattr(g['registos'][0].relatorio, 'descricao', '-') if g['registos'] else '-'
-
-        parts = [
-            f"Saudações!",
-            f"",
-            f"📊 RELATÓRIO DIÁRIO DE AUTOCARROS",
-            f"📅 DATA: {data_str}",
-            f"🏢 REGIÃO: {sector_name}",
-            "",
-            f"📝 DESCRIÇÃO: {descricao}",
-        ]
-
-        for reg in g['registos']:
-            parts.append("")
-            parts.append("__________________________________________")
-            parts.append("")
-            parts.append(f"🚌 Autocarro: {reg.autocarro.numero} - {reg.autocarro.modelo}")
-            parts.append(f"👨‍✈️ Motorista: {reg.motorista or 'N/A'}")
-            parts.append(f"👨‍💼 Cobrador Principal: {reg.cobrador_principal or 'N/A'}")
-            parts.append(f"👨‍💼 Cobrador Auxiliar: {reg.cobrador_auxiliar or 'N/A'}")
-            parts.append("")
-            parts.append("✅ Entradas")
-            parts.append(f"Normal: {fmt_money(getattr(reg, 'normal', 0))}kz")
-            parts.append(f"Alunos: {fmt_money(getattr(reg, 'alunos', 0))}kz")
-            parts.append(f"Luvu: {fmt_money(getattr(reg, 'luvu', 0))}kz")
-            parts.append(f"Frete: {fmt_money(getattr(reg, 'frete', 0))}kz")
-            parts.append(f"➡️ Total Entradas: {fmt_money(reg.entradas_total())}kz")
-            parts.append("")
-            parts.append("❌ Saídas")
-            parts.append(f"Alimentação: {fmt_money(getattr(reg, 'alimentacao', 0))}kz")
-            parts.append(f"Parqueamento: {fmt_money(getattr(reg, 'parqueamento', 0))}kz")
-            parts.append(f"Taxa: {fmt_money(getattr(reg, 'taxa', 0))}kz")
-            parts.append(f"Outros: {fmt_money(getattr(reg, 'outros', 0))}kz")
-            parts.append(f"Taxi: {fmt_money(getattr(reg, 'taxi', 0))}kz")
-            parts.append(f"Combustível: {fmt_money(reg.combustivel_total)}kz")
-            parts.append(f"Sobragem/Filtros: {fmt_money(reg.combustivel_sobragem)}kz")
-            parts.append(f"Lavagem: {fmt_money(reg.combustivel_lavagem)}kz")
-            parts.append(f"➡️ Total Saídas: {fmt_money(reg.saidas_total_incl_combustivel)}kz")
-            parts.append("")
-            parts.append("📊 Outros Dados")
-            parts.append(f"Kms: {getattr(reg, 'km_percorridos', 0)}")
-            parts.append(f"Passageiros: {getattr(reg, 'numero_passageiros', 0)}")
-            parts.append(f"Viagens: {getattr(reg, 'numero_viagens', 0)}")
-            parts.append(f"💰 Saldo Liquído: {fmt_money(reg.saldo_liquido_incl_combustivel)}kz")
-
-        parts.append("")
-        parts.append("____________________________")
-        parts.append("")
-        parts.append("📊 Resumo Geral")
-        parts.append(f"✅ Entrada Geral: {fmt_money(total_entradas)}kz")
-        parts.append(f"❌Despesa Feita Na Produção: {fmt_money(g.get('despesa_geral', 0))}kz")
-        parts.append(f"❌Alimentação Estaleiro: {fmt_money(g.get('alimentacao_estaleiro', 0))}kz")
-        parts.append(f"❌ Saída Geral: {fmt_money(total_saidas)}kz")
-        parts.append(f"💰 Liquído Geral: {fmt_money(total_saldo)}kz")
-        parts.append("")
-        parts.append("Suporte técnico: @kiangebenimatias4@gmail.com, +244 944 790 744 (WhatsApp)")
-
-        message = '\n'.join(parts)
-        g['whatsapp_link'] = f"https://wa.me/?text={quote_plus(message)}"
-
     # 🔹 Contexto final
     sectores = Sector.objects.all()
     context = {
@@ -1534,12 +995,137 @@ def listar_registros(request):
         'data_fim': data_fim,
         'totais': totais,
         'hoje': hoje,
-        'combustivel_map': combustivel_map,
     }
 
     return render(request, 'autocarros/listar_registros.html', context)
 
 
+# === MENSAGEM DE WHATSAPP DE UM GRUPO (SECTOR + DATA) === #
+def _formatar_kz(valor):
+    try:
+        d = Decimal(valor)
+    except Exception:
+        return "0,00"
+    sign = '-' if d < 0 else ''
+    d = abs(d).quantize(Decimal('0.01'))
+    s = f"{d:.2f}"
+    integer, frac = s.split('.')
+    integer = '{:,}'.format(int(integer)).replace(',', '.')
+    return f"{sign}{integer},{frac}"
+
+
+def _mensagem_whatsapp_grupo(sector, data):
+    """Texto do relatório diário de um sector, com os totais do grupo."""
+    registos = (
+        RegistoDiario.objects
+        .filter(autocarro__sector=sector, data=data)
+        .select_related('autocarro', 'resumo_diario')
+        .order_by('autocarro__numero')
+    )
+    relatorio = RelatorioSector.objects.filter(sector=sector, data=data).first()
+    despesa_geral = (relatorio.despesa_geral if relatorio else None) or Decimal('0')
+    alimentacao_estaleiro = (relatorio.alimentacao_estaleiro if relatorio else None) or Decimal('0')
+
+    parts = [
+        f"Saudações!",
+        f"",
+        f"📊 RELATÓRIO DIÁRIO DE AUTOCARROS",
+        f"📅 DATA: {data.strftime('%d/%m/%Y')}",
+        f"🏢 REGIÃO: {sector.nome}",
+        "",
+        f"📝 DESCRIÇÃO: {getattr(relatorio, 'descricao', '-')}",
+    ]
+
+    total_entradas = Decimal('0')
+    total_saidas = despesa_geral + alimentacao_estaleiro
+    for reg in registos:
+        anexar_resumo(reg)
+        total_entradas += reg.entradas_total()
+        total_saidas += reg.saidas_total_incl_combustivel
+
+        parts.append("")
+        parts.append("__________________________________________")
+        parts.append("")
+        parts.append(f"🚌 Autocarro: {reg.autocarro.numero} - {reg.autocarro.modelo}")
+        parts.append(f"👨‍✈️ Motorista: {reg.motorista or 'N/A'}")
+        parts.append(f"👨‍💼 Cobrador Principal: {reg.cobrador_principal or 'N/A'}")
+        parts.append(f"👨‍💼 Cobrador Auxiliar: {reg.cobrador_auxiliar or 'N/A'}")
+        parts.append("")
+        parts.append("✅ Entradas")
+        parts.append(f"Normal: {_formatar_kz(getattr(reg, 'normal', 0))}kz")
+        parts.append(f"Alunos: {_formatar_kz(getattr(reg, 'alunos', 0))}kz")
+        parts.append(f"Luvu: {_formatar_kz(getattr(reg, 'luvu', 0))}kz")
+        parts.append(f"Frete: {_formatar_kz(getattr(reg, 'frete', 0))}kz")
+        parts.append(f"➡️ Total Entradas: {_formatar_kz(reg.entradas_total())}kz")
+        parts.append("")
+        parts.append("❌ Saídas")
+        parts.append(f"Alimentação: {_formatar_kz(getattr(reg, 'alimentacao', 0))}kz")
+        parts.append(f"Parqueamento: {_formatar_kz(getattr(reg, 'parqueamento', 0))}kz")
+        parts.append(f"Taxa: {_formatar_kz(getattr(reg, 'taxa', 0))}kz")
+        parts.append(f"Outros: {_formatar_kz(getattr(reg, 'outros', 0))}kz")
+        parts.append(f"Taxi: {_formatar_kz(getattr(reg, 'taxi', 0))}kz")
+        parts.append(f"Combustível: {_formatar_kz(reg.combustivel_total)}kz")
+        parts.append(f"Sobragem/Filtros: {_formatar_kz(reg.combustivel_sobragem)}kz")
+        parts.append(f"Lavagem: {_formatar_kz(reg.combustivel_lavagem)}kz")
+        parts.append(f"➡️ Total Saídas: {_formatar_kz(reg.saidas_total_incl_combustivel)}kz")
+        parts.append("")
+        parts.append("📊 Outros Dados")
+        parts.append(f"Kms: {getattr(reg, 'km_percorridos', 0)}")
+        parts.append(f"Passageiros: {getattr(reg, 'numero_passageiros', 0)}")
+        parts.append(f"Viagens: {getattr(reg, 'numero_viagens', 0)}")
+        parts.append(f"💰 Saldo Liquído: {_formatar_kz(reg.saldo_liquido_incl_combustivel)}kz")
+
+    parts.append("")
+    parts.append("____________________________")
+    parts.append("")
+    parts.append("📊 Resumo Geral")
+    parts.append(f"✅ Entrada Geral: {_formatar_kz(total_entradas)}kz")
+    parts.append(f"❌Despesa Feita Na Produção: {_formatar_kz(despesa_geral)}kz")
+    parts.append(f"❌Alimentação Estaleiro: {_formatar_kz(alimentacao_estaleiro)}kz")
+    parts.append(f"❌ Saída Geral: {_formatar_kz(total_saidas)}kz")
+    parts.append(f"💰 Liquído Geral: {_formatar_kz(total_entradas - total_saidas)}kz")
+    parts.append("")
+    parts.append("Suporte técnico: @kiangebenimatias4@gmail.com, +244 944 790 744 (WhatsApp)")
+    return '\n'.join(parts)
+
+
+def _pode_ver_sector(user, sector):
+    nivel = (user.nivel_acesso or '').lower()
+    if nivel in ['admin', 'superuser']:
+        return True
+    if nivel == 'gestor':
+        return sector.gestor_id == user.id
+    if nivel == 'associado':
+        return sector.associados.filter(pk=user.pk).exists()
+    return False
+
+
+@login_required
+def whatsapp_registos_sector_data(request, sector_id, data):
+    """
+    Abre o WhatsApp com o relatório de um grupo da listagem de registos.
+    A mensagem só é montada quando o utilizador clica em "Enviar" e fica
+    em cache até os dados desse mês mudarem.
+    """
+    sector = get_object_or_404(Sector, pk=sector_id)
+    data_obj = parse_date(data)
+    if not data_obj:
+        raise Http404("Data inválida.")
+    if not _pode_ver_sector(request.user, sector):
+        return redirect('acesso_negado')
+
+    mensagem = em_cache(
+        'mensagem_whatsapp',
+        lambda: _mensagem_whatsapp_grupo(sector, data_obj),
+        versao_dados(data_obj, data_obj),
+        sector=sector.pk,
+        data=data_obj.isoformat(),
+    )
+    if request.GET.get('formato') == 'texto':
+        return HttpResponse(mensagem, content_type='text/plain; charset=utf-8')
+    return redirect(f"https://wa.me/?text={quote_plus(mensagem)}")
+
+
 @login_required
 @acesso_restrito(['admin'])
 def deletar_registros_sector_data(request, sector_id, data):
@@ -1647,48 +1233,11 @@ def relatorios_validados(request):
         data_inicio = data_hoje.isoformat()
         data_fim = data_hoje.isoformat()
     
-    # Agregar despesas de combustível para os registos validados (por autocarro+data)
-    combustivel_map_validados = {}
-    if registos_validados.exists():
-        autocarro_ids = set(registos_validados.values_list('autocarro_id', flat=True))
-        datas = set(registos_validados.values_list('data', flat=True))
-        combustiveis_val = DespesaCombustivel.objects.filter(autocarro_id__in=autocarro_ids, data__in=datas)
-        from collections import defaultdict
-        agg_val = defaultdict(lambda: {
-            'total_valor': Decimal('0'),
-            'total_valor_litros': Decimal('0'),
-            'total_sobragem': Decimal('0'),
-            'total_lavagem': Decimal('0'),
-        })
-        for c in combustiveis_val:
-            key = f"{c.autocarro_id}_{c.data.isoformat()}"
-            agg_val[key]['total_valor'] += c.valor or Decimal('0')
-            agg_val[key]['total_valor_litros'] += c.valor_litros or Decimal('0')
-            agg_val[key]['total_sobragem'] += c.sobragem_filtros or Decimal('0')
-            agg_val[key]['total_lavagem'] += c.lavagem or Decimal('0')
-        for k, v in agg_val.items():
-            combustivel_map_validados[k] = v
-
-    # Agrupar registos por data e sector para exibição e anexar combustíveis
+    # Agrupar registos por data e sector para exibição e anexar combustíveis (do resumo diário)
     registos_por_data_sector = {}
     processed_registos = []
-    for registro in registos_validados.select_related('autocarro__sector'):
-        # anexar agregados de combustível ao registro para uso nos totais
-        key = f"{registro.autocarro_id}_{registro.data.isoformat()}"
-        comb = combustivel_map_validados.get(key, {})
-        registro.combustivel_total = comb.get('total_valor', Decimal('0'))
-        registro.combustivel_valor_litros = comb.get('total_valor_litros', Decimal('0'))
-        registro.combustivel_sobragem = comb.get('total_sobragem', Decimal('0'))
-        registro.combustivel_lavagem = comb.get('total_lavagem', Decimal('0'))
-        # saídas e saldo que incluem combustível
-        try:
-            registro.saidas_total_incl_combustivel = registro.saidas_total() + registro.combustivel_total + registro.combustivel_sobragem + registro.combustivel_lavagem
-        except Exception:
-            registro.saidas_total_incl_combustivel = registro.saidas_total()
-        try:
-            registro.saldo_liquido_incl_combustivel = registro.entradas_total() - registro.saidas_total_incl_combustivel
-        except Exception:
-            registro.saldo_liquido_incl_combustivel = registro.saldo_liquido()
+    for registro in registos_validados.select_related('autocarro__sector', 'resumo_diario'):
+        anexar_resumo(registro)
 
         chave = f"{registro.data}_{registro.autocarro.sector.id}"
         if chave not in registos_por_data_sector:
@@ -1802,21 +1351,12 @@ def adicionar_relatorio_sector(request):
                         )
                 
                 # Criar registos para cada autocarro do sector
-                autocarros = Autocarro.objects.filter(sector=relatorio.sector)
-                registros_criados = []
-                for autocarro in autocarros:
-                    registro, criado = RegistoDiario.objects.get_or_create(
-                        relatorio=relatorio,
-                        autocarro=autocarro,
-                        data=relatorio.data
-                    )
-                    if criado:
-                        registros_criados.append(registro)
+                registros, criados = preparar_registos(relatorio.sector, relatorio.data, relatorio)
 
                 messages.success(request, f"✅ Relatório para {relatorio.sector.nome} criado com {len(arquivos)} comprovativos!")
-                # Redirecionar para o primeiro registro criado
-                if registros_criados:
-                    return redirect('editar_relatorio_sector', pk=registros_criados[0].pk)
+                # Redirecionar para a folha de registos do sector
+                if criados and registros:
+                    return redirect('editar_relatorio_sector', pk=registros[0].pk)
                 else:
                     return redirect('listar_registros')
                 
@@ -1863,13 +1403,7 @@ def gerir_relatorio_sector(request, pk=None):
 
                 # 🔹 Criar registos (somente se for novo)
                 if pk is None:
-                    autocarros = Autocarro.objects.filter(sector=relatorio.sector)
-                    for autocarro in autocarros:
-                        RegistoDiario.objects.get_or_create(
-                            relatorio=relatorio,
-                            autocarro=autocarro,
-                            data=relatorio.data
-                        )
+                    preparar_registos(relatorio.sector, relatorio.data, relatorio)
 
                 if pk:
                     messages.success(request, f"✅ Relatório de {relatorio.sector.nome} atualizado com sucesso!")
@@ -1930,22 +1464,7 @@ def editar_relatorio_sector(request, pk=None, sector_id=None, data=None):
     )
 
     # 🔹 Garantir que todos os autocarros do setor tenham registro
-    autocarros_do_sector = Autocarro.objects.filter(sector=sector)
-    registros = RegistoDiario.objects.filter(
-        autocarro__sector=sector,
-        data=data
-    ).select_related('autocarro')
-
-    autocarros_com_registro = registros.values_list('autocarro_id', flat=True)
-    for autocarro in autocarros_do_sector:
-        if autocarro.id not in autocarros_com_registro:
-            RegistoDiario.objects.create(autocarro=autocarro, data=data)
-
-    # Recarregar registros
-    registros = RegistoDiario.objects.filter(
-        autocarro__sector=sector,
-        data=data
-    ).select_related('autocarro')
+    registros, _ = preparar_registos(sector, data, relatorio_sector)
 
     # 🔹 POST - salvar alterações
     if request.method == "POST":
@@ -1966,22 +1485,17 @@ def editar_relatorio_sector(request, pk=None, sector_id=None, data=None):
         else:
             messages.warning(request, "⚠️ Verifique o campo 'Despesa geral do setor'.")
 
-        # 🔹 Salvar cada registo de autocarro
+        # 🔹 Comparar cada registo de autocarro com o que foi submetido
+        campos = RegistoSectorForm._meta.fields
+        alterados = []
         for registro in registros:
-            form = RegistoDiarioForm(
-                request.POST,
-                instance=registro,
-                prefix=f"registro_{registro.id}"
-            )
+            # validado sem instância: a folha não muda autocarro nem data, por
+            # isso a verificação de duplicados do modelo não é precisa
+            form = RegistoSectorForm(request.POST, prefix=f"registro_{registro.id}")
 
             if form.is_valid():
-                try:
-                    form.save()
-                except Exception as e:
-                    messages.error(
-                        request,
-                        f"Erro ao salvar registo do autocarro {registro.autocarro.numero}: {str(e)}"
-                    )
+                if aplicar_alteracoes(registro, form.cleaned_data, campos):
+                    alterados.append(registro)
             else:
                 for field, errors in form.errors.items():
                     for error in errors:
@@ -1990,10 +1504,16 @@ def editar_relatorio_sector(request, pk=None, sector_id=None, data=None):
                             f"Autocarro {registro.autocarro.numero}, campo {field}: {error}"
                         )
 
-        if not any(message.tags == 'error' for message in messages.get_messages(request)):
+        # 🔹 Gravar só os registos alterados, de uma vez
+        try:
+            gravados = gravar_alterados(sector, data, alterados, campos)
+        except Exception as e:
+            messages.error(request, f"Erro ao salvar os registos do setor {sector.nome}: {str(e)}")
+        else:
             messages.success(
                 request,
-                f"✅ Registos e relatório do setor {sector.nome} ({data}) atualizados com sucesso!"
+                f"✅ Relatório do setor {sector.nome} ({data}) atualizado — "
+                f"{gravados} registo(s) de autocarro alterado(s)."
             )
             return redirect("listar_registros")
 
@@ -2004,7 +1524,7 @@ def editar_relatorio_sector(request, pk=None, sector_id=None, data=None):
     forms = []
     for registro in registros:
         forms.append({
-            "form": RegistoDiarioForm(instance=registro, prefix=f"registro_{registro.id}"),
+            "form": RegistoSectorForm(instance=registro, prefix=f"registro_{registro.id}"),
             "registro": registro,
         })
 
@@ -2014,8 +1534,8 @@ def editar_relatorio_sector(request, pk=None, sector_id=None, data=None):
         "relatorio": relatorio_sector,  # ✅ adicionado — essencial para o template
         "relatorio_form": relatorio_form,
         "forms": forms,
-        "total_autocarros": autocarros_do_sector.count(),
-        "total_registros": registros.count(),
+        "total_autocarros": len(registros),  # cada autocarro do sector tem o seu registo
+        "total_registros": len(registros),
     }
 
     return render(request, "autocarros/editar_relatorio_sector.html", context)
@@ -2646,10 +2166,7 @@ def depositos_list(request):
 
     year  = request.GET.get('year')
     month = request.GET.get('month')
-    if year:
-        qs = qs.filter(data_deposito__year=year)
-    if month:
-        qs = qs.filter(data_deposito__month=month)
+    qs = qs.filter(**filtro_periodo('data_deposito', year, month))
 
     # FIX: calcular o total ANTES do slice (aggregate ignora slice em Django,
     # mas manter a ordem correcta evita confusão futura)
@@ -2799,106 +2316,48 @@ def decimal_default(obj):
 
 
 from decimal import Decimal
+from functools import reduce
+import operator
 from django.db.models import Sum, F, DecimalField, ExpressionWrapper
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.utils.timezone import now
 
-@login_required
-@acesso_restrito(['admin'])
-def contabilista_financas(request):
-
-    # 🔹 Ano selecionado
-    ano = request.GET.get("ano")
-
-    if ano:
-        ano = int(ano)
-    else:
-        ano = now().year
-
+def _dados_contabilista_financas(ano):
+    """Totais do ano para o painel do contabilista (guardados em cache)."""
     # ===============================
-    # REGISTOS DIÁRIOS
+    # TOTAIS DO ANO (resumo mensal)
     # ===============================
-
-    registos = RegistoDiario.objects.filter(data__year=ano).annotate(
-        saldo_liquido=ExpressionWrapper(
-            (F("normal") + F("alunos") + F("luvu") + F("frete")) -
-            (F("alimentacao") + F("parqueamento") + F("taxa") + F("outros")),
-            output_field=DecimalField(max_digits=12, decimal_places=2)
-        )
-    )
-
-    totais = registos.aggregate(
-        total_entradas=Sum(
-            F("normal") + F("alunos") + F("luvu") + F("frete"),
-            output_field=DecimalField()
-        ),
-        total_saidas=Sum(
-            F("alimentacao") + F("parqueamento") + F("taxa") + F("outros"),
-            output_field=DecimalField()
-        ),
-        total_saldo=Sum("saldo_liquido"),
+    # Uma só query ao ResumoMensalSector. As despesas fixas ativas contam
+    # todas (como antes), as restantes colunas apenas as do ano escolhido.
+
+    do_ano = Q(ano=ano)
+    colunas_fixas = [F(f'fixa_{categoria}') for categoria, _ in DespesaFixa.CATEGORIAS]
+
+    resumo = ResumoMensalSector.objects.aggregate(
+        total_entradas=Sum(F("normal") + F("alunos") + F("luvu") + F("frete"), filter=do_ano),
+        total_saidas=Sum(F("alimentacao") + F("parqueamento") + F("taxa") + F("outros") + F("taxi"), filter=do_ano),
+        total_despesas_gerais=Sum('despesas_variaveis', filter=do_ano),
+        total_combustivel=Sum('combustivel', filter=do_ano),
+        total_sobragem=Sum('sobragem', filter=do_ano),
+        total_lavagem=Sum('lavagem', filter=do_ano),
+        total_despesas_fixas=Sum(reduce(operator.add, colunas_fixas)),
+        total_despesa2=Sum('despesa2', filter=do_ano),
+        total_despesa_sector=Sum('despesa_geral', filter=do_ano),
+        total_alimentacao_sector=Sum('alimentacao_estaleiro', filter=do_ano),
     )
 
     # Garantir valores válidos
-    total_entradas = Decimal(totais.get("total_entradas") or 0)
-    total_saidas_base = Decimal(totais.get("total_saidas") or 0)
-
-    # ===============================
-    # DESPESAS GERAIS
-    # ===============================
-
-    total_despesas_gerais = (
-        Despesa.objects.filter(data__year=ano)
-        .aggregate(total=Sum('valor', output_field=DecimalField()))
-        .get('total') or Decimal('0')
-    )
-
-    # ===============================
-    # COMBUSTÍVEL
-    # ===============================
-
-    comb = DespesaCombustivel.objects.filter(data__year=ano).aggregate(
-        total_valor=Sum('valor', output_field=DecimalField()),
-        total_sobragem=Sum('sobragem_filtros', output_field=DecimalField()),
-        total_lavagem=Sum('lavagem', output_field=DecimalField()),
-    )
-
-    total_combustivel = comb.get('total_valor') or Decimal('0')
-    total_sobragem = comb.get('total_sobragem') or Decimal('0')
-    total_lavagem = comb.get('total_lavagem') or Decimal('0')
-
-    # ===============================
-    # DESPESAS FIXAS
-    # ===============================
-
-    total_despesas_fixas = (
-        DespesaFixa.objects.filter(ativo=True)
-        .aggregate(total=Sum('valor', output_field=DecimalField()))
-        .get('total') or Decimal('0')
-    )
-
-    # ===============================
-    # DESPESA2
-    # ===============================
-
-    total_despesa2 = (
-        Despesa2.objects.filter(data__year=ano)
-        .aggregate(total=Sum('valor', output_field=DecimalField()))
-        .get('total') or Decimal('0')
-    )
-
-    # ===============================
-    # RELATÓRIOS DOS SECTORES
-    # ===============================
-
-    relatorio_sector = RelatorioSector.objects.filter(data__year=ano).aggregate(
-        total_despesa_geral=Sum('despesa_geral', output_field=DecimalField()),
-        total_alimentacao=Sum('alimentacao_estaleiro', output_field=DecimalField()),
-    )
-
-    total_despesa_sector = relatorio_sector.get('total_despesa_geral') or Decimal('0')
-    total_alimentacao_sector = relatorio_sector.get('total_alimentacao') or Decimal('0')
+    total_entradas = Decimal(resumo.get("total_entradas") or 0)
+    total_saidas_base = Decimal(resumo.get("total_saidas") or 0)
+    total_despesas_gerais = resumo.get('total_despesas_gerais') or Decimal('0')
+    total_combustivel = resumo.get('total_combustivel') or Decimal('0')
+    total_sobragem = resumo.get('total_sobragem') or Decimal('0')
+    total_lavagem = resumo.get('total_lavagem') or Decimal('0')
+    total_despesas_fixas = resumo.get('total_despesas_fixas') or Decimal('0')
+    total_despesa2 = resumo.get('total_despesa2') or Decimal('0')
+    total_despesa_sector = resumo.get('total_despesa_sector') or Decimal('0')
+    total_alimentacao_sector = resumo.get('total_alimentacao_sector') or Decimal('0')
 
     # ===============================
     # TOTAL DE SAÍDAS
@@ -2932,7 +2391,7 @@ def contabilista_financas(request):
     # ÚLTIMAS DESPESAS
     # ===============================
 
-    despesas = Despesa.objects.filter(data__year=ano).order_by("-data")[:10]
+    despesas = Despesa.objects.filter(**filtro_periodo("data", ano)).order_by("-data")[:10]
 
     context = {
         "totais": totais,
@@ -2943,159 +2402,43 @@ def contabilista_financas(request):
         "total_despesa_sector": total_despesa_sector,
         "total_alimentacao_sector": total_alimentacao_sector,
     }
+    return context
 
-    return render(request, "dashboards/contabilista_financas.html", context)
 
-# ...existing code...
 @login_required
 @acesso_restrito(['admin'])
-def gerencia_financas(request):
+def contabilista_financas(request):
 
-    # Captura parâmetro ?mes=YYYY-MM (opcional)
-    mes_param = request.GET.get('mes', '').strip()
-    ano_mes = None
-    if mes_param:
-        try:
-            ano, mes = map(int, mes_param.split('-'))
-            ano_mes = (ano, mes)
-        except Exception:
-            ano_mes = None
+    # 🔹 Ano selecionado
+    ano = request.GET.get("ano")
+
+    if ano:
+        ano = int(ano)
+    else:
+        ano = now().year
+
+    context = em_cache(
+        'contabilista_financas', lambda: _dados_contabilista_financas(ano), versao_ano(ano), ano=ano
+    )
+
+    return render(request, "dashboards/contabilista_financas.html", context)
 
+# ...existing code...
+def _dados_gerencia_financas(ano_mes):
+    """Séries mensais dos gráficos da gerência (guardadas em cache)."""
     # =========================== #
     #   AGRUPAMENTOS MENSAIS      #
     # =========================== #
+    # Uma só query ao ResumoMensalSector (somado por mês). Só entram os meses
+    # com registos diários, como nos gráficos originais.
     if ano_mes:
         ano, mes = ano_mes
-        registros = (
-            RegistoDiario.objects
-            .filter(data__year=ano, data__month=mes)
-            .annotate(mes=TruncMonth('data'))
-            .values('mes')
-            .annotate(
-                total_normal=Sum('normal', output_field=DecimalField()),
-                total_alunos=Sum('alunos', output_field=DecimalField()),
-                total_luvu=Sum('luvu', output_field=DecimalField()),
-                total_frete=Sum('frete', output_field=DecimalField()),
-                total_alimentacao=Sum('alimentacao', output_field=DecimalField()),
-                total_parqueamento=Sum('parqueamento', output_field=DecimalField()),
-                total_taxa=Sum('taxa', output_field=DecimalField()),
-                total_outros=Sum('outros', output_field=DecimalField()),
-            )
-            .order_by('mes')
-        )
-
-        despesas_relatorio = (
-            RelatorioSector.objects
-            .filter(data__year=ano, data__month=mes)
-            .annotate(mes=TruncMonth('data'))
-            .values('mes')
-            .annotate(total_despesas_geral=Sum('despesa_geral', output_field=DecimalField()))
-            .order_by('mes')
-        )
-
-        combustiveis_qs = (
-            DespesaCombustivel.objects
-            .filter(data__year=ano, data__month=mes)
-            .annotate(mes=TruncMonth('data'))
-            .values('mes')
-            .annotate(
-                total_valor=Sum('valor', output_field=DecimalField()),
-                total_sobragem=Sum('sobragem_filtros', output_field=DecimalField()),
-                total_lavagem=Sum('lavagem', output_field=DecimalField())
-            )
-            .order_by('mes')
-        )
-
-        despesas_fixas = (
-            DespesaFixa.objects
-            .filter(ativo=True, data_inicio__year=ano, data_inicio__month=mes)
-            .annotate(mes=TruncMonth('data_inicio'))
-            .values('mes', 'categoria')
-            .annotate(total_valor=Sum('valor', output_field=DecimalField()))
-            .order_by('mes', 'categoria')
-        )
-
-        despesas_variaveis = (
-            Despesa.objects
-            .filter(data__year=ano, data__month=mes)
-            .annotate(mes=TruncMonth('data'))
-            .values('mes')
-            .annotate(total_despesas_variaveis=Sum('valor', output_field=DecimalField()))
-            .order_by('mes')
-        )
-
+        registros = totais_mensais(ano, mes, apenas_com_registos=True)
     else:
-        registros = (
-            RegistoDiario.objects
-            .annotate(mes=TruncMonth('data'))
-            .values('mes')
-            .annotate(
-                total_normal=Sum('normal', output_field=DecimalField()),
-                total_alunos=Sum('alunos', output_field=DecimalField()),
-                total_luvu=Sum('luvu', output_field=DecimalField()),
-                total_frete=Sum('frete', output_field=DecimalField()),
-                total_alimentacao=Sum('alimentacao', output_field=DecimalField()),
-                total_parqueamento=Sum('parqueamento', output_field=DecimalField()),
-                total_taxa=Sum('taxa', output_field=DecimalField()),
-                total_outros=Sum('outros', output_field=DecimalField()),
-            )
-            .order_by('mes')
-        )
-
-        despesas_relatorio = (
-            RelatorioSector.objects
-            .annotate(mes=TruncMonth('data'))
-            .values('mes')
-            .annotate(total_despesas_geral=Sum('despesa_geral', output_field=DecimalField()))
-            .order_by('mes')
-        )
-
-        combustiveis_qs = (
-            DespesaCombustivel.objects
-            .annotate(mes=TruncMonth('data'))
-            .values('mes')
-            .annotate(
-                total_valor=Sum('valor', output_field=DecimalField()),
-                total_sobragem=Sum('sobragem_filtros', output_field=DecimalField()),
-                total_lavagem=Sum('lavagem', output_field=DecimalField())
-            )
-            .order_by('mes')
-        )
-
-        despesas_fixas = (
-            DespesaFixa.objects
-            .filter(ativo=True)
-            .annotate(mes=TruncMonth('data_inicio'))
-            .values('mes', 'categoria')
-            .annotate(total_valor=Sum('valor', output_field=DecimalField()))
-            .order_by('mes', 'categoria')
-        )
-
-        despesas_variaveis = (
-            Despesa.objects
-            .annotate(mes=TruncMonth('data'))
-            .values('mes')
-            .annotate(total_despesas_variaveis=Sum('valor', output_field=DecimalField()))
-            .order_by('mes')
-        )
-
-    # ============================================
-    #   MAPAS PARA ACESSO RÁPIDO POR MÊS
-    # ============================================
-    despesas_rel_map = {d['mes']: (d.get('total_despesas_geral') or 0) for d in despesas_relatorio}
-    despesas_var = {d['mes']: (d.get('total_despesas_variaveis') or 0) for d in despesas_variaveis}
-
-    despesas_fixas_map = {
-        (d['mes'], d['categoria']): (d.get('total_valor') or 0)
-        for d in despesas_fixas
-    }
+        registros = totais_mensais(apenas_com_registos=True)
 
     categorias_fixas = [c[0] for c in DespesaFixa.CATEGORIAS]
 
-    combustivel_map_valor = {c['mes']: c.get('total_valor') or 0 for c in combustiveis_qs}
-    combustivel_map_sobragem = {c['mes']: c.get('total_sobragem') or 0 for c in combustiveis_qs}
-    combustivel_map_lavagem = {c['mes']: c.get('total_lavagem') or 0 for c in combustiveis_qs}
-
     # ================================
     #   LABELS DOS GRÁFICOS
     # ================================
@@ -3104,10 +2447,10 @@ def gerencia_financas(request):
     # ================================
     #   ENTRADAS
     # ================================
-    serie_normal = [float(r['total_normal'] or 0) for r in registros]
-    serie_alunos = [float(r['total_alunos'] or 0) for r in registros]
-    serie_luvu = [float(r['total_luvu'] or 0) for r in registros]
-    serie_frete = [float(r['total_frete'] or 0) for r in registros]
+    serie_normal = [float(r['normal']) for r in registros]
+    serie_alunos = [float(r['alunos']) for r in registros]
+    serie_luvu = [float(r['luvu']) for r in registros]
+    serie_frete = [float(r['frete']) for r in registros]
 
     # Soma correta das entradas por mês
     serie_entradas = [
@@ -3118,18 +2461,18 @@ def gerencia_financas(request):
     # ================================
     #   SAÍDAS
     # ================================
-    serie_alimentacao = [float(r['total_alimentacao'] or 0) for r in registros]
-    serie_parqueamento = [float(r['total_parqueamento'] or 0) for r in registros]
-    serie_taxa = [float(r['total_taxa'] or 0) for r in registros]
-    serie_outros = [float(r['total_outros'] or 0) for r in registros]
-    serie_taxi = [float(r['total_taxi'] or 0) for r in registros]
-    
-    serie_alimentacao_estaleiro = [float(r['total_alimentacao_estaleiro'] or 0) for r in registros]
-    serie_despesas_extra = [float(despesas_rel_map.get(r['mes'], 0)) for r in registros]
+    serie_alimentacao = [float(r['alimentacao']) for r in registros]
+    serie_parqueamento = [float(r['parqueamento']) for r in registros]
+    serie_taxa = [float(r['taxa']) for r in registros]
+    serie_outros = [float(r['outros']) for r in registros]
+    serie_taxi = [float(r['taxi']) for r in registros]
 
-    serie_combustivel_valor = [float(combustivel_map_valor.get(r['mes'], 0)) for r in registros]
-    serie_combustivel_sobragem = [float(combustivel_map_sobragem.get(r['mes'], 0)) for r in registros]
-    serie_combustivel_lavagem = [float(combustivel_map_lavagem.get(r['mes'], 0)) for r in registros]
+    serie_alimentacao_estaleiro = [float(r['alimentacao_estaleiro']) for r in registros]
+    serie_despesas_extra = [float(r['despesa_geral']) for r in registros]
+
+    serie_combustivel_valor = [float(r['combustivel']) for r in registros]
+    serie_combustivel_sobragem = [float(r['sobragem']) for r in registros]
+    serie_combustivel_lavagem = [float(r['lavagem']) for r in registros]
 
     serie_saidas = [
         (
@@ -3160,7 +2503,7 @@ def gerencia_financas(request):
     # ================================
     serie_despesas_fixas = {
         categoria: [
-            float(despesas_fixas_map.get((r['mes'], categoria), 0))
+            float(r[f'fixa_{categoria}'])
             for r in registros
         ]
         for categoria in categorias_fixas
@@ -3176,7 +2519,7 @@ def gerencia_financas(request):
     #   DESPESAS VARIÁVEIS
     # ================================
     serie_despesas_variaveis = [
-        float(despesas_var.get(r['mes'], 0)) for r in registros
+        float(r['despesas_variaveis']) for r in registros
     ]
 
     # ================================
@@ -3241,6 +2584,27 @@ def gerencia_financas(request):
         # Lucro final
         "serie_lucro": serie_lucro,
     }
+    return context
+
+
+@login_required
+@acesso_restrito(['admin'])
+def gerencia_financas(request):
+
+    # Captura parâmetro ?mes=YYYY-MM (opcional)
+    mes_param = request.GET.get('mes', '').strip()
+    ano_mes = None
+    if mes_param:
+        try:
+            ano, mes = map(int, mes_param.split('-'))
+            ano_mes = (ano, mes)
+        except Exception:
+            ano_mes = None
+
+    versao = versao_mes(*ano_mes) if ano_mes else versao_dados()
+    context = em_cache(
+        'gerencia_financas', lambda: _dados_gerencia_financas(ano_mes), versao, ano_mes=ano_mes
+    )
 
     # ---------------------------
     # download CSV com TODOS os dados exibidos no template
@@ -3309,6 +2673,26 @@ def gerencia_financas(request):
         from docx.oxml import parse_xml
         from docx.oxml.ns import nsdecls
 
+        # as mesmas séries que vão para o template (vindas da cache)
+        labels = context["labels"]
+        serie_normal = context["serie_normal"]
+        serie_alunos = context["serie_alunos"]
+        serie_luvu = context["serie_luvu"]
+        serie_frete = context["serie_frete"]
+        serie_entradas = context["serie_entradas"]
+        serie_alimentacao = context["serie_alimentacao"]
+        serie_taxa = context["serie_taxa"]
+        serie_outros = context["serie_outros"]
+        serie_parqueamento = context["serie_parqueamento"]
+        serie_despesas_extra = context["serie_despesas_extra"]
+        serie_combustivel_valor = context["serie_combustivel_valor"]
+        serie_combustivel_lavagem = context["serie_combustivel_lavagem"]
+        serie_combustivel_sobragem = context["serie_combustivel_sobragem"]
+        serie_saldo = context["serie_saldo"]
+        serie_total_despesas_fixas = context["serie_total_despesas_fixas"]
+        serie_despesas_variaveis = context["serie_despesas_variaveis"]
+        serie_lucro = context["serie_lucro"]
+
         def _fmt_kz(value):
             try:
                 v = Decimal(value or 0).quantize(Decimal('0.01'))
@@ -3559,6 +2943,40 @@ def cobrador_viagens_save(request):
     return JsonResponse({"ok": True, "viagem_id": viagem.id})
 
 
+@login_required
+@require_POST
+def cobrador_viagens_sync(request):
+    """
+    Sincroniza de uma vez a fila de viagens guardada no telemóvel do cobrador.
+    Espera JSON {"viagens": [...]} (ou a lista diretamente); cada viagem tem os
+    campos de cobrador_viagens_save e uma "chave" única gerada no telemóvel.
+    Devolve um resultado por viagem, pela mesma ordem (criada | existente | erro).
+    """
+    try:
+        data = json.loads(request.body.decode("utf-8"))
+    except Exception:
+        return HttpResponseBadRequest("JSON inválido")
+
+    viagens = data.get("viagens") if isinstance(data, dict) else data
+    if not isinstance(viagens, list):
+        return JsonResponse({"ok": False, "error": "lista de viagens obrigatória"}, status=400)
+    if len(viagens) > MAX_VIAGENS:
+        return JsonResponse({"ok": False, "error": f"no máximo {MAX_VIAGENS} viagens por envio"}, status=400)
+
+    resultados = sincronizar_viagens(request.user, viagens)
+    totais = {estado: 0 for estado in ("criada", "existente", "erro")}
+    for resultado in resultados:
+        totais[resultado["estado"]] += 1
+
+    return JsonResponse({
+        "ok": True,
+        "resultados": resultados,
+        "criadas": totais["criada"],
+        "existentes": totais["existente"],
+        "erros": totais["erro"],
+    })
+
+
 @login_required
 def cobrador_viagens_list(request):
     """
@@ -3862,10 +3280,35 @@ def api_autocarros_por_sector(request):
     sector_id = request.GET.get('sector_id')
     if not sector_id:
         return JsonResponse({'ok': False, 'error': 'sector_id obrigatório'}, status=400)
-    autos = Autocarro.objects.filter(sector_id=sector_id).values('id','numero','modelo')
+    # km atual estimado pelo odómetro, para orientar a nova leitura
+    autos = (
+        Autocarro.objects.filter(sector_id=sector_id)
+        .annotate(km_atual=F('odometro__km_leitura') + F('odometro__km_desde_leitura'))
+        .values('id', 'numero', 'modelo', 'km_atual')
+    )
     return JsonResponse({'ok': True, 'autocarros': list(autos)})
 
 
+def _km_proxima_por_autocarro(autocarro_ids):
+    """{autocarro_id: km_proxima da manutenção mais recente} (subconsulta correlacionada)."""
+    ultima = (
+        Manutencao.objects
+        .filter(autocarro=OuterRef('pk'))
+        .order_by('-data_ultima', '-criado_em', '-id')
+        .values('km_proxima')[:1]
+    )
+    return {
+        pk: km
+        for pk, km in (
+            Autocarro.objects
+            .filter(pk__in=autocarro_ids)
+            .annotate(km_proxima=Subquery(ultima))
+            .values_list('pk', 'km_proxima')
+        )
+        if km is not None
+    }
+
+
 @login_required
 @acesso_restrito(['admin', 'gestor'])
 def registro_km_view(request):
@@ -3873,14 +3316,17 @@ def registro_km_view(request):
     # listar últimos registros (paginacao simples: últimos 20)
     registros = RegistroKM.objects.select_related('sector').prefetch_related('itens__autocarro').order_by('-data_registo')[:20]
 
+    # km_proxima da manutenção mais recente de cada autocarro da página, numa só consulta
+    km_proxima = _km_proxima_por_autocarro(
+        {it.autocarro_id for r in registros for it in r.itens.all()}
+    )
+
     # preparar dados para listagem com previsão (km_proxima vs km_atual)
     registros_data = []
     for r in registros:
         itens = []
         for it in r.itens.all():
-            # buscar manutenção mais recente para o autocarro
-            m = Manutencao.objects.filter(autocarro=it.autocarro).order_by('-data_ultima').first()
-            km_prox = m.km_proxima if m else None
+            km_prox = km_proxima.get(it.autocarro_id)
             falta = None
             status = 'Sem plano'
             if km_prox is not None:
@@ -3931,19 +3377,88 @@ def registro_km_save(request):
     except Sector.DoesNotExist:
         return JsonResponse({'ok': False, 'error': 'Sector não encontrado'}, status=404)
 
-    registro = RegistroKM.objects.create(sector=sector, data_registo=data_registo or None)
-    created = 0
+    # ler os km de cada item (os inválidos são ignorados; um autocarro repetido conta uma vez)
+    kms = {}
     for it in itens:
         try:
             aid = int(it.get('autocarro_id'))
             km = int(it.get('km_atual'))
-            aut = Autocarro.objects.get(pk=aid, sector=sector)
-            RegistroKMItem.objects.create(registro=registro, autocarro=aut, km_atual=km)
-            created += 1
-        except Exception:
+        except (AttributeError, TypeError, ValueError):
             continue
+        if km >= 0:
+            kms.setdefault(aid, km)
+
+    # validar todos os autocarros do sector de uma vez
+    validos = set(
+        Autocarro.objects.filter(pk__in=kms, sector=sector).values_list('pk', flat=True)
+    )
+
+    with transaction.atomic():
+        registro = RegistroKM(sector=sector)
+        if data_registo:
+            registro.data_registo = data_registo
+        registro.save()
+        criados = RegistroKMItem.objects.bulk_create([
+            RegistroKMItem(registro=registro, autocarro_id=aid, km_atual=km)
+            for aid, km in kms.items() if aid in validos
+        ])
+        # bulk_create não dispara os signals do odómetro
+        agendar_recalculo_odometro(*(item.autocarro_id for item in criados))
+
+    return JsonResponse({'ok': True, 'registro_id': registro.id, 'created': len(criados)})
+
+
+ORDENS_VENCIMENTOS = {
+    'data': ('prioridade_hoje', F('data_limite').asc(nulls_last=True), F('km_em_falta').asc(nulls_last=True), 'autocarro__numero'),
+    'km': (F('km_em_falta').asc(nulls_last=True), 'autocarro__numero'),
+    'autocarro': ('autocarro__numero', 'componente', 'posicao'),
+}
+
 
-    return JsonResponse({'ok': True, 'registro_id': registro.id, 'created': created})
+@login_required
+@acesso_restrito(['admin', 'gestor'])
+def vencimentos_list(request):
+    """Lista de vencimentos de manutenção da frota (calculada em vencimentos.py)."""
+    # o estado segue o calendário: calculado na consulta, não o do último recálculo
+    qs = com_estado_do_dia(VencimentoManutencao.objects.select_related('autocarro__sector'))
+
+    sector_id = request.GET.get('sector')
+    if sector_id:
+        qs = qs.filter(autocarro__sector_id=sector_id)
+
+    autocarro_numero = request.GET.get('autocarro')
+    if autocarro_numero:
+        qs = qs.filter(autocarro__numero__icontains=autocarro_numero)
+
+    componente = request.GET.get('componente')
+    if componente:
+        qs = qs.filter(componente=componente)
+
+    # contagem por estado com os outros filtros aplicados, numa só consulta
+    contagens = qs.aggregate(**{
+        estado: Count('pk', filter=Q(estado_hoje=estado))
+        for estado, _ in VencimentoManutencao.ESTADO_CHOICES
+    })
+
+    estado = request.GET.get('estado')
+    if estado:
+        qs = qs.filter(estado_hoje=estado)
+
+    ordem = request.GET.get('ordem')
+    if ordem not in ORDENS_VENCIMENTOS:
+        ordem = 'data'
+    pagina = Paginator(qs.order_by(*ORDENS_VENCIMENTOS[ordem]), 50).get_page(request.GET.get('page'))
+    for vencimento in pagina:
+        vencimento.estado = vencimento.estado_hoje
+
+    return render(request, 'autocarros/vencimentos_list.html', {
+        'vencimentos': pagina,
+        'contagens': contagens,
+        'ordem': ordem,
+        'sectores': Sector.objects.order_by('nome'),
+        'estado_choices': VencimentoManutencao.ESTADO_CHOICES,
+        'componente_choices': VencimentoManutencao.COMPONENTE_CHOICES,
+    })
 
 
 from itertools import groupby
@@ -3973,21 +3488,22 @@ def pneu_list(request):
     if referencia:
         qs = qs.filter(referencia__icontains=referencia)
 
+    pagina = paginar_keyset(request, qs, ('-data_compra', '-criado_em', '-id'))
+
     # ── Agrupamento por data de compra ──────────────────────
-    # Como a queryset já vem ordenada por -data_compra, os registos com a
+    # Como a página já vem ordenada por -data_compra, os registos com a
     # mesma data ficam sempre contíguos, então dá para usar groupby direto.
     grupos = []
-    for data_compra, itens in groupby(qs, key=lambda p: p.data_compra):
+    for data_compra, itens in groupby(pagina, key=lambda p: p.data_compra):
         grupos.append({
             'data_compra': data_compra,
             'itens': list(itens),
         })
 
-    total_pneus = sum(len(g['itens']) for g in grupos)
-
     return render(request, 'pneus/pneu_list.html', {
         'grupos': grupos,
-        'total_pneus': total_pneus,
+        'pagina': pagina,
+        'total_pneus': qs.count(),
     })
 
 # ---------- Mapa Registro de Pneus ----------#
@@ -4092,7 +3608,37 @@ def troca_delete(request, pk):
 @login_required
 @acesso_restrito(['admin', 'gestor'])
 def inspecao_list(request):
-    qs = Troca.objects.select_related('pneu', 'autocarro').all().order_by('-data_troca', '-criado_em')
+    """Mostra só a troca MAIS RECENTE de cada combinação autocarro + local
+    — ou seja, o pneu que está montado agora em cada posição."""
+    qs = Troca.objects.all()
+
+    autocarro_numero = request.GET.get('autocarro')
+    if autocarro_numero:
+        qs = qs.filter(autocarro__numero__icontains=autocarro_numero)
+
+    local = request.GET.get('local')
+    if local:
+        qs = qs.filter(local=local)
+
+    trocas = qs.instaladas().select_related('pneu', 'autocarro__odometro').order_by('autocarro__numero', 'local')
+
+    # a referência filtra o pneu instalado, não o histórico da posição
+    referencia = request.GET.get('referencia')
+    if referencia:
+        trocas = trocas.filter(pneu__referencia__icontains=referencia)
+
+    trocas = list(trocas)
+
+    return render(request, 'pneus/inspecao_list.html', {
+        'trocas': trocas,
+        'total_trocas': len(trocas),
+        'local_choices': Troca.LOCAL_CHOICES,
+    })
+
+@login_required
+@acesso_restrito(['admin', 'gestor'])
+def historico_pneu_list(request):
+    qs = Troca.objects.select_related('pneu', 'autocarro__odometro').all().order_by('-data_troca', '-criado_em')
 
     # ── Filtros ────────────────────────────────────────────
     referencia = request.GET.get('referencia')
@@ -4107,8 +3653,11 @@ def inspecao_list(request):
     if local:
         qs = qs.filter(local=local)
 
-    return render(request, 'pneus/inspecao_list.html', {
-        'trocas': qs,
+    pagina = paginar_keyset(request, qs, ('-data_troca', '-criado_em', '-id'))
+
+    return render(request, 'pneus/historico_pneu_list.html', {
+        'trocas': pagina,
+        'pagina': pagina,
         'total_trocas': qs.count(),
         'local_choices': Troca.LOCAL_CHOICES,
     })
@@ -4150,7 +3699,14 @@ def peca_create(request):
     if request.method == 'POST':
         form = PecaForm(request.POST)
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                peca = form.save()
+                if peca.quantidade_estoque > 0:
+                    # o estoque inicial entra no livro de estoque como a primeira entrada
+                    Movimentacao.objects.create(
+                        peca=peca, tipo='entrada', quantidade=peca.quantidade_estoque,
+                        data=timezone.localdate(), responsavel=request.user, observacao='Estoque inicial',
+                    )
             messages.success(request, 'Peça cadastrada com sucesso.')
             return redirect('peca_list')
     else:
@@ -4195,19 +3751,30 @@ def peca_delete(request, pk):
 @login_required
 @acesso_restrito(['admin', 'gestor'])
 def estoque_list(request):
+    """Estoque de cada peça pelas movimentações: o atual ou o de ?data=AAAA-MM-DD."""
     qs = Peca.objects.all().order_by('nome')
 
     nome = request.GET.get('nome')
     if nome:
         qs = qs.filter(nome__icontains=nome)
 
+    try:
+        data = parse_date(request.GET.get('data') or '')
+    except ValueError:
+        data = None
+    qs = com_estoque(qs, data)
+
     apenas_baixo = request.GET.get('baixo')
     if apenas_baixo:
-        qs = [p for p in qs if p.estoque_baixo]
+        qs = qs.filter(em_baixo=True)
+
+    totais = qs.aggregate(total_pecas=Count('id'), valor_total=Sum('valor'))
 
     return render(request, 'pecas/estoque_list.html', {
         'pecas': qs,
-        'total_pecas': len(qs) if isinstance(qs, list) else qs.count(),
+        'data': data,
+        'total_pecas': totais['total_pecas'],
+        'valor_total': totais['valor_total'],
     })
 
 
@@ -4277,15 +3844,17 @@ def movimentacao_historico(request):
     if autocarro_numero:
         qs = qs.filter(autocarro__numero__icontains=autocarro_numero)
 
+    pagina = paginar_keyset(request, qs, ('-data', '-criado_em', '-id'))
+
     return render(request, 'pecas/historico_list.html', {
-        'movimentacoes': qs,
+        'movimentacoes': pagina,
+        'pagina': pagina,
         'total_movimentacoes': qs.count(),
         'tipo_choices': Movimentacao.TIPO_CHOICES,
     })
 
 
 # ───────────────────────── BATERIAS ─────────────────────────
-from collections import OrderedDict
 from itertools import groupby
 
 from django.contrib import messages
@@ -4424,9 +3993,7 @@ def trocabateria_delete(request, pk):
 def inspecao_bateria_list(request):
     """Mostra só a troca MAIS RECENTE de cada combinação autocarro + local
     (Principal / Auxiliar) — ou seja, a bateria que está instalada agora."""
-    qs = TrocaBateria.objects.select_related('bateria', 'autocarro').all().order_by(
-        'autocarro_id', 'local', '-data_troca', '-criado_em'
-    )
+    qs = TrocaBateria.objects.all()
 
     autocarro_numero = request.GET.get('autocarro')
     if autocarro_numero:
@@ -4436,13 +4003,11 @@ def inspecao_bateria_list(request):
     if local:
         qs = qs.filter(local=local)
 
-    ultimas = OrderedDict()
-    for t in qs:
-        chave = (t.autocarro_id, t.local)
-        if chave not in ultimas:
-            ultimas[chave] = t
-
-    trocas = sorted(ultimas.values(), key=lambda t: (t.autocarro.numero, t.local))
+    trocas = list(
+        qs.instaladas()
+        .select_related('bateria', 'autocarro__odometro')
+        .order_by('autocarro__numero', 'local')
+    )
 
     return render(request, 'baterias/inspecao_bateria_list.html', {
         'trocas': trocas,
@@ -4468,8 +4033,11 @@ def historico_bateria_list(request):
     if local:
         qs = qs.filter(local=local)
 
+    pagina = paginar_keyset(request, qs, ('-data_troca', '-criado_em', '-id'))
+
     return render(request, 'baterias/historico_bateria_list.html', {
-        'trocas': qs,
+        'trocas': pagina,
+        'pagina': pagina,
         'total_trocas': qs.count(),
         'local_choices': TrocaBateria.LOCAL_CHOICES,
     })
@@ -4494,38 +4062,20 @@ from .decorators import acesso_restrito
 
 
 # ================================
-# FUNÇÃO: SEMANA DO MÊS (4 COLUNAS)
+# MAPA GERAL FINANCEIRO
 # ================================
+def _semanas_mapa_financeiro(ano, mes, sector=None):
+    """As 4 colunas semanais do mapa (partilhadas com a exportação CSV)."""
+    return em_cache(
+        'mapa_geral_financeiro',
+        lambda: mapa_financeiro_semanas(ano, mes, sector),
+        versao_mes(ano, mes),
+        ano=ano,
+        mes=mes,
+        sector=sector.pk if sector else None,
+    )
 
-from datetime import timedelta
-
-def semana_do_mes_4colunas(data):
-    primeiro_dia = data.replace(day=1)
-
-    # 🔹 Descobrir fim da primeira semana natural (domingo)
-    dias_ate_domingo = (6 - primeiro_dia.weekday()) % 7
-    fim_primeira_semana = primeiro_dia + timedelta(days=dias_ate_domingo)
-
-    # 🔹 Quantos dias tem essa primeira semana
-    total_dias_primeira_semana = (fim_primeira_semana - primeiro_dia).days + 1
-
-    # 🔴 REGRA: se tiver 3 dias ou menos, juntar com a próxima
-    if total_dias_primeira_semana <= 4:
-        fim_primeira_semana = fim_primeira_semana + timedelta(days=7)
-
-    # 🔹 Se a data estiver dentro da primeira semana ajustada
-    if data <= fim_primeira_semana:
-        return 1
-
-    # 🔹 Calcular semanas seguintes
-    dias_apos = (data - fim_primeira_semana).days
-    semana = 2 + ((dias_apos - 1) // 7)
-
-    return min(semana, 4)
 
-# ================================
-# MAPA GERAL FINANCEIRO
-# ================================
 @login_required
 @acesso_restrito(['admin'])
 def mapa_geral_financeiro(request):
@@ -4536,108 +4086,19 @@ def mapa_geral_financeiro(request):
     sectores = Sector.objects.all()
     sector = None
 
-    registos = RegistoDiario.objects.filter(
-        data__year=ano,
-        data__month=mes,
-    )
-
-    combustiveis = DespesaCombustivel.objects.filter(
-        data__year=ano,
-        data__month=mes
-    )
-
-    despesas_gerais = RelatorioSector.objects.filter(
-        data__year=ano,
-        data__month=mes
-    )
-
     if sector_id and sector_id != "all":
         sector = Sector.objects.get(id=sector_id)
-        registos = registos.filter(autocarro__sector=sector)
-        combustiveis = combustiveis.filter(sector=sector)
-        despesas_gerais = despesas_gerais.filter(sector=sector)
 
     # ================================
     # ESTRUTURA DAS 4 SEMANAS
     # ================================
-    semanas = {
-        i: {
-            "entradas": {
-                "normal": Decimal(0),
-                "alunos": Decimal(0),
-                "luvu": Decimal(0),
-                "frete": Decimal(0),
-                "total": Decimal(0),
-            },
-            "despesas": {
-                "alimentacao": Decimal(0),
-                "parqueamento": Decimal(0),
-                "taxa": Decimal(0),
-                "outros": Decimal(0),
-                "taxi": Decimal(0),
-                "combustivel": Decimal(0),
-                "lavagem": Decimal(0),
-                "sopragem": Decimal(0),
-                "despesa_geral": Decimal(0),
-                "alimentacao_estaleiro": Decimal(0),
-                "total": Decimal(0),
-            },
-            "saldo": Decimal(0),
-        }
-        for i in range(1, 5)
-    }
-
-    # ================================
-    # REGISTOS DIÁRIOS
-    # ================================
-    for r in registos:
-        s = semana_do_mes_4colunas(r.data)
-
-        semanas[s]["entradas"]["normal"] += r.normal
-        semanas[s]["entradas"]["alunos"] += r.alunos
-        semanas[s]["entradas"]["luvu"] += r.luvu
-        semanas[s]["entradas"]["frete"] += r.frete
-
-        semanas[s]["despesas"]["alimentacao"] += r.alimentacao
-        semanas[s]["despesas"]["parqueamento"] += r.parqueamento
-        semanas[s]["despesas"]["taxa"] += r.taxa
-        semanas[s]["despesas"]["outros"] += r.outros
-        semanas[s]["despesas"]["taxi"] += r.taxi
-    # ================================
-    # DESPESAS DE COMBUSTÍVEL
-    # ================================
-    for d in combustiveis:
-        s = semana_do_mes_4colunas(d.data)
-
-        semanas[s]["despesas"]["combustivel"] += d.valor or Decimal(0)
-        semanas[s]["despesas"]["lavagem"] += d.lavagem or Decimal(0)
-        semanas[s]["despesas"]["sopragem"] += d.sobragem_filtros or Decimal(0)
-
-    # ================================
-    # DESPESA GERAL (CORREÇÃO PRINCIPAL)
-    # ================================
-    for dg in despesas_gerais:
-        s = semana_do_mes_4colunas(dg.data)
-        semanas[s]["despesas"]["despesa_geral"] += dg.despesa_geral or Decimal(0)
-        semanas[s]["despesas"]["alimentacao_estaleiro"] += dg.alimentacao_estaleiro or Decimal(0)
+    semanas = _semanas_mapa_financeiro(ano, mes, sector)
 
     # ================================
     # TOTAIS E SALDOS
     # ================================
-    total_entradas = Decimal(0)
-    total_despesas = Decimal(0)
-
-    for s in semanas.values():
-        s["entradas"]["total"] = sum(
-            v for k, v in s["entradas"].items() if k != "total"
-        )
-        s["despesas"]["total"] = sum(
-            v for k, v in s["despesas"].items() if k != "total"
-        )
-        s["saldo"] = s["entradas"]["total"] - s["despesas"]["total"]
-
-        total_entradas += s["entradas"]["total"]
-        total_despesas += s["despesas"]["total"]
+    total_entradas = sum((s["entradas"]["total"] for s in semanas.values()), Decimal(0))
+    total_despesas = sum((s["despesas"]["total"] for s in semanas.values()), Decimal(0))
 
     context = {
         "sectores": sectores,
@@ -4830,16 +4291,15 @@ def despesa_list(request):
 
     despesas = (
         Despesa2.objects
-        .filter(data__month=mes, data__year=ano)
+        .filter(**filtro_periodo('data', ano, mes))
         .select_related("categoria", "subcategoria")
     )
 
     if categoria_id:
         despesas = despesas.filter(categoria_id=categoria_id)
 
-    despesas = despesas.order_by("data")
-
-    total = despesas.aggregate(total=Sum("valor"))["total"] or 0
+    resumo = despesas.aggregate(total=Sum("valor"), total_despesas=Count("id"))
+    total = resumo["total"] or 0
 
     totais_categoria = (
         despesas
@@ -4857,8 +4317,12 @@ def despesa_list(request):
 
     categorias = CategoriaDespesa.objects.all().order_by("nome")
 
+    pagina = paginar_keyset(request, despesas, ("data", "criado_em", "id"))
+
     context = {
-        "despesas": despesas,
+        "despesas": pagina,
+        "pagina": pagina,
+        "total_despesas": resumo["total_despesas"],
         "categorias": categorias,
         "mes": mes,
         "ano": ano,
@@ -4961,79 +4425,55 @@ def comparacao_registo_deposito(request):
     data_inicio = f"{year}-{month:02d}-01"
     data_fim = f"{year}-{month:02d}-{ultimo_dia}"
 
-    registros = RegistoDiario.objects.filter(
-        data__range=[data_inicio, data_fim]
-    ).select_related('autocarro__sector')
+    # 🔹 Entradas/saídas por (data, sector) a partir do resumo diário (só dias com registo)
+    resumos = ResumoDiarioAutocarro.objects.filter(
+        data__range=[data_inicio, data_fim],
+        registo__isnull=False,
+    )
 
     depositos = Deposito.objects.filter(
-        data_deposito__year=year,
-        data_deposito__month=month
+        **filtro_periodo('data_deposito', year, month)
     )
 
+    relatorios = RelatorioSector.objects.filter(data__range=[data_inicio, data_fim])
+
     if sector_id:
-        registros = registros.filter(autocarro__sector_id=sector_id)
+        resumos = resumos.filter(autocarro__sector_id=sector_id)
         depositos = depositos.filter(sector_id=sector_id)
+        relatorios = relatorios.filter(sector_id=sector_id)
+
+    sectores_map = {s.id: s for s in Sector.objects.all()}
+
+    # 🔹 RelatorioSector do mês numa só query
+    relatorios_map = {
+        (r['data'], r['sector_id']): r
+        for r in relatorios.values('data', 'sector_id', 'despesa_geral', 'alimentacao_estaleiro')
+    }
 
     # 🔹 AGRUPAMENTO
     resultado = {}
 
-    # 🔹 Combustível agregado
-    combustivel_qs = DespesaCombustivel.objects.filter(
-        data__range=[data_inicio, data_fim]
+    linhas = (
+        resumos.values('data', 'autocarro__sector_id')
+        .annotate(entrada=Sum('entradas'), saida=Sum('saidas'))
+        .order_by('data', 'autocarro__sector_id')
     )
 
-    combustivel_map = defaultdict(lambda: {
-        'valor': Decimal('0'),
-        'sobragem': Decimal('0'),
-        'lavagem': Decimal('0'),
-    })
-
-    for c in combustivel_qs:
-        key = (c.autocarro_id, c.data)
-        combustivel_map[key]['valor'] += c.valor or Decimal('0')
-        combustivel_map[key]['sobragem'] += c.sobragem_filtros or Decimal('0')
-        combustivel_map[key]['lavagem'] += c.lavagem or Decimal('0')
-
-    for reg in registros:
-
-        chave = (reg.data, reg.autocarro.sector.id)
-
-        if chave not in resultado:
-            resultado[chave] = {
-                'data': reg.data,
-                'sector': reg.autocarro.sector,
-                'entrada': Decimal('0'),
-                'saida': Decimal('0'),
-                'resto': Decimal('0'),
-                'depositado': Decimal('0'),
-                'diferenca': Decimal('0'),
-                'despesa_geral': Decimal('0'),
-                'alimentacao_estaleiro': Decimal('0'),
-            }
-
-            # 🔹 Buscar RelatorioSector (1x)
-            relatorio = RelatorioSector.objects.filter(
-                sector=reg.autocarro.sector,
-                data=reg.data
-            ).first()
-
-            if relatorio:
-                resultado[chave]['despesa_geral'] = relatorio.despesa_geral or Decimal('0')
-                resultado[chave]['alimentacao_estaleiro'] = relatorio.alimentacao_estaleiro or Decimal('0')
-
-        entrada = reg.entradas_total()
-
-        comb = combustivel_map.get((reg.autocarro_id, reg.data), {})
-
-        saida_real = (
-            reg.saidas_total()
-            + comb.get('valor', Decimal('0'))
-            + comb.get('sobragem', Decimal('0'))
-            + comb.get('lavagem', Decimal('0'))
-        )
-
-        resultado[chave]['entrada'] += entrada
-        resultado[chave]['saida'] += saida_real
+    for linha in linhas:
+        chave = (linha['data'], linha['autocarro__sector_id'])
+        relatorio = relatorios_map.get(chave) or {}
+
+        resultado[chave] = {
+            'data': linha['data'],
+            'sector': sectores_map.get(linha['autocarro__sector_id']),
+            'entrada': linha['entrada'] or Decimal('0'),
+            'saida': linha['saida'] or Decimal('0'),
+            'resto': Decimal('0'),
+            'depositado': Decimal('0'),
+            'diferenca': Decimal('0'),
+            'despesa_geral': relatorio.get('despesa_geral') or Decimal('0'),
+            'alimentacao_estaleiro': relatorio.get('alimentacao_estaleiro') or Decimal('0'),
+        }
 
     # 🔹 SOMAR despesas gerais 1x por grupo
     for item in resultado.values():
@@ -5102,14 +4542,7 @@ def relatorio_autocarros(request):
     )
 
     # 🔹 filtros de data
-    if ano:
-        registos = registos.filter(data__year=ano)
-
-    if mes:
-        registos = registos.filter(data__month=mes)
-
-    if dia:
-        registos = registos.filter(data__day=dia)
+    registos = registos.filter(**filtro_periodo('data', ano, mes, dia))
 
     # 🔹 filtro sector
     if sector_id:
@@ -5124,12 +4557,7 @@ def relatorio_autocarros(request):
 
     combustiveis = DespesaCombustivel.objects.all()
 
-    if ano:
-        combustiveis = combustiveis.filter(data__year=ano)
-    if mes:
-        combustiveis = combustiveis.filter(data__month=mes)
-    if dia:
-        combustiveis = combustiveis.filter(data__day=dia)
+    combustiveis = combustiveis.filter(**filtro_periodo('data', ano, mes, dia))
     if sector_id:
         combustiveis = combustiveis.filter(autocarro__sector_id=sector_id)
 
@@ -5228,30 +4656,16 @@ def relatorio_autocarros(request):
     )
 
     # Filtros de data
-    if ano:
-        registos_qs = registos_qs.filter(data__year=ano)
-    if mes:
-        registos_qs = registos_qs.filter(data__month=mes)
-    if dia:
-        registos_qs = registos_qs.filter(data__day=dia)
+    registos_qs = registos_qs.filter(**filtro_periodo('data', ano, mes, dia))
 
     # Filtro sector
     if sector_id:
         registos_qs = registos_qs.filter(autocarro__sector_id=sector_id)
 
-    # 🚀 OTIMIZAÇÃO: Calcular entradas e saídas na query (não em Python)
-    # Campos corretos: normal, frete, alunos, luvu (entradas)
-    # Campos corretos: alimentacao, parqueamento, taxa, outros (saídas)
+    # 🚀 Entradas e saídas lidas das colunas geradas do registo
     registos = registos_qs.annotate(
-        entradas_total_calc=Coalesce(F('normal'), Value(0), output_field=DecimalField()) + 
-                           Coalesce(F('frete'), Value(0), output_field=DecimalField()) + 
-                           Coalesce(F('alunos'), Value(0), output_field=DecimalField()) + 
-                           Coalesce(F('luvu'), Value(0), output_field=DecimalField()),
-        
-        saidas_total_calc=Coalesce(F('alimentacao'), Value(0), output_field=DecimalField()) + 
-                         Coalesce(F('parqueamento'), Value(0), output_field=DecimalField()) + 
-                         Coalesce(F('taxa'), Value(0), output_field=DecimalField()) + 
-                         Coalesce(F('outros'), Value(0), output_field=DecimalField())
+        entradas_total_calc=F('entradas'),
+        saidas_total_calc=F('saidas'),
     ).order_by('data', 'autocarro__numero')
 
     # ═══════════════════════════════════════════════════
@@ -5259,12 +4673,7 @@ def relatorio_autocarros(request):
     # ═══════════════════════════════════════════════════
     combustiveis_qs = DespesaCombustivel.objects.select_related('autocarro')
 
-    if ano:
-        combustiveis_qs = combustiveis_qs.filter(data__year=ano)
-    if mes:
-        combustiveis_qs = combustiveis_qs.filter(data__month=mes)
-    if dia:
-        combustiveis_qs = combustiveis_qs.filter(data__day=dia)
+    combustiveis_qs = combustiveis_qs.filter(**filtro_periodo('data', ano, mes, dia))
     if sector_id:
         combustiveis_qs = combustiveis_qs.filter(autocarro__sector_id=sector_id)
 
@@ -5383,49 +4792,12 @@ def relatorio_autocarros_paginado(request):
         "autocarro__sector"
     )
 
-    if ano:
-        registos_qs = registos_qs.filter(data__year=ano)
-    if mes:
-        registos_qs = registos_qs.filter(data__month=mes)
-    if dia:
-        registos_qs = registos_qs.filter(data__day=dia)
+    registos_qs = registos_qs.filter(**filtro_periodo('data', ano, mes, dia))
     if sector_id:
         registos_qs = registos_qs.filter(autocarro__sector_id=sector_id)
 
-    registos = registos_qs.annotate(
-        entradas_total_calc=Coalesce(F('normal'), Value(0), output_field=DecimalField()) + 
-                           Coalesce(F('frete'), Value(0), output_field=DecimalField()) + 
-                           Coalesce(F('alunos'), Value(0), output_field=DecimalField()) + 
-                           Coalesce(F('luvu'), Value(0), output_field=DecimalField()),
-        
-        saidas_total_calc=Coalesce(F('alimentacao'), Value(0), output_field=DecimalField()) + 
-                         Coalesce(F('parqueamento'), Value(0), output_field=DecimalField()) + 
-                         Coalesce(F('taxa'), Value(0), output_field=DecimalField()) + 
-                         Coalesce(F('outros'), Value(0), output_field=DecimalField())
-    ).order_by('-data', 'autocarro__numero')
-
-    # Combustíveis
-    combustiveis_qs = DespesaCombustivel.objects.select_related('autocarro')
-    if ano:
-        combustiveis_qs = combustiveis_qs.filter(data__year=ano)
-    if mes:
-        combustiveis_qs = combustiveis_qs.filter(data__month=mes)
-    if dia:
-        combustiveis_qs = combustiveis_qs.filter(data__day=dia)
-    if sector_id:
-        combustiveis_qs = combustiveis_qs.filter(autocarro__sector_id=sector_id)
-
-    combustivel_map = defaultdict(lambda: {
-        "valor": Decimal("0"),
-        "sobragem": Decimal("0"),
-        "lavagem": Decimal("0")
-    })
-
-    for c in combustiveis_qs.values('autocarro_id', 'data', 'valor', 'sobragem_filtros', 'lavagem'):
-        key = f"{c['autocarro_id']}_{c['data']}"
-        combustivel_map[key]["valor"] += c['valor'] or Decimal("0")
-        combustivel_map[key]["sobragem"] += c['sobragem_filtros'] or Decimal("0")
-        combustivel_map[key]["lavagem"] += c['lavagem'] or Decimal("0")
+    # Entradas, saídas (com combustível) e saldo vêm do resumo diário
+    registos = registos_qs.select_related("resumo_diario").order_by('-data', 'autocarro__numero')
 
     # 🔹 PAGINAÇÃO: 50 registos por página
     paginator = Paginator(registos, 50)
@@ -5440,32 +4812,14 @@ def relatorio_autocarros_paginado(request):
     # Montar tabela apenas para a página atual
     tabela = []
     for r in registos_page:
-        entradas = r.entradas_total_calc or Decimal("0")
-        saidas = r.saidas_total_calc or Decimal("0")
-
-        key = f"{r.autocarro_id}_{r.data}"
-        comb = combustivel_map.get(key, {})
-
-        combustivel_valor = comb.get("valor", Decimal("0"))
-        combustivel_sobragem = comb.get("sobragem", Decimal("0"))
-        combustivel_lavagem = comb.get("lavagem", Decimal("0"))
-
-        saidas_total = (
-            saidas +
-            combustivel_valor +
-            combustivel_sobragem +
-            combustivel_lavagem
-        )
-
-        saldo = entradas - saidas_total
-
+        anexar_resumo(r)
         tabela.append({
             "ref_autocarro": r.autocarro.numero,
             "motorista": r.motorista,
             "data": r.data,
-            "entradas": entradas,
-            "saidas": saidas_total,
-            "saldo": saldo,
+            "entradas": r.entradas_total(),
+            "saidas": r.saidas_total_incl_combustivel,
+            "saldo": r.saldo_liquido_incl_combustivel,
         })
 
     sectores = Sector.objects.all()
@@ -5509,19 +4863,20 @@ from collections import defaultdict
 # ═══════════════════════════════════════════════════════════
 
 @login_required
+@acesso_restrito(['admin'])
 def exportar_mapa_financeiro_csv(request):
     """
-    Exporta o Mapa Financeiro para CSV
+    Exporta o Mapa Financeiro para CSV (mesmos números do mapa_geral_financeiro)
     """
     # Pegar os filtros da URL
     sector_id = request.GET.get('sector', '')
-    mes = int(request.GET.get('mes', datetime.now().month))
-    ano = int(request.GET.get('ano', datetime.now().year))
+    mes = int(request.GET.get('mes') or datetime.now().month)
+    ano = int(request.GET.get('ano') or datetime.now().year)
     
     # Buscar o setor se fornecido
     sector = None
     sector_nome = "Todos"
-    if sector_id:
+    if sector_id and sector_id != "all":
         try:
             sector = Sector.objects.get(id=sector_id)
             sector_nome = sector.nome
@@ -5535,223 +4890,80 @@ def exportar_mapa_financeiro_csv(request):
         9: 'Setembro', 10: 'Outubro', 11: 'Novembro', 12: 'Dezembro'
     }
     mes_nome = meses.get(mes, 'Desconhecido')
-    
-    # Criar resposta HTTP com tipo CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    response['Content-Disposition'] = f'attachment; filename="mapa_financeiro_{mes_nome}_{ano}_{sector_nome}.csv"'
-    
-    # Adicionar BOM para Excel reconhecer UTF-8
-    response.write('\ufeff')
-    
-    # Criar writer CSV
-    writer = csv.writer(response, delimiter=';')
-    
-    # ═══ CABEÇALHO DO RELATÓRIO ═══
-    writer.writerow(['MAPA FINANCEIRO - ALCA & ATY TRANSPORTES'])
-    writer.writerow([f'Setor: {sector_nome}'])
-    writer.writerow([f'Período: {mes_nome}/{ano}'])
-    writer.writerow([f'Data de Exportação: {datetime.now().strftime("%d/%m/%Y %H:%M")}'])
-    writer.writerow([])  # Linha em branco
-    
-    # ═══ CABEÇALHO DA TABELA ═══
-    writer.writerow([
-        'CATEGORIA',
-        '1ª SEMANA',
-        '2ª SEMANA',
-        '3ª SEMANA',
-        '4ª SEMANA',
-        'TOTAL MENSAL'
-    ])
-    
-    # ═══ AQUI VOCÊ DEVE BUSCAR OS DADOS DO SEU MODEL ═══
-    # Substitua isso pela sua lógica real de busca de dados
-    # Exemplo de estrutura:
-    semanas = {
-        1: {'entradas': {'normal': 0, 'frete': 0, 'alunos': 0, 'luvu': 0, 'total': 0},
-            'despesas': {'combustivel': 0, 'alimentacao': 0, 'taxi': 0, 'lavagem': 0, 
-                        'sopragem': 0, 'taxa': 0, 'parqueamento': 0, 'outros': 0,
-                        'despesa_geral': 0, 'alimentacao_estaleiro': 0, 'total': 0},
-            'saldo': 0},
-        2: {'entradas': {}, 'despesas': {}, 'saldo': 0},
-        3: {'entradas': {}, 'despesas': {}, 'saldo': 0},
-        4: {'entradas': {}, 'despesas': {}, 'saldo': 0},
-    }
-    
-    # Calcular totais
-    total_entradas_normal = sum(semanas[i]['entradas']['normal'] for i in range(1, 5))
-    total_entradas_frete = sum(semanas[i]['entradas']['frete'] for i in range(1, 5))
-    total_entradas_alunos = sum(semanas[i]['entradas']['alunos'] for i in range(1, 5))
-    total_entradas_luvu = sum(semanas[i]['entradas']['luvu'] for i in range(1, 5))
-    total_entradas = sum(semanas[i]['entradas']['total'] for i in range(1, 5))
-    
-    total_despesas_combustivel = sum(semanas[i]['despesas']['combustivel'] for i in range(1, 5))
-    total_despesas_alimentacao = sum(semanas[i]['despesas']['alimentacao'] for i in range(1, 5))
-    total_despesas_taxi = sum(semanas[i]['despesas']['taxi'] for i in range(1, 5))
-    total_despesas_lavagem = sum(semanas[i]['despesas']['lavagem'] for i in range(1, 5))
-    total_despesas_sopragem = sum(semanas[i]['despesas']['sopragem'] for i in range(1, 5))
-    total_despesas_taxa = sum(semanas[i]['despesas']['taxa'] for i in range(1, 5))
-    total_despesas_parqueamento = sum(semanas[i]['despesas']['parqueamento'] for i in range(1, 5))
-    total_despesas_outros = sum(semanas[i]['despesas']['outros'] for i in range(1, 5))
-    total_despesa_geral = sum(semanas[i]['despesas']['despesa_geral'] for i in range(1, 5))
-    total_despesa_alimentacao_estaleiro = sum(semanas[i]['despesas']['alimentacao_estaleiro'] for i in range(1, 5))
-    total_despesas = sum(semanas[i]['despesas']['total'] for i in range(1, 5))
-    
-    saldo_liquido = total_entradas - total_despesas
-    
-    # ═══ SEÇÃO DE ENTRADAS ═══
-    writer.writerow(['ENTRADAS'])
-    writer.writerow([
-        'MANHÃ/LAVRA/NORMAL',
-        f'{semanas[1]["entradas"]["normal"]:.2f}',
-        f'{semanas[2]["entradas"]["normal"]:.2f}',
-        f'{semanas[3]["entradas"]["normal"]:.2f}',
-        f'{semanas[4]["entradas"]["normal"]:.2f}',
-        f'{total_entradas_normal:.2f}'
-    ])
-    writer.writerow([
-        'FRETE/ALUGUEL',
-        f'{semanas[1]["entradas"]["frete"]:.2f}',
-        f'{semanas[2]["entradas"]["frete"]:.2f}',
-        f'{semanas[3]["entradas"]["frete"]:.2f}',
-        f'{semanas[4]["entradas"]["frete"]:.2f}',
-        f'{total_entradas_frete:.2f}'
-    ])
-    writer.writerow([
-        'ALUNOS/TARDE',
-        f'{semanas[1]["entradas"]["alunos"]:.2f}',
-        f'{semanas[2]["entradas"]["alunos"]:.2f}',
-        f'{semanas[3]["entradas"]["alunos"]:.2f}',
-        f'{semanas[4]["entradas"]["alunos"]:.2f}',
-        f'{total_entradas_alunos:.2f}'
-    ])
-    writer.writerow([
-        'LUVU',
-        f'{semanas[1]["entradas"]["luvu"]:.2f}',
-        f'{semanas[2]["entradas"]["luvu"]:.2f}',
-        f'{semanas[3]["entradas"]["luvu"]:.2f}',
-        f'{semanas[4]["entradas"]["luvu"]:.2f}',
-        f'{total_entradas_luvu:.2f}'
-    ])
-    writer.writerow([
-        'TOTAL ENTRADAS',
-        f'{semanas[1]["entradas"]["total"]:.2f}',
-        f'{semanas[2]["entradas"]["total"]:.2f}',
-        f'{semanas[3]["entradas"]["total"]:.2f}',
-        f'{semanas[4]["entradas"]["total"]:.2f}',
-        f'{total_entradas:.2f}'
-    ])
-    writer.writerow([])  # Linha em branco
-    
-    # ═══ SEÇÃO DE DESPESAS ═══
-    writer.writerow(['DESPESAS FIXAS'])
-    writer.writerow([
-        'COMBUSTÍVEL AUTOCARROS',
-        f'{semanas[1]["despesas"]["combustivel"]:.2f}',
-        f'{semanas[2]["despesas"]["combustivel"]:.2f}',
-        f'{semanas[3]["despesas"]["combustivel"]:.2f}',
-        f'{semanas[4]["despesas"]["combustivel"]:.2f}',
-        f'{total_despesas_combustivel:.2f}'
-    ])
-    writer.writerow([
-        'ALIMENTAÇÃO MOTORISTAS E COBRAD',
-        f'{semanas[1]["despesas"]["alimentacao"]:.2f}',
-        f'{semanas[2]["despesas"]["alimentacao"]:.2f}',
-        f'{semanas[3]["despesas"]["alimentacao"]:.2f}',
-        f'{semanas[4]["despesas"]["alimentacao"]:.2f}',
-        f'{total_despesas_alimentacao:.2f}'
-    ])
-    writer.writerow([
-        'TRANSPORTE MOTORISTAS/COBRAD/OUTROS',
-        f'{semanas[1]["despesas"]["taxi"]:.2f}',
-        f'{semanas[2]["despesas"]["taxi"]:.2f}',
-        f'{semanas[3]["despesas"]["taxi"]:.2f}',
-        f'{semanas[4]["despesas"]["taxi"]:.2f}',
-        f'{total_despesas_taxi:.2f}'
-    ])
-    writer.writerow([
-        'LAVAGEM',
-        f'{semanas[1]["despesas"]["lavagem"]:.2f}',
-        f'{semanas[2]["despesas"]["lavagem"]:.2f}',
-        f'{semanas[3]["despesas"]["lavagem"]:.2f}',
-        f'{semanas[4]["despesas"]["lavagem"]:.2f}',
-        f'{total_despesas_lavagem:.2f}'
-    ])
-    writer.writerow([
-        'SOPRAGENS DE FILTROS',
-        f'{semanas[1]["despesas"]["sopragem"]:.2f}',
-        f'{semanas[2]["despesas"]["sopragem"]:.2f}',
-        f'{semanas[3]["despesas"]["sopragem"]:.2f}',
-        f'{semanas[4]["despesas"]["sopragem"]:.2f}',
-        f'{total_despesas_sopragem:.2f}'
-    ])
-    writer.writerow([
-        'TAXA LOTAÇÃO',
-        f'{semanas[1]["despesas"]["taxa"]:.2f}',
-        f'{semanas[2]["despesas"]["taxa"]:.2f}',
-        f'{semanas[3]["despesas"]["taxa"]:.2f}',
-        f'{semanas[4]["despesas"]["taxa"]:.2f}',
-        f'{total_despesas_taxa:.2f}'
-    ])
-    writer.writerow([
-        'SEGURANÇA/PARQUE',
-        f'{semanas[1]["despesas"]["parqueamento"]:.2f}',
-        f'{semanas[2]["despesas"]["parqueamento"]:.2f}',
-        f'{semanas[3]["despesas"]["parqueamento"]:.2f}',
-        f'{semanas[4]["despesas"]["parqueamento"]:.2f}',
-        f'{total_despesas_parqueamento:.2f}'
-    ])
-    writer.writerow([
-        'OUTROS',
-        f'{semanas[1]["despesas"]["outros"]:.2f}',
-        f'{semanas[2]["despesas"]["outros"]:.2f}',
-        f'{semanas[3]["despesas"]["outros"]:.2f}',
-        f'{semanas[4]["despesas"]["outros"]:.2f}',
-        f'{total_despesas_outros:.2f}'
-    ])
-    writer.writerow([
-        'DESPESA FEITA NA PRODUÇÃO',
-        f'{semanas[1]["despesas"]["despesa_geral"]:.2f}',
-        f'{semanas[2]["despesas"]["despesa_geral"]:.2f}',
-        f'{semanas[3]["despesas"]["despesa_geral"]:.2f}',
-        f'{semanas[4]["despesas"]["despesa_geral"]:.2f}',
-        f'{total_despesa_geral:.2f}'
-    ])
-    writer.writerow([
-        'ALIMENTAÇÃO DO ESTALEIRO',
-        f'{semanas[1]["despesas"]["alimentacao_estaleiro"]:.2f}',
-        f'{semanas[2]["despesas"]["alimentacao_estaleiro"]:.2f}',
-        f'{semanas[3]["despesas"]["alimentacao_estaleiro"]:.2f}',
-        f'{semanas[4]["despesas"]["alimentacao_estaleiro"]:.2f}',
-        f'{total_despesa_alimentacao_estaleiro:.2f}'
-    ])
-    writer.writerow([
-        'TOTAL DESPESAS',
-        f'{semanas[1]["despesas"]["total"]:.2f}',
-        f'{semanas[2]["despesas"]["total"]:.2f}',
-        f'{semanas[3]["despesas"]["total"]:.2f}',
-        f'{semanas[4]["despesas"]["total"]:.2f}',
-        f'{total_despesas:.2f}'
-    ])
-    writer.writerow([])  # Linha em branco
-    
-    # ═══ SALDO SEMANAL ═══
-    writer.writerow([
-        'SALDO SEMANAL',
-        f'{semanas[1]["saldo"]:.2f}',
-        f'{semanas[2]["saldo"]:.2f}',
-        f'{semanas[3]["saldo"]:.2f}',
-        f'{semanas[4]["saldo"]:.2f}',
-        f'{saldo_liquido:.2f}'
-    ])
-    writer.writerow([])  # Linha em branco
-    
-    # ═══ RESUMO FINAL ═══
-    writer.writerow(['RESUMO FINAL'])
-    writer.writerow(['ENTRADAS GERAIS', '', '', '', '', f'{total_entradas:.2f}'])
-    writer.writerow(['DESPESAS FIXAS E VARIÁVEIS', '', '', '', '', f'{total_despesas:.2f}'])
-    writer.writerow(['SALDO LÍQUIDO', '', '', '', '', f'{saldo_liquido:.2f}'])
-    
-    return response
+    exportado_em = datetime.now()
+
+    # (rótulo, grupo, chave) pela ordem do mapa impresso
+    linhas_entradas = [
+        ('MANHÃ/LAVRA/NORMAL', 'normal'),
+        ('FRETE/ALUGUEL', 'frete'),
+        ('ALUNOS/TARDE', 'alunos'),
+        ('LUVU', 'luvu'),
+        ('TOTAL ENTRADAS', 'total'),
+    ]
+    linhas_despesas = [
+        ('COMBUSTÍVEL AUTOCARROS', 'combustivel'),
+        ('ALIMENTAÇÃO MOTORISTAS E COBRAD', 'alimentacao'),
+        ('TRANSPORTE MOTORISTAS/COBRAD/OUTROS', 'taxi'),
+        ('LAVAGEM', 'lavagem'),
+        ('SOPRAGENS DE FILTROS', 'sopragem'),
+        ('TAXA LOTAÇÃO', 'taxa'),
+        ('SEGURANÇA/PARQUE', 'parqueamento'),
+        ('OUTROS', 'outros'),
+        ('DESPESA FEITA NA PRODUÇÃO', 'despesa_geral'),
+        ('ALIMENTAÇÃO DO ESTALEIRO', 'alimentacao_estaleiro'),
+        ('TOTAL DESPESAS', 'total'),
+    ]
+
+    def _linha(rotulo, valores):
+        return [rotulo] + [f'{v:.2f}' for v in valores] + [f'{sum(valores, Decimal(0)):.2f}']
+
+    def linhas():
+        # ═══ CABEÇALHO DO RELATÓRIO ═══
+        yield ['MAPA FINANCEIRO - ALCA & ATY TRANSPORTES']
+        yield [f'Setor: {sector_nome}']
+        yield [f'Período: {mes_nome}/{ano}']
+        yield [f'Data de Exportação: {exportado_em.strftime("%d/%m/%Y %H:%M")}']
+        yield []  # Linha em branco
+
+        # ═══ CABEÇALHO DA TABELA ═══
+        yield [
+            'CATEGORIA',
+            '1ª SEMANA',
+            '2ª SEMANA',
+            '3ª SEMANA',
+            '4ª SEMANA',
+            'TOTAL MENSAL'
+        ]
+
+        # Os dados só são lidos quando o primeiro bloco já saiu
+        semanas = _semanas_mapa_financeiro(ano, mes, sector)
+        colunas = [semanas[i] for i in range(1, 5)]
+
+        # ═══ SEÇÃO DE ENTRADAS ═══
+        yield ['ENTRADAS']
+        for rotulo, chave in linhas_entradas:
+            yield _linha(rotulo, [s['entradas'][chave] for s in colunas])
+        yield []  # Linha em branco
+
+        # ═══ SEÇÃO DE DESPESAS ═══
+        yield ['DESPESAS FIXAS']
+        for rotulo, chave in linhas_despesas:
+            yield _linha(rotulo, [s['despesas'][chave] for s in colunas])
+        yield []  # Linha em branco
+
+        # ═══ SALDO SEMANAL ═══
+        yield _linha('SALDO SEMANAL', [s['saldo'] for s in colunas])
+        yield []  # Linha em branco
+
+        # ═══ RESUMO FINAL ═══
+        total_entradas = sum((s['entradas']['total'] for s in colunas), Decimal(0))
+        total_despesas = sum((s['despesas']['total'] for s in colunas), Decimal(0))
+        yield ['RESUMO FINAL']
+        yield ['ENTRADAS GERAIS', '', '', '', '', f'{total_entradas:.2f}']
+        yield ['DESPESAS FIXAS E VARIÁVEIS', '', '', '', '', f'{total_despesas:.2f}']
+        yield ['SALDO LÍQUIDO', '', '', '', '', f'{total_entradas - total_despesas:.2f}']
+
+    return resposta_csv(linhas(), f"mapa_financeiro_{mes_nome}_{ano}_{sector_nome}.csv")
 
 
 # ═══════════════════════════════════════════════════════════
@@ -5797,87 +5009,20 @@ def exportar_relatorio_autocarros_csv(request):
     )
 
     # Filtros de data
-    if ano:
-        registos_qs = registos_qs.filter(data__year=ano)
-    if mes:
-        registos_qs = registos_qs.filter(data__month=mes)
-    if dia:
-        registos_qs = registos_qs.filter(data__day=dia)
+    registos_qs = registos_qs.filter(**filtro_periodo('data', ano, mes, dia))
 
     # Filtro sector
     if sector_id:
         registos_qs = registos_qs.filter(autocarro__sector_id=sector_id)
 
-    # Calcular totais na query (OTIMIZADO)
+    # Entradas e saídas das colunas geradas — só as colunas exportadas
     registos = registos_qs.annotate(
-        entradas_total_calc=Coalesce(F('normal'), Value(0), output_field=DecimalField()) + 
-                           Coalesce(F('frete'), Value(0), output_field=DecimalField()) + 
-                           Coalesce(F('alunos'), Value(0), output_field=DecimalField()) + 
-                           Coalesce(F('luvu'), Value(0), output_field=DecimalField()),
-        
-        saidas_total_calc=Coalesce(F('alimentacao'), Value(0), output_field=DecimalField()) + 
-                         Coalesce(F('parqueamento'), Value(0), output_field=DecimalField()) + 
-                         Coalesce(F('taxa'), Value(0), output_field=DecimalField()) + 
-                         Coalesce(F('outros'), Value(0), output_field=DecimalField())
-    ).order_by('data', 'autocarro__numero')
-
-    # Combustíveis
-    combustiveis_qs = DespesaCombustivel.objects.select_related('autocarro')
-
-    if ano:
-        combustiveis_qs = combustiveis_qs.filter(data__year=ano)
-    if mes:
-        combustiveis_qs = combustiveis_qs.filter(data__month=mes)
-    if dia:
-        combustiveis_qs = combustiveis_qs.filter(data__day=dia)
-    if sector_id:
-        combustiveis_qs = combustiveis_qs.filter(autocarro__sector_id=sector_id)
-
-    # Mapa de combustível
-    combustivel_map = defaultdict(lambda: {
-        "valor": Decimal("0"),
-        "sobragem": Decimal("0"),
-        "lavagem": Decimal("0")
-    })
-
-    for c in combustiveis_qs.values('autocarro_id', 'data', 'valor', 'sobragem_filtros', 'lavagem'):
-        key = f"{c['autocarro_id']}_{c['data']}"
-        combustivel_map[key]["valor"] += c['valor'] or Decimal("0")
-        combustivel_map[key]["sobragem"] += c['sobragem_filtros'] or Decimal("0")
-        combustivel_map[key]["lavagem"] += c['lavagem'] or Decimal("0")
-
-    # Tabela final
-    tabela = []
-
-    for r in registos:
-        # Usar valores calculados pelo annotate
-        entradas = r.entradas_total_calc or Decimal("0")
-        saidas = r.saidas_total_calc or Decimal("0")
-
-        key = f"{r.autocarro_id}_{r.data}"
-        comb = combustivel_map.get(key, {})
-
-        combustivel_valor = comb.get("valor", Decimal("0"))
-        combustivel_sobragem = comb.get("sobragem", Decimal("0"))
-        combustivel_lavagem = comb.get("lavagem", Decimal("0"))
-
-        saidas_total = (
-            saidas +
-            combustivel_valor +
-            combustivel_sobragem +
-            combustivel_lavagem
-        )
-
-        saldo = entradas - saidas_total
-
-        tabela.append({
-            "ref_autocarro": r.autocarro.numero,
-            "motorista": r.motorista,
-            "data": r.data,
-            "entradas": entradas,
-            "saidas": saidas_total,
-            "saldo": saldo,
-        })
+        entradas_total_calc=F('entradas'),
+        saidas_total_calc=F('saidas'),
+    ).order_by('data', 'autocarro__numero').values_list(
+        'autocarro_id', 'data', 'autocarro__numero', 'motorista',
+        'entradas_total_calc', 'saidas_total_calc',
+    )
 
     # ═══ INFORMAÇÕES PARA O CABEÇALHO ═══
     sector_nome = "Todos"
@@ -5904,81 +5049,92 @@ def exportar_relatorio_autocarros_csv(request):
     
     periodo = ' - '.join(periodo_parts) if periodo_parts else 'Todos os períodos'
     
-    # ═══ CRIAR RESPOSTA CSV ═══
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    response['Content-Disposition'] = f'attachment; filename="relatorio_autocarros_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-    
-    # Adicionar BOM para Excel reconhecer UTF-8
-    response.write('\ufeff')
-    
-    # Criar writer CSV
-    writer = csv.writer(response, delimiter=';')
-    
-    # ═══ CABEÇALHO DO RELATÓRIO ═══
-    writer.writerow(['RELATÓRIO POR AUTOCARRO - ALCA & ATY TRANSPORTES'])
-    writer.writerow([f'Setor: {sector_nome}'])
-    writer.writerow([f'Período: {periodo}'])
-    writer.writerow([f'Data de Exportação: {datetime.now().strftime("%d/%m/%Y %H:%M")}'])
-    writer.writerow([])  # Linha em branco
-    
-    # ═══ CABEÇALHO DA TABELA ═══
-    writer.writerow([
-        'DATA',
-        'REFERÊNCIA AUTOCARRO',
-        'MOTORISTA',
-        'ENTRADAS (Kz)',
-        'SAÍDAS (Kz)',
-        'SALDO (Kz)'
-    ])
-    
-    # ═══ DADOS DA TABELA ═══
-    total_entradas = Decimal("0")
-    total_saidas = Decimal("0")
-    total_saldo = Decimal("0")
-    
-    for registro in tabela:
-        entradas = registro.get('entradas', Decimal("0"))
-        saidas = registro.get('saidas', Decimal("0"))
-        saldo = registro.get('saldo', Decimal("0"))
-        
-        writer.writerow([
-            registro.get('data', '').strftime('%d/%m/%Y') if registro.get('data') else '',
-            registro.get('ref_autocarro', ''),
-            registro.get('motorista', ''),
-            f"{float(entradas):.2f}",
-            f"{float(saidas):.2f}",
-            f"{float(saldo):.2f}"
-        ])
-        
-        total_entradas += entradas
-        total_saidas += saidas
-        total_saldo += saldo
-    
-    # ═══ LINHA DE TOTAIS ═══
-    writer.writerow([])  # Linha em branco
-    writer.writerow([
-        '',
-        'TOTAIS',
-        '',
-        f'{float(total_entradas):.2f}',
-        f'{float(total_saidas):.2f}',
-        f'{float(total_saldo):.2f}'
-    ])
-    
-    # ═══ ESTATÍSTICAS ═══
-    writer.writerow([])  # Linha em branco
-    writer.writerow(['ESTATÍSTICAS'])
-    writer.writerow(['Total de Registos', len(tabela)])
-    writer.writerow(['Total de Entradas', f'{float(total_entradas):.2f} Kz'])
-    writer.writerow(['Total de Saídas', f'{float(total_saidas):.2f} Kz'])
-    writer.writerow(['Saldo Total', f'{float(total_saldo):.2f} Kz'])
-    
-    if len(tabela) > 0:
-        writer.writerow(['Média de Entradas por Registo', f'{float(total_entradas)/len(tabela):.2f} Kz'])
-        writer.writerow(['Média de Saídas por Registo', f'{float(total_saidas)/len(tabela):.2f} Kz'])
-        writer.writerow(['Média de Saldo por Registo', f'{float(total_saldo)/len(tabela):.2f} Kz'])
-    
-    return response
+    exportado_em = datetime.now()
+
+    def linhas():
+        # ═══ CABEÇALHO DO RELATÓRIO ═══
+        yield ['RELATÓRIO POR AUTOCARRO - ALCA & ATY TRANSPORTES']
+        yield [f'Setor: {sector_nome}']
+        yield [f'Período: {periodo}']
+        yield [f'Data de Exportação: {exportado_em.strftime("%d/%m/%Y %H:%M")}']
+        yield []  # Linha em branco
+
+        # ═══ CABEÇALHO DA TABELA ═══
+        yield [
+            'DATA',
+            'REFERÊNCIA AUTOCARRO',
+            'MOTORISTA',
+            'ENTRADAS (Kz)',
+            'SAÍDAS (Kz)',
+            'SALDO (Kz)'
+        ]
+
+        # ═══ DADOS DA TABELA ═══
+        # Os registos vêm em blocos (.iterator) e o combustível de cada bloco
+        # é somado numa query só para as chaves (autocarro, data) desse bloco.
+        total_entradas = Decimal("0")
+        total_saidas = Decimal("0")
+        total_saldo = Decimal("0")
+        num_registos = 0
+
+        for bloco in em_blocos(registos):
+            combustivel = combustivel_por_chave({(r[0], r[1]) for r in bloco})
+
+            for autocarro_id, data, numero, motorista, entradas, saidas in bloco:
+                entradas = entradas or Decimal("0")
+                comb = combustivel.get((autocarro_id, data), {})
+
+                saidas_total = (
+                    (saidas or Decimal("0")) +
+                    (comb.get("total_valor") or Decimal("0")) +
+                    (comb.get("total_sobragem") or Decimal("0")) +
+                    (comb.get("total_lavagem") or Decimal("0"))
+                )
+                saldo = entradas - saidas_total
+
+                yield [
+                    data.strftime('%d/%m/%Y') if data else '',
+                    numero,
+                    motorista,
+                    f"{float(entradas):.2f}",
+                    f"{float(saidas_total):.2f}",
+                    f"{float(saldo):.2f}"
+                ]
+
+                total_entradas += entradas
+                total_saidas += saidas_total
+                total_saldo += saldo
+                num_registos += 1
+
+        # ═══ LINHA DE TOTAIS ═══
+        yield []  # Linha em branco
+        yield [
+            '',
+            'TOTAIS',
+            '',
+            f'{float(total_entradas):.2f}',
+            f'{float(total_saidas):.2f}',
+            f'{float(total_saldo):.2f}'
+        ]
+
+        # ═══ ESTATÍSTICAS ═══
+        yield []  # Linha em branco
+        yield ['ESTATÍSTICAS']
+        yield ['Total de Registos', num_registos]
+        yield ['Total de Entradas', f'{float(total_entradas):.2f} Kz']
+        yield ['Total de Saídas', f'{float(total_saidas):.2f} Kz']
+        yield ['Saldo Total', f'{float(total_saldo):.2f} Kz']
+
+        if num_registos > 0:
+            yield ['Média de Entradas por Registo', f'{float(total_entradas)/num_registos:.2f} Kz']
+            yield ['Média de Saídas por Registo', f'{float(total_saidas)/num_registos:.2f} Kz']
+            yield ['Média de Saldo por Registo', f'{float(total_saldo)/num_registos:.2f} Kz']
+
+    # ═══ CRIAR RESPOSTA CSV (streaming) ═══
+    return resposta_csv(
+        linhas(),
+        f'relatorio_autocarros_{exportado_em.strftime("%Y%m%d_%H%M%S")}.csv',
+    )
 
 
 
@@ -5994,23 +5150,63 @@ import os
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
+from django.core.exceptions import ValidationError
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 
 from .forms import PlanoContasForm
 from .models import PlanoContas
+from .plano_contas import importar_plano, ler_plano
 
 
 @login_required
 def plano_contas_list(request):
-    raiz = PlanoContas.objects.filter(parent__isnull=True).order_by('codigo')
+    data_inicio, data_fim = _periodo_balancete(request)
+    contas = balancete_em_cache(data_inicio, data_fim)
     return render(request, 'contabilidade/plano_contas_list.html', {
-        'raiz': raiz,
-        'total_contas': PlanoContas.objects.count(),
+        'raiz': arvore_balancete(contas),
+        'total_contas': len(contas),
+        'data_inicio': data_inicio,
+        'data_fim': data_fim,
     })
 
 
+def _periodo_balancete(request):
+    """Datas do balancete em ?data_inicio / ?data_fim (por omissão, o ano até hoje)."""
+    hoje = timezone.now().date()
+    try:
+        data_inicio = parse_date(request.GET.get('data_inicio') or '') or hoje.replace(month=1, day=1)
+        data_fim = parse_date(request.GET.get('data_fim') or '') or hoje
+    except ValueError:
+        data_inicio, data_fim = hoje.replace(month=1, day=1), hoje
+    if data_fim < data_inicio:
+        data_inicio, data_fim = data_fim, data_inicio
+    return data_inicio, data_fim
+
+
+@login_required
+def exportar_balancete_csv(request):
+    """Balancete do Plano de Contas no período em CSV."""
+    data_inicio, data_fim = _periodo_balancete(request)
+    contas = balancete_em_cache(data_inicio, data_fim)
+
+    def linhas():
+        yield ['Código', 'Designação', 'Tipo', 'Natureza',
+               'Saldo inicial', 'Débitos', 'Créditos', 'Saldo final']
+        for conta in contas:
+            yield [
+                conta['codigo'],
+                '  ' * conta['level'] + conta['nome'],
+                'Sintética' if conta['tipo'] == 'S' else 'Analítica',
+                'Devedora' if conta['natureza'] == 'D' else 'Credora',
+                *(f"{conta[chave]:.2f}" for chave in ('saldo_inicial', 'debitos', 'creditos', 'saldo_final')),
+            ]
+
+    return resposta_csv(
+        linhas(), f"balancete_{data_inicio:%Y%m%d}_{data_fim:%Y%m%d}.csv"
+    )
+
+
 @login_required
 def plano_contas_create(request):
     parent_id = request.POST.get('parent') or request.GET.get('parent')
@@ -6081,29 +5277,18 @@ def sugerir_codigo_ajax(request):
 
 
 @login_required
-@transaction.atomic
 def carregar_plano_padrao(request):
-    if PlanoContas.objects.exists():
-        messages.warning(request, 'Já existem contas registadas — a importação foi cancelada para evitar duplicados.')
+    """Carrega o plano-base; num plano já em uso junta só os códigos novos."""
+    try:
+        criadas, ja_existiam = importar_plano(ler_plano())
+    except ValidationError as exc:
+        messages.error(request, 'O plano-base tem erros: ' + ' '.join(exc.messages))
         return redirect('plano_contas_list')
 
-    caminho = os.path.join(os.path.dirname(__file__), 'fixtures', 'plano_base.json')
-    with open(caminho, encoding='utf-8') as ficheiro:
-        dados = json.load(ficheiro)
-
-    mapa = {}
-    for item in dados:
-        mae = mapa.get(item.get('parent_codigo'))
-        conta = PlanoContas.objects.create(
-            codigo=item['codigo'],
-            nome=item['nome'],
-            tipo=item['tipo'],
-            natureza=item['natureza'],
-            parent=mae,
-        )
-        mapa[item['codigo']] = conta
-
-    messages.success(request, f'{len(dados)} conta(s) importada(s) a partir do plano-base.')
+    if criadas:
+        messages.success(request, f'{criadas} conta(s) importada(s) a partir do plano-base.')
+    if ja_existiam:
+        messages.info(request, f'{ja_existiam} conta(s) do plano-base já existiam e foram mantidas.')
     return redirect('plano_contas_list')
 
 # ═══════════════════════════════════════════════════════════
@@ -6207,18 +5392,46 @@ def movimento_list(request):
     if data_fim:
         qs = qs.filter(data__lte=data_fim)
 
-    total_debito = sum(m.valor for m in qs if m.tipo == 'debito')
-    total_credito = sum(m.valor for m in qs if m.tipo == 'credito')
+    # totais do conjunto filtrado numa só consulta (não só da página)
+    totais = qs.aggregate(
+        total_movimentos=Count('id'),
+        total_debito=Sum('valor', filter=Q(tipo='debito')),
+        total_credito=Sum('valor', filter=Q(tipo='credito')),
+    )
+    pagina = paginar_keyset(request, qs, ('-data', '-criado_em', '-id'))
 
     return render(request, 'contabilidade/movimento_list.html', {
-        'movimentos': qs,
-        'total_movimentos': qs.count(),
-        'total_debito': total_debito,
-        'total_credito': total_credito,
+        'movimentos': pagina,
+        'pagina': pagina,
+        'total_movimentos': totais['total_movimentos'],
+        # o SQLite devolve a soma sem as casas decimais
+        'total_debito': totais['total_debito'].quantize(Decimal('0.01')) if totais['total_debito'] is not None else 0,
+        'total_credito': totais['total_credito'].quantize(Decimal('0.01')) if totais['total_credito'] is not None else 0,
         'tipo_choices': MovimentoBancario.TIPO_CHOICES,
         'sectores': Sector.objects.all(),
     })
 
+
+@login_required
+def conta_extrato(request, pk):
+    """Extrato de uma conta do Plano de Contas com o saldo corrido."""
+    conta = get_object_or_404(PlanoContas, pk=pk)
+    hoje = timezone.now().date()
+    try:
+        data_inicio = parse_date(request.GET.get('data_inicio') or '') or hoje.replace(day=1)
+        data_fim = parse_date(request.GET.get('data_fim') or '') or hoje
+    except ValueError:
+        data_inicio, data_fim = hoje.replace(day=1), hoje
+    if data_fim < data_inicio:
+        data_inicio, data_fim = data_fim, data_inicio
+
+    return render(request, 'contabilidade/conta_extrato.html', {
+        'conta': conta,
+        'data_inicio': data_inicio,
+        'data_fim': data_fim,
+        **extrato_conta(conta, data_inicio, data_fim),
+    })
+
 # ═══════════════════════════════════════════════════════════
 # 3. ADICIONAR AS URLS NO urls.py
 # ═══════════════════════════════════════════════════════════
@@ -0,0 +1,8 @@
+# Carrega a app Celery (quando instalada) para que os @shared_task usem o
+# broker configurado. Sem Celery, as exportações correm em modo eager.
+try:
+    from .celery import app as celery_app
+except ImportError:
+    celery_app = None
+
+__all__ = ('celery_app',)
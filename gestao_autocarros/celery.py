@@ -0,0 +1,11 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gestao_autocarros.settings')
+
+app = Celery('gestao_autocarros')
+
+# Configuração lida das settings com prefixo CELERY_ (CELERY_BROKER_URL, ...)
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -94,6 +94,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'autocarros.middleware.MetricasConsultasMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -124,3 +125,56 @@ TEMPLATES = [
 
 
 
+
+# 🔹 Celery / exportações em segundo plano
+# Sem CELERY_BROKER_URL as exportações correm no próprio processo (modo
+# eager), o que chega para desenvolvimento. Não usa REDIS_URL (a cache, em
+# baixo): definir o Redis da cache não pode pôr os jobs à espera de um
+# worker que não existe. Em produção o render.yaml cria o broker e arranca
+# o worker no serviço web (o Procfile arranca-o quando há broker).
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', '')
+CELERY_TASK_IGNORE_RESULT = True
+EXPORTACOES_EAGER = os.getenv('EXPORTACOES_EAGER', '0' if CELERY_BROKER_URL else '1') == '1'
+# Segundos até um job pendente/em curso deixar de ser reaproveitado (worker parado)
+EXPORTACOES_TEMPO_LIMITE = 15 * 60
+
+
+# 🔹 Cache (resultados dos painéis — ver autocarros/cache_resultados.py)
+# Memória local por omissão; Redis quando REDIS_URL está definido, para a
+# cache ser partilhada pelos vários workers.
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'alca',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'alca-resultados',
+        }
+    }
+# As chaves incluem a versão dos dados; o tempo limite só liberta memória.
+RESULTADOS_CACHE_TIMEOUT = 6 * 60 * 60
+
+
+# 🔹 Instrumentação de consultas (autocarros.middleware.MetricasConsultasMiddleware)
+# Aviso no log "autocarros.consultas" quando uma vista passa o orçamento
+# (por nome de URL) ou faz uma consulta acima de CONSULTAS_LENTA_MS.
+CONSULTAS_METRICAS = True
+CONSULTAS_ORCAMENTO_PADRAO = 50
+CONSULTAS_ORCAMENTO = {
+    'dashboard': 25,
+    'resumo_sector': 30,
+    'listar_registros': 30,
+    'gerencia_financas': 10,
+    'contabilista_financas': 25,
+    'mapa_geral_financeiro': 15,
+}
+CONSULTAS_LENTA_MS = 200
+# Cabeçalho Server-Timing (só para administradores)
+SERVER_TIMING = os.getenv('SERVER_TIMING', '1' if DEBUG else '0') == '1'
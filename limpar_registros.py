@@ -5,37 +5,20 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gestao_autocarros.settings')
 django.setup()
 
+from autocarros.integridade import DESCRICOES, corrigir, verificar
 from autocarros.models import RegistoDiario
-from django.db.models import Count
 
 def limpar_registros_duplicados():
     print("🔄 Iniciando limpeza de registros duplicados...")
     
-    # Encontrar duplicados
-    duplicados = RegistoDiario.objects.values('autocarro', 'data').annotate(
-        total=Count('id')
-    ).filter(total__gt=1)
+    # (autocarro, data) é único: um autocarro repetido no mesmo relatório são
+    # registos de dias diferentes, religados ao relatório do seu dia (ver autocarros/integridade.py)
+    print(f"📊 Encontrados {verificar()['mal_arquivados']} registros no relatório de outro dia")
     
-    print(f"📊 Encontrados {len(duplicados)} grupos de registros duplicados")
-    
-    total_excluidos = 0
-    
-    for dup in duplicados:
-        registros = RegistoDiario.objects.filter(
-            autocarro_id=dup['autocarro'], 
-            data=dup['data']
-        ).order_by('-id')
-        
-        # Manter o mais recente, excluir os outros
-        if registros.count() > 1:
-            registro_manter = registros.first()
-            excluir_count = registros.exclude(id=registro_manter.id).count()
-            registros.exclude(id=registro_manter.id).delete()
-            total_excluidos += excluir_count
-            print(f"✅ Autocarro {dup['autocarro']}, Data {dup['data']}: {excluir_count} excluídos")
+    resultado = corrigir(['mal_arquivados'], progresso=lambda chave, total: print(f"✅ ... {total} {DESCRICOES[chave]}"))
     
     print(f"\n🎯 Limpeza concluída!")
-    print(f"📝 Registros excluídos: {total_excluidos}")
+    print(f"📝 Registros religados: {resultado['mal_arquivados_ligados']}")
     print(f"💾 Registros restantes: {RegistoDiario.objects.count()}")
 
 if __name__ == "__main__":
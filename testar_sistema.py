@@ -33,8 +33,7 @@ def testar_sistema():
         registro1 = RegistoDiario.objects.create(
             autocarro=autocarro_teste,
             data=data_teste,
-            normal=100.00,
-            numero_passageiros=50
+            normal=100.00
         )
         print("✅ Primeiro registro criado com sucesso!")
         